@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
 """
 Apply database schema to Supabase using Python client
+
+For first-time setup only. Later schema changes are versioned migrations in
+supabase/migrations, applied with backend/migrate.py.
 """
 import os
 import sys
@@ -2,6 +2,9 @@
 """
 Apply database schema to Supabase using HTTP requests
 This approach uses direct SQL execution via the PostgREST API
+
+For first-time setup only. Later schema changes are versioned migrations in
+supabase/migrations, applied with backend/migrate.py.
 """
 import os
 import sys
@@ -0,0 +1,193 @@
+"""
+Buffered Activity Logger for FileInASnap
+Queues audit events in memory and writes them to activity_logs with
+multi-row inserts from a background thread, keeping logging off the
+request path.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, List, Optional
+
+from clients import get_supabase
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_POLICIES = ("drop_oldest", "drop_newest", "block")
+
+
+class ActivityLogger:
+    """
+    Non-blocking activity log writer
+
+    Events are flushed when the buffer reaches `batch_size` or every
+    `flush_interval` seconds, whichever comes first. When the queue holds
+    `max_queue` events the overflow policy decides what happens:
+      - drop_oldest: evict the oldest buffered event (default)
+      - drop_newest: reject the incoming event
+      - block: wait up to `block_timeout` seconds for room, then reject
+    """
+
+    def __init__(
+        self,
+        supabase_client=None,
+        table: str = "activity_logs",
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+        max_queue: int = 10000,
+        overflow_policy: str = "drop_oldest",
+        block_timeout: float = 0.05,
+        max_retries: int = 3,
+    ):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}")
+
+        self.supabase = supabase_client
+        self.table = table
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.overflow_policy = overflow_policy
+        self.block_timeout = block_timeout
+        self.max_retries = max_retries
+
+        self._queue: Deque[Dict[str, Any]] = deque()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self.stats = {"enqueued": 0, "written": 0, "dropped": 0, "failed_batches": 0}
+
+    @property
+    def supabase(self):
+        # Resolved on first flush so constructing a logger never creates a client
+        return self._supabase or get_supabase()
+
+    @supabase.setter
+    def supabase(self, client):
+        self._supabase = client
+
+    @classmethod
+    def from_env(cls, supabase_client=None) -> "ActivityLogger":
+        """Build a logger configured from ACTIVITY_LOG_* environment variables"""
+        return cls(
+            supabase_client,
+            batch_size=int(os.getenv("ACTIVITY_LOG_BATCH_SIZE", 500)),
+            flush_interval=float(os.getenv("ACTIVITY_LOG_FLUSH_INTERVAL", 1.0)),
+            max_queue=int(os.getenv("ACTIVITY_LOG_MAX_QUEUE", 10000)),
+            overflow_policy=os.getenv("ACTIVITY_LOG_OVERFLOW_POLICY", "drop_oldest"),
+        )
+
+    def log(
+        self,
+        user_id: Optional[str],
+        action: str,
+        resource_type: Optional[str] = None,
+        resource_id: Optional[str] = None,
+        details: Optional[Dict] = None,
+        ip_address: Optional[str] = None,
+        user_agent: Optional[str] = None,
+    ) -> bool:
+        """Enqueue an activity event; returns False if it was dropped"""
+        event = {
+            "user_id": user_id,
+            "action": action,
+            "resource_type": resource_type,
+            "resource_id": resource_id,
+            "details": details or {},
+            "ip_address": ip_address,
+            "user_agent": user_agent,
+            # Stamp at enqueue time so rows land in the right monthly partition
+            "created_at": datetime.now(timezone.utc).isoformat(),
+        }
+
+        with self._cond:
+            if len(self._queue) >= self.max_queue:
+                if self.overflow_policy == "drop_oldest":
+                    self._queue.popleft()
+                    self.stats["dropped"] += 1
+                elif self.overflow_policy == "block":
+                    deadline = time.monotonic() + self.block_timeout
+                    while len(self._queue) >= self.max_queue:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.stats["dropped"] += 1
+                            return False
+                        self._cond.notify_all()
+                        self._cond.wait(remaining)
+                else:
+                    self.stats["dropped"] += 1
+                    return False
+
+            self._queue.append(event)
+            self.stats["enqueued"] += 1
+            if len(self._queue) >= self.batch_size:
+                self._cond.notify_all()
+        return True
+
+    def start(self):
+        """Start the background flush thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="activity-log-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """Stop the flush thread, writing whatever is still buffered"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush()
+
+    def flush(self):
+        """Synchronously write all buffered events"""
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                return
+            self._write(batch)
+
+    def _take_batch(self) -> List[Dict[str, Any]]:
+        with self._cond:
+            count = min(self.batch_size, len(self._queue))
+            batch = [self._queue.popleft() for _ in range(count)]
+            if batch:
+                # Wake producers waiting under the "block" policy
+                self._cond.notify_all()
+            return batch
+
+    def _run(self):
+        while True:
+            with self._cond:
+                deadline = time.monotonic() + self.flush_interval
+                while not self._stopping and len(self._queue) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if self._stopping:
+                    return
+            batch = self._take_batch()
+            if batch:
+                self._write(batch)
+
+    def _write(self, batch: List[Dict[str, Any]]):
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                self.supabase.table(self.table).insert(batch, returning="minimal").execute()
+                self.stats["written"] += len(batch)
+                return
+            except Exception as e:
+                if attempt == self.max_retries:
+                    self.stats["failed_batches"] += 1
+                    self.stats["dropped"] += len(batch)
+                    logger.error(f"Dropping {len(batch)} activity events after {attempt} attempts: {e}")
+                    return
+                time.sleep(min(0.1 * 2 ** attempt, 2.0))
@@ -0,0 +1,363 @@
+"""
+Admission control for FileInASnap
+Per-user, tier-scaled token buckets, per-user concurrency caps on heavy
+endpoints and a global in-flight byte budget for uploads. Requests are
+admitted or rejected in ASGI middleware, before their body is read, and
+rejections are 429s with Retry-After, or 413s for bodies larger than an
+endpoint's limit or the whole upload byte budget.
+"""
+
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+import jwt
+
+from optional import optional_import
+
+logger = logging.getLogger(__name__)
+
+# Rate multipliers applied to each endpoint's base bucket
+TIER_MULTIPLIERS = {
+    "anonymous": 0.5,
+    "free": 1.0,
+    "standard": 1.0,
+    "pro": 3.0,
+    "team": 5.0,
+    "enterprise": 10.0,
+}
+
+
+class EndpointPolicy:
+    """
+    Limits for one class of endpoint; rate is tokens/second for the free tier
+    Requests to endpoints with max_bytes must declare a Content-Length no larger.
+    """
+
+    def __init__(self, rate: float, burst: int, max_concurrent: Optional[int] = None, counts_bytes: bool = False,
+                 max_bytes: Optional[int] = None):
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrent = max_concurrent
+        self.counts_bytes = counts_bytes
+        self.max_bytes = max_bytes
+
+
+DEFAULT_POLICIES = {
+    # Base64 uploads are decoded in memory; keep few in flight per user
+    "upload": EndpointPolicy(rate=0.5, burst=10, max_concurrent=2, counts_bytes=True),
+    # Full scans of a user's files
+    "stats": EndpointPolicy(rate=1.0, burst=5, max_concurrent=1),
+    # Folder listing fans out per folder
+    "folders": EndpointPolicy(rate=2.0, burst=10, max_concurrent=2),
+    # Long-running archive streams
+    "export": EndpointPolicy(rate=0.05, burst=3, max_concurrent=1),
+    # Archives are copied to temp disk before the import job starts
+    "import": EndpointPolicy(rate=0.02, burst=2, max_concurrent=1,
+                             max_bytes=int(os.getenv("IMPORT_MAX_BYTES", 2 * 1024 * 1024 * 1024))),
+    # Public share links, keyed by client IP; slows token guessing
+    "share": EndpointPolicy(rate=5.0, burst=30),
+}
+
+
+class Rejection(Exception):
+    """A refused request; retryable (429 with Retry-After) unless retry_after is None"""
+
+    def __init__(self, detail: str, retry_after: Optional[float], status: int = 429):
+        super().__init__(detail)
+        self.detail = detail
+        self.retry_after = retry_after
+        self.status = status
+
+
+class InMemoryBackend:
+    """
+    Process-local state; correct for a single worker
+
+    Every unverified token and client IP gets its own bucket, so buckets
+    that have refilled to their burst (and are equivalent to no bucket)
+    are swept every `sweep_interval` seconds, like the Redis backend's
+    EXPIRE. Beyond `max_buckets` the least recently used are dropped,
+    which at worst hands a caller a fresh burst. Counters only exist
+    while requests hold them.
+    """
+
+    def __init__(self, max_buckets: int = 100_000, sweep_interval: float = 60.0):
+        # key -> (tokens, updated, time the bucket is full again)
+        self._buckets: "OrderedDict[str, Tuple[float, float, float]]" = OrderedDict()
+        self._counters: Dict[str, int] = {}
+        self.max_buckets = max_buckets
+        self.sweep_interval = sweep_interval
+        self._next_sweep = time.monotonic() + sweep_interval
+
+    async def take(self, key: str, rate: float, burst: float, cost: float = 1.0) -> float:
+        """Consume tokens; returns 0 when allowed, else seconds until enough tokens refill"""
+        now = time.monotonic()
+        tokens, updated, _ = self._buckets.get(key, (burst, now, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        wait = 0.0
+        if tokens >= cost:
+            tokens -= cost
+        else:
+            wait = (cost - tokens) / rate
+        self._buckets[key] = (tokens, now, now + (burst - tokens) / rate)
+        self._buckets.move_to_end(key)
+        self._evict(now)
+        return wait
+
+    def _evict(self, now: float):
+        if now >= self._next_sweep:
+            self._next_sweep = now + self.sweep_interval
+            for key in [key for key, (_, _, full_at) in self._buckets.items() if full_at <= now]:
+                del self._buckets[key]
+        while len(self._buckets) > self.max_buckets:
+            self._buckets.popitem(last=False)
+
+    async def acquire(self, key: str, amount: int, limit: int) -> bool:
+        current = self._counters.get(key, 0)
+        if current + amount > limit:
+            return False
+        self._counters[key] = current + amount
+        return True
+
+    async def release(self, key: str, amount: int) -> None:
+        remaining = self._counters.get(key, 0) - amount
+        if remaining > 0:
+            self._counters[key] = remaining
+        else:
+            self._counters.pop(key, None)
+
+
+class RedisBackend:
+    """Shared state for multi-worker deployments (requires the `redis` package)"""
+
+    TOKEN_BUCKET = """
+local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens'))
+local updated = tonumber(redis.call('HGET', KEYS[1], 'updated'))
+local rate, burst, now, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+if tokens == nil then tokens = burst; updated = now end
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= cost then tokens = tokens - cost else wait = (cost - tokens) / rate end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+    ACQUIRE = """
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+if current + tonumber(ARGV[1]) > tonumber(ARGV[2]) then return 0 end
+redis.call('INCRBY', KEYS[1], ARGV[1])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return 1
+"""
+
+    def __init__(self, url: str, prefix: str = "fileinasnap:admission:", counter_ttl: int = 300):
+        self.url = url
+        self.prefix = prefix
+        # Counters expire so slots held by a crashed worker are eventually returned
+        self.counter_ttl = counter_ttl
+        self._redis = None
+
+    @property
+    def redis(self):
+        if self._redis is None:
+            redis_asyncio = optional_import("redis.asyncio", "redis")
+            self._redis = redis_asyncio.from_url(self.url)
+        return self._redis
+
+    async def take(self, key: str, rate: float, burst: float, cost: float = 1.0) -> float:
+        wait = await self.redis.eval(self.TOKEN_BUCKET, 1, self.prefix + key, rate, burst, time.time(), cost)
+        return float(wait)
+
+    async def acquire(self, key: str, amount: int, limit: int) -> bool:
+        return bool(await self.redis.eval(self.ACQUIRE, 1, self.prefix + key, amount, limit, self.counter_ttl))
+
+    async def release(self, key: str, amount: int) -> None:
+        await self.redis.decrby(self.prefix + key, amount)
+
+
+class AdmissionController:
+    """Applies endpoint policies for a user and tier"""
+
+    def __init__(
+        self,
+        backend=None,
+        policies: Optional[Dict[str, EndpointPolicy]] = None,
+        upload_byte_budget: int = 256 * 1024 * 1024,
+        default_request_bytes: int = 70 * 1024 * 1024,
+        tier_resolver: Optional[Callable[[str, Optional[str]], Optional[str]]] = None,
+        enabled: bool = True,
+    ):
+        self.enabled = enabled
+        self.backend = backend or InMemoryBackend()
+        self.policies = policies or DEFAULT_POLICIES
+        self.upload_byte_budget = upload_byte_budget
+        # Charged against the byte budget when a body arrives without Content-Length
+        self.default_request_bytes = default_request_bytes
+        self.tier_resolver = tier_resolver
+
+    @classmethod
+    def from_env(cls, **kwargs) -> "AdmissionController":
+        """
+        ADMISSION_BACKEND=redis with REDIS_URL shares limits across workers;
+        ADMISSION_CONTROL=off disables admission entirely
+        """
+        backend = None
+        if os.getenv("ADMISSION_BACKEND", "memory") == "redis":
+            backend = RedisBackend(os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+        return cls(
+            backend=backend,
+            upload_byte_budget=int(os.getenv("UPLOAD_BYTE_BUDGET", 256 * 1024 * 1024)),
+            enabled=os.getenv("ADMISSION_CONTROL", "on").lower() not in ("off", "false", "0"),
+            **kwargs,
+        )
+
+    def resolve_tier(self, user_id: Optional[str], claimed_tier: Optional[str]) -> str:
+        tier = None
+        if user_id and self.tier_resolver:
+            tier = self.tier_resolver(user_id, claimed_tier)
+        tier = tier or claimed_tier or ("free" if user_id else "anonymous")
+        return tier if tier in TIER_MULTIPLIERS else "free"
+
+    async def admit(self, endpoint: str, subject: str, tier: str, request_bytes: Optional[int]) -> List[Tuple[str, int]]:
+        """
+        Admit one request or raise Rejection
+        Returns the counters to release once the request finishes
+        """
+        policy = self.policies[endpoint]
+        multiplier = TIER_MULTIPLIERS.get(tier, 1.0)
+        if policy.max_bytes is not None:
+            if request_bytes is None:
+                raise Rejection("Content-Length is required", None, status=411)
+            if request_bytes > policy.max_bytes:
+                raise Rejection(f"Request of {request_bytes} bytes exceeds the limit of {policy.max_bytes}",
+                                None, status=413)
+        if policy.counts_bytes and request_bytes is not None and request_bytes > self.upload_byte_budget:
+            # Could never fit in the budget, so retrying would not help
+            raise Rejection(f"Upload of {request_bytes} bytes exceeds the limit of {self.upload_byte_budget}",
+                            None, status=413)
+
+        wait = await self.backend.take(
+            f"bucket:{endpoint}:{subject}", policy.rate * multiplier, max(1, policy.burst * multiplier)
+        )
+        if wait > 0:
+            raise Rejection(f"Rate limit exceeded for {endpoint}", wait)
+
+        held: List[Tuple[str, int]] = []
+        try:
+            if policy.max_concurrent:
+                key = f"inflight:{endpoint}:{subject}"
+                limit = max(1, int(policy.max_concurrent * max(1.0, multiplier / 2)))
+                if not await self.backend.acquire(key, 1, limit):
+                    raise Rejection(f"Too many concurrent {endpoint} requests", 1.0)
+                held.append((key, 1))
+
+            if policy.counts_bytes:
+                amount = request_bytes if request_bytes is not None else self.default_request_bytes
+                if not await self.backend.acquire("inflight-bytes:upload", amount, self.upload_byte_budget):
+                    raise Rejection("Server is busy processing uploads", 2.0)
+                held.append(("inflight-bytes:upload", amount))
+        except Rejection:
+            await self.release(held)
+            raise
+        return held
+
+    async def release(self, held: List[Tuple[str, int]]) -> None:
+        for key, amount in held:
+            try:
+                await self.backend.release(key, amount)
+            except Exception as e:
+                logger.error(f"Failed to release admission counter {key}: {e}")
+
+
+def route_pattern(path: str) -> "re.Pattern":
+    """Regex matching request paths for a route template like /folders/{folder_id}"""
+    return re.compile("^" + re.sub(r"\{[^/]+\}", "[^/]+", path) + "/?$")
+
+
+def identify_caller(scope, headers: Dict[str, str], jwt_secret: Optional[str]) -> Tuple[Optional[str], str, Optional[str]]:
+    """
+    Return (user_id, subject, tier claimed in the token) for a request
+    The subject is "user:<id>" for a locally verified Supabase JWT, otherwise
+    a hash of the bearer token, otherwise the client IP.
+    """
+    authorization = headers.get("authorization", "")
+    token = authorization[7:].strip() if authorization.lower().startswith("bearer ") else ""
+    if token and jwt_secret:
+        try:
+            payload = jwt.decode(token, jwt_secret, algorithms=["HS256"], options={"verify_aud": False})
+            user_id = payload.get("sub") or payload.get("user_id")
+            app_metadata = payload.get("app_metadata") or {}
+            claimed = app_metadata.get("tier") or app_metadata.get("subscription_tier")
+            if user_id:
+                return user_id, f"user:{user_id}", claimed
+        except jwt.InvalidTokenError:
+            pass
+    if token:
+        return None, "token:" + hashlib.sha256(token.encode()).hexdigest()[:32], None
+    client = scope.get("client") or ("unknown", 0)
+    return None, f"ip:{client[0]}", None
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware applying an AdmissionController to selected routes
+
+    routes maps (method, path template) to a policy name, e.g.
+    {("POST", "/api/files/upload"): "upload"}. Callers are identified by a
+    locally verified Supabase JWT when SUPABASE_JWT_SECRET is set, otherwise
+    by a hash of the bearer token, so one caller cannot drain another's budget.
+    """
+
+    def __init__(self, app, controller: AdmissionController, routes: Dict[Tuple[str, str], str],
+                 jwt_secret: Optional[str] = None):
+        self.app = app
+        self.controller = controller
+        self.routes = [(method, route_pattern(path), name) for (method, path), name in routes.items()]
+        self.jwt_secret = jwt_secret or os.getenv("SUPABASE_JWT_SECRET")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.controller.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        endpoint = next(
+            (name for method, pattern, name in self.routes
+             if method == scope["method"] and pattern.match(scope["path"])),
+            None,
+        )
+        if endpoint is None:
+            await self.app(scope, receive, send)
+            return
+
+        headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in scope.get("headers", [])}
+        user_id, subject, claimed_tier = identify_caller(scope, headers, self.jwt_secret)
+        tier = self.controller.resolve_tier(user_id, claimed_tier)
+        length = headers.get("content-length")
+        request_bytes = int(length) if length and length.isdigit() else None
+
+        try:
+            held = await self.controller.admit(endpoint, subject, tier, request_bytes)
+        except Rejection as rejection:
+            await self._reject(send, rejection)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            await self.controller.release(held)
+
+    async def _reject(self, send, rejection: Rejection):
+        body = json.dumps({"detail": rejection.detail}).encode()
+        headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+        if rejection.retry_after is not None:
+            headers.append((b"retry-after", str(max(1, math.ceil(rejection.retry_after))).encode()))
+        await send({"type": "http.response.start", "status": rejection.status, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
 """
 Script to apply the database schema to Supabase
+
+For first-time setup only. Later schema changes are versioned migrations in
+supabase/migrations, applied with backend/migrate.py.
 """
 import os
 from supabase import create_client, Client
@@ -5,6 +5,7 @@ Handles JWT validation and user authentication using Auth0
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer
+from functools import lru_cache
 from typing import Dict, Optional
 import jwt
 import httpx
@@ -33,7 +34,10 @@ class Auth0Config:
         self.jwks_url = f"https://{self.domain}/.well-known/jwks.json"
         self.issuer = f"https://{self.domain}/"
 
-auth0_config = Auth0Config()
+@lru_cache(maxsize=1)
+def get_auth0_config() -> Auth0Config:
+    """Validate Auth0 configuration on first use rather than at import"""
+    return Auth0Config()
 
 class Auth0TokenValidator:
     def __init__(self):
@@ -44,7 +48,7 @@ class Auth0TokenValidator:
         """Get JSON Web Key Set from Auth0 with caching"""
         try:
             async with httpx.AsyncClient() as client:
-                response = await client.get(auth0_config.jwks_url)
+                response = await client.get(get_auth0_config().jwks_url)
                 response.raise_for_status()
                 return response.json()
         except Exception as e:
@@ -87,8 +91,8 @@ class Auth0TokenValidator:
                 token,
                 rsa_key,
                 algorithms=["RS256"],
-                audience=auth0_config.audience,
-                issuer=auth0_config.issuer,
+                audience=get_auth0_config().audience,
+                issuer=get_auth0_config().issuer,
                 options={"verify_exp": True, "verify_aud": True, "verify_iss": True}
             )
             
@@ -190,7 +194,7 @@ def require_scope(required_scope: str):
 # Optional: Auth0 Management API client for admin operations
 class Auth0ManagementClient:
     def __init__(self):
-        self.domain = auth0_config.domain
+        self.domain = get_auth0_config().domain
         self.management_token = os.getenv("AUTH0_MANAGEMENT_API_TOKEN")
         self.base_url = f"https://{self.domain}/api/v2"
         
@@ -240,4 +244,15 @@ class Auth0ManagementClient:
             logger.error(f"Error updating user metadata: {e}")
             return False
 
-auth0_management = Auth0ManagementClient()
\ No newline at end of file
+@lru_cache(maxsize=1)
+def get_auth0_management() -> Auth0ManagementClient:
+    """Management API client, built only when an admin operation needs it"""
+    return Auth0ManagementClient()
+
+def __getattr__(name: str):
+    # Lazy module attributes keep existing `auth0_config` / `auth0_management` imports working
+    if name == "auth0_config":
+        return get_auth0_config()
+    if name == "auth0_management":
+        return get_auth0_management()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
\ No newline at end of file
@@ -0,0 +1,165 @@
+"""
+Upstream call budgets for FileInASnap
+Every PostgREST, Storage and Auth request made while serving an API
+request is counted and timed in a per-request CallLedger (fed by the
+instrumented httpx clients, see tracing.py). The totals are returned in a
+Server-Timing header, e.g.
+
+    Server-Timing: rest;dur=12.4;desc="3 calls", auth;dur=2.1;desc="1 call", total;dur=18.0
+
+which browser dev tools display next to the request. Requests that make
+more than CALL_BUDGET calls, or repeat one operation (say "select files")
+more than CALL_BUDGET_REPEATS times, the usual sign of an N+1 loop, are
+logged with their route and breakdown. With CALL_BUDGET_MODE=enforce
+they fail with a 500 instead, so tests and benchmarks catch round-trip
+regressions; tests/test_call_scaling.py additionally fails any endpoint
+whose call count grows with the size of the result.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+from profiling import route_label
+
+logger = logging.getLogger(__name__)
+
+MODES = ("off", "log", "enforce")
+
+_ledger: ContextVar[Optional["CallLedger"]] = ContextVar("call_ledger", default=None)
+
+
+class CallLedger:
+    """Upstream calls made while serving one request, by service and by operation"""
+
+    def __init__(self):
+        self.calls: Counter = Counter()
+        self.seconds: Dict[str, float] = {}
+        self.operations: Counter = Counter()
+        # Sync handlers and asyncio.to_thread fan-outs record from worker threads
+        self._lock = threading.Lock()
+
+    def record(self, service: str, operation: str, seconds: float):
+        with self._lock:
+            self.calls[service] += 1
+            self.seconds[service] = self.seconds.get(service, 0.0) + seconds
+            self.operations[f"{service} {operation}"] += 1
+
+    @property
+    def total(self) -> int:
+        return sum(self.calls.values())
+
+    def repeated(self, limit: int) -> List[str]:
+        """Operations made more than `limit` times, e.g. 'rest select files x12'"""
+        return [f"{operation} x{count}" for operation, count in self.operations.most_common() if count > limit]
+
+    def server_timing(self, elapsed: float) -> str:
+        metrics = [
+            f'{service};dur={self.seconds[service] * 1000:.1f};desc="{count} call{"s" if count != 1 else ""}"'
+            for service, count in sorted(self.calls.items())
+        ]
+        metrics.append(f"total;dur={elapsed * 1000:.1f}")
+        return ", ".join(metrics)
+
+    def summary(self) -> str:
+        return ", ".join(f"{operation} x{count}" for operation, count in self.operations.most_common())
+
+
+def record(service: str, operation: str, seconds: float):
+    """Count a call against the current request, if there is one"""
+    ledger = _ledger.get()
+    if ledger is not None:
+        ledger.record(service, operation, seconds)
+
+
+def current_ledger() -> Optional[CallLedger]:
+    return _ledger.get()
+
+
+class CallBudget:
+    """How many upstream calls a request may make before it is reported"""
+
+    def __init__(self, max_calls: int = 15, max_repeats: int = 5, mode: str = "log"):
+        if mode not in MODES:
+            raise ValueError(f"Unknown call budget mode: {mode}")
+        self.max_calls = max_calls
+        self.max_repeats = max_repeats
+        self.mode = mode
+
+    @classmethod
+    def from_env(cls) -> "CallBudget":
+        """Build a budget configured from CALL_BUDGET* environment variables"""
+        return cls(
+            max_calls=int(os.getenv("CALL_BUDGET", 15)),
+            max_repeats=int(os.getenv("CALL_BUDGET_REPEATS", 5)),
+            mode=os.getenv("CALL_BUDGET_MODE", "log").lower(),
+        )
+
+    def violations(self, ledger: CallLedger) -> List[str]:
+        problems = []
+        if ledger.total > self.max_calls:
+            problems.append(f"{ledger.total} upstream calls (budget {self.max_calls})")
+        repeated = ledger.repeated(self.max_repeats)
+        if repeated:
+            problems.append(f"repeated operations: {', '.join(repeated)}")
+        return problems
+
+
+class CallBudgetMiddleware:
+    """
+    ASGI middleware giving each HTTP request a CallLedger
+
+    Adds the Server-Timing header when the response starts and checks the
+    budget when it ends, so calls made while streaming a body count too.
+    In enforce mode a response whose calls are already over budget when
+    its headers are sent is replaced by a 500.
+    """
+
+    def __init__(self, app, budget: CallBudget):
+        self.app = app
+        self.budget = budget
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.budget.mode == "off":
+            await self.app(scope, receive, send)
+            return
+
+        ledger = CallLedger()
+        token = _ledger.set(ledger)
+        started = time.perf_counter()
+        replaced = False
+
+        async def send_timed(message):
+            nonlocal replaced
+            if replaced:
+                return
+            if message["type"] == "http.response.start":
+                timing = (b"server-timing", ledger.server_timing(time.perf_counter() - started).encode())
+                problems = self.budget.violations(ledger)
+                if problems and self.budget.mode == "enforce":
+                    replaced = True
+                    body = json.dumps({"detail": f"Upstream call budget exceeded: {'; '.join(problems)}"}).encode()
+                    await send({
+                        "type": "http.response.start",
+                        "status": 500,
+                        "headers": [(b"content-type", b"application/json"),
+                                    (b"content-length", str(len(body)).encode()), timing],
+                    })
+                    await send({"type": "http.response.body", "body": body})
+                    return
+                message["headers"] = list(message.get("headers", [])) + [timing]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_timed)
+        finally:
+            _ledger.reset(token)
+            problems = self.budget.violations(ledger)
+            if problems:
+                route = route_label(scope) or f"{scope['method']} {scope['path']}"
+                logger.warning(f"{route} over its upstream call budget: {'; '.join(problems)} [{ledger.summary()}]")
@@ -0,0 +1,324 @@
+"""
+Realtime change feed for FileInASnap
+Streams per-user file and folder events to clients over Server-Sent Events
+so they can stop polling list endpoints.
+
+Events come from one of two sources (CHANGE_FEED_SOURCE):
+  - local: the API's own write paths call ChangeHub.publish()
+  - postgres: a listener thread receives NOTIFYs from the triggers in
+    supabase/migrations/*_change_feed_notify*.sql (needs psycopg2 and
+    DATABASE_URL), which also covers writes made by other services such as
+    AI processing
+
+Every event carries an increasing id. Clients resume with Last-Event-ID (or
+?cursor=); if events they missed have already left the per-user buffer they
+receive a `reset` event and should refetch their lists.
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+import os
+import select
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Deque, Dict, Optional, Set
+
+from optional import optional_import
+
+logger = logging.getLogger(__name__)
+
+SOURCES = ("local", "postgres")
+
+
+class Subscription:
+    def __init__(self, user_id: str, queue_size: int):
+        self.user_id = user_id
+        self.queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue(queue_size)
+        # Set when the client fell too far behind; the stream sends a reset and closes
+        self.overflowed = False
+
+
+class UserLog:
+    """Recent events for one user and the highest id evicted from them"""
+
+    def __init__(self, floor: int, size: int):
+        self.floor = floor
+        self.events: Deque[Dict[str, Any]] = deque(maxlen=size)
+
+
+class ChangeHub:
+    """
+    Fan-out of change events to per-user SSE subscribers
+
+    An idle subscriber costs one small asyncio.Queue and a suspended
+    generator, so a worker can hold thousands of open streams. Each user
+    keeps a ring buffer of the last `buffer_size` events for resume; buffers
+    for the least recently active users are evicted beyond `max_users`.
+    """
+
+    def __init__(
+        self,
+        source: str = "local",
+        buffer_size: int = 256,
+        queue_size: int = 100,
+        max_users: int = 10000,
+        heartbeat_interval: float = 15.0,
+        dsn: Optional[str] = None,
+        channel: str = "user_changes",
+    ):
+        if source not in SOURCES:
+            raise ValueError(f"Unknown change feed source: {source}")
+        self.source = source
+        self.buffer_size = buffer_size
+        self.queue_size = queue_size
+        self.max_users = max_users
+        self.heartbeat_interval = heartbeat_interval
+        self.dsn = dsn
+        self.channel = channel
+
+        # Local ids start from the clock so they keep increasing across restarts
+        self._ids = itertools.count(int(time.time() * 1000) * 1000)
+        # Cursors below a floor may have missed events that are no longer buffered
+        self._floor = next(self._ids)
+        self._last_id = self._floor
+        self._gap = False
+        self._logs: "OrderedDict[str, UserLog]" = OrderedDict()
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._listener: Optional[PostgresListener] = None
+        self.stats = {"published": 0, "delivered": 0, "overflows": 0, "resets": 0}
+
+    @classmethod
+    def from_env(cls) -> "ChangeHub":
+        """Build a hub configured from CHANGE_FEED_* environment variables"""
+        return cls(
+            source=os.getenv("CHANGE_FEED_SOURCE", "local"),
+            buffer_size=int(os.getenv("CHANGE_FEED_BUFFER_SIZE", 256)),
+            max_users=int(os.getenv("CHANGE_FEED_MAX_USERS", 10000)),
+            heartbeat_interval=float(os.getenv("CHANGE_FEED_HEARTBEAT", 15.0)),
+            dsn=os.getenv("DATABASE_URL"),
+        )
+
+    @property
+    def subscriber_count(self) -> int:
+        return sum(len(subs) for subs in self._subscribers.values())
+
+    def start(self):
+        """Bind to the running event loop; call from the app's lifespan"""
+        self._loop = asyncio.get_running_loop()
+        if self.source == "postgres":
+            if not self.dsn:
+                raise ValueError("CHANGE_FEED_SOURCE=postgres requires DATABASE_URL")
+            # Ids come from the database sequence; nothing before the first NOTIFY is known
+            self._floor = self._last_id = 0
+            self._gap = True
+            self._listener = PostgresListener(self, self.dsn, self.channel)
+            self._listener.start()
+
+    def stop(self):
+        if self._listener:
+            self._listener.stop()
+            self._listener = None
+        for subs in self._subscribers.values():
+            for sub in subs:
+                if not sub.queue.full():
+                    sub.queue.put_nowait({"type": "shutdown"})
+        self._loop = None
+
+    def publish(self, user_id: str, event_type: str, data: Optional[Dict[str, Any]] = None):
+        """
+        Record an event from an API write path; safe to call from any thread
+        No-op when events are sourced from Postgres, which sees the same write.
+        """
+        if self.source != "local" or not user_id:
+            return
+        self._dispatch({
+            "id": next(self._ids),
+            "user_id": user_id,
+            "type": event_type,
+            "data": data or {},
+            "at": datetime.now(timezone.utc).isoformat(),
+        })
+
+    def deliver(self, event: Dict[str, Any]):
+        """Record an event that already carries its id (e.g. from NOTIFY)"""
+        self._dispatch(event)
+
+    def mark_gap(self):
+        """Events may have been lost; resuming clients get a reset until the feed catches up"""
+        self._call(self._start_gap)
+
+    def _start_gap(self):
+        self._gap = True
+        self._floor = self._last_id
+        self._logs.clear()
+
+    def _dispatch(self, event: Dict[str, Any]):
+        self.stats["published"] += 1
+        self._call(self._record, event)
+
+    def _call(self, fn, *args):
+        loop = self._loop
+        if loop is None:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            fn(*args)
+        else:
+            loop.call_soon_threadsafe(fn, *args)
+
+    def _record(self, event: Dict[str, Any]):
+        event_id = event["id"]
+        if self._gap:
+            # Everything between the last event before the gap and this one was missed
+            self._floor = max(self._floor, event_id - 1)
+            self._gap = False
+        self._last_id = max(self._last_id, event_id)
+
+        user_id = event["user_id"]
+        log = self._logs.get(user_id)
+        if log is None:
+            log = self._logs[user_id] = UserLog(self._floor, self.buffer_size)
+            while len(self._logs) > self.max_users:
+                _, evicted = self._logs.popitem(last=False)
+                if evicted.events:
+                    self._floor = max(self._floor, evicted.events[-1]["id"])
+        else:
+            self._logs.move_to_end(user_id)
+        if len(log.events) == log.events.maxlen:
+            log.floor = log.events[0]["id"]
+        log.events.append(event)
+
+        for sub in self._subscribers.get(user_id, ()):
+            if sub.overflowed:
+                continue
+            try:
+                sub.queue.put_nowait(event)
+                self.stats["delivered"] += 1
+            except asyncio.QueueFull:
+                sub.overflowed = True
+                self.stats["overflows"] += 1
+
+    def _resume(self, user_id: str, cursor: Optional[int]):
+        """Buffered events after `cursor`, or None if some were already evicted"""
+        if cursor is None:
+            return []
+        log = self._logs.get(user_id)
+        floor = log.floor if log else self._floor
+        if self._gap or cursor < floor:
+            return None
+        return [event for event in (log.events if log else ()) if event["id"] > cursor]
+
+    async def stream(self, user_id: str, cursor: Optional[int] = None) -> AsyncIterator[str]:
+        """SSE byte stream for one subscriber"""
+        sub = Subscription(user_id, self.queue_size)
+        try:
+            # Subscribe and snapshot the backlog without yielding in between, so each
+            # event is either replayed or queued, never both
+            self._subscribers.setdefault(user_id, set()).add(sub)
+            backlog = self._resume(user_id, cursor)
+            yield "retry: 5000\n\n"
+            if backlog is None:
+                self.stats["resets"] += 1
+                yield _format({"id": self._last_id, "type": "reset", "data": {"reason": "cursor_expired"}})
+            else:
+                for event in backlog:
+                    yield _format(event)
+
+            while True:
+                if sub.overflowed:
+                    self.stats["resets"] += 1
+                    yield _format({"id": self._last_id, "type": "reset", "data": {"reason": "slow_consumer"}})
+                    return
+                try:
+                    event = await asyncio.wait_for(sub.queue.get(), self.heartbeat_interval)
+                except asyncio.TimeoutError:
+                    # Comment line keeps proxies from closing idle connections
+                    yield ": keep-alive\n\n"
+                    continue
+                if event.get("type") == "shutdown":
+                    return
+                yield _format(event)
+        finally:
+            subs = self._subscribers.get(user_id)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._subscribers[user_id]
+
+
+def _format(event: Dict[str, Any]) -> str:
+    payload = {k: v for k, v in event.items() if k != "user_id"}
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(payload, default=str)}\n\n"
+
+
+def parse_cursor(last_event_id: Optional[str], cursor: Optional[str]) -> Optional[int]:
+    """Resume point from the Last-Event-ID header or ?cursor= (header wins)"""
+    for value in (last_event_id, cursor):
+        if value and value.strip().isdigit():
+            return int(value)
+    return None
+
+
+class PostgresListener:
+    """LISTENs on a channel in a background thread and feeds NOTIFY payloads to the hub"""
+
+    def __init__(self, hub: ChangeHub, dsn: str, channel: str, poll_timeout: float = 5.0):
+        self.hub = hub
+        self.dsn = dsn
+        self.channel = channel
+        self.poll_timeout = poll_timeout
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="change-feed-listener", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        psycopg2 = optional_import("psycopg2", "psycopg2-binary")
+        backoff = 1.0
+        while not self._stopping.is_set():
+            try:
+                conn = psycopg2.connect(self.dsn)
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {self.channel}")
+                logger.info(f"Change feed listening on {self.channel}")
+                backoff = 1.0
+                try:
+                    self._listen(conn)
+                finally:
+                    conn.close()
+            except Exception as e:
+                logger.error(f"Change feed listener error: {e}")
+            if not self._stopping.is_set():
+                # Anything notified while disconnected is lost
+                self.hub.mark_gap()
+                self._stopping.wait(backoff)
+                backoff = min(backoff * 2, 30.0)
+
+    def _listen(self, conn):
+        while not self._stopping.is_set():
+            if select.select([conn], [], [], self.poll_timeout) == ([], [], []):
+                continue
+            conn.poll()
+            while conn.notifies:
+                notify = conn.notifies.pop(0)
+                try:
+                    self.hub.deliver(json.loads(notify.payload))
+                except (ValueError, KeyError) as e:
+                    logger.warning(f"Ignoring malformed change notification: {e}")
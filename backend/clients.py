@@ -0,0 +1,84 @@
+"""
+Shared Supabase clients for FileInASnap
+Clients are created on first use, normally from an app's lifespan handler,
+and shared by every module in the process. Nothing here touches the
+network or validates configuration at import time.
+"""
+
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict
+
+from dotenv import load_dotenv
+
+from resilience import Upstream, install
+from tracing import instrument
+
+if TYPE_CHECKING:
+    from supabase import Client
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+logger = logging.getLogger(__name__)
+
+_clients: Dict[str, "Client"] = {}
+_lock = threading.Lock()
+
+# Timeouts, hedging, bulkheads and circuit breakers for PostgREST and Storage (see resilience.py)
+upstreams: Dict[str, Upstream] = {
+    "rest": Upstream.from_env("rest", timeout=10.0, hedge_after=1.0),
+    # Uploads and downloads of large files legitimately take a while; never hedged
+    "storage": Upstream.from_env("storage", timeout=60.0, max_concurrent=16),
+}
+
+
+def _create(name: str, key_env: str) -> "Client":
+    with _lock:
+        client = _clients.get(name)
+        if client is not None:
+            return client
+
+        url = os.getenv("SUPABASE_URL")
+        key = os.getenv(key_env)
+        if not url or not key:
+            raise ValueError(f"Missing required Supabase configuration (SUPABASE_URL, {key_env})")
+
+        # supabase pulls in httpx, realtime and websockets; only pay for it when a client is needed
+        from supabase import ClientOptions, create_client
+
+        client = create_client(url, key, options=ClientOptions(
+            postgrest_client_timeout=upstreams["rest"].timeout,
+            storage_client_timeout=upstreams["storage"].timeout,
+        ))
+        install(client.postgrest.session, upstreams["rest"])
+        install(client.storage.session, upstreams["storage"])
+        # Outside the resilience layer, so spans include bulkhead waits and breaker rejections
+        instrument(client.postgrest.session, "rest")
+        instrument(client.storage.session, "storage")
+        instrument(client.auth._http_client, "auth")
+        _clients[name] = client
+        logger.info(f"Created Supabase {name} client")
+        return client
+
+
+def get_supabase() -> "Client":
+    """Service-role client used for data and storage access"""
+    return _clients.get("service") or _create("service", "SUPABASE_SERVICE_KEY")
+
+
+def get_supabase_anon() -> "Client":
+    """Anon-key client used to validate end-user access tokens"""
+    return _clients.get("anon") or _create("anon", "SUPABASE_ANON_KEY")
+
+
+def has_service_key() -> bool:
+    return bool(os.getenv("SUPABASE_SERVICE_KEY"))
+
+
+def reset_clients() -> None:
+    """Forget cached clients (e.g. after changing configuration)"""
+    with _lock:
+        _clients.clear()
@@ -0,0 +1,128 @@
+"""
+Response compression for FileInASnap
+Negotiates brotli (when the `brotli` package is installed) or gzip from
+Accept-Encoding and compresses complete response bodies above a size
+threshold. Streamed responses are passed through untouched: the change
+feed's Server-Sent Events must reach clients as they are written, and ZIP
+exports are already compressed. Starlette's GZipMiddleware would buffer
+both.
+"""
+
+import asyncio
+import gzip
+import os
+from typing import Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from optional import is_available, optional_import
+
+# Compressing a body this large would hold up the event loop noticeably
+THREAD_THRESHOLD = 256 * 1024
+
+# Already compressed, or must not be buffered
+SKIPPED_TYPES = ("text/event-stream", "application/zip", "application/gzip", "image/", "video/", "audio/")
+
+
+def negotiate(accept_encoding: str, brotli_available: bool) -> Optional[str]:
+    """Best encoding the client accepts: br, then gzip; None for identity"""
+    accepted = {}
+    for part in accept_encoding.lower().split(","):
+        coding, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if coding:
+            accepted[coding] = quality
+    wildcard = accepted.get("*", 0.0)
+    for coding in (("br", "gzip") if brotli_available else ("gzip",)):
+        if accepted.get(coding, wildcard) > 0:
+            return coding
+    return None
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing eligible responses with br or gzip"""
+
+    def __init__(self, app: ASGIApp, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4,
+                 enabled: bool = True):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.enabled = enabled
+        self.brotli_available = is_available("brotli")
+
+    @classmethod
+    def options_from_env(cls) -> dict:
+        """Keyword arguments for app.add_middleware from COMPRESSION_* environment variables"""
+        return {
+            "minimum_size": int(os.getenv("COMPRESSION_MIN_SIZE", 1024)),
+            "gzip_level": int(os.getenv("COMPRESSION_GZIP_LEVEL", 6)),
+            "brotli_quality": int(os.getenv("COMPRESSION_BROTLI_QUALITY", 4)),
+            "enabled": os.getenv("COMPRESSION", "on").lower() not in ("0", "off", "false"),
+        }
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not self.enabled:
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding", ""), self.brotli_available)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start: Optional[Message] = None
+        passthrough = False
+
+        async def send_compressed(message: Message) -> None:
+            nonlocal start, passthrough
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+            if start is not None:
+                body = message.get("body", b"")
+                initial, start = start, None
+                if message.get("more_body", False) or not self._eligible(initial, body):
+                    passthrough = True
+                    await send(initial)
+                    await send(message)
+                    return
+                compressed = await self._compress(encoding, body)
+                headers = MutableHeaders(raw=initial["headers"])
+                headers["Content-Encoding"] = encoding
+                headers["Content-Length"] = str(len(compressed))
+                headers.add_vary_header("Accept-Encoding")
+                await send(initial)
+                await send({"type": "http.response.body", "body": compressed, "more_body": False})
+                return
+            await send(message)
+
+        await self.app(scope, receive, send_compressed)
+
+    def _eligible(self, start: Message, body: bytes) -> bool:
+        if len(body) < self.minimum_size or start.get("status", 200) in (204, 304):
+            return False
+        headers = Headers(raw=start["headers"])
+        if "content-encoding" in headers:
+            return False
+        content_type = headers.get("content-type", "").lower()
+        return not content_type.startswith(SKIPPED_TYPES)
+
+    async def _compress(self, encoding: str, body: bytes) -> bytes:
+        if len(body) >= THREAD_THRESHOLD:
+            return await asyncio.to_thread(self._encode, encoding, body)
+        return self._encode(encoding, body)
+
+    def _encode(self, encoding: str, body: bytes) -> bytes:
+        if encoding == "br":
+            return optional_import("brotli", "brotli").compress(body, quality=self.brotli_quality)
+        return gzip.compress(body, compresslevel=self.gzip_level)
@@ -0,0 +1,175 @@
+"""
+Near-duplicate image detection for FileInASnap
+Images get a 64-bit difference hash (dHash) at upload time, stored in
+user_files.metadata. Clusters of near-identical images are found with a
+multi-index hash: each hash is split into four 16-bit chunks, and by the
+pigeonhole principle two hashes within distance d agree to within d // 4
+bits on at least one chunk. Only pairs sharing such a chunk are compared,
+with vectorized popcounts, so a 100k-image library needs a few million
+comparisons instead of five billion.
+
+Requires Pillow (hashing) and numpy (clustering); see requirements-optional.txt.
+"""
+
+import io
+import logging
+from itertools import combinations
+from typing import Dict, List, Optional, Sequence
+
+from optional import optional_import
+
+logger = logging.getLogger(__name__)
+
+HASH_ALGORITHM = "dhash"
+CHUNKS = 4
+CHUNK_BITS = 64 // CHUNKS
+MAX_DISTANCE = 10
+
+
+def image_fingerprint(content: bytes) -> Optional[Dict]:
+    """
+    dHash and dimensions of an image, or None if it cannot be decoded
+    The hash compares adjacent pixels of a 9x8 grayscale thumbnail, so it
+    survives re-encoding, resizing and small exposure changes.
+    """
+    Image = optional_import("PIL.Image", "Pillow")
+    try:
+        with Image.open(io.BytesIO(content)) as image:
+            width, height = image.size
+            # draft() lets JPEG decode at reduced scale, which is most of the cost
+            image.draft("L", (64, 64))
+            pixels = list(image.convert("L").resize((9, 8), Image.Resampling.LANCZOS).getdata())
+    except Exception as e:
+        logger.info(f"Could not fingerprint image: {e}")
+        return None
+
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            value = (value << 1) | (left > right)
+    return {"phash": f"{value:016x}", "phash_algo": HASH_ALGORITHM, "width": width, "height": height}
+
+
+def _popcount(np, values):
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    table = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+    return table[values.view(np.uint8).reshape(-1, 8)].sum(axis=1)
+
+
+def _probe_masks(radius: int) -> List[int]:
+    masks = [0]
+    for r in range(1, radius + 1):
+        for bits in combinations(range(CHUNK_BITS), r):
+            masks.append(sum(1 << b for b in bits))
+    return masks
+
+
+def near_duplicate_pairs(hashes: Sequence[int], max_distance: int = 6):
+    """
+    Index pairs (i, j), i < j, whose hashes differ in at most max_distance bits
+    Returns two numpy arrays. Identical hashes must already be collapsed by
+    the caller, otherwise one popular hash makes the candidate set quadratic.
+    """
+    np = optional_import("numpy")
+    if not 0 <= max_distance <= MAX_DISTANCE:
+        raise ValueError(f"max_distance must be between 0 and {MAX_DISTANCE}")
+
+    values = np.asarray(hashes, dtype=np.uint64)
+    n = len(values)
+    if n < 2:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty
+
+    masks = np.asarray(_probe_masks(max_distance // CHUNKS), dtype=np.int64)
+    left_parts, right_parts = [], []
+    for chunk in range(CHUNKS):
+        keys = ((values >> np.uint64(chunk * CHUNK_BITS)) & np.uint64(0xFFFF)).astype(np.int64)
+        order = np.argsort(keys, kind="stable")
+        # bucket_start[k]:bucket_start[k + 1] is the slice of `order` whose chunk equals k
+        bucket_start = np.searchsorted(keys[order], np.arange((1 << CHUNK_BITS) + 1))
+        for mask in masks:
+            probes = keys ^ mask
+            start = bucket_start[probes]
+            counts = bucket_start[probes + 1] - start
+            total = int(counts.sum())
+            if total == 0:
+                continue
+            # Expand each probe into its bucket members without a Python loop
+            left = np.repeat(np.arange(n), counts)
+            offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+            right = order[np.repeat(start, counts) + offsets]
+            keep = left < right
+            left, right = left[keep], right[keep]
+            close = _popcount(np, values[left] ^ values[right]) <= max_distance
+            left_parts.append(left[close])
+            right_parts.append(right[close])
+
+    left = np.concatenate(left_parts) if left_parts else np.empty(0, dtype=np.int64)
+    right = np.concatenate(right_parts) if right_parts else np.empty(0, dtype=np.int64)
+    # A pair can match on several chunks; keep it once
+    pair_ids = np.unique(left * n + right)
+    return pair_ids // n, pair_ids % n
+
+
+class _DisjointSet:
+    def __init__(self, size: int):
+        self.parent = list(range(size))
+
+    def find(self, item: int) -> int:
+        root = item
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[item] != root:
+            self.parent[item], item = root, self.parent[item]
+        return root
+
+    def union(self, a: int, b: int):
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            self.parent[rb] = ra
+
+
+def _keeper_rank(file: Dict):
+    # Highest resolution wins, then largest file, then the oldest upload
+    pixels = int(file.get("width") or 0) * int(file.get("height") or 0)
+    return (-pixels, -int(file.get("size") or 0), file.get("upload_date") or "")
+
+
+def find_duplicate_clusters(files: List[Dict], max_distance: int = 6) -> List[Dict]:
+    """
+    Group files (dicts with id, size, upload_date, phash and optionally
+    width/height) into near-duplicate clusters with a suggested keeper
+    """
+    np = optional_import("numpy")
+    hashed = [f for f in files if f.get("phash")]
+    if len(hashed) < 2:
+        return []
+
+    unique_hashes, inverse = np.unique(
+        np.array([int(f["phash"], 16) for f in hashed], dtype=np.uint64), return_inverse=True
+    )
+    groups = _DisjointSet(len(unique_hashes))
+    left, right = near_duplicate_pairs(unique_hashes, max_distance)
+    for a, b in zip(left.tolist(), right.tolist()):
+        groups.union(a, b)
+
+    members: Dict[int, List[Dict]] = {}
+    for file, hash_index in zip(hashed, inverse.ravel().tolist()):
+        members.setdefault(groups.find(hash_index), []).append(file)
+
+    clusters = []
+    for cluster_files in members.values():
+        if len(cluster_files) < 2:
+            continue
+        cluster_files.sort(key=_keeper_rank)
+        keeper, others = cluster_files[0], cluster_files[1:]
+        clusters.append({
+            "keeper_id": keeper["id"],
+            "files": cluster_files,
+            "reclaimable_bytes": sum(int(f.get("size") or 0) for f in others),
+        })
+    clusters.sort(key=lambda c: -c["reclaimable_bytes"])
+    return clusters
@@ -0,0 +1,75 @@
+"""
+Conditional GET support for FileInASnap
+ETags are derived from the per-user change version that triggers bump on
+every folders/files write (see supabase/migrations/*_user_change_versions.sql),
+so an unchanged poll costs one primary-key lookup and returns 304.
+"""
+
+import hashlib
+import json
+import logging
+from typing import Any, Optional, Set
+
+from fastapi import Request, Response
+
+logger = logging.getLogger(__name__)
+
+
+def get_change_version(supabase, user_id: str) -> Optional[int]:
+    """
+    Current change version for a user, 0 if they have never written
+    Returns None if versions are unavailable (e.g. migration not applied),
+    in which case callers serve the request without an ETag.
+    """
+    try:
+        result = supabase.table("user_change_versions").select("version").eq("owner_id", user_id).limit(1).execute()
+    except Exception as e:
+        logger.warning(f"Change version lookup failed: {e}")
+        return None
+    return result.data[0]["version"] if result.data else 0
+
+
+def make_etag(resource: str, user_id: str, version: int, *params: Any) -> str:
+    """Weak ETag for one user's view of a resource with the given query parameters"""
+    variant = hashlib.sha1(repr((user_id,) + params).encode()).hexdigest()[:12]
+    return f'W/"{resource}-{version}-{variant}"'
+
+
+def content_etag(resource: str, content: Any) -> str:
+    """Weak ETag hashed from a payload, for data without a change version"""
+    digest = hashlib.sha1(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()[:16]
+    return f'W/"{resource}-{digest}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """True if the request's If-None-Match covers `etag` (weak comparison)"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return (etag[2:] if etag.startswith("W/") else etag) in if_none_match(request)
+
+
+def if_none_match(request: Request) -> Set[str]:
+    """Entity tags listed in If-None-Match, without weak prefixes"""
+    tags = set()
+    for candidate in (request.headers.get("if-none-match") or "").split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate:
+            tags.add(candidate)
+    return tags
+
+
+def set_etag(response: Response, etag: str) -> None:
+    response.headers["ETag"] = etag
+    # Let clients cache but always revalidate; the payload is per-user
+    response.headers["Cache-Control"] = "private, no-cache"
+
+
+def not_modified(etag: str) -> Response:
+    response = Response(status_code=304)
+    set_etag(response, etag)
+    return response
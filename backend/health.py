@@ -0,0 +1,125 @@
+"""
+Health probes for FileInASnap
+Liveness never does I/O. Readiness is answered from the results of the
+last background check pass, refreshed every `interval` seconds, so however
+often load balancers poll, each node checks its dependencies at a fixed
+rate. Deep diagnostics run every check on demand and time each one; their
+results are reused for `deep_ttl` seconds so a burst of requests costs one
+pass. No check creates or changes anything.
+"""
+
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class HealthMonitor:
+    """Runs named dependency checks and keeps their latest results"""
+
+    def __init__(
+        self,
+        checks: Dict[str, Callable[[], Any]],
+        critical: Iterable[str] = (),
+        interval: float = 15.0,
+        deep_ttl: float = 5.0,
+    ):
+        self.checks = checks
+        # Readiness requires these checks to pass; the others are reported only
+        self.critical = set(critical)
+        self.interval = interval
+        self.deep_ttl = deep_ttl
+        self._results: Optional[Dict[str, Any]] = None
+        self._deep: Optional[Dict[str, Any]] = None
+        self._deep_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_env(cls, checks: Dict[str, Callable[[], Any]], critical: Iterable[str] = ()) -> "HealthMonitor":
+        """Build a monitor configured from HEALTH_* environment variables"""
+        return cls(
+            checks,
+            critical,
+            interval=float(os.getenv("HEALTH_INTERVAL", 15.0)),
+            deep_ttl=float(os.getenv("HEALTH_DEEP_TTL", 5.0)),
+        )
+
+    def run_checks(self) -> Dict[str, Any]:
+        """Run every check once, timing each; never raises"""
+        results = {}
+        for name, check in self.checks.items():
+            started = time.perf_counter()
+            try:
+                detail = check()
+                result = {"ok": True}
+                if detail is not None:
+                    result["detail"] = detail
+            except Exception as e:
+                result = {"ok": False, "error": str(e)}
+            result["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            results[name] = result
+        return {
+            "ok": all(results[name]["ok"] for name in self.critical if name in results),
+            "checked_at": datetime.now(timezone.utc).isoformat(),
+            "checked_monotonic": time.monotonic(),
+            "checks": results,
+        }
+
+    def refresh(self) -> Dict[str, Any]:
+        self._results = self.run_checks()
+        failed = [name for name, result in self._results["checks"].items() if not result["ok"]]
+        if failed:
+            logger.warning(f"Health checks failing: {', '.join(failed)}")
+        return self._results
+
+    def readiness(self) -> Dict[str, Any]:
+        """The last background pass; not ready before the first one or if passes have stalled"""
+        results = self._results
+        if results is None:
+            return {"ready": False, "reason": "starting"}
+        age = time.monotonic() - results["checked_monotonic"]
+        report = {
+            "ready": results["ok"],
+            "checked_at": results["checked_at"],
+            "age_s": round(age, 1),
+            "checks": {name: {"ok": result["ok"]} for name, result in results["checks"].items()},
+        }
+        if age > self.interval * 3:
+            report.update(ready=False, reason="health checks stalled")
+        return report
+
+    def diagnostics(self) -> Dict[str, Any]:
+        """Fresh checks with per-dependency latency, shared by callers within `deep_ttl`"""
+        with self._deep_lock:
+            deep = self._deep
+            if deep is None or time.monotonic() - deep["checked_monotonic"] > self.deep_ttl:
+                deep = self._deep = self.run_checks()
+        return {key: value for key, value in deep.items() if key != "checked_monotonic"}
+
+    def start(self):
+        """Run check passes every `interval` seconds in the background, starting now"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="health-monitor", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Health check pass failed: {e}")
+            if self._stopping.wait(self.interval):
+                return
+
+    def stop(self, timeout: float = 5.0):
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
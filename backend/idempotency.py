@@ -0,0 +1,294 @@
+"""
+Idempotency keys for FileInASnap
+Clients on flaky networks retry uploads and creates after timeouts, which
+used to create duplicate rows and objects and count twice against quotas.
+Requests to selected routes that carry an Idempotency-Key header are now
+executed at most once per caller and key: the first claims the key in the
+idempotency_keys table (see supabase/migrations/*_idempotency_keys.sql),
+and its 2xx JSON response is stored with a TTL. Retries get the stored
+response, marked Idempotent-Replayed, without running the handler again.
+A duplicate arriving while the first is still running waits for it,
+in-process without any queries and across workers by polling the row.
+Reusing a key for a different request (method, path or body) is a 422.
+Failed requests release their key so they can be retried. If the table
+cannot be reached, requests run without idempotency rather than fail.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+from admission import identify_caller, route_pattern
+from clients import get_supabase
+
+logger = logging.getLogger(__name__)
+
+# Printable ASCII without spaces, e.g. a UUID generated by the client per logical operation
+KEY_PATTERN = re.compile(r"^[\x21-\x7e]{1,255}$")
+
+# (fingerprint, status, response) of a finished request
+Outcome = Tuple[str, int, object]
+
+
+class IdempotencyStore:
+    """
+    Claims, results and releases of keys in the idempotency_keys table
+
+    Results are kept for `ttl` seconds. A request that has held its key for
+    `lock_timeout` seconds without finishing is presumed dead and the key
+    can be claimed again. Duplicates wait up to `wait` seconds for the
+    first request before getting a 409.
+    """
+
+    def __init__(self, supabase_client=None, ttl: float = 86400.0, lock_timeout: float = 120.0,
+                 wait: float = 30.0, enabled: bool = True):
+        self._supabase = supabase_client
+        self.ttl = ttl
+        self.lock_timeout = lock_timeout
+        self.wait = wait
+        self.enabled = enabled
+
+    @classmethod
+    def from_env(cls, supabase_client=None) -> "IdempotencyStore":
+        """Build a store configured from IDEMPOTENCY_* environment variables"""
+        return cls(
+            supabase_client,
+            ttl=float(os.getenv("IDEMPOTENCY_TTL", 86400)),
+            lock_timeout=float(os.getenv("IDEMPOTENCY_LOCK_TIMEOUT", 120)),
+            wait=float(os.getenv("IDEMPOTENCY_WAIT", 30)),
+            enabled=os.getenv("IDEMPOTENCY", "on").lower() != "off",
+        )
+
+    @property
+    def supabase(self):
+        return self._supabase or get_supabase()
+
+    def claim(self, subject: str, key: str, fingerprint: str) -> Dict:
+        """{claimed, stored_fingerprint, stored_status, stored_response} for the key"""
+        rows = self.supabase.rpc("claim_idempotency_key", {
+            "p_subject": subject,
+            "p_key": key,
+            "p_fingerprint": fingerprint,
+            "p_ttl_seconds": int(self.ttl),
+            "p_lock_seconds": int(self.lock_timeout),
+        }).execute().data
+        return rows[0] if isinstance(rows, list) else rows
+
+    def lookup(self, subject: str, key: str) -> Optional[Dict]:
+        rows = self.supabase.table("idempotency_keys").select("fingerprint, status_code, response") \
+            .eq("subject", subject).eq("key", key).limit(1).execute().data
+        return rows[0] if rows else None
+
+    def complete(self, subject: str, key: str, fingerprint: str, status: int, response):
+        self.supabase.table("idempotency_keys") \
+            .update({"status_code": status, "response": response, "locked_until": None}, returning="minimal") \
+            .eq("subject", subject).eq("key", key).eq("fingerprint", fingerprint).execute()
+
+    def release(self, subject: str, key: str, fingerprint: str):
+        """Forget an unfinished claim so the request can be retried"""
+        self.supabase.table("idempotency_keys").delete(returning="minimal") \
+            .eq("subject", subject).eq("key", key).eq("fingerprint", fingerprint) \
+            .is_("status_code", "null").execute()
+
+
+async def _error(send, status: int, detail: str, retry_after: Optional[int] = None):
+    body = json.dumps({"detail": detail}).encode()
+    headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    if retry_after is not None:
+        headers.append((b"retry-after", str(retry_after).encode()))
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+class IdempotencyMiddleware:
+    """
+    ASGI middleware applying an IdempotencyStore to selected routes
+
+    routes lists (method, path template) pairs, e.g.
+    [("POST", "/api/files/upload")]. Keys are scoped to the caller as
+    identified by admission control, so callers cannot see each other's
+    responses. The request body is read in full to fingerprint it before
+    the handler runs; these routes parse their whole body anyway.
+    """
+
+    def __init__(self, app, store: IdempotencyStore, routes: Iterable[Tuple[str, str]],
+                 jwt_secret: Optional[str] = None):
+        self.app = app
+        self.store = store
+        self.routes = [(method, route_pattern(path)) for method, path in routes]
+        self.jwt_secret = jwt_secret or os.getenv("SUPABASE_JWT_SECRET")
+        # (subject, key) -> outcome of the request currently running it in this worker (None if it failed)
+        self._inflight: Dict[Tuple[str, str], "asyncio.Future[Optional[Outcome]]"] = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.store.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in scope.get("headers", [])}
+        key = headers.get("idempotency-key")
+        if key is None or not any(method == scope["method"] and pattern.match(scope["path"])
+                                  for method, pattern in self.routes):
+            await self.app(scope, receive, send)
+            return
+        if not KEY_PATTERN.match(key):
+            await _error(send, 400, "Idempotency-Key must be 1-255 printable characters")
+            return
+
+        body = await self._read_body(receive)
+        if body is None:
+            return
+        fingerprint = hashlib.sha256(b"\0".join(
+            (scope["method"].encode(), scope["path"].encode(), scope.get("query_string", b""), body)
+        )).hexdigest()
+        _, subject, _ = identify_caller(scope, headers, self.jwt_secret)
+
+        sent = False
+
+        async def replay_receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        deadline = time.monotonic() + self.store.wait
+        while True:
+            running = self._inflight.get((subject, key))
+            if running is not None:
+                try:
+                    outcome = await asyncio.wait_for(asyncio.shield(running), deadline - time.monotonic())
+                except asyncio.TimeoutError:
+                    await _error(send, 409, "A request with this Idempotency-Key is still in progress", retry_after=1)
+                    return
+                if outcome is not None:
+                    await self._replay(send, fingerprint, outcome)
+                    return
+                # It failed and released the key; claim it for this request
+                continue
+
+            future = asyncio.get_running_loop().create_future()
+            self._inflight[(subject, key)] = future
+            try:
+                try:
+                    row = await asyncio.to_thread(self.store.claim, subject, key, fingerprint)
+                except Exception as e:
+                    logger.warning(f"Idempotency keys unavailable, running request without one: {e}")
+                    await self.app(scope, replay_receive, send)
+                    return
+
+                if row["claimed"]:
+                    outcome = await self._execute(scope, replay_receive, send, subject, key, fingerprint)
+                    future.set_result(outcome)
+                    return
+                if row["stored_fingerprint"] != fingerprint:
+                    await _error(send, 422, "Idempotency-Key was already used for a different request")
+                    return
+                if row["stored_status"] is not None:
+                    await self._replay(send, fingerprint,
+                                       (row["stored_fingerprint"], row["stored_status"], row["stored_response"]))
+                    return
+            finally:
+                if self._inflight.get((subject, key)) is future:
+                    del self._inflight[(subject, key)]
+                if not future.done():
+                    future.set_result(None)
+
+            # Running in another worker: poll until it finishes, fails (row released) or we give up
+            outcome = await self._await_other_worker(subject, key, deadline)
+            if outcome is False:
+                await _error(send, 409, "A request with this Idempotency-Key is still in progress", retry_after=1)
+                return
+            if outcome is not None:
+                await self._replay(send, fingerprint, outcome)
+                return
+
+    @staticmethod
+    async def _read_body(receive) -> Optional[bytes]:
+        chunks = []
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return None
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body"):
+                return b"".join(chunks)
+
+    async def _execute(self, scope, receive, send, subject: str, key: str, fingerprint: str) -> Optional[Outcome]:
+        """Run the handler, streaming its response while keeping a copy; store it if it succeeded"""
+        status = 500
+        chunks = []
+
+        async def capture(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, capture)
+        except BaseException:
+            await self._record(subject, key, fingerprint, None)
+            raise
+
+        outcome = None
+        if 200 <= status < 300:
+            body = b"".join(chunks)
+            try:
+                outcome = (fingerprint, status, json.loads(body) if body else None)
+            except ValueError:
+                logger.warning(f"Not storing non-JSON response for {scope['method']} {scope['path']}")
+        await self._record(subject, key, fingerprint, outcome)
+        return outcome
+
+    async def _record(self, subject: str, key: str, fingerprint: str, outcome: Optional[Outcome]):
+        try:
+            if outcome is not None:
+                await asyncio.to_thread(self.store.complete, subject, key, fingerprint, outcome[1], outcome[2])
+            else:
+                await asyncio.to_thread(self.store.release, subject, key, fingerprint)
+        except Exception as e:
+            # An unfinished claim expires after lock_timeout; until then retries get a 409
+            logger.error(f"Could not record idempotency key outcome: {e}")
+
+    async def _await_other_worker(self, subject: str, key: str, deadline: float):
+        """The stored outcome once another worker finishes, None if it released the key, False on timeout"""
+        delay = 0.05
+        while time.monotonic() < deadline:
+            await asyncio.sleep(min(delay, max(deadline - time.monotonic(), 0)))
+            delay = min(delay * 2, 1.0)
+            try:
+                row = await asyncio.to_thread(self.store.lookup, subject, key)
+            except Exception as e:
+                logger.warning(f"Could not poll idempotency key: {e}")
+                continue
+            if row is None:
+                return None
+            if row["status_code"] is not None:
+                return row["fingerprint"], row["status_code"], row["response"]
+        return False
+
+    @staticmethod
+    async def _replay(send, fingerprint: str, outcome: Outcome):
+        stored_fingerprint, status, response = outcome
+        if stored_fingerprint != fingerprint:
+            await _error(send, 422, "Idempotency-Key was already used for a different request")
+            return
+        body = json.dumps(response).encode()
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"idempotent-replayed", b"true"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
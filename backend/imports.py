@@ -0,0 +1,333 @@
+"""
+Bulk archive import for FileInASnap
+Extracts a ZIP or tar archive entry by entry, validates each file, uploads
+accepted files to storage from a bounded worker pool and inserts their
+metadata in batches. Progress is kept on an ImportJob and written to the
+import_jobs table so any API worker can report it.
+"""
+
+import logging
+import mimetypes
+import os
+import posixpath
+import tarfile
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from clients import get_supabase
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")
+MAX_ENTRIES = 50000
+MAX_ERRORS = 100
+
+# Finder/Explorer debris that should never become files
+IGNORED_NAMES = {".ds_store", "thumbs.db", "desktop.ini"}
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class ImportJob:
+    """Progress of one archive import"""
+
+    def __init__(self, user_id: str, archive_name: str):
+        self.id = str(uuid.uuid4())
+        self.user_id = user_id
+        self.archive_name = archive_name
+        self.status = "queued"
+        self.total_entries = 0
+        self.imported = 0
+        self.skipped = 0
+        self.failed = 0
+        self.bytes_imported = 0
+        self.errors: List[Dict[str, str]] = []
+        self.created_at = _now()
+        self.finished_at: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def record_error(self, name: str, reason: str, skipped: bool = False):
+        with self._lock:
+            if skipped:
+                self.skipped += 1
+            else:
+                self.failed += 1
+            if len(self.errors) < MAX_ERRORS:
+                self.errors.append({"name": name, "reason": reason})
+
+    def record_imported(self, count: int, size: int):
+        with self._lock:
+            self.imported += count
+            self.bytes_imported += size
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            return {
+                "id": self.id,
+                "user_id": self.user_id,
+                "archive_name": self.archive_name,
+                "status": self.status,
+                "total_entries": self.total_entries,
+                "imported": self.imported,
+                "skipped": self.skipped,
+                "failed": self.failed,
+                "bytes_imported": self.bytes_imported,
+                "errors": list(self.errors),
+                "created_at": self.created_at,
+                "updated_at": _now(),
+                "finished_at": self.finished_at,
+            }
+
+
+class _ByteBudget:
+    """Caps bytes held by queued and running uploads; an oversized entry runs alone"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, size: int):
+        with self._cond:
+            while self.in_flight and self.in_flight + size > self.limit:
+                self._cond.wait()
+            self.in_flight += size
+
+    def release(self, size: int):
+        with self._cond:
+            self.in_flight -= size
+            self._cond.notify_all()
+
+
+def iter_archive(path: str, max_entry_size: int) -> Iterator[Tuple[str, int, Callable[[], Optional[bytes]]]]:
+    """
+    Yield (name, declared size, read) for each regular file in a ZIP or tar archive
+    read() returns the content, or None if it is larger than max_entry_size;
+    reads are capped so a forged header cannot inflate memory. Tar archives
+    are read as a stream, so each read() must happen before the next entry.
+    """
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+
+                def read(info=info):
+                    with archive.open(info) as src:
+                        data = src.read(max_entry_size + 1)
+                    return data if len(data) <= max_entry_size else None
+
+                yield info.filename, info.file_size, read
+        return
+
+    with tarfile.open(path, mode="r|*") as archive:
+        for member in archive:
+            # Regular files only: no links, devices or directories
+            if not member.isfile():
+                continue
+
+            def read(member=member):
+                if member.size > max_entry_size:
+                    return None
+                src = archive.extractfile(member)
+                return src.read(max_entry_size + 1) if src else None
+
+            yield member.name, member.size, read
+
+
+class ArchiveImporter:
+    """
+    Runs import jobs against a FileService
+
+    `workers` uploads run concurrently while the archive keeps being read;
+    at most `max_in_flight_bytes` of extracted content is held at once.
+    Metadata rows are inserted `batch_size` at a time.
+    """
+
+    def __init__(
+        self,
+        file_service,
+        extractor=None,
+        bucket: str = "user-files",
+        workers: int = 8,
+        batch_size: int = 200,
+        max_in_flight_bytes: int = 128 * 1024 * 1024,
+        progress_interval: float = 2.0,
+        on_imported: Optional[Callable[[str, List[Dict]], None]] = None,
+    ):
+        self.file_service = file_service
+        self.extractor = extractor
+        self.bucket = bucket
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_in_flight_bytes = max_in_flight_bytes
+        self.progress_interval = progress_interval
+        self.on_imported = on_imported
+        self.jobs: Dict[str, ImportJob] = {}
+        # Archives are imported one or two at a time per process; the rest wait queued
+        self._runner = ThreadPoolExecutor(max_workers=2, thread_name_prefix="archive-import")
+
+    @property
+    def supabase(self):
+        return get_supabase()
+
+    def submit(self, job: ImportJob, archive_path: str, max_files: Optional[int]) -> ImportJob:
+        """Queue a job; the archive file is deleted when the job finishes"""
+        # Finished jobs stay readable from import_jobs; keep only recent ones in memory
+        if len(self.jobs) >= 1000:
+            for job_id in [j.id for j in self.jobs.values() if j.finished_at][:500]:
+                del self.jobs[job_id]
+        self.jobs[job.id] = job
+        self._save(job)
+        self._runner.submit(self._run, job, archive_path, max_files)
+        return job
+
+    def get_job(self, job_id: str, user_id: str) -> Optional[Dict]:
+        """Job status from this process, or from import_jobs if another worker runs it"""
+        job = self.jobs.get(job_id)
+        if job is not None:
+            return job.to_dict() if job.user_id == user_id else None
+        result = self.supabase.table("import_jobs").select("*").eq("id", job_id).eq("user_id", user_id).execute()
+        return result.data[0] if result.data else None
+
+    def shutdown(self):
+        self._runner.shutdown(wait=False, cancel_futures=True)
+
+    def _save(self, job: ImportJob):
+        try:
+            self.supabase.table("import_jobs").upsert(job.to_dict(), returning="minimal").execute()
+        except Exception as e:
+            logger.warning(f"Could not persist import job {job.id}: {e}")
+
+    def _run(self, job: ImportJob, archive_path: str, max_files: Optional[int]):
+        job.status = "running"
+        self._save(job)
+        try:
+            self._import(job, archive_path, max_files)
+            job.status = "completed"
+        except Exception as e:
+            logger.error(f"Import job {job.id} failed: {e}")
+            job.record_error(job.archive_name, f"archive could not be read: {e}")
+            job.status = "failed"
+        finally:
+            job.finished_at = _now()
+            self._save(job)
+            try:
+                os.unlink(archive_path)
+            except OSError:
+                pass
+
+    def _import(self, job: ImportJob, archive_path: str, max_files: Optional[int]):
+        budget = _ByteBudget(self.max_in_flight_bytes)
+        pending_rows: List[Dict] = []
+        rows_lock = threading.Lock()
+        accepted = 0
+        last_saved = time.monotonic()
+
+        def upload(name: str, mime_type: str, content: bytes):
+            try:
+                file_id = str(uuid.uuid4())
+                extension = os.path.splitext(name)[1].lower() or mimetypes.guess_extension(mime_type) or ""
+                storage_path = f"{job.user_id}/{file_id}{extension}"
+                self.supabase.storage.from_(self.bucket).upload(
+                    storage_path, content, file_options={"content-type": mime_type}
+                )
+                metadata = {"import_job_id": job.id}
+                # Already off the request path, so extract before the row is written
+                if self.extractor:
+                    metadata.update(self.extractor.extract(content, mime_type))
+                row = {
+                    "id": file_id,
+                    "user_id": job.user_id,
+                    "name": name,
+                    "original_name": name,
+                    "mime_type": mime_type,
+                    "size": len(content),
+                    "storage_path": storage_path,
+                    "upload_date": _now(),
+                    "status": "uploaded",
+                    "metadata": metadata,
+                }
+                with rows_lock:
+                    pending_rows.append(row)
+            except Exception as e:
+                job.record_error(name, f"upload failed: {e}")
+            finally:
+                budget.release(len(content))
+
+        def flush(final: bool = False):
+            with rows_lock:
+                if not pending_rows or (not final and len(pending_rows) < self.batch_size):
+                    return
+                batch = pending_rows[:]
+                pending_rows.clear()
+            for start in range(0, len(batch), self.batch_size):
+                self._insert(job, batch[start:start + self.batch_size])
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="import-upload") as pool:
+                for name, declared_size, read in iter_archive(archive_path, self.file_service.max_file_size):
+                    base = posixpath.basename(name.replace("\\", "/"))
+                    if not base or base.startswith("._") or base.lower() in IGNORED_NAMES or "__MACOSX/" in name:
+                        continue
+                    job.total_entries += 1
+                    if job.total_entries > MAX_ENTRIES:
+                        job.record_error(base, f"archive has more than {MAX_ENTRIES} files", skipped=True)
+                        continue
+
+                    mime_type = mimetypes.guess_type(base)[0] or "application/octet-stream"
+                    reason = self.file_service.rejection_reason(mime_type, declared_size)
+                    if reason is None and max_files is not None and accepted >= max_files:
+                        reason = "plan file limit reached"
+                    if reason:
+                        job.record_error(base, reason, skipped=True)
+                        continue
+
+                    try:
+                        content = read()
+                    except Exception as e:
+                        # Corrupt (bad CRC), encrypted or unsupported entries; the rest may be fine
+                        job.record_error(base, f"could not be read: {e}")
+                        continue
+                    if content is None:
+                        job.record_error(base, f"file exceeds {self.file_service.max_file_size} bytes", skipped=True)
+                        continue
+                    if not content:
+                        job.record_error(base, "empty file", skipped=True)
+                        continue
+
+                    accepted += 1
+                    budget.acquire(len(content))
+                    pool.submit(upload, base, mime_type, content)
+
+                    flush()
+                    if time.monotonic() - last_saved >= self.progress_interval:
+                        self._save(job)
+                        last_saved = time.monotonic()
+        finally:
+            # Objects already uploaded get their rows even when the archive breaks part way
+            flush(final=True)
+
+    def _insert(self, job: ImportJob, rows: List[Dict]):
+        try:
+            self.supabase.table("user_files").insert(rows, returning="minimal").execute()
+        except Exception as e:
+            logger.error(f"Import job {job.id}: inserting {len(rows)} rows failed: {e}")
+            for row in rows:
+                job.record_error(row["name"], "could not save file metadata")
+            # Don't leave orphaned objects behind
+            try:
+                self.supabase.storage.from_(self.bucket).remove([row["storage_path"] for row in rows])
+            except Exception as cleanup_error:
+                logger.warning(f"Could not remove orphaned import objects: {cleanup_error}")
+            return
+        job.record_imported(len(rows), sum(row["size"] for row in rows))
+        if self.on_imported:
+            self.on_imported(job.user_id, rows)
@@ -1,54 +1,161 @@
+import asyncio
 import os
 import time
 import jwt
 import uuid
+from contextlib import asynccontextmanager
 from datetime import datetime
 from pathlib import Path
 from typing import List, Optional, Dict, Any
-from fastapi import FastAPI, APIRouter, Depends, HTTPException, Query
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.security import HTTPBearer
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from pydantic import BaseModel
-from supabase import Client, create_client
 from dotenv import load_dotenv
 import logging
+from activity_log import ActivityLogger
+from admission import AdmissionController, AdmissionMiddleware
+from call_budget import CallBudget, CallBudgetMiddleware
+from change_feed import ChangeHub, parse_cursor
+from exports import export_files, folder_dirs
+from clients import get_supabase, upstreams
+from health import HealthMonitor
+from idempotency import IdempotencyMiddleware, IdempotencyStore
+from etags import content_etag, etag_matches, get_change_version, if_none_match, make_etag, not_modified, set_etag
+from plans import PLANS, plan_key
+from profiling import AllocationMiddleware, AllocationTracker, NotTracking, ProfilerBusy, SamplingProfiler
+from compression import CompressionMiddleware
+from rekey_objects import object_key
+from resilience import StaleCache, mark_stale, upstream_error
+from responses import FastJSONResponse, json_response, parse_fields, select_list
+from tracing import LOG_FORMAT, TracingMiddleware, current_span, tracer
 
 # Load environment variables
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # Environment configuration
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY") 
-SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET", "super-secret-jwt-token-with-at-least-32-characters-long")
+# The Supabase CLI's published local secret: anyone can sign tokens with it, so they are only
+# trusted when ALLOW_DEFAULT_JWT_SECRET=true (local development), and never for admin access
+DEFAULT_JWT_SECRET = "super-secret-jwt-token-with-at-least-32-characters-long"
+SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET", DEFAULT_JWT_SECRET)
+ALLOW_DEFAULT_JWT_SECRET = os.getenv("ALLOW_DEFAULT_JWT_SECRET", "false").lower() in ("1", "true", "on")
 CORS_ORIGINS = os.getenv("CORS_ORIGINS", "http://localhost:3000").split(",")
 
-# Initialize Supabase client
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+# Buffered audit logging, flushed to activity_logs in the background
+activity_logger = ActivityLogger.from_env()
 
-# FastAPI app setup
-app = FastAPI(title="FileInASnap API", version="2.0.0")
-security = HTTPBearer()
+# Pushes folder/file changes to /events subscribers
+change_hub = ChangeHub.from_env()
+
+# Last folders/files/stats served per user, answered while Supabase is failing
+stale_cache = StaleCache.from_env()
+
+# Per-user rate limits and concurrency caps for the expensive listing endpoints
+admission = AdmissionController.from_env()
+ADMISSION_ROUTES = {
+    ("GET", "/folders"): "folders",
+    ("GET", "/folders/{folder_id}/tree"): "folders",
+    ("GET", "/stats"): "stats",
+    ("GET", "/bootstrap"): "stats",
+    ("GET", "/folders/{folder_id}/export"): "export",
+    ("POST", "/exports"): "export",
+}
 
-# CORS Configuration
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=CORS_ORIGINS,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+# Creates a client may retry with an Idempotency-Key header without duplicating anything
+idempotency_store = IdempotencyStore.from_env()
+IDEMPOTENT_ROUTES = [
+    ("POST", "/uploads/complete"),
+    ("POST", "/folders"),
+]
+
+# Columns a client may pick with ?fields=. Folder counts and sizes are kept up to date by
+# triggers (see supabase/migrations/*_folder_hierarchy.sql): file_count/total_bytes for the
+# folder itself, subtree_* for it and everything below it.
+FOLDER_COLUMNS = (
+    "id", "name", "owner_id", "parent_id", "path", "depth", "created_at", "updated_at",
+    "file_count", "total_bytes", "subtree_file_count", "subtree_bytes",
+)
+FILE_COLUMNS = (
+    "id", "folder_id", "owner_id", "object_key", "filename", "original_filename",
+    "bytes", "mime", "status", "created_at", "updated_at",
 )
 
+# SQLSTATEs raised by the folder hierarchy triggers and functions
+FOREIGN_KEY_VIOLATION = "23503"
+CHECK_VIOLATION = "23514"
+
+# Keys per storage remove call when deleting a folder tree
+STORAGE_REMOVE_BATCH = 1000
+
+# Files per bulk move, rename or export request
+MAX_BULK_FILES = 10000
+
+# Newest files included in /bootstrap
+BOOTSTRAP_RECENT_FILES = 20
+
+# Dependency checks for /readyz and /health/deep; none of them write anything
+def check_database():
+    get_supabase().table("folders").select("id").limit(1).execute()
+
+def check_storage():
+    get_supabase().storage.get_bucket("user-files")
+
+def check_rpc():
+    result = get_supabase().rpc("health_check").execute()
+    # Accept either boolean true or object with ok=true
+    ok = result.data.get("ok", True) if isinstance(result.data, dict) else result.data
+    if ok is False:
+        raise RuntimeError("health_check() reported not ok")
+
+health_monitor = HealthMonitor.from_env(
+    {"database": check_database, "storage": check_storage, "rpc": check_rpc},
+    critical=("database",),
+)
+
+# On-demand CPU and memory profiling for admins
+profiler = SamplingProfiler.from_env()
+allocation_tracker = AllocationTracker.from_env()
+
+# Routes are registered on a router and mounted by create_app()
+router = APIRouter()
+security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
+
 # Configure logging
-logging.basicConfig(level=logging.INFO)
+logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
 logger = logging.getLogger(__name__)
 
 # Pydantic Models
 class User(BaseModel):
     id: str
+    # Supabase app_metadata.role; only settable with the service key
+    role: Optional[str] = None
 
 class FolderIn(BaseModel):
     name: str
+    parent_id: Optional[str] = None
+
+class FolderUpdate(BaseModel):
+    name: Optional[str] = None
+    # Sent as null to move the folder to the top level; omitted to leave it in place
+    parent_id: Optional[str] = None
+
+class ExportIn(BaseModel):
+    file_ids: List[str]
+    name: Optional[str] = None
+
+class FilesMoveIn(BaseModel):
+    file_ids: List[str]
+    folder_id: str
+
+class FileRename(BaseModel):
+    id: str
+    filename: str
+
+class FilesRenameIn(BaseModel):
+    files: List[FileRename]
 
 class CompleteUploadIn(BaseModel):
     folder_id: str
@@ -58,13 +165,10 @@ class CompleteUploadIn(BaseModel):
     mime: Optional[str] = None
 
 # Authentication dependency
-def get_current_user(authorization: str = Depends(security)) -> User:
-    """Extract user from Supabase JWT token"""
-    if not authorization or not authorization.credentials.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Missing or invalid token")
-    
-    token = authorization.credentials.replace("Bearer ", "")
-    
+def decode_user_token(token: str) -> User:
+    """Validate a Supabase JWT locally and return its user"""
+    if SUPABASE_JWT_SECRET == DEFAULT_JWT_SECRET and not ALLOW_DEFAULT_JWT_SECRET:
+        raise HTTPException(status_code=503, detail="Authentication is not configured")
     try:
         payload = jwt.decode(
             token, 
@@ -76,99 +180,300 @@ def get_current_user(authorization: str = Depends(security)) -> User:
         if not user_id:
             raise HTTPException(status_code=401, detail="Invalid token payload")
         
-        return User(id=user_id)
+        # Tag the request's span so its trace can be found by user
+        span = current_span()
+        if span:
+            span.set_attribute("enduser.id", user_id)
+        return User(id=user_id, role=(payload.get("app_metadata") or {}).get("role"))
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token has expired")
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
+def get_current_user(authorization: str = Depends(security)) -> User:
+    """Extract user from Supabase JWT token"""
+    if not authorization or not authorization.credentials:
+        raise HTTPException(status_code=401, detail="Missing or invalid token")
+    
+    # HTTPBearer already strips the scheme; tolerate clients that repeat it
+    return decode_user_token(authorization.credentials.replace("Bearer ", ""))
+
+def get_stream_user(
+    access_token: Optional[str] = Query(None),
+    authorization: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)
+) -> User:
+    """Like get_current_user, but EventSource clients may pass ?access_token= instead of a header"""
+    token = authorization.credentials if authorization else access_token
+    if not token:
+        raise HTTPException(status_code=401, detail="Missing or invalid token")
+    return decode_user_token(token.replace("Bearer ", ""))
+
+def require_admin(user: User = Depends(get_current_user)) -> User:
+    """Current user, if their token carries the admin role"""
+    if SUPABASE_JWT_SECRET == DEFAULT_JWT_SECRET:
+        raise HTTPException(status_code=503, detail="Admin access requires SUPABASE_JWT_SECRET to be set")
+    if user.role != "admin":
+        raise HTTPException(status_code=403, detail="Insufficient permissions. Required role: admin")
+    return user
+
+# Conditional GET support
+def conditional_etag(supabase, resource: str, user_id: str, *params) -> Optional[str]:
+    """
+    ETag for a user's resource from their change version, or None if unavailable
+    The version is read before the data, so a concurrent write can only make
+    the ETag older than the body (forcing a refetch), never newer.
+    """
+    version = get_change_version(supabase, user_id)
+    if version is None:
+        return None
+    return make_etag(resource, user_id, version, *params)
+
+# Queries shared by the listing endpoints and /bootstrap
+def fetch_folders(supabase, user_id: str, columns: str = "*", parent_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """A user's folders, oldest first; parent_id 'root' for top-level folders only"""
+    query = supabase.table("folders").select(columns).eq("owner_id", user_id)
+    if parent_id == "root":
+        query = query.is_("parent_id", "null")
+    elif parent_id:
+        query = query.eq("parent_id", parent_id)
+    return query.order("created_at", desc=False).execute().data or []
+
+def fetch_files(supabase, user_id: str, columns: str = "*", folder_id: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
+    """A user's newest files, optionally in one folder"""
+    query = supabase.table("files").select(columns).eq("owner_id", user_id)
+    if folder_id:
+        query = query.eq("folder_id", folder_id)
+    return query.order("created_at", desc=True).limit(limit).execute().data or []
+
+def fetch_stats(supabase, user_id: str) -> Dict[str, Any]:
+    """Folder and file counts, total size and files per MIME type for a user"""
+    # Totals come from the folders' rolled-up subtree stats; see user_file_stats in supabase/migrations
+    rows = supabase.rpc("user_file_stats", {"p_owner_id": user_id}).execute().data
+    stats = (rows[0] if isinstance(rows, list) else rows) or {}
+    total_bytes = stats.get("total_bytes") or 0
+    
+    return {
+        "folders": stats.get("folders") or 0,
+        "files": stats.get("files") or 0,
+        "total_bytes": total_bytes,
+        "total_mb": round(total_bytes / (1024 * 1024), 2),
+        "type_breakdown": stats.get("type_breakdown") or {}
+    }
+
+def fetch_profile(supabase, user_id: str) -> Optional[Dict[str, Any]]:
+    """A user's profile row, or None before their first visit to /api/auth/profile"""
+    result = supabase.table("profiles").select("*").eq("id", user_id).limit(1).execute()
+    return result.data[0] if result.data else None
+
 # Health check endpoint
-@app.get("/health")
+@router.get("/health")
+@router.get("/livez")
 def health():
-    """Health check endpoint"""
+    """Liveness: the process is serving requests; no I/O"""
     return {"status": "ok", "time": int(time.time()), "service": "FileInASnap API"}
 
-# DB health including storage bucket verification
-@app.get("/db-health")
+@router.get("/readyz")
+def readiness(response: Response):
+    """Readiness from the last background health pass; 503 until the database check passes"""
+    report = health_monitor.readiness()
+    if not report["ready"]:
+        response.status_code = 503
+    return report
+
+@router.get("/health/deep")
+def deep_health():
+    """Fresh dependency checks with latencies, plus breaker and cache state"""
+    return {
+        **health_monitor.diagnostics(),
+        "upstreams": {name: upstream.snapshot() for name, upstream in upstreams.items()},
+        "stale_cache": stale_cache.stats,
+    }
+
+# Kept for existing pollers; answered from the cached readiness pass
+@router.get("/db-health")
 def db_health():
-    try:
-        # Ping a simple select
-        supabase.table("folders").select("id").limit(1).execute()
-        # Ensure storage bucket exists
-        buckets = supabase.storage.list_buckets()
-        names = [b.get("name") for b in buckets]
-        bucket_ok = "user-files" in names
-        if not bucket_ok:
-            # Attempt to create if missing (private by default)
-            try:
-                supabase.storage.create_bucket("user-files", public=False)
-                bucket_ok = True
-            except Exception:
-                bucket_ok = False
-        # Extra verification via RPC function (if present)
-        rpc_ok = True
-        try:
-            rpc_result = supabase.rpc("health_check").execute()
-            # Accept either boolean true or object with ok=true
-            if rpc_result.data is not None:
-                if isinstance(rpc_result.data, dict):
-                    rpc_ok = bool(rpc_result.data.get("ok", True))
-                else:
-                    rpc_ok = bool(rpc_result.data)
-        except Exception:
-            rpc_ok = False
-        return {"ok": True, "bucket_ok": bucket_ok, "rpc_ok": rpc_ok}
-    except Exception as e:
-        logger.error(f"DB health failed: {e}")
-        return {"ok": False, "error": str(e)}
+    report = health_monitor.readiness()
+    checks = report.get("checks", {})
+    result = {
+        "ok": report["ready"],
+        "bucket_ok": checks.get("storage", {}).get("ok", False),
+        "rpc_ok": checks.get("rpc", {}).get("ok", False),
+    }
+    if not report["ready"]:
+        result["error"] = report.get("reason") or "database check failing"
+    return result
 
 # Folder management endpoints
-@app.get("/folders")
-def list_folders(user: User = Depends(get_current_user)):
-    """List user's folders"""
+@router.get("/folders")
+def list_folders(
+    request: Request,
+    response: Response,
+    parent_id: Optional[str] = Query(None, description="Only the children of this folder; 'root' for top-level folders"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return, e.g. id,name,file_count"),
+    user: User = Depends(get_current_user)
+):
+    """List user's folders, with file counts and sizes"""
+    selected = parse_fields(fields, FOLDER_COLUMNS)
+    supabase = get_supabase()
+    etag = conditional_etag(supabase, "folders", user.id, fields and ",".join(selected), parent_id)
+    if etag and etag_matches(request, etag):
+        return not_modified(etag)
     try:
-        result = supabase.table("folders").select("*").eq("owner_id", user.id).order("created_at", desc=False).execute()
-        
-        # Add file count for each folder
-        folders = []
-        for folder in result.data or []:
-            file_count_result = supabase.table("files").select("id", count="exact").eq("folder_id", folder["id"]).execute()
-            folder["file_count"] = file_count_result.count or 0
-            folders.append(folder)
+        folders, age = stale_cache.load(
+            ("folders", user.id, fields and ",".join(selected), parent_id),
+            lambda: fetch_folders(supabase, user.id, select_list(selected, FOLDER_COLUMNS), parent_id),
+        )
             
-        return folders
+        if age is not None:
+            mark_stale(response, age)
+        elif etag:
+            set_etag(response, etag)
+        return json_response(folders, response)
     except Exception as e:
         logger.error(f"Error listing folders: {e}")
-        raise HTTPException(status_code=500, detail="Failed to fetch folders")
+        raise upstream_error(e, "Failed to fetch folders")
 
-@app.post("/folders")
+@router.post("/folders")
 def create_folder(body: FolderIn, user: User = Depends(get_current_user)):
     """Create a new folder"""
+    supabase = get_supabase()
     try:
         folder_data = {
             "name": body.name,
             "owner_id": user.id,
+            "parent_id": body.parent_id,
             "created_at": datetime.utcnow().isoformat()
         }
         
+        # Path and depth are filled in from the parent by the folders_set_path trigger
         result = supabase.table("folders").insert(folder_data).execute()
         
         if not result.data:
             raise HTTPException(status_code=500, detail="Failed to create folder")
-            
+        
+        activity_logger.log(user.id, "folder.create", "folder", result.data[0].get("id"), {"name": body.name})
+        change_hub.publish(user.id, "folder.created", {
+            "folder_id": result.data[0].get("id"), "name": body.name, "parent_id": body.parent_id
+        })
         return result.data[0]
+    except HTTPException:
+        raise
     except Exception as e:
+        if getattr(e, "code", None) == FOREIGN_KEY_VIOLATION:
+            raise HTTPException(status_code=404, detail="Parent folder not found")
         logger.error(f"Error creating folder: {e}")
-        raise HTTPException(status_code=500, detail="Failed to create folder")
+        raise upstream_error(e, "Failed to create folder")
+
+@router.get("/folders/{folder_id}/tree")
+def folder_tree(
+    folder_id: str,
+    request: Request,
+    response: Response,
+    max_depth: Optional[int] = Query(None, ge=1, description="Levels below the folder to include"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return for each folder"),
+    user: User = Depends(get_current_user)
+):
+    """A folder and its descendants in path order, each with its depth; two queries at any depth"""
+    selected = parse_fields(fields, FOLDER_COLUMNS, always=("id", "parent_id", "depth"))
+    supabase = get_supabase()
+    etag = conditional_etag(supabase, "folder-tree", user.id, folder_id, max_depth, fields and ",".join(selected))
+    if etag and etag_matches(request, etag):
+        return not_modified(etag)
+    try:
+        root = supabase.table("folders").select("path, depth").eq("id", folder_id).eq("owner_id", user.id).execute()
+        if not root.data:
+            raise HTTPException(status_code=404, detail="Folder not found")
+        # One range scan on (owner_id, path) covers the whole subtree
+        query = supabase.table("folders").select(select_list(selected, FOLDER_COLUMNS)) \
+            .eq("owner_id", user.id).like("path", f"{root.data[0]['path']}*")
+        if max_depth is not None:
+            query = query.lte("depth", root.data[0]["depth"] + max_depth)
+        folders = query.order("path").execute().data or []
+        
+        if etag:
+            set_etag(response, etag)
+        return json_response({"folder": folders[0] if folders else None, "descendants": folders[1:]}, response)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error fetching folder tree: {e}")
+        raise upstream_error(e, "Failed to fetch folder tree")
+
+@router.patch("/folders/{folder_id}")
+def update_folder(folder_id: str, body: FolderUpdate, user: User = Depends(get_current_user)):
+    """Rename a folder and/or move it, with everything below it, under another parent"""
+    supabase = get_supabase()
+    try:
+        folder = None
+        if "parent_id" in body.model_fields_set:
+            moved = supabase.rpc("move_folder", {
+                "p_folder_id": folder_id, "p_owner_id": user.id, "p_parent_id": body.parent_id,
+            }).execute()
+            if not moved.data:
+                raise HTTPException(status_code=404, detail="Folder not found")
+            folder = moved.data[0]
+        if body.name is not None:
+            renamed = supabase.table("folders").update({"name": body.name, "updated_at": datetime.utcnow().isoformat()}) \
+                .eq("id", folder_id).eq("owner_id", user.id).execute()
+            if not renamed.data:
+                raise HTTPException(status_code=404, detail="Folder not found")
+            folder = renamed.data[0]
+        if folder is None:
+            raise HTTPException(status_code=400, detail="Nothing to update")
+        
+        activity_logger.log(user.id, "folder.update", "folder", folder_id, body.model_dump(exclude_unset=True))
+        change_hub.publish(user.id, "folder.updated", {
+            "folder_id": folder_id, "name": folder.get("name"), "parent_id": folder.get("parent_id")
+        })
+        return folder
+    except HTTPException:
+        raise
+    except Exception as e:
+        code = getattr(e, "code", None)
+        if code == FOREIGN_KEY_VIOLATION:
+            raise HTTPException(status_code=404, detail="Parent folder not found")
+        if code == CHECK_VIOLATION:
+            raise HTTPException(status_code=400, detail="Cannot move a folder into itself or its subfolders")
+        logger.error(f"Error updating folder: {e}")
+        raise upstream_error(e, "Failed to update folder")
+
+@router.delete("/folders/{folder_id}")
+def delete_folder(folder_id: str, user: User = Depends(get_current_user)):
+    """Delete a folder with all of its subfolders and files"""
+    supabase = get_supabase()
+    try:
+        folder = supabase.table("folders").select("name").eq("id", folder_id).eq("owner_id", user.id).execute()
+        if not folder.data:
+            raise HTTPException(status_code=404, detail="Folder not found")
+        
+        # One transaction removes the subtree's files and folders and returns their storage keys
+        keys = [row["object_key"] for row in supabase.rpc("delete_folder_tree", {
+            "p_folder_id": folder_id, "p_owner_id": user.id,
+        }).execute().data or []]
+        for start in range(0, len(keys), STORAGE_REMOVE_BATCH):
+            try:
+                supabase.storage.from_("user-files").remove(keys[start:start + STORAGE_REMOVE_BATCH])
+            except Exception as e:
+                logger.warning(f"Failed to delete {len(keys[start:start + STORAGE_REMOVE_BATCH])} objects from storage: {e}")
+        
+        activity_logger.log(user.id, "folder.delete", "folder", folder_id, {"name": folder.data[0]["name"], "files": len(keys)})
+        change_hub.publish(user.id, "folder.deleted", {"folder_id": folder_id})
+        return {"ok": True, "message": "Folder deleted successfully", "files_deleted": len(keys)}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error deleting folder: {e}")
+        raise upstream_error(e, "Failed to delete folder")
 
 # Upload endpoints with presigned URLs
-@app.get("/uploads/presign")
+@router.get("/uploads/presign")
 def presign_upload(
     folder_id: str = Query(...), 
     filename: str = Query(...), 
     user: User = Depends(get_current_user)
 ):
     """Generate presigned URL for file upload"""
+    supabase = get_supabase()
     try:
         # Verify folder exists and belongs to user
         folder_result = supabase.table("folders").select("*").eq("id", folder_id).eq("owner_id", user.id).execute()
@@ -176,26 +481,29 @@ def presign_upload(
         if not folder_result.data:
             raise HTTPException(status_code=404, detail="Folder not found")
         
-        # Generate object key for Supabase storage
-        object_key = f"{user.id}/{folder_id}/{filename}"
+        # Keys don't depend on the folder or name, so moves and renames never touch storage
+        key = object_key(user.id, filename)
         
         # Create presigned upload URL using Supabase
-        signed_result = supabase.storage.from_("user-files").create_signed_upload_url(object_key)
+        signed_result = supabase.storage.from_("user-files").create_signed_upload_url(key)
         
         return {
             "url": signed_result.get("signedUrl") or signed_result.get("signed_url"),
-            "object_key": object_key
+            "object_key": key
         }
         
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Error creating presigned URL: {e}")
-        raise HTTPException(status_code=500, detail="Failed to create upload URL")
+        raise upstream_error(e, "Failed to create upload URL")
 
-@app.post("/uploads/complete")
+@router.post("/uploads/complete")
 def complete_upload(body: CompleteUploadIn, user: User = Depends(get_current_user)):
     """Complete file upload by saving metadata"""
+    if not body.object_key.startswith(f"{user.id}/"):
+        raise HTTPException(status_code=400, detail="Invalid object key")
+    supabase = get_supabase()
     try:
         # Verify folder exists and belongs to user
         folder_result = supabase.table("folders").select("*").eq("id", body.folder_id).eq("owner_id", user.id).execute()
@@ -221,45 +529,65 @@ def complete_upload(body: CompleteUploadIn, user: User = Depends(get_current_use
         if not result.data:
             raise HTTPException(status_code=500, detail="Failed to save file metadata")
         
+        activity_logger.log(
+            user.id, "file.upload", "file", result.data[0].get("id"),
+            {"folder_id": body.folder_id, "bytes": body.bytes, "mime": body.mime}
+        )
+        change_hub.publish(user.id, "file.created", {
+            "file_id": result.data[0].get("id"), "folder_id": body.folder_id,
+            "filename": body.filename, "bytes": body.bytes, "mime": body.mime, "status": "uploaded"
+        })
         return {"ok": True, "file": result.data[0]}
         
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Error completing upload: {e}")
-        raise HTTPException(status_code=500, detail="Failed to complete upload")
+        raise upstream_error(e, "Failed to complete upload")
 
 # File management endpoints
-@app.get("/files")
+@router.get("/files")
 def list_files(
+    request: Request,
+    response: Response,
     folder_id: Optional[str] = Query(None),
     limit: int = Query(50, le=200),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return, e.g. id,filename,bytes"),
     user: User = Depends(get_current_user)
 ):
     """List user's files, optionally filtered by folder"""
+    selected = parse_fields(fields, FILE_COLUMNS)
+    supabase = get_supabase()
+    etag = conditional_etag(supabase, "files", user.id, folder_id, limit, fields and ",".join(selected))
+    if etag and etag_matches(request, etag):
+        return not_modified(etag)
     try:
-        query = supabase.table("files").select("*").eq("owner_id", user.id)
+        def load_files():
+            if folder_id:
+                # Verify folder belongs to user
+                folder_result = supabase.table("folders").select("*").eq("id", folder_id).eq("owner_id", user.id).execute()
+                if not folder_result.data:
+                    raise HTTPException(status_code=404, detail="Folder not found")
+            return fetch_files(supabase, user.id, select_list(selected, FILE_COLUMNS), folder_id, limit)
         
-        if folder_id:
-            # Verify folder belongs to user
-            folder_result = supabase.table("folders").select("*").eq("id", folder_id).eq("owner_id", user.id).execute()
-            if not folder_result.data:
-                raise HTTPException(status_code=404, detail="Folder not found")
-            query = query.eq("folder_id", folder_id)
-        
-        result = query.order("created_at", desc=True).limit(limit).execute()
+        files, age = stale_cache.load(("files", user.id, folder_id, limit, fields and ",".join(selected)), load_files)
         
-        return result.data or []
+        if age is not None:
+            mark_stale(response, age)
+        elif etag:
+            set_etag(response, etag)
+        return json_response(files, response)
         
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Error listing files: {e}")
-        raise HTTPException(status_code=500, detail="Failed to fetch files")
+        raise upstream_error(e, "Failed to fetch files")
 
-@app.delete("/files/{file_id}")
+@router.delete("/files/{file_id}")
 def delete_file(file_id: str, user: User = Depends(get_current_user)):
     """Delete a file"""
+    supabase = get_supabase()
     try:
         # Get file metadata
         file_result = supabase.table("files").select("*").eq("id", file_id).eq("owner_id", user.id).execute()
@@ -279,47 +607,352 @@ def delete_file(file_id: str, user: User = Depends(get_current_user)):
         # Delete from database
         supabase.table("files").delete().eq("id", file_id).eq("owner_id", user.id).execute()
         
+        activity_logger.log(user.id, "file.delete", "file", file_id, {"bytes": file_info.get("bytes")})
+        change_hub.publish(user.id, "file.deleted", {"file_id": file_id, "folder_id": file_info.get("folder_id")})
         return {"ok": True, "message": "File deleted successfully"}
         
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Error deleting file: {e}")
-        raise HTTPException(status_code=500, detail="Failed to delete file")
+        raise upstream_error(e, "Failed to delete file")
+
+@router.post("/files/move")
+def move_files(body: FilesMoveIn, user: User = Depends(get_current_user)):
+    """Move files into a folder; one UPDATE however many files, storage is untouched"""
+    if not body.file_ids:
+        raise HTTPException(status_code=400, detail="No files selected")
+    if len(body.file_ids) > MAX_BULK_FILES:
+        raise HTTPException(status_code=400, detail="Too many files selected")
+    
+    supabase = get_supabase()
+    try:
+        result = supabase.rpc("move_files", {
+            "p_owner_id": user.id, "p_file_ids": body.file_ids, "p_folder_id": body.folder_id,
+        }).execute()
+        moved = [row["id"] for row in result.data or []]
+        
+        if moved:
+            activity_logger.log(user.id, "files.move", "file", None, {"folder_id": body.folder_id, "files": len(moved)})
+            for file_id in moved:
+                change_hub.publish(user.id, "file.moved", {"file_id": file_id, "folder_id": body.folder_id})
+        return {"ok": True, "moved": len(moved)}
+    except Exception as e:
+        if getattr(e, "code", None) == FOREIGN_KEY_VIOLATION:
+            raise HTTPException(status_code=404, detail="Folder not found")
+        logger.error(f"Error moving files: {e}")
+        raise upstream_error(e, "Failed to move files")
+
+@router.post("/files/rename")
+def rename_files(body: FilesRenameIn, user: User = Depends(get_current_user)):
+    """Rename files; one UPDATE however many files, storage is untouched"""
+    if not body.files:
+        raise HTTPException(status_code=400, detail="No files selected")
+    if len(body.files) > MAX_BULK_FILES:
+        raise HTTPException(status_code=400, detail="Too many files selected")
+    renames = {item.id: item.filename.strip() for item in body.files}
+    if not all(renames.values()):
+        raise HTTPException(status_code=400, detail="Filename cannot be empty")
+    
+    supabase = get_supabase()
+    try:
+        result = supabase.rpc("rename_files", {
+            "p_owner_id": user.id,
+            "p_renames": [{"id": file_id, "filename": filename} for file_id, filename in renames.items()],
+        }).execute()
+        renamed = result.data or []
+        
+        if renamed:
+            activity_logger.log(user.id, "files.rename", "file", None, {"files": len(renamed)})
+            for row in renamed:
+                change_hub.publish(user.id, "file.renamed", {"file_id": row["id"], "filename": row["filename"]})
+        return {"ok": True, "renamed": len(renamed)}
+    except Exception as e:
+        logger.error(f"Error renaming files: {e}")
+        raise upstream_error(e, "Failed to rename files")
+
+# Bulk export endpoints
+EXPORT_COLUMNS = "id, object_key, filename, mime, bytes, created_at"
+
+def zip_response(supabase, files: List[Dict[str, Any]], name: str) -> StreamingResponse:
+    """Stream `files` as a ZIP download named `name`.zip"""
+    filename = "".join(c for c in name if c.isalnum() or c in " ._-").strip() or "export"
+    return StreamingResponse(
+        export_files(supabase, files),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}.zip"'},
+    )
+
+@router.get("/folders/{folder_id}/export")
+def export_folder(folder_id: str, user: User = Depends(get_current_user)):
+    """Download a folder and everything below it as a streamed ZIP archive"""
+    supabase = get_supabase()
+    try:
+        folder_result = supabase.table("folders").select("id, name, path").eq("id", folder_id).eq("owner_id", user.id).execute()
+        if not folder_result.data:
+            raise HTTPException(status_code=404, detail="Folder not found")
+        
+        # The whole subtree in one range scan on (owner_id, path); parents sort before their children
+        subtree = supabase.table("folders").select("id, name, parent_id") \
+            .eq("owner_id", user.id).like("path", f"{folder_result.data[0]['path']}*").order("path").execute().data or []
+        dirs = folder_dirs(subtree, folder_id)
+        position = {fid: i for i, fid in enumerate(dirs)}
+        
+        files = []
+        folder_ids = list(dirs)
+        for start in range(0, len(folder_ids), 500):
+            batch = folder_ids[start:start + 500]
+            files.extend(supabase.table("files").select(EXPORT_COLUMNS + ", folder_id").in_("folder_id", batch).eq("owner_id", user.id).order("created_at").execute().data or [])
+        files.sort(key=lambda f: position[f["folder_id"]])
+        for file in files:
+            file["directory"] = dirs[file["folder_id"]]
+        response = zip_response(supabase, files, folder_result.data[0]["name"])
+        
+        activity_logger.log(user.id, "folder.export", "folder", folder_id, {"files": len(files), "folders": len(dirs)})
+        return response
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error exporting folder: {e}")
+        raise upstream_error(e, "Failed to export folder")
+
+@router.post("/exports")
+def export_selection(body: ExportIn, user: User = Depends(get_current_user)):
+    """Download selected files as a streamed ZIP archive"""
+    if not body.file_ids:
+        raise HTTPException(status_code=400, detail="No files selected")
+    if len(body.file_ids) > MAX_BULK_FILES:
+        raise HTTPException(status_code=400, detail="Too many files selected")
+    
+    supabase = get_supabase()
+    try:
+        files = []
+        for start in range(0, len(body.file_ids), 500):
+            batch = body.file_ids[start:start + 500]
+            files.extend(supabase.table("files").select(EXPORT_COLUMNS).in_("id", batch).eq("owner_id", user.id).execute().data or [])
+        if not files:
+            raise HTTPException(status_code=404, detail="Files not found")
+        position = {file_id: i for i, file_id in enumerate(body.file_ids)}
+        files.sort(key=lambda f: position.get(f["id"], 0))
+        
+        response = zip_response(supabase, files, body.name or "export")
+        activity_logger.log(user.id, "files.export", "file", None, {"files": len(files)})
+        return response
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error exporting files: {e}")
+        raise upstream_error(e, "Failed to export files")
 
 # User stats endpoint
-@app.get("/stats")
-def get_user_stats(user: User = Depends(get_current_user)):
+@router.get("/stats")
+def get_user_stats(request: Request, response: Response, user: User = Depends(get_current_user)):
     """Get user statistics"""
+    supabase = get_supabase()
+    etag = conditional_etag(supabase, "stats", user.id)
+    if etag and etag_matches(request, etag):
+        return not_modified(etag)
     try:
-        # Get folder count
-        folders_result = supabase.table("folders").select("id", count="exact").eq("owner_id", user.id).execute()
-        folder_count = folders_result.count or 0
-        
-        # Get file count and total size
-        files_result = supabase.table("files").select("bytes").eq("owner_id", user.id).execute()
-        file_count = len(files_result.data or [])
-        total_bytes = sum(file.get("bytes", 0) for file in files_result.data or [])
-        
-        # Get file type breakdown
-        type_counts = {}
-        for file in files_result.data or []:
-            mime = file.get("mime", "unknown")
-            if mime:
-                file_type = mime.split("/")[0]
-                type_counts[file_type] = type_counts.get(file_type, 0) + 1
+        stats, age = stale_cache.load(("stats", user.id), lambda: fetch_stats(supabase, user.id))
         
-        return {
-            "folders": folder_count,
-            "files": file_count,
-            "total_bytes": total_bytes,
-            "total_mb": round(total_bytes / (1024 * 1024), 2),
-            "type_breakdown": type_counts
-        }
+        if age is not None:
+            mark_stale(response, age)
+        elif etag:
+            set_etag(response, etag)
+        return stats
         
     except Exception as e:
         logger.error(f"Error getting stats: {e}")
-        raise HTTPException(status_code=500, detail="Failed to fetch statistics")
+        raise upstream_error(e, "Failed to fetch statistics")
+
+# Dashboard bootstrap
+@router.get("/bootstrap")
+async def bootstrap(request: Request, response: Response, user: User = Depends(get_current_user)):
+    """
+    Everything the dashboard needs on load, fetched concurrently in one request
+    Each section carries its own ETag, the same one its standalone endpoint
+    would send. Sections whose ETag the client lists in If-None-Match come
+    back as {"etag": ..., "not_modified": true} and are not queried; if
+    every section is unchanged the response is a 304.
+    """
+    supabase = get_supabase()
+    known = if_none_match(request)
+    # Section -> (ETag resource and params as used by the standalone endpoint, loader); the
+    # same parameters key the stale cache, so an outage serves whatever either one last saw
+    versioned = {
+        "folders": (("folders", None, None), lambda: fetch_folders(supabase, user.id)),
+        "recent_files": (("files", None, BOOTSTRAP_RECENT_FILES, None),
+                         lambda: fetch_files(supabase, user.id, limit=BOOTSTRAP_RECENT_FILES)),
+        "stats": (("stats",), lambda: fetch_stats(supabase, user.id)),
+    }
+    
+    async def load(name: str, key: tuple, loader):
+        value, age = await asyncio.to_thread(stale_cache.load, key, loader)
+        if age is not None:
+            ages[name] = age
+        return value
+    
+    ages: Dict[str, float] = {}
+    try:
+        # The version is read before the sections, like conditional_etag()
+        version, profile = await asyncio.gather(
+            asyncio.to_thread(get_change_version, supabase, user.id),
+            load("profile", ("profile", user.id), lambda: fetch_profile(supabase, user.id)),
+        )
+        plans = {"current": plan_key(profile and profile.get("tier")), "plans": PLANS}
+        etags = {
+            name: make_etag(resource, user.id, version, *params) if version is not None else None
+            for name, ((resource, *params), _) in versioned.items()
+        }
+        etags["profile"] = content_etag("profile", profile)
+        etags["plans"] = content_etag("plans", plans)
+        fresh = {name for name, etag in etags.items() if etag and etag[2:] in known}
+        etag = content_etag("bootstrap", etags) if version is not None else None
+        if etag and (etag_matches(request, etag) or len(fresh) == len(etags)):
+            return not_modified(etag)
+        
+        wanted = [name for name in versioned if name not in fresh]
+        loaded = await asyncio.gather(*(
+            load(name, (versioned[name][0][0], user.id, *versioned[name][0][1:]), versioned[name][1]) for name in wanted
+        ))
+        data = dict(zip(wanted, loaded), profile=profile, plans=plans)
+        
+        sections = {}
+        for name in etags:
+            if name in fresh:
+                sections[name] = {"etag": etags[name], "not_modified": True}
+            elif name in ages:
+                # Last known data from before the outage; no ETag, so the client refetches it later
+                sections[name] = {"etag": None, "data": data[name], "stale_age": int(ages[name])}
+            else:
+                sections[name] = {"etag": etags[name], "data": data[name]}
+        if ages:
+            mark_stale(response, max(ages.values()))
+        elif etag:
+            set_etag(response, etag)
+        return json_response(sections, response)
+    except Exception as e:
+        logger.error(f"Error loading dashboard: {e}")
+        raise upstream_error(e, "Failed to load dashboard")
+
+# Realtime change feed
+@router.get("/events")
+async def stream_events(
+    request: Request,
+    cursor: Optional[str] = Query(None),
+    user: User = Depends(get_stream_user)
+):
+    """Server-Sent Events stream of the user's folder and file changes"""
+    start = parse_cursor(request.headers.get("last-event-id"), cursor)
+    return StreamingResponse(
+        change_hub.stream(user.id, start),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# Profiling (admins only)
+@router.get("/admin/profile/cpu", response_class=PlainTextResponse)
+async def profile_cpu(
+    seconds: float = Query(10, gt=0),
+    interval_ms: float = Query(10, ge=1, le=1000),
+    include_idle: bool = False,
+    user: User = Depends(require_admin)
+):
+    """Sample every thread's stack for `seconds`; returns collapsed stacks for flamegraph.pl or speedscope"""
+    try:
+        stacks = await asyncio.to_thread(profiler.profile, seconds, interval_ms / 1000, include_idle)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return PlainTextResponse(stacks)
+
+@router.post("/admin/profile/memory")
+def start_memory_profile(frames: Optional[int] = Query(None, ge=1, le=128), user: User = Depends(require_admin)):
+    """Start tracemalloc (or take a new baseline if it is running)"""
+    return allocation_tracker.start(frames)
+
+@router.get("/admin/profile/memory")
+def memory_profile(
+    request: Request,
+    top: int = Query(25, ge=1, le=500),
+    route: Optional[str] = Query(None, description='Limit top_lines to one route, e.g. "GET /stats"'),
+    user: User = Depends(require_admin)
+):
+    """Memory allocated since the baseline and still held, by route and source line, plus per-route peaks"""
+    try:
+        return allocation_tracker.report(request.app.routes, top, route)
+    except NotTracking as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@router.delete("/admin/profile/memory")
+def stop_memory_profile(user: User = Depends(require_admin)):
+    """Stop tracemalloc"""
+    return allocation_tracker.stop()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create shared clients and background workers once per process, not at import"""
+    started = time.perf_counter()
+    get_supabase()
+    if SUPABASE_JWT_SECRET == DEFAULT_JWT_SECRET:
+        logger.warning("SUPABASE_JWT_SECRET is the public default; " + (
+            "accepting user tokens signed with it, admin endpoints disabled" if ALLOW_DEFAULT_JWT_SECRET
+            else "all authenticated endpoints will answer 503"))
+    activity_logger.start()
+    change_hub.start()
+    health_monitor.start()
+    tracer.start()
+    logger.info(f"FileInASnap API ready in {(time.perf_counter() - started) * 1000:.1f}ms")
+    yield
+    tracer.stop()
+    health_monitor.stop()
+    change_hub.stop()
+    activity_logger.stop()
+
+def create_app() -> FastAPI:
+    """Build the FastAPI application"""
+    app = FastAPI(title="FileInASnap API", version="2.0.0", lifespan=lifespan, default_response_class=FastJSONResponse)
+    
+    # Innermost, so stored and replayed responses are the uncompressed bodies the routes produced
+    app.add_middleware(
+        IdempotencyMiddleware,
+        store=idempotency_store,
+        routes=IDEMPOTENT_ROUTES,
+        jwt_secret=SUPABASE_JWT_SECRET,
+    )
+    
+    # Compresses route and replayed responses alike
+    app.add_middleware(CompressionMiddleware, **CompressionMiddleware.options_from_env())
+    
+    # Admission control sits inside CORS so 429s are readable by browsers
+    app.add_middleware(
+        AdmissionMiddleware,
+        controller=admission,
+        routes=ADMISSION_ROUTES,
+        jwt_secret=SUPABASE_JWT_SECRET,
+    )
+    
+    # CORS Configuration
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=CORS_ORIGINS,
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    
+    # Per-route memory peaks while allocation tracking is on; a no-op otherwise
+    app.add_middleware(AllocationMiddleware, tracker=allocation_tracker)
+    
+    # Counts Supabase calls per request into Server-Timing and flags requests over CALL_BUDGET
+    app.add_middleware(CallBudgetMiddleware, budget=CallBudget.from_env())
+    
+    # Outermost, so each request's root span covers all of the above
+    app.add_middleware(TracingMiddleware)
+    
+    app.include_router(router)
+    return app
+
+app = create_app()
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+"""
+Media metadata extraction for FileInASnap
+Pulls capture time, GPS position, camera, dimensions, PDF page count and
+title, and video duration out of uploaded files and merges them into
+user_files.metadata. Extraction runs in a process pool off the request
+path; the timeline and places views then query the indexed keys (see
+supabase/migrations/*_user_files_metadata_indexes.sql) instead of opening
+files.
+
+Files uploaded before extraction existed can be backfilled:
+    python media_metadata.py --limit 5000
+"""
+
+import argparse
+import io
+import logging
+import multiprocessing
+import os
+import struct
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional, Tuple
+
+from clients import get_supabase
+from duplicates import image_fingerprint
+from optional import OptionalDependencyError, optional_import
+from storage_tiers import StorageTiers
+
+logger = logging.getLogger(__name__)
+
+# Bumped when extraction changes; rows with an older version are backfilled again
+EXTRACTOR_VERSION = 1
+
+IMAGE_TYPES = ("image/jpeg", "image/png", "image/gif", "image/webp")
+VIDEO_TYPES = ("video/mp4", "video/quicktime", "video/x-msvideo")
+EXTRACTABLE_TYPES = IMAGE_TYPES + ("application/pdf",) + VIDEO_TYPES
+
+# EXIF tags (see the EXIF 2.3 specification)
+TAG_MAKE, TAG_MODEL, TAG_ORIENTATION, TAG_DATETIME = 0x010F, 0x0110, 0x0112, 0x0132
+TAG_DATETIME_ORIGINAL, TAG_DATETIME_DIGITIZED, TAG_OFFSET_TIME_ORIGINAL = 0x9003, 0x9004, 0x9011
+IFD_EXIF, IFD_GPS = 0x8769, 0x8825
+
+MP4_EPOCH = datetime(1904, 1, 1)
+
+
+def extract_metadata(content: bytes, mime_type: str) -> Dict:
+    """
+    Metadata for one file, keyed as stored in user_files.metadata
+    Fields that are missing or unreadable are left out. Raises
+    OptionalDependencyError when the library for this type is not installed.
+    """
+    if mime_type in IMAGE_TYPES:
+        fields = _image_metadata(content)
+    elif mime_type == "application/pdf":
+        fields = _pdf_metadata(content)
+    elif mime_type in ("video/mp4", "video/quicktime"):
+        fields = _mp4_metadata(content)
+    elif mime_type == "video/x-msvideo":
+        fields = _avi_metadata(content)
+    else:
+        return {}
+    fields["extracted_version"] = EXTRACTOR_VERSION
+    return fields
+
+
+def _image_metadata(content: bytes) -> Dict:
+    Image = optional_import("PIL.Image", "Pillow")
+    fields = image_fingerprint(content) or {}
+    try:
+        with Image.open(io.BytesIO(content)) as image:
+            exif = image.getexif()
+            exif_ifd = exif.get_ifd(IFD_EXIF)
+            gps_ifd = exif.get_ifd(IFD_GPS)
+    except Exception as e:
+        logger.info(f"Could not read EXIF: {e}")
+        return fields
+
+    # Rotated photos are stored sideways; report the dimensions as displayed
+    if exif.get(TAG_ORIENTATION) in (5, 6, 7, 8) and "width" in fields:
+        fields["width"], fields["height"] = fields["height"], fields["width"]
+
+    captured = _exif_datetime(exif_ifd.get(TAG_DATETIME_ORIGINAL) or exif_ifd.get(TAG_DATETIME_DIGITIZED)
+                              or exif.get(TAG_DATETIME))
+    if captured:
+        fields["captured_at"] = captured
+        offset = _clean(exif_ifd.get(TAG_OFFSET_TIME_ORIGINAL))
+        if offset:
+            fields["captured_offset"] = offset
+
+    for tag, key in ((TAG_MAKE, "camera_make"), (TAG_MODEL, "camera_model")):
+        value = _clean(exif.get(tag))
+        if value:
+            fields[key] = value[:100]
+
+    position = _gps_position(gps_ifd)
+    if position:
+        fields["gps_lat"], fields["gps_lon"] = position
+    return fields
+
+
+def _clean(value) -> Optional[str]:
+    if isinstance(value, bytes):
+        value = value.decode("utf-8", "ignore")
+    if not isinstance(value, str):
+        return None
+    return value.strip("\x00 ") or None
+
+
+def _exif_datetime(value) -> Optional[str]:
+    """EXIF 'YYYY:MM:DD HH:MM:SS' as ISO 8601 local time, the form the captured_at index sorts on"""
+    value = _clean(value)
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value[:19], "%Y:%m:%d %H:%M:%S").isoformat()
+    except ValueError:
+        return None
+
+
+def _gps_position(gps: Dict) -> Optional[Tuple[float, float]]:
+    def degrees(dms, ref) -> Optional[float]:
+        try:
+            d, m, s = (float(part) for part in dms)
+        except (TypeError, ValueError, ZeroDivisionError):
+            return None
+        value = d + m / 60 + s / 3600
+        return -value if _clean(ref) in ("S", "W") else value
+
+    lat = degrees(gps.get(2), gps.get(1))
+    lon = degrees(gps.get(4), gps.get(3))
+    if lat is None or lon is None or not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return None
+    # Cameras without a fix often write zeros
+    if lat == 0 and lon == 0:
+        return None
+    return round(lat, 6), round(lon, 6)
+
+
+def _pdf_metadata(content: bytes) -> Dict:
+    pypdf = optional_import("pypdf")
+    fields: Dict = {}
+    try:
+        reader = pypdf.PdfReader(io.BytesIO(content))
+        fields["page_count"] = len(reader.pages)
+        title = _clean(reader.metadata.title) if reader.metadata else None
+        if title:
+            fields["title"] = title[:500]
+    except Exception as e:
+        logger.info(f"Could not read PDF metadata: {e}")
+    return fields
+
+
+def _mp4_boxes(content: bytes, start: int, end: int):
+    """(type, payload start, payload end) of ISO base media boxes in content[start:end]"""
+    offset = start
+    while offset + 8 <= end:
+        size, kind = struct.unpack_from(">I4s", content, offset)
+        header = 8
+        if size == 1:
+            if offset + 16 > end:
+                return
+            size = struct.unpack_from(">Q", content, offset + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header:
+            return
+        yield kind, offset + header, min(offset + size, end)
+        offset += size
+
+
+def _mp4_metadata(content: bytes) -> Dict:
+    """Duration and creation time from the movie header (moov/mvhd); no decoding needed"""
+    for kind, start, end in _mp4_boxes(content, 0, len(content)):
+        if kind != b"moov":
+            continue
+        for inner, payload, payload_end in _mp4_boxes(content, start, end):
+            if inner != b"mvhd" or payload_end - payload < 32:
+                continue
+            if content[payload] == 1:
+                created, _, timescale, duration = struct.unpack_from(">QQIQ", content, payload + 4)
+            else:
+                created, _, timescale, duration = struct.unpack_from(">IIII", content, payload + 4)
+            fields: Dict = {}
+            if timescale:
+                fields["duration_seconds"] = round(duration / timescale, 3)
+            # Phones record UTC here; zero means unset
+            if created:
+                captured = MP4_EPOCH + timedelta(seconds=created)
+                if captured.year >= 1990:
+                    fields["captured_at"] = captured.isoformat()
+                    fields["captured_offset"] = "+00:00"
+            return fields
+    return {}
+
+
+def _avi_metadata(content: bytes) -> Dict:
+    """Duration and frame size from the AVI main header (avih)"""
+    position = content.find(b"avih", 0, 8192)
+    if content[:4] != b"RIFF" or position < 0 or position + 48 > len(content):
+        return {}
+    micro_per_frame, _, _, _, total_frames, _, _, _, width, height = struct.unpack_from("<10I", content, position + 8)
+    fields: Dict = {}
+    if micro_per_frame and total_frames:
+        fields["duration_seconds"] = round(micro_per_frame * total_frames / 1_000_000, 3)
+    if width and height:
+        fields["width"], fields["height"] = width, height
+    return fields
+
+
+class MetadataExtractor:
+    """
+    Runs extract_metadata() in worker processes and merges the results into user_files
+
+    Image decoding and PDF parsing are CPU-bound, so they run in a process
+    pool where they cannot hold the GIL against request handling. Video
+    headers are parsed in-process since that only reads a few boxes. At most
+    `max_pending` submitted files are held; beyond that, files are left for
+    the backfill instead of queueing unbounded content in memory.
+    """
+
+    def __init__(
+        self,
+        supabase_client=None,
+        workers: int = 2,
+        max_pending: int = 200,
+        max_tasks_per_child: int = 500,
+        enabled: bool = True,
+        on_extracted: Optional[Callable[[str, str, Dict], None]] = None,
+    ):
+        self._supabase = supabase_client
+        self.workers = workers
+        self.max_pending = max_pending
+        self.max_tasks_per_child = max_tasks_per_child
+        self.enabled = enabled
+        self.on_extracted = on_extracted
+        self.pending = 0
+        self._lock = threading.Lock()
+        self._processes: Optional[ProcessPoolExecutor] = None
+        self._threads: Optional[ThreadPoolExecutor] = None
+        self._missing: set = set()
+
+    @classmethod
+    def from_env(cls, **kwargs) -> "MetadataExtractor":
+        """Build an extractor configured from METADATA_* environment variables"""
+        return cls(
+            workers=int(os.getenv("METADATA_WORKERS", 2)),
+            max_pending=int(os.getenv("METADATA_MAX_PENDING", 200)),
+            enabled=os.getenv("METADATA_EXTRACTION", "on").lower() not in ("off", "false", "0"),
+            **kwargs,
+        )
+
+    @property
+    def supabase(self):
+        return self._supabase or get_supabase()
+
+    def _pools(self) -> Tuple[ProcessPoolExecutor, ThreadPoolExecutor]:
+        with self._lock:
+            if self._processes is None:
+                # spawn, not fork: the API process has threads whose locks a forked child would inherit
+                self._processes = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    max_tasks_per_child=self.max_tasks_per_child,
+                )
+            if self._threads is None:
+                self._threads = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="metadata")
+            return self._processes, self._threads
+
+    def extract(self, content: bytes, mime_type: str) -> Dict:
+        """Blocking extraction for callers already off the request path; {} if nothing could be read"""
+        if not self.enabled or mime_type not in EXTRACTABLE_TYPES:
+            return {}
+        try:
+            if mime_type in VIDEO_TYPES:
+                return extract_metadata(content, mime_type)
+            processes, _ = self._pools()
+            return processes.submit(extract_metadata, content, mime_type).result()
+        except BrokenProcessPool as e:
+            # A worker died (e.g. a decoder crash or OOM kill); start a fresh pool for later files
+            logger.error(f"Metadata worker pool broke: {e}")
+            with self._lock:
+                if self._processes is processes:
+                    self._processes = None
+            processes.shutdown(wait=False, cancel_futures=True)
+        except OptionalDependencyError as e:
+            if mime_type not in self._missing:
+                self._missing.add(mime_type)
+                logger.warning(f"Skipping {mime_type} metadata: {e}")
+        except Exception as e:
+            logger.warning(f"Metadata extraction failed for {mime_type}: {e}")
+        return {}
+
+    def submit(self, file_id: str, user_id: str, mime_type: str, content: bytes) -> bool:
+        """Extract in the background and merge into the file's row; False if not queued"""
+        if not self.enabled or mime_type not in EXTRACTABLE_TYPES:
+            return False
+        with self._lock:
+            if self.pending >= self.max_pending:
+                logger.warning(f"Metadata extraction backlog full; {file_id} left for backfill")
+                return False
+            self.pending += 1
+        _, threads = self._pools()
+        threads.submit(self._process, file_id, user_id, mime_type, content)
+        return True
+
+    def _process(self, file_id: str, user_id: str, mime_type: str, content: bytes):
+        try:
+            fields = self.extract(content, mime_type)
+            if fields:
+                self.store(file_id, user_id, fields)
+        except Exception as e:
+            logger.error(f"Could not store metadata for {file_id}: {e}")
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+    def store(self, file_id: str, user_id: str, fields: Dict):
+        """Merge extracted fields into the row's existing metadata"""
+        result = self.supabase.table("user_files").select("metadata").eq("id", file_id).eq("user_id", user_id).execute()
+        if not result.data:
+            return  # deleted meanwhile
+        merged = {**(result.data[0].get("metadata") or {}), **fields}
+        self.supabase.table("user_files").update({"metadata": merged}, returning="minimal") \
+            .eq("id", file_id).eq("user_id", user_id).execute()
+        if self.on_extracted:
+            self.on_extracted(user_id, file_id, fields)
+
+    def stop(self):
+        with self._lock:
+            processes, threads = self._processes, self._threads
+            self._processes = self._threads = None
+        if threads:
+            threads.shutdown(wait=False, cancel_futures=True)
+        if processes:
+            processes.shutdown(wait=False, cancel_futures=True)
+
+
+def backfill(extractor: MetadataExtractor, tiers: Optional[StorageTiers] = None, limit: Optional[int] = None,
+             user_id: Optional[str] = None, page_size: int = 200) -> Dict[str, int]:
+    """Extract metadata for files that have none from the current extractor version"""
+    supabase = extractor.supabase
+    tiers = tiers or StorageTiers.from_env()
+    counts = {"processed": 0, "updated": 0, "failed": 0}
+
+    def process(row: Dict) -> str:
+        try:
+            content = supabase.storage.from_(tiers.bucket_for(row)).download(row["storage_path"])
+            fields = extractor.extract(content, row["mime_type"])
+            if not fields:
+                return "processed"
+            extractor.store(row["id"], row["user_id"], fields)
+            return "updated"
+        except Exception as e:
+            logger.warning(f"Backfill of {row['id']} failed: {e}")
+            return "failed"
+
+    last_id = None
+    # Downloads and extraction overlap across rows; the process pool bounds CPU use
+    with ThreadPoolExecutor(max_workers=extractor.workers * 2, thread_name_prefix="metadata-backfill") as pool:
+        while limit is None or counts["processed"] < limit:
+            query = supabase.table("user_files").select("id,user_id,mime_type,storage_path,storage_tier,metadata") \
+                .in_("mime_type", list(EXTRACTABLE_TYPES))
+            if user_id:
+                query = query.eq("user_id", user_id)
+            if last_id:
+                query = query.gt("id", last_id)
+            page = query.order("id").limit(page_size).execute().data or []
+            if not page:
+                break
+            last_id = page[-1]["id"]
+            todo = [row for row in page
+                    if (row.get("metadata") or {}).get("extracted_version", 0) < EXTRACTOR_VERSION]
+            if limit is not None:
+                todo = todo[:limit - counts["processed"]]
+            counts["processed"] += len(todo)
+            for outcome in pool.map(process, todo):
+                if outcome != "processed":
+                    counts[outcome] += 1
+            logger.info(f"Metadata backfill: {counts}")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill media metadata for existing FileInASnap files")
+    parser.add_argument("--limit", type=int, default=None, help="Stop after this many files")
+    parser.add_argument("--user", default=None, help="Only this user's files")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    extractor = MetadataExtractor(workers=args.workers)
+    try:
+        print(backfill(extractor, limit=args.limit, user_id=args.user))
+    finally:
+        extractor.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+"""
+Schema migration runner for FileInASnap
+Applies supabase/migrations/*.sql in version order over a direct Postgres
+connection (DATABASE_URL) and records each one, with its checksum, in
+app_migrations.history. Unlike pushing files through an exec RPC, this can
+build indexes on live tables without blocking writes:
+
+  - A migration runs in one transaction unless it contains CONCURRENTLY
+    statements, batched backfills or a `-- migrate:no-transaction` line;
+    those run statement by statement in autocommit mode and must be safe
+    to re-run (IF NOT EXISTS, CREATE OR REPLACE), since a failure part way
+    leaves earlier statements applied.
+  - Every attempt runs with a short lock_timeout. When it cannot get a
+    lock, it gives up instead of queueing every other query on the table
+    behind it, and is retried with backoff.
+  - An index left INVALID by an interrupted CREATE INDEX CONCURRENTLY is
+    dropped and rebuilt rather than silently kept by IF NOT EXISTS.
+  - A statement preceded by `-- migrate:batch` is a backfill. It is
+    repeated until it affects no rows, each batch in its own transaction.
+    `:batch_size` in the statement is replaced by a size that adapts to
+    keep each batch near the target duration, and the runner pauses
+    between batches to leave the database headroom. For example:
+
+        -- migrate:batch size=1000
+        UPDATE user_files SET owner_id = user_id
+        WHERE id IN (SELECT id FROM user_files WHERE owner_id IS NULL LIMIT :batch_size);
+
+Usage:
+    python migrate.py status
+    python migrate.py up [--target VERSION] [--dry-run]
+    python migrate.py baseline --target VERSION   # record as applied without running
+"""
+
+import argparse
+import hashlib
+import logging
+import os
+import re
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from optional import optional_import
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = Path(__file__).resolve().parent.parent / "supabase" / "migrations"
+FILENAME_PATTERN = re.compile(r"^(\d+)_([\w-]+)\.sql$")
+
+# Only one runner at a time, across hosts
+ADVISORY_LOCK_ID = 0x46494E53  # "FINS"
+
+# SQLSTATEs worth retrying: lock_not_available, deadlock_detected, serialization_failure
+RETRYABLE = {"55P03", "40P01", "40001"}
+
+HISTORY_DDL = """
+CREATE SCHEMA IF NOT EXISTS app_migrations;
+CREATE TABLE IF NOT EXISTS app_migrations.history (
+    version TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    checksum TEXT NOT NULL,
+    transactional BOOLEAN NOT NULL,
+    execution_ms INTEGER NOT NULL,
+    applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
+);
+REVOKE ALL ON SCHEMA app_migrations FROM PUBLIC;
+"""
+
+# Statements that cannot run inside a transaction block (matched on their leading keywords,
+# so e.g. REFRESH ... CONCURRENTLY inside a function body does not count)
+CONCURRENT_PATTERN = re.compile(
+    r"^(CREATE\s+(UNIQUE\s+)?INDEX|DROP\s+INDEX|REINDEX|ALTER\s+TABLE)\b[^;]*?\bCONCURRENTLY\b",
+    re.IGNORECASE,
+)
+CREATE_INDEX_CONCURRENTLY = re.compile(
+    r"^\s*CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+(?:IF\s+NOT\s+EXISTS\s+)?(\"?[\w.]+\"?)",
+    re.IGNORECASE,
+)
+DIRECTIVE_PATTERN = re.compile(r"^--\s*migrate:([\w-]+)(.*)$")
+BATCH_PLACEHOLDER = re.compile(r"(?<!:):batch_size\b")
+
+
+class MigrationError(Exception):
+    """A migration could not be applied, or history does not match the files"""
+
+
+class Statement:
+    def __init__(self, sql: str, directives: Dict[str, Dict[str, str]]):
+        self.sql = sql
+        self.directives = directives
+
+    @property
+    def batch(self) -> Optional[Dict[str, str]]:
+        return self.directives.get("batch")
+
+
+class Migration:
+    def __init__(self, path: Path):
+        match = FILENAME_PATTERN.match(path.name)
+        if not match:
+            raise MigrationError(f"Migration file name must look like <version>_<name>.sql: {path.name}")
+        self.path = path
+        self.version, self.name = match.groups()
+        self.sql = path.read_text().replace("\r\n", "\n")
+        self.checksum = hashlib.sha256(self.sql.encode()).hexdigest()
+        self.statements = split_statements(self.sql)
+
+    @property
+    def transactional(self) -> bool:
+        if re.search(r"^--\s*migrate:no-transaction\b", self.sql, re.MULTILINE):
+            return False
+        return not any(CONCURRENT_PATTERN.match(_strip_comments(s.sql)) or s.batch is not None
+                       for s in self.statements)
+
+
+def split_statements(sql: str) -> List[Statement]:
+    """
+    Split SQL into statements on top-level semicolons
+    Quotes, quoted identifiers, comments and dollar-quoted bodies are
+    skipped. `-- migrate:<name> key=value ...` lines attach to the
+    statement that follows them.
+    """
+    statements: List[Statement] = []
+    directives: Dict[str, Dict[str, str]] = {}
+    start, i, n = 0, 0, len(sql)
+    while i < n:
+        char = sql[i]
+        if sql.startswith("--", i):
+            end = sql.find("\n", i)
+            end = n if end < 0 else end
+            directive = DIRECTIVE_PATTERN.match(sql[i:end].strip())
+            if directive:
+                name, args = directive.groups()
+                directives[name] = dict(arg.split("=", 1) for arg in args.split() if "=" in arg)
+            i = end
+        elif sql.startswith("/*", i):
+            end = sql.find("*/", i + 2)
+            i = n if end < 0 else end + 2
+        elif char in ("'", '"'):
+            i += 1
+            while i < n:
+                if sql[i] == char:
+                    # A doubled quote is an escaped quote
+                    if i + 1 < n and sql[i + 1] == char:
+                        i += 2
+                        continue
+                    break
+                i += 1
+            i += 1
+        elif char == "$":
+            tag = re.match(r"\$[A-Za-z_]*\$", sql[i:])
+            if tag:
+                end = sql.find(tag.group(), i + len(tag.group()))
+                i = n if end < 0 else end + len(tag.group())
+            else:
+                i += 1
+        elif char == ";":
+            _append(statements, sql[start:i], directives)
+            directives = {}
+            start = i = i + 1
+        else:
+            i += 1
+    _append(statements, sql[start:], directives)
+    return statements
+
+
+def _append(statements: List[Statement], text: str, directives: Dict[str, Dict[str, str]]):
+    # Comment-only chunks (e.g. after the last semicolon) are not statements
+    if _strip_comments(text):
+        statements.append(Statement(text.strip(), directives))
+
+
+def discover(directory: Path = MIGRATIONS_DIR) -> List[Migration]:
+    migrations = [Migration(path) for path in sorted(directory.glob("*.sql"))]
+    versions = [m.version for m in migrations]
+    duplicates = {v for v in versions if versions.count(v) > 1}
+    if duplicates:
+        raise MigrationError(f"Duplicate migration versions: {', '.join(sorted(duplicates))}")
+    return sorted(migrations, key=lambda m: m.version)
+
+
+class MigrationRunner:
+    """
+    Applies pending migrations over one psycopg2 connection
+
+    Lock waits are capped at `lock_timeout`; an attempt that hits it (or a
+    deadlock) is retried up to `retries` times with exponential backoff.
+    Backfill batches aim for `batch_target_seconds` each and the runner
+    sleeps so that it is busy at most `batch_duty_cycle` of the time.
+    """
+
+    def __init__(
+        self,
+        dsn: str,
+        directory: Path = MIGRATIONS_DIR,
+        lock_timeout: str = "5s",
+        retries: int = 10,
+        batch_target_seconds: float = 0.5,
+        batch_duty_cycle: float = 0.5,
+        max_batch_size: int = 50000,
+    ):
+        self.dsn = dsn
+        self.directory = directory
+        self.lock_timeout = lock_timeout
+        self.retries = retries
+        self.batch_target_seconds = batch_target_seconds
+        self.batch_duty_cycle = batch_duty_cycle
+        self.max_batch_size = max_batch_size
+        self._conn = None
+
+    @classmethod
+    def from_env(cls, **kwargs) -> "MigrationRunner":
+        """Build a runner configured from DATABASE_URL and MIGRATE_* environment variables"""
+        dsn = kwargs.pop("dsn", None) or os.getenv("DATABASE_URL")
+        if not dsn:
+            raise MigrationError("DATABASE_URL is not set")
+        return cls(
+            dsn,
+            lock_timeout=os.getenv("MIGRATE_LOCK_TIMEOUT", "5s"),
+            retries=int(os.getenv("MIGRATE_RETRIES", 10)),
+            **kwargs,
+        )
+
+    # Connection and history
+
+    def connect(self):
+        psycopg2 = optional_import("psycopg2", "psycopg2-binary")
+        self._conn = psycopg2.connect(self.dsn, application_name="fileinasnap-migrate")
+        self._conn.autocommit = True
+        with self._conn.cursor() as cur:
+            cur.execute("SELECT pg_try_advisory_lock(%s)", (ADVISORY_LOCK_ID,))
+            if not cur.fetchone()[0]:
+                self._conn.close()
+                raise MigrationError("Another migration run holds the lock")
+            cur.execute("SET lock_timeout = %s", (self.lock_timeout,))
+            # Index builds and backfills are long by design; lock waits are what we cap
+            cur.execute("SET statement_timeout = 0")
+            cur.execute(HISTORY_DDL)
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def applied(self) -> Dict[str, Tuple[str, str]]:
+        with self._conn.cursor() as cur:
+            cur.execute("SELECT version, name, checksum FROM app_migrations.history")
+            return {version: (name, checksum) for version, name, checksum in cur.fetchall()}
+
+    def plan(self, target: Optional[str] = None) -> List[Migration]:
+        """Pending migrations up to `target`, after checking applied ones were not edited"""
+        applied = self.applied()
+        migrations = discover(self.directory)
+        changed = [m.path.name for m in migrations if m.version in applied and applied[m.version][1] != m.checksum]
+        if changed:
+            raise MigrationError(
+                f"Applied migrations were modified: {', '.join(changed)}; add a new migration instead"
+            )
+        known = {m.version for m in migrations}
+        missing = sorted(set(applied) - known)
+        if missing:
+            logger.warning(f"Applied migrations not found on disk: {', '.join(missing)}")
+        return [m for m in migrations if m.version not in applied and (target is None or m.version <= target)]
+
+    def _record(self, cur, migration: Migration, started: float):
+        cur.execute(
+            "INSERT INTO app_migrations.history (version, name, checksum, transactional, execution_ms) "
+            "VALUES (%s, %s, %s, %s, %s)",
+            (migration.version, migration.name, migration.checksum, migration.transactional,
+             int((time.monotonic() - started) * 1000)),
+        )
+
+    # Applying
+
+    def baseline(self, target: str) -> List[Migration]:
+        """Record migrations up to `target` as applied without running them (already set up by hand)"""
+        pending = self.plan(target)
+        with self._conn.cursor() as cur:
+            for migration in pending:
+                self._record(cur, migration, time.monotonic())
+                logger.info(f"Baselined {migration.path.name}")
+        return pending
+
+    def up(self, target: Optional[str] = None, dry_run: bool = False) -> List[Migration]:
+        pending = self.plan(target)
+        for migration in pending:
+            mode = "transaction" if migration.transactional else "statement by statement"
+            if dry_run:
+                logger.info(f"Would apply {migration.path.name} ({mode}, {len(migration.statements)} statements)")
+                continue
+            logger.info(f"Applying {migration.path.name} ({mode})")
+            started = time.monotonic()
+            if migration.transactional:
+                self._retry(migration.path.name, lambda: self._apply_transaction(migration, started))
+            else:
+                for index, statement in enumerate(migration.statements, 1):
+                    label = f"{migration.path.name} statement {index}"
+                    if statement.batch is not None:
+                        self._backfill(label, statement)
+                    else:
+                        self._retry(label, lambda: self._execute(statement.sql))
+                with self._conn.cursor() as cur:
+                    self._record(cur, migration, started)
+            logger.info(f"Applied {migration.path.name} in {(time.monotonic() - started) * 1000:.0f}ms")
+        return pending
+
+    def _apply_transaction(self, migration: Migration, started: float):
+        self._conn.autocommit = False
+        try:
+            with self._conn.cursor() as cur:
+                cur.execute(migration.sql)
+                self._record(cur, migration, started)
+            self._conn.commit()
+        except Exception:
+            self._conn.rollback()
+            raise
+        finally:
+            self._conn.autocommit = True
+
+    def _execute(self, sql: str) -> int:
+        with self._conn.cursor() as cur:
+            index = CREATE_INDEX_CONCURRENTLY.match(_strip_comments(sql))
+            if index:
+                self._drop_if_invalid(cur, index.group(1))
+            cur.execute(sql)
+            return cur.rowcount
+
+    def _drop_if_invalid(self, cur, name: str):
+        # A failed concurrent build leaves an INVALID index that IF NOT EXISTS would keep forever
+        cur.execute(
+            "SELECT i.indexrelid::regclass::text FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE NOT i.indisvalid AND c.oid = to_regclass(%s)",
+            (name,),
+        )
+        row = cur.fetchone()
+        if row:
+            logger.warning(f"Dropping invalid index {row[0]} left by an earlier attempt")
+            cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {row[0]}")
+
+    def _retry(self, label: str, attempt):
+        for number in range(1, self.retries + 1):
+            try:
+                return attempt()
+            except Exception as e:
+                code = getattr(e, "pgcode", None)
+                if code not in RETRYABLE or number == self.retries:
+                    raise MigrationError(f"{label} failed: {e}".strip()) from e
+                delay = min(0.5 * 2 ** number, 30.0)
+                logger.warning(f"{label}: {str(e).strip()}; retrying in {delay:.1f}s ({number}/{self.retries})")
+                time.sleep(delay)
+
+    def _backfill(self, label: str, statement: Statement):
+        size = int(statement.batch.get("size", 1000))
+        if not BATCH_PLACEHOLDER.search(statement.sql):
+            raise MigrationError(f"{label}: batched statements must limit themselves with :batch_size")
+        total, batches = 0, 0
+        while True:
+            sql = BATCH_PLACEHOLDER.sub(str(size), statement.sql)
+            started = time.monotonic()
+            affected = self._retry(label, lambda: self._execute(sql))
+            elapsed = time.monotonic() - started
+            total += max(affected, 0)
+            batches += 1
+            if affected <= 0:
+                break
+            # Aim for batches of about the target duration
+            if elapsed < self.batch_target_seconds / 2:
+                size = min(size * 2, self.max_batch_size)
+            elif elapsed > self.batch_target_seconds * 2:
+                size = max(size // 2, 1)
+            if batches % 20 == 0:
+                logger.info(f"{label}: {total} rows in {batches} batches, batch size {size}")
+            time.sleep(elapsed * (1 - self.batch_duty_cycle) / self.batch_duty_cycle)
+        logger.info(f"{label}: backfilled {total} rows in {batches} batches")
+
+    def status(self) -> Iterator[Tuple[Migration, bool]]:
+        applied = self.applied()
+        for migration in discover(self.directory):
+            yield migration, migration.version in applied
+
+
+def _strip_comments(sql: str) -> str:
+    return re.sub(r"/\*.*?\*/", "", re.sub(r"--[^\n]*", "", sql), flags=re.DOTALL).strip()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply FileInASnap schema migrations")
+    parser.add_argument("command", choices=("status", "up", "baseline"))
+    parser.add_argument("--target", help="Highest version to apply (or baseline)")
+    parser.add_argument("--dry-run", action="store_true", help="List what `up` would apply")
+    parser.add_argument("--dsn", help="Postgres connection string (default: DATABASE_URL)")
+    parser.add_argument("--dir", type=Path, default=MIGRATIONS_DIR, help="Migrations directory")
+    parser.add_argument("--lock-timeout", default=None, help="Longest wait for a lock per attempt, e.g. 5s")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    if args.command == "baseline" and not args.target:
+        parser.error("baseline requires --target")
+    runner = MigrationRunner.from_env(dsn=args.dsn, directory=args.dir)
+    if args.lock_timeout:
+        runner.lock_timeout = args.lock_timeout
+    try:
+        runner.connect()
+        if args.command == "status":
+            for migration, applied in runner.status():
+                mode = "" if migration.transactional else "  (no transaction)"
+                print(f"{'applied' if applied else 'pending'}  {migration.path.name}{mode}")
+        elif args.command == "baseline":
+            runner.baseline(args.target)
+        else:
+            runner.up(args.target, args.dry_run)
+    except MigrationError as e:
+        logger.error(str(e))
+        sys.exit(1)
+    finally:
+        runner.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+"""
+On-demand imports for optional, heavy dependencies
+Feature modules call optional_import() at the point of use so that app
+startup never pays for libraries a request may not need.
+"""
+
+import importlib
+from types import ModuleType
+from typing import Dict, Optional
+
+_modules: Dict[str, ModuleType] = {}
+
+
+class OptionalDependencyError(ImportError):
+    """Raised when a feature needs a package that is not installed"""
+
+
+def optional_import(module_name: str, package: Optional[str] = None) -> ModuleType:
+    """
+    Import `module_name` the first time it is needed
+    `package` is the pip distribution to suggest when it is missing
+    """
+    module = _modules.get(module_name)
+    if module is not None:
+        return module
+    try:
+        module = importlib.import_module(module_name)
+    except ImportError as e:
+        hint = package or module_name.split(".")[0]
+        raise OptionalDependencyError(
+            f"{module_name} is required for this feature; install it with `pip install {hint}`"
+        ) from e
+    _modules[module_name] = module
+    return module
+
+
+def is_available(module_name: str) -> bool:
+    try:
+        optional_import(module_name)
+        return True
+    except OptionalDependencyError:
+        return False
@@ -0,0 +1,50 @@
+"""
+Subscription plans for FileInASnap
+Shared by both APIs: server.py serves them at /api/plans and enforces file
+limits, main.py includes them in /bootstrap.
+"""
+
+from typing import Dict, Optional
+
+PLANS: Dict[str, Dict] = {
+    "free": {
+        "name": "Free",
+        "price": 0,
+        "features": ["5 files", "Basic support", "1GB storage", "Basic AI organization"],
+        "max_files": 5,
+        "storage_gb": 1,
+        "ai_features": ["basic_tagging"]
+    },
+    "pro": {
+        "name": "Pro",
+        "price": 9.99,
+        "features": ["100 files", "Priority support", "10GB storage", "Advanced AI", "File sharing"],
+        "max_files": 100,
+        "storage_gb": 10,
+        "ai_features": ["advanced_tagging", "smart_search", "auto_categorization"]
+    },
+    "team": {
+        "name": "Team",
+        "price": 19.99,
+        "features": ["500 files", "Team collaboration", "50GB storage", "API access", "Admin dashboard"],
+        "max_files": 500,
+        "storage_gb": 50,
+        "ai_features": ["advanced_tagging", "smart_search", "auto_categorization", "team_insights"]
+    },
+    "enterprise": {
+        "name": "Enterprise",
+        "price": 49.99,
+        "features": ["Unlimited files", "Custom integrations", "Unlimited storage", "24/7 support", "Advanced security"],
+        "max_files": -1,
+        "storage_gb": -1,
+        "ai_features": ["all_features", "custom_models", "priority_processing"]
+    }
+}
+
+
+def plan_key(tier: Optional[str]) -> str:
+    """Plan for a profile tier; the default 'standard' tier is the free plan"""
+    tier = tier or "standard"
+    if tier == "standard":
+        tier = "free"
+    return tier if tier in PLANS else "free"
@@ -0,0 +1,263 @@
+"""
+On-demand profiling for FileInASnap
+Admin-only endpoints in both APIs use these to look inside a slow worker
+without restarting it:
+  - SamplingProfiler samples every thread's Python stack at a fixed
+    interval for a few seconds and returns collapsed stacks
+    ("frame;frame;frame count" per line), the input format of
+    flamegraph.pl, speedscope and inferno.
+  - AllocationTracker runs tracemalloc between a start and a report and
+    attributes the memory allocated meanwhile to the route whose handler
+    was on the stack. Together with AllocationMiddleware it also records
+    how far memory rose above its starting level while each request ran,
+    so transient blow-ups (a large base64 decode, a full-table
+    aggregation) show up even though they are freed again.
+Neither costs anything until started.
+"""
+
+import inspect
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# (file, function) of frames where a thread sits waiting rather than working
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("selectors.py", "select"),
+    ("thread.py", "_worker"),
+}
+
+
+class ProfilerBusy(Exception):
+    """Raised when a profile is requested while another one is running"""
+
+
+class NotTracking(Exception):
+    """Raised when an allocation report is requested before tracking started"""
+
+
+def _frame_label(code) -> str:
+    # Functions, not lines, so samples from anywhere in a function aggregate into one frame
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """Samples all threads' stacks from a background loop; one profile at a time"""
+
+    def __init__(self, max_seconds: float = 60.0):
+        self.max_seconds = max_seconds
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "SamplingProfiler":
+        return cls(max_seconds=float(os.getenv("PROFILE_MAX_SECONDS", 60.0)))
+
+    def profile(self, seconds: float, interval: float = 0.01, include_idle: bool = False) -> str:
+        """Collapsed stacks for `seconds` of samples, most frequent first; blocks the calling thread"""
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy("A profile is already running")
+        try:
+            counts: Counter = Counter()
+            me = threading.get_ident()
+            names: Dict[int, str] = {}
+            deadline = time.monotonic() + min(seconds, self.max_seconds)
+            while time.monotonic() < deadline:
+                for ident, frame in sys._current_frames().items():
+                    if ident == me:
+                        continue
+                    code = frame.f_code
+                    if not include_idle and (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+                        continue
+                    if ident not in names:
+                        names.update((thread.ident, thread.name) for thread in threading.enumerate())
+                    stack = []
+                    while frame is not None:
+                        stack.append(_frame_label(frame.f_code))
+                        frame = frame.f_back
+                    stack.append(names.get(ident, f"thread-{ident}"))
+                    counts[";".join(reversed(stack))] += 1
+                time.sleep(interval)
+        finally:
+            self._lock.release()
+        return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
+
+
+def route_label(scope: Dict[str, Any]) -> Optional[str]:
+    """"GET /folders/{folder_id}"-style label for a request the router has matched"""
+    path = getattr(scope.get("route"), "path", None)
+    return f"{scope['method']} {path}" if path else None
+
+
+def _route_index(routes: Iterable) -> Dict[str, List[Tuple[int, int, str]]]:
+    """Source file -> [(first line, last line, route label)] of each route's handler"""
+    index: Dict[str, List[Tuple[int, int, str]]] = {}
+    for route in routes:
+        endpoint = getattr(route, "endpoint", None)
+        code = getattr(inspect.unwrap(endpoint), "__code__", None) if endpoint else None
+        if code is None:
+            continue
+        last = max((line for _, _, line in code.co_lines() if line), default=code.co_firstlineno)
+        for method in sorted(getattr(route, "methods", None) or ("GET",)):
+            if method != "HEAD":
+                index.setdefault(code.co_filename, []).append(
+                    (code.co_firstlineno, last, f"{method} {route.path}"))
+    return index
+
+
+def _attribute(traceback, index: Dict[str, List[Tuple[int, int, str]]]) -> str:
+    # Innermost handler on the stack; tracemalloc tracebacks run from oldest to newest frame
+    for frame in reversed(traceback):
+        for first, last, label in index.get(frame.filename, ()):
+            if first <= frame.lineno <= last:
+                return label
+    return "unattributed"
+
+
+class AllocationTracker:
+    """
+    tracemalloc between two points, attributed by route
+
+    start() begins tracing with `frames` frames per allocation and takes a
+    baseline snapshot; report() diffs a new snapshot against it. An
+    allocation is credited to a route if that route's handler is among its
+    innermost `frames` frames; deeper ones (e.g. inside httpx) are
+    "unattributed". Tracing slows allocation-heavy code noticeably, so
+    stop() it when done.
+    """
+
+    def __init__(self, frames: int = 32):
+        self.frames = frames
+        self._baseline: Optional[tracemalloc.Snapshot] = None
+        self._started_at: Optional[str] = None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._peaks: Dict[str, Dict[str, int]] = {}
+
+    @classmethod
+    def from_env(cls) -> "AllocationTracker":
+        return cls(frames=int(os.getenv("TRACEMALLOC_FRAMES", 32)))
+
+    @property
+    def active(self) -> bool:
+        return self._baseline is not None
+
+    def start(self, frames: Optional[int] = None) -> Dict[str, Any]:
+        """Start tracing (if needed) and take a new baseline; per-request peaks restart too"""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames or self.frames)
+        with self._lock:
+            self._peaks = {}
+        self._baseline = tracemalloc.take_snapshot()
+        self._started_at = datetime.now(timezone.utc).isoformat()
+        logger.info(f"Allocation tracking started with {tracemalloc.get_traceback_limit()} frames")
+        return self.status()
+
+    def stop(self) -> Dict[str, Any]:
+        self._baseline = None
+        self._started_at = None
+        tracemalloc.stop()
+        logger.info("Allocation tracking stopped")
+        return self.status()
+
+    def status(self) -> Dict[str, Any]:
+        status = {"tracking": self.active, "since": self._started_at}
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            status.update(frames=tracemalloc.get_traceback_limit(), traced_bytes=current, peak_bytes=peak,
+                          overhead_bytes=tracemalloc.get_tracemalloc_memory())
+        return status
+
+    def report(self, routes: Iterable, top: int = 25, route: Optional[str] = None) -> Dict[str, Any]:
+        """Memory allocated since start() and still held, by route and by source line"""
+        if self._baseline is None:
+            raise NotTracking("Allocation tracking has not been started")
+        ignored = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen *>")]
+        snapshot = tracemalloc.take_snapshot().filter_traces(ignored)
+        baseline = self._baseline.filter_traces(ignored)
+        index = _route_index(routes)
+
+        by_route: Dict[str, List[int]] = {}
+        by_line: Dict[Tuple[str, str], List[int]] = {}
+        for diff in snapshot.compare_to(baseline, "traceback"):
+            if not diff.size_diff and not diff.count_diff:
+                continue
+            label = _attribute(diff.traceback, index)
+            totals = by_route.setdefault(label, [0, 0])
+            totals[0] += diff.size_diff
+            totals[1] += diff.count_diff
+            if route is None or label == route:
+                frame = diff.traceback[-1]
+                location = f"{frame.filename}:{frame.lineno}"
+                totals = by_line.setdefault((location, label), [0, 0])
+                totals[0] += diff.size_diff
+                totals[1] += diff.count_diff
+
+        with self._lock:
+            peaks = {label: dict(peak) for label, peak in self._peaks.items()}
+        return {
+            **self.status(),
+            "by_route": [
+                {"route": label, "size_diff_bytes": size, "count_diff": count}
+                for label, (size, count) in sorted(by_route.items(), key=lambda item: -abs(item[1][0]))
+            ],
+            "request_peaks": [
+                {"route": label, **peak}
+                for label, peak in sorted(peaks.items(), key=lambda item: -item[1]["max_rise_bytes"])
+            ],
+            "top_lines": [
+                {"location": location, "route": label, "size_diff_bytes": size, "count_diff": count}
+                for (location, label), (size, count) in
+                sorted(by_line.items(), key=lambda item: -abs(item[1][0]))[:top]
+            ],
+        }
+
+    def begin_request(self) -> int:
+        """Traced bytes at the start of a request, restarting the peak if nothing else is running"""
+        with self._lock:
+            if self._in_flight == 0:
+                tracemalloc.reset_peak()
+            self._in_flight += 1
+            return tracemalloc.get_traced_memory()[0]
+
+    def end_request(self, label: str, started_bytes: int):
+        """Record how far traced memory rose above its level when the request began"""
+        with self._lock:
+            overlapped = self._in_flight > 1
+            self._in_flight -= 1
+            if not tracemalloc.is_tracing():
+                return
+            rise = max(tracemalloc.get_traced_memory()[1] - started_bytes, 0)
+            peak = self._peaks.setdefault(label, {"requests": 0, "max_rise_bytes": 0, "overlapped": 0})
+            peak["requests"] += 1
+            peak["max_rise_bytes"] = max(peak["max_rise_bytes"], rise)
+            # With other requests in flight the rise may include their allocations too
+            peak["overlapped"] += overlapped
+
+
+class AllocationMiddleware:
+    """ASGI middleware feeding per-request memory peaks to an AllocationTracker while it is active"""
+
+    def __init__(self, app, tracker: AllocationTracker):
+        self.app = app
+        self.tracker = tracker
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.tracker.active:
+            await self.app(scope, receive, send)
+            return
+
+        started_bytes = self.tracker.begin_request()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.tracker.end_request(route_label(scope) or scope["method"], started_bytes)
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Query plan check for FileInASnap's hot queries
+Runs EXPLAIN on the SQL equivalent of each folders/files query in main.py
+and fails if any of them reads a table with a sequential scan, walks a
+whole index without a condition, or sorts rows that an index should
+already return in order. Planning runs with enable_seqscan and enable_sort
+off. The planner then only picks either one when no index can serve the
+query, so the result does not depend on how
+much data the database holds. Nothing is written.
+
+Usage:
+    python query_plans.py [--dsn DSN] [--verbose]
+
+Exits with status 1 if any query fails the check, so it can gate a deploy
+after `migrate.py up`. tests/test_query_plans.py runs the same check in
+the test suite whenever DATABASE_URL is set.
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import uuid
+from typing import Dict, Iterator, List, NamedTuple
+
+from optional import optional_import
+
+logger = logging.getLogger(__name__)
+
+CHECKED_TABLES = {"folders", "files"}
+
+
+class HotQuery(NamedTuple):
+    name: str
+    sql: str
+    # True when the query has an ORDER BY the index is expected to satisfy
+    ordered: bool = False
+
+
+# Mirrors what PostgREST generates for each supabase-py call in main.py, and the statements of its RPCs
+HOT_QUERIES: List[HotQuery] = [
+    HotQuery(
+        "list folders",
+        "SELECT * FROM folders WHERE owner_id = %(owner_id)s ORDER BY created_at",
+        ordered=True,
+    ),
+    HotQuery(
+        "list child folders",
+        "SELECT * FROM folders WHERE owner_id = %(owner_id)s AND parent_id = %(folder_id)s ORDER BY created_at",
+        ordered=True,
+    ),
+    HotQuery(
+        "folder subtree",
+        "SELECT * FROM folders WHERE owner_id = %(owner_id)s AND path LIKE %(path_prefix)s ORDER BY path",
+    ),
+    HotQuery(
+        "list files",
+        "SELECT * FROM files WHERE owner_id = %(owner_id)s ORDER BY created_at DESC LIMIT 50",
+        ordered=True,
+    ),
+    HotQuery(
+        "list files in folder",
+        "SELECT * FROM files WHERE owner_id = %(owner_id)s AND folder_id = %(folder_id)s "
+        "ORDER BY created_at DESC LIMIT 50",
+        ordered=True,
+    ),
+    HotQuery(
+        "folder lookup",
+        "SELECT * FROM folders WHERE id = %(folder_id)s AND owner_id = %(owner_id)s",
+    ),
+    HotQuery(
+        "export folder",
+        "SELECT id, filename, object_key, bytes FROM files "
+        "WHERE folder_id = %(folder_id)s AND owner_id = %(owner_id)s ORDER BY created_at",
+        ordered=True,
+    ),
+    HotQuery(
+        "file lookup",
+        "SELECT * FROM files WHERE id = %(file_id)s AND owner_id = %(owner_id)s",
+    ),
+    HotQuery(
+        "export selection",
+        "SELECT id, filename, object_key, bytes FROM files "
+        "WHERE id = ANY(%(file_ids)s::uuid[]) AND owner_id = %(owner_id)s",
+    ),
+    HotQuery(
+        "stats folder count",
+        "SELECT count(*) FROM folders WHERE owner_id = %(owner_id)s",
+    ),
+    HotQuery(
+        "stats totals",
+        "SELECT subtree_file_count, subtree_bytes FROM folders WHERE owner_id = %(owner_id)s AND parent_id IS NULL",
+    ),
+    HotQuery(
+        "stats type breakdown",
+        "SELECT split_part(mime, '/', 1), count(*) FROM files "
+        "WHERE owner_id = %(owner_id)s AND COALESCE(mime, '') <> '' GROUP BY 1",
+    ),
+]
+
+
+def iter_nodes(plan: Dict) -> Iterator[Dict]:
+    """Every node of an EXPLAIN (FORMAT JSON) plan tree"""
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from iter_nodes(child)
+
+
+def plan_problems(plan: Dict, ordered: bool) -> List[str]:
+    """Reasons a plan would degrade with table size; empty if it is fine"""
+    problems = []
+    for node in iter_nodes(plan):
+        relation = node.get("Relation Name")
+        if node["Node Type"] == "Seq Scan" and relation in CHECKED_TABLES:
+            problems.append(f"sequential scan on {relation}")
+        elif "Index Name" in node and relation in CHECKED_TABLES and "Index Cond" not in node:
+            # Walking a whole index only to filter rows is a sequential scan in disguise
+            problems.append(f"full scan of index {node['Index Name']}")
+        elif node["Node Type"] in ("Sort", "Incremental Sort") and ordered:
+            problems.append(f"sort on {', '.join(node.get('Sort Key', []))}")
+    return problems
+
+
+def indexes_used(plan: Dict) -> List[str]:
+    return sorted({node["Index Name"] for node in iter_nodes(plan) if "Index Name" in node})
+
+
+def check(dsn: str, verbose: bool = False) -> bool:
+    """EXPLAIN every hot query; True if all of them are served by indexes"""
+    psycopg2 = optional_import("psycopg2", "psycopg2-binary")
+    params = {
+        "owner_id": str(uuid.uuid4()),
+        "folder_id": str(uuid.uuid4()),
+        "file_id": str(uuid.uuid4()),
+        "file_ids": [str(uuid.uuid4()) for _ in range(3)],
+    }
+    params["path_prefix"] = f"/{params['folder_id']}/%"
+    ok = True
+    conn = psycopg2.connect(dsn, application_name="fileinasnap-query-plans")
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SET LOCAL enable_seqscan = off")
+            cur.execute("SET LOCAL enable_sort = off")
+            for query in HOT_QUERIES:
+                cur.execute("EXPLAIN (FORMAT JSON) " + query.sql, params)
+                raw = cur.fetchone()[0]
+                plan = (json.loads(raw) if isinstance(raw, str) else raw)[0]["Plan"]
+                problems = plan_problems(plan, query.ordered)
+                if problems:
+                    ok = False
+                    logger.error(f"{query.name}: {'; '.join(problems)}")
+                else:
+                    logger.info(f"{query.name}: ok ({', '.join(indexes_used(plan)) or 'no index'})")
+                if verbose:
+                    print(json.dumps(plan, indent=2))
+        conn.rollback()
+    finally:
+        conn.close()
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that hot folders/files queries use indexes")
+    parser.add_argument("--dsn", help="Postgres connection string (default: DATABASE_URL)")
+    parser.add_argument("--verbose", action="store_true", help="Print each full plan")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s - %(message)s")
+    dsn = args.dsn or os.getenv("DATABASE_URL")
+    if not dsn:
+        parser.error("set DATABASE_URL or pass --dsn")
+    if not check(dsn, args.verbose):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
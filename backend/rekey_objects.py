@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Object key migration for FileInASnap
+Uploads through main.py used to be stored at <owner>/<folder>/<filename>,
+so moving or renaming a file meant moving its object, and two uploads with
+the same name overwrote each other. New uploads get immutable keys,
+<owner>/<uuid><ext>, like server.py's. This script gives existing files
+such keys: it copies each object to a new key, switches the row with an
+update guarded on the old key, and then removes the old object once no
+other row shares it (the overwritten uploads all point at it). A file
+changed or deleted meanwhile keeps its row untouched and the copy is
+removed again. The pass pages through files by id and can be stopped and
+rerun at any time; rows that already have new-style keys are skipped.
+
+Usage:
+    python rekey_objects.py run [--limit N] [--dry-run]
+"""
+
+import argparse
+import logging
+import os
+import re
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+from clients import get_supabase
+
+logger = logging.getLogger(__name__)
+
+BUCKET = "user-files"
+
+# <uuid><ext> under the owner's prefix
+_ID_KEY = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}(\.[a-z0-9]{1,10})?$")
+
+
+def object_key(owner_id: str, filename: str) -> str:
+    """New immutable storage key for an upload; only the extension survives from the name"""
+    extension = os.path.splitext(filename)[1].lower()
+    if not re.fullmatch(r"\.[a-z0-9]{1,10}", extension):
+        extension = ""
+    return f"{owner_id}/{uuid.uuid4()}{extension}"
+
+
+def is_id_key(owner_id: str, key: str) -> bool:
+    """True if `key` is already an immutable <owner>/<uuid><ext> key"""
+    prefix = f"{owner_id}/"
+    return key.startswith(prefix) and bool(_ID_KEY.match(key[len(prefix):]))
+
+
+class ObjectRekeyer:
+    """Copies legacy objects to immutable keys and repoints their rows"""
+
+    def __init__(self, supabase_client=None, batch_size: int = 500, workers: int = 4):
+        self._supabase = supabase_client
+        self.batch_size = batch_size
+        self.workers = workers
+
+    @classmethod
+    def from_env(cls, supabase_client=None) -> "ObjectRekeyer":
+        """Build a rekeyer configured from REKEY_* environment variables"""
+        return cls(
+            supabase_client,
+            batch_size=int(os.getenv("REKEY_BATCH", 500)),
+            workers=int(os.getenv("REKEY_WORKERS", 4)),
+        )
+
+    @property
+    def supabase(self):
+        return self._supabase or get_supabase()
+
+    def rekey(self, row: Dict) -> bool:
+        """Give one file an immutable key; False if its row changed meanwhile"""
+        old_key = row["object_key"]
+        new_key = object_key(row["owner_id"], row.get("filename") or old_key)
+        bucket = self.supabase.storage.from_(BUCKET)
+        bucket.copy(old_key, new_key)
+        result = self.supabase.table("files").update({"object_key": new_key}) \
+            .eq("id", row["id"]).eq("object_key", old_key).execute()
+        if not result.data:
+            bucket.remove([new_key])
+            return False
+        # Legacy keys were shared by every upload of the same name; the last row to move removes the object
+        still_used = self.supabase.table("files").select("id") \
+            .eq("owner_id", row["owner_id"]).eq("object_key", old_key).limit(1).execute().data
+        if not still_used:
+            bucket.remove([old_key])
+        return True
+
+    def run_once(self, limit: Optional[int] = None, dry_run: bool = False) -> Dict[str, int]:
+        """One pass over all files; returns how many were scanned, rekeyed, skipped and failed"""
+        counts = {"scanned": 0, "candidates": 0, "rekeyed": 0, "skipped": 0, "failed": 0}
+
+        def rekey(row: Dict) -> str:
+            try:
+                return "rekeyed" if self.rekey(row) else "skipped"
+            except Exception as e:
+                logger.warning(f"Rekeying {row['id']} failed: {e}")
+                return "failed"
+
+        after = None
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="rekey") as pool:
+            while limit is None or counts["candidates"] < limit:
+                query = self.supabase.table("files").select("id, owner_id, object_key, filename")
+                if after is not None:
+                    query = query.gt("id", after)
+                page = query.order("id").limit(self.batch_size).execute().data or []
+                if not page:
+                    break
+                after = page[-1]["id"]
+                counts["scanned"] += len(page)
+                legacy = [row for row in page if not is_id_key(row["owner_id"], row["object_key"])]
+                if limit is not None:
+                    legacy = legacy[:limit - counts["candidates"]]
+                counts["candidates"] += len(legacy)
+                if not dry_run:
+                    for outcome in pool.map(rekey, legacy):
+                        counts[outcome] += 1
+        logger.info(f"Object rekey pass: {counts}")
+        return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move FileInASnap objects to immutable, ID-based keys")
+    parser.add_argument("command", choices=("run",))
+    parser.add_argument("--limit", type=int, default=None, help="Stop after this many legacy files")
+    parser.add_argument("--dry-run", action="store_true", help="Count legacy files without moving them")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    print(ObjectRekeyer.from_env().run_once(limit=args.limit, dry_run=args.dry_run))
+
+
+if __name__ == "__main__":
+    main()
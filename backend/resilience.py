@@ -0,0 +1,338 @@
+"""
+Upstream resilience for FileInASnap
+Every PostgREST and Storage request from the shared Supabase clients goes
+through a ResilientTransport (installed by clients.py), which gives each
+upstream:
+
+- a bulkhead: at most `max_concurrent` requests in flight; others wait up
+  to `max_wait` seconds for a slot and are then refused, so a slow upstream
+  ties up a bounded number of workers;
+- a circuit breaker: after `failure_threshold` consecutive failures
+  (transport errors, timeouts, 502/503/504) requests are refused at once
+  for `reset_timeout` seconds, then a single probe decides whether to close
+  it again;
+- hedging: a GET still unanswered after `hedge_after` seconds is sent a
+  second time and whichever answer arrives first wins;
+- a client timeout of `timeout` seconds instead of the library defaults.
+
+Refused requests raise UpstreamUnavailable, which handlers turn into a 503
+with Retry-After via upstream_error(). Read endpoints load through a
+StaleCache, so while an upstream is failing they keep answering with the
+last data they served, marked stale.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+import httpx
+from fastapi import HTTPException, Response
+
+logger = logging.getLogger(__name__)
+
+# Upstream answers that mean it is unhealthy rather than that the request was wrong
+FAILURE_STATUSES = {502, 503, 504}
+
+
+class UpstreamUnavailable(Exception):
+    """Raised instead of calling an upstream whose breaker is open or bulkhead is full"""
+
+    def __init__(self, upstream: str, reason: str, retry_after: float):
+        super().__init__(f"{upstream} unavailable: {reason}")
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker with a single half-open probe"""
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 15.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Whether a request may go out now; in half-open state only the probe may"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning(f"Circuit for {self.name} opened after {self.failures} consecutive failures")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def retry_after(self) -> float:
+        """Seconds until the next probe may go out"""
+        with self._lock:
+            if self.state != self.OPEN:
+                return 0.0
+            return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+
+class Bulkhead:
+    """Caps concurrent requests to one upstream"""
+
+    def __init__(self, max_concurrent: int = 32, max_wait: float = 1.0):
+        self.max_concurrent = max_concurrent
+        self.max_wait = max_wait
+        self.in_use = 0
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+
+    def acquire(self) -> bool:
+        if not self._slots.acquire(timeout=self.max_wait):
+            return False
+        with self._lock:
+            self.in_use += 1
+        return True
+
+    def release(self):
+        with self._lock:
+            self.in_use -= 1
+        self._slots.release()
+
+
+class Upstream:
+    """Timeout, hedging, bulkhead and breaker settings and state for one upstream service"""
+
+    def __init__(
+        self,
+        name: str,
+        timeout: float = 10.0,
+        hedge_after: float = 0.0,
+        max_concurrent: int = 32,
+        max_wait: float = 1.0,
+        failure_threshold: int = 5,
+        reset_timeout: float = 15.0,
+        enabled: bool = True,
+    ):
+        self.name = name
+        self.timeout = timeout
+        self.hedge_after = hedge_after
+        self.enabled = enabled
+        self.bulkhead = Bulkhead(max_concurrent, max_wait)
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_timeout)
+        self.stats = {"requests": 0, "failures": 0, "rejected": 0, "hedged": 0, "hedge_wins": 0}
+
+    @classmethod
+    def from_env(cls, name: str, **defaults) -> "Upstream":
+        """Build an upstream configured from UPSTREAM_<NAME>_* environment variables"""
+        prefix = f"UPSTREAM_{name.upper()}_"
+        settings = {"timeout": 10.0, "hedge_after": 0.0, "max_concurrent": 32, "max_wait": 1.0,
+                    "failure_threshold": 5, "reset_timeout": 15.0, **defaults}
+        for key, default in settings.items():
+            value = os.getenv(prefix + key.upper())
+            if value is not None:
+                settings[key] = type(default)(value)
+        enabled = os.getenv("UPSTREAM_RESILIENCE", "on").lower() not in ("0", "off", "false")
+        return cls(name, enabled=enabled, **settings)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Current state, for diagnostics"""
+        return {
+            "state": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "in_flight": self.bulkhead.in_use,
+            "max_concurrent": self.bulkhead.max_concurrent,
+            **self.stats,
+        }
+
+
+class ResilientTransport(httpx.BaseTransport):
+    """httpx transport applying an Upstream's bulkhead, breaker and hedging to every request"""
+
+    def __init__(self, transport: httpx.BaseTransport, upstream: Upstream):
+        self.transport = transport
+        self.upstream = upstream
+        self._hedges = ThreadPoolExecutor(max_workers=upstream.bulkhead.max_concurrent,
+                                          thread_name_prefix=f"{upstream.name}-hedge")
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        upstream = self.upstream
+        if not upstream.enabled:
+            return self.transport.handle_request(request)
+        # Refuse without queueing for a slot while the breaker is open
+        if upstream.breaker.retry_after() > 0:
+            upstream.stats["rejected"] += 1
+            raise UpstreamUnavailable(upstream.name, "circuit open", upstream.breaker.retry_after())
+        if not upstream.bulkhead.acquire():
+            upstream.stats["rejected"] += 1
+            raise UpstreamUnavailable(upstream.name, "too many requests in flight", 1.0)
+        try:
+            if not upstream.breaker.allow():
+                upstream.stats["rejected"] += 1
+                raise UpstreamUnavailable(upstream.name, "circuit open", upstream.breaker.retry_after())
+            upstream.stats["requests"] += 1
+            try:
+                response = self._send(request)
+            except Exception:
+                # Any error must settle a half-open probe, or the breaker would refuse everything forever
+                upstream.stats["failures"] += 1
+                upstream.breaker.record_failure()
+                raise
+        finally:
+            upstream.bulkhead.release()
+        if response.status_code in FAILURE_STATUSES:
+            upstream.stats["failures"] += 1
+            upstream.breaker.record_failure()
+        else:
+            upstream.breaker.record_success()
+        return response
+
+    def _send(self, request: httpx.Request) -> httpx.Response:
+        upstream = self.upstream
+        # Only idempotent reads are repeated, and not while the breaker is probing or slots are scarce
+        if (upstream.hedge_after <= 0 or request.method not in ("GET", "HEAD")
+                or upstream.breaker.state != CircuitBreaker.CLOSED
+                or upstream.bulkhead.in_use * 2 > upstream.bulkhead.max_concurrent):
+            return self.transport.handle_request(request)
+
+        first = self._hedges.submit(self.transport.handle_request, request)
+        done, _ = wait([first], timeout=upstream.hedge_after)
+        if done:
+            return first.result()
+        upstream.stats["hedged"] += 1
+        second = self._hedges.submit(self.transport.handle_request, request)
+        pending = {first, second}
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for attempt in done:
+                if attempt.exception() is not None:
+                    error = attempt.exception()
+                    continue
+                for loser in pending:
+                    loser.add_done_callback(_close_response)
+                if attempt is second:
+                    upstream.stats["hedge_wins"] += 1
+                return attempt.result()
+        raise error
+
+    def close(self):
+        self._hedges.shutdown(wait=False)
+        self.transport.close()
+
+
+def _close_response(attempt: Future):
+    if attempt.exception() is None:
+        attempt.result().close()
+
+
+def install(session: httpx.Client, upstream: Upstream):
+    """Route an httpx client's requests, including any proxy mounts, through `upstream`'s protections"""
+    if not isinstance(session._transport, ResilientTransport):
+        session._transport = ResilientTransport(session._transport, upstream)
+    session._mounts = {
+        pattern: transport if transport is None or isinstance(transport, ResilientTransport)
+        else ResilientTransport(transport, upstream)
+        for pattern, transport in session._mounts.items()
+    }
+
+
+class StaleCache:
+    """
+    Last successfully loaded value per key, served when a reload fails
+
+    Every read still tries the upstream first, so clients see their own
+    writes whenever it is up. While it is failing (or refused by the
+    breaker, which fails instantly) the last value younger than `max_age`
+    is returned instead, with its age. Entries are kept in an LRU of
+    `max_entries`.
+    """
+
+    def __init__(self, max_entries: int = 5000, max_age: float = 3600.0):
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"stale_hits": 0, "misses": 0}
+
+    @classmethod
+    def from_env(cls) -> "StaleCache":
+        """Build a cache configured from STALE_CACHE_* environment variables"""
+        return cls(
+            max_entries=int(os.getenv("STALE_CACHE_MAX_ENTRIES", 5000)),
+            max_age=float(os.getenv("STALE_CACHE_MAX_AGE", 3600.0)),
+        )
+
+    def load(self, key: Hashable, loader: Callable[[], Any]) -> Tuple[Any, Optional[float]]:
+        """(value, age): age is None for a fresh value, seconds for a stale one"""
+        try:
+            value = loader()
+        except Exception as e:
+            return self._fallback(key, e)
+        self._store(key, value)
+        return value, None
+
+    async def aload(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Tuple[Any, Optional[float]]:
+        """load() for a coroutine loader"""
+        try:
+            value = await loader()
+        except Exception as e:
+            return self._fallback(key, e)
+        self._store(key, value)
+        return value, None
+
+    def _store(self, key: Hashable, value: Any):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _fallback(self, key: Hashable, error: Exception) -> Tuple[Any, float]:
+        if isinstance(error, HTTPException) and error.status_code < 500:
+            # A definite answer (not found, bad request), not an outage
+            raise error
+        with self._lock:
+            entry = self._entries.get(key)
+        age = time.monotonic() - entry[0] if entry else None
+        if age is None or age > self.max_age:
+            self.stats["misses"] += 1
+            raise error
+        self.stats["stale_hits"] += 1
+        logger.warning(f"Serving {age:.0f}s old data for {key[0] if isinstance(key, tuple) else key}: {error}")
+        return entry[1], age
+
+
+def mark_stale(response: Response, age: float):
+    """Label a response served from a StaleCache; it must not carry a fresh ETag"""
+    response.headers["Age"] = str(int(age))
+    response.headers["X-Cache-Status"] = "stale"
+    response.headers["Cache-Control"] = "private, no-store"
+
+
+def upstream_error(error: Exception, detail: str) -> HTTPException:
+    """503 with Retry-After for a refused or unreachable upstream, 500 for anything else"""
+    cause = error
+    while cause is not None and not isinstance(cause, (UpstreamUnavailable, httpx.TransportError)):
+        cause = cause.__cause__ or cause.__context__
+    if isinstance(cause, UpstreamUnavailable):
+        return HTTPException(status_code=503, detail=detail, headers={"Retry-After": str(max(1, round(cause.retry_after)))})
+    if isinstance(cause, httpx.TransportError):
+        return HTTPException(status_code=503, detail=detail, headers={"Retry-After": "5"})
+    return HTTPException(status_code=500, detail=detail)
@@ -0,0 +1,60 @@
+"""
+Lean JSON responses for FileInASnap list endpoints
+`fields=` lets a client ask only for the columns it renders; it is
+validated against a per-endpoint whitelist and passed to PostgREST as the
+select list, so unused columns (metadata JSONB, AI descriptions, tags) are
+never read or sent. Bodies are rendered with orjson when it is installed.
+json_response() skips FastAPI's jsonable_encoder pass entirely, which for
+rows that are already plain JSON types is most of the serialization cost.
+"""
+
+from typing import Any, Iterable, List, Optional
+
+from fastapi import HTTPException, Response
+from fastapi.responses import JSONResponse, ORJSONResponse
+
+from optional import is_available
+
+# Default response class for both apps
+FastJSONResponse = ORJSONResponse if is_available("orjson") else JSONResponse
+
+
+def parse_fields(fields: Optional[str], allowed: Iterable[str], always: Iterable[str] = ("id",)) -> Optional[List[str]]:
+    """
+    Validated field names from a `fields=a,b,c` parameter, or None for all fields
+    Unknown names are a 400, so a typo never silently returns less data.
+    """
+    if fields is None or not fields.strip():
+        return None
+    requested = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = sorted(set(requested) - set(allowed))
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown fields: {', '.join(unknown)}. Allowed: {', '.join(sorted(allowed))}",
+        )
+    selected = list(always)
+    selected.extend(name for name in requested if name not in selected)
+    return selected
+
+
+def select_list(selected: Optional[List[str]], columns: Iterable[str]) -> str:
+    """PostgREST select list for the chosen fields that are real columns"""
+    if selected is None:
+        return "*"
+    columns = set(columns)
+    return ",".join(name for name in selected if name in columns)
+
+
+def json_response(content: Any, response: Optional[Response] = None, status_code: int = 200) -> Response:
+    """
+    Render `content` (plain JSON types only) without jsonable_encoder
+    Headers already set on the endpoint's injected `response` (ETag etc.)
+    are carried over, since FastAPI drops them when a Response is returned.
+    """
+    rendered = FastJSONResponse(content, status_code=status_code)
+    if response is not None:
+        for key, value in response.headers.items():
+            if key not in ("content-length", "content-type"):
+                rendered.headers[key] = value
+    return rendered
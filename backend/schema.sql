@@ -77,6 +77,7 @@ CREATE TABLE IF NOT EXISTS user_sessions (
 
 -- Activity Logs Table
 -- Track user actions for analytics and debugging
+-- Range-partitioned by month in supabase/migrations/20261019000100_partition_activity_logs.sql
 CREATE TABLE IF NOT EXISTS activity_logs (
     id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
     user_id UUID REFERENCES auth.users(id) ON DELETE SET NULL,
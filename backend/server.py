@@ -1,10 +1,11 @@
-from fastapi import FastAPI, APIRouter, Depends, HTTPException, status, UploadFile, File
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, Query, Request, status, UploadFile, File
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.security import HTTPBearer
 from starlette.middleware.cors import CORSMiddleware
-from supabase import Client, create_client
 from pydantic import BaseModel, EmailStr, validator
-from typing import List, Optional, Dict, Any
-from datetime import datetime
+from typing import TYPE_CHECKING, List, Optional, Dict, Any
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
 from pathlib import Path
 import os
@@ -12,19 +13,37 @@ import logging
 import uuid
 import base64
 import mimetypes
-from supabase_auth import get_current_user, require_permission
+import time
+import asyncio
+import tempfile
+from supabase_auth import get_current_user, get_stream_user, require_permission, require_user_role
+from activity_log import ActivityLogger
+from admission import AdmissionController, AdmissionMiddleware
+from call_budget import CallBudget, CallBudgetMiddleware
+from change_feed import ChangeHub, parse_cursor
+from clients import get_supabase, get_supabase_anon
+from compression import CompressionMiddleware
+from duplicates import MAX_DISTANCE, find_duplicate_clusters
+from idempotency import IdempotencyMiddleware, IdempotencyStore
+from imports import ARCHIVE_SUFFIXES, ArchiveImporter, ImportJob
+from media_metadata import MetadataExtractor
+from optional import OptionalDependencyError
+from plans import PLANS, plan_key
+from profiling import AllocationMiddleware, AllocationTracker, NotTracking, ProfilerBusy, SamplingProfiler
+from resilience import StaleCache, mark_stale, upstream_error
+from responses import FastJSONResponse, json_response, parse_fields, select_list
+from shares import AccessCounter, ShareResolver, is_share_token, new_share_token
+from storage_tiers import StorageLifecycle, StorageTiers
+from tracing import LOG_FORMAT, TracingMiddleware, traced, tracer
+
+if TYPE_CHECKING:
+    from supabase import Client
 
 # Load environment variables
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# Supabase Configuration for data storage
-supabase_url = os.getenv("SUPABASE_URL")
-supabase_key = os.getenv("SUPABASE_SERVICE_KEY")
-supabase: Client = create_client(supabase_url, supabase_key)
-
-# Create FastAPI app
-app = FastAPI(title="FileInASnap API", version="1.0.0")
+# Routes are registered on a router and mounted by create_app()
 api_router = APIRouter(prefix="/api")
 security = HTTPBearer()
 
@@ -50,6 +69,15 @@ class FileUpload(BaseModel):
     mime_type: str
     size: Optional[int] = None
 
+class ShareCreate(BaseModel):
+    expires_in_hours: Optional[int] = None
+    
+    @validator('expires_in_hours')
+    def valid_expiry(cls, v):
+        if v is not None and not 1 <= v <= 24 * 365:
+            raise ValueError('expires_in_hours must be between 1 and 8760')
+        return v
+
 class FileMetadata(BaseModel):
     id: str
     name: str
@@ -58,11 +86,27 @@ class FileMetadata(BaseModel):
     upload_date: str
     user_id: str
 
+# Base for services backed by the shared Supabase client
+class SupabaseService:
+    def __init__(self, supabase_client: Optional["Client"] = None):
+        self._supabase = supabase_client
+    
+    @property
+    def supabase(self) -> "Client":
+        # Resolved per call so importing this module never creates a client
+        return self._supabase or get_supabase()
+
 # User Service for managing user profiles
-class UserService:
-    def __init__(self, supabase_client: Client):
-        self.supabase = supabase_client
+class UserService(SupabaseService):
+    def __init__(self, supabase_client: Optional["Client"] = None):
+        super().__init__(supabase_client)
+        # Last seen tier per user, consulted by admission control without a query
+        self.tiers: Dict[str, str] = {}
+    
+    def cached_tier(self, user_id: str, claimed_tier: Optional[str] = None) -> Optional[str]:
+        return self.tiers.get(user_id)
     
+    @traced()
     async def get_or_create_profile(self, supabase_user: Dict) -> Dict:
         """Get existing profile or create new one for Supabase user"""
         try:
@@ -70,7 +114,9 @@ class UserService:
             existing_profile = self.supabase.table('profiles').select('*').eq('id', supabase_user['sub']).execute()
             
             if existing_profile.data:
-                return existing_profile.data[0]
+                profile = existing_profile.data[0]
+                self.tiers[profile['id']] = profile.get('tier') or 'standard'
+                return profile
             
             # Create new profile if it doesn't exist
             profile_data = {
@@ -85,8 +131,9 @@ class UserService:
             
         except Exception as e:
             logging.error(f"Error managing user profile: {e}")
-            raise HTTPException(status_code=500, detail="Profile management error")
+            raise upstream_error(e, "Profile management error")
     
+    @traced()
     async def update_profile(self, supabase_user_id: str, profile_data: ProfileUpdate) -> Dict:
         """Update user profile"""
         try:
@@ -98,12 +145,30 @@ class UserService:
             
         except Exception as e:
             logging.error(f"Error updating profile: {e}")
-            raise HTTPException(status_code=500, detail="Profile update error")
+            raise upstream_error(e, "Profile update error")
 
 # File Service for managing file uploads
-class FileService:
-    def __init__(self, supabase_client: Client):
-        self.supabase = supabase_client
+class FileService(SupabaseService):
+    # Columns a client may pick with ?fields= on GET /api/files
+    list_columns = (
+        'id', 'name', 'original_name', 'mime_type', 'size', 'storage_path', 'public_url', 'thumbnail_url',
+        'ai_tags', 'ai_description', 'ai_processed', 'status', 'upload_date', 'last_accessed', 'metadata',
+        'storage_tier',
+    )
+    # Columns for the timeline and places views, read from indexed metadata keys
+    media_columns = (
+        'id,name,mime_type,size,storage_path,thumbnail_url,upload_date,'
+        'captured_at:metadata->>captured_at,gps_lat:metadata->gps_lat,gps_lon:metadata->gps_lon'
+    )
+    
+    # Download links for a file's owner
+    download_url_ttl = 300
+    
+    def __init__(self, supabase_client: Optional["Client"] = None, extractor: Optional[MetadataExtractor] = None,
+                 lifecycle: Optional[StorageLifecycle] = None):
+        super().__init__(supabase_client)
+        self.extractor = extractor
+        self.lifecycle = lifecycle or StorageLifecycle(StorageTiers.from_env())
         self.max_file_size = 50 * 1024 * 1024  # 50MB limit
         self.allowed_types = [
             'image/jpeg', 'image/png', 'image/gif', 'image/webp',
@@ -112,16 +177,23 @@ class FileService:
             'video/mp4', 'video/quicktime', 'video/x-msvideo'
         ]
     
+    def rejection_reason(self, mime_type: str, size: Optional[int]) -> Optional[str]:
+        """Why a file of this type and size would be refused, or None if it is acceptable"""
+        if mime_type not in self.allowed_types:
+            return f"File type {mime_type} not allowed"
+        if size and size > self.max_file_size:
+            return f"File size exceeds {self.max_file_size} bytes"
+        return None
+    
     def validate_file(self, file_data: FileUpload) -> bool:
         """Validate file type and size"""
-        if file_data.mime_type not in self.allowed_types:
-            raise HTTPException(status_code=400, detail=f"File type {file_data.mime_type} not allowed")
-        
-        if file_data.size and file_data.size > self.max_file_size:
-            raise HTTPException(status_code=400, detail=f"File size exceeds {self.max_file_size} bytes")
+        reason = self.rejection_reason(file_data.mime_type, file_data.size)
+        if reason:
+            raise HTTPException(status_code=400, detail=reason)
         
         return True
     
+    @traced()
     async def upload_file(self, file_data: FileUpload, user_id: str) -> Dict:
         """Upload file to Supabase storage and save metadata"""
         try:
@@ -140,7 +212,7 @@ class FileService:
             file_path = f"{user_id}/{file_id}{file_extension}"
             
             # Upload to Supabase Storage
-            storage_result = self.supabase.storage.from_('user-files').upload(
+            storage_result = self.supabase.storage.from_(self.lifecycle.tiers.hot.bucket).upload(
                 file_path, file_content, 
                 file_options={"content-type": file_data.mime_type}
             )
@@ -155,11 +227,16 @@ class FileService:
                 'size': actual_size,
                 'storage_path': file_path,
                 'upload_date': datetime.utcnow().isoformat(),
-                'status': 'uploaded'
+                'status': 'uploaded',
+                'metadata': {}
             }
             
             metadata_result = self.supabase.table('user_files').insert(file_metadata).execute()
             
+            # EXIF, perceptual hash, page count etc. are merged into metadata in the background
+            if self.extractor:
+                self.extractor.submit(file_id, user_id, file_data.mime_type, file_content)
+            
             return {
                 "file_id": file_id,
                 "message": "File uploaded successfully",
@@ -170,17 +247,122 @@ class FileService:
             raise
         except Exception as e:
             logging.error(f"File upload error: {e}")
-            raise HTTPException(status_code=500, detail="File upload failed")
+            raise upstream_error(e, "File upload failed")
     
-    async def get_user_files(self, user_id: str, limit: int = 50) -> List[Dict]:
-        """Get user's files"""
+    @traced()
+    async def get_user_files(self, user_id: str, limit: int = 50, columns: str = '*') -> List[Dict]:
+        """Get user's files, newest first; `columns` is a PostgREST select list"""
         try:
-            result = self.supabase.table('user_files').select('*').eq('user_id', user_id).limit(limit).order('upload_date', desc=True).execute()
+            result = self.supabase.table('user_files').select(columns).eq('user_id', user_id).limit(limit).order('upload_date', desc=True).execute()
             return result.data or []
         except Exception as e:
             logging.error(f"Error fetching files: {e}")
-            raise HTTPException(status_code=500, detail="Could not fetch files")
+            raise upstream_error(e, "Could not fetch files")
+    
+    @traced()
+    async def count_user_files(self, user_id: str) -> int:
+        """Number of files a user has, without fetching them"""
+        try:
+            result = self.supabase.table('user_files').select('id', count='exact').eq('user_id', user_id).limit(1).execute()
+            return result.count or 0
+        except Exception as e:
+            logging.error(f"Error counting files: {e}")
+            raise upstream_error(e, "Could not fetch files")
+    
+    @traced()
+    async def get_image_fingerprints(self, user_id: str, page_size: int = 1000) -> List[Dict]:
+        """All of a user's hashed images, paged by id so large libraries stay cheap to read"""
+        try:
+            # Many pages for a large library; keep them off the event loop
+            return await asyncio.to_thread(self._page_image_fingerprints, user_id, page_size)
+        except Exception as e:
+            logging.error(f"Error fetching image fingerprints: {e}")
+            raise upstream_error(e, "Could not fetch files")
+
+    def _page_image_fingerprints(self, user_id: str, page_size: int) -> List[Dict]:
+        files, last_id = [], None
+        while True:
+            query = self.supabase.table('user_files').select(
+                'id,name,size,upload_date,phash:metadata->>phash,'
+                'width:metadata->>width,height:metadata->>height'
+            ).eq('user_id', user_id).like('mime_type', 'image/%').not_.is_('metadata->>phash', 'null')
+            if last_id:
+                query = query.gt('id', last_id)
+            page = query.order('id').limit(page_size).execute().data or []
+            files.extend(page)
+            if len(page) < page_size:
+                return files
+            last_id = page[-1]['id']
+    
+    @traced()
+    async def get_timeline(self, user_id: str, start: Optional[str] = None, end: Optional[str] = None,
+                           cursor: Optional[str] = None, limit: int = 100) -> Dict:
+        """Files by capture time, newest first; `cursor` continues from a previous page"""
+        query = self.supabase.table('user_files').select(self.media_columns).eq('user_id', user_id) \
+            .not_.is_('metadata->>captured_at', 'null')
+        if start:
+            query = query.gte('metadata->>captured_at', start)
+        if end:
+            query = query.lt('metadata->>captured_at', end)
+        if cursor:
+            captured_at, _, last_id = cursor.partition('|')
+            # Keyset on (captured_at, id) so photos taken in the same second are not skipped
+            query = query.or_(
+                f'metadata->>captured_at.lt."{captured_at}",'
+                f'and(metadata->>captured_at.eq."{captured_at}",id.lt.{last_id})'
+            )
+        try:
+            files = query.order('metadata->>captured_at', desc=True).order('id', desc=True).limit(limit).execute().data or []
+        except Exception as e:
+            logging.error(f"Error fetching timeline: {e}")
+            raise upstream_error(e, "Could not fetch files")
+        next_cursor = f"{files[-1]['captured_at']}|{files[-1]['id']}" if len(files) == limit else None
+        return {"files": files, "next_cursor": next_cursor}
+    
+    @traced()
+    async def get_places(self, user_id: str, south: float, north: float, west: float, east: float,
+                         limit: int = 500) -> List[Dict]:
+        """Geotagged files inside a bounding box; west > east means the box crosses the antimeridian"""
+        spans = [(west, east)] if west <= east else [(west, 180.0), (-180.0, east)]
+        files = []
+        try:
+            for low, high in spans:
+                files.extend(
+                    self.supabase.table('user_files').select(self.media_columns).eq('user_id', user_id)
+                    .gte('metadata->gps_lat', south).lte('metadata->gps_lat', north)
+                    .gte('metadata->gps_lon', low).lte('metadata->gps_lon', high)
+                    .limit(limit - len(files)).execute().data or []
+                )
+                if len(files) >= limit:
+                    break
+        except Exception as e:
+            logging.error(f"Error fetching places: {e}")
+            raise upstream_error(e, "Could not fetch files")
+        return files
+    
+    @traced()
+    async def get_download(self, file_id: str, user_id: str) -> Dict:
+        """Signed download URL for one of the user's files, restoring it from a cold tier if needed"""
+        result = self.supabase.table('user_files').select('id,name,mime_type,size,storage_path,storage_tier') \
+            .eq('id', file_id).eq('user_id', user_id).execute()
+        if not result.data:
+            raise HTTPException(status_code=404, detail="File not found")
+        file_info = result.data[0]
+        try:
+            bucket = await asyncio.to_thread(self.lifecycle.readable_bucket, file_info)
+            signed = self.supabase.storage.from_(bucket).create_signed_url(
+                file_info['storage_path'], self.download_url_ttl, {'download': file_info['name']}
+            )
+        except Exception as e:
+            logging.error(f"Download link error: {e}")
+            raise upstream_error(e, "Could not create download link")
+        return {
+            'file': {k: file_info[k] for k in ('id', 'name', 'mime_type', 'size')},
+            'download_url': signed.get('signedURL') or signed.get('signedUrl'),
+            'expires_in': self.download_url_ttl,
+        }
     
+    @traced()
     async def delete_file(self, file_id: str, user_id: str) -> bool:
         """Delete user's file"""
         try:
@@ -192,8 +374,8 @@ class FileService:
             
             file_info = file_result.data[0]
             
-            # Delete from storage
-            storage_result = self.supabase.storage.from_('user-files').remove([file_info['storage_path']])
+            # Delete from storage, wherever the lifecycle has moved it
+            storage_result = self.supabase.storage.from_(self.lifecycle.tiers.bucket_for(file_info)).remove([file_info['storage_path']])
             
             # Delete metadata
             metadata_result = self.supabase.table('user_files').delete().eq('id', file_id).eq('user_id', user_id).execute()
@@ -204,11 +386,186 @@ class FileService:
             raise
         except Exception as e:
             logging.error(f"File deletion error: {e}")
-            raise HTTPException(status_code=500, detail="File deletion failed")
+            raise upstream_error(e, "File deletion failed")
+
+# Analytics Service for the admin dashboard
+# Reads only precomputed rows (user_analytics_mv and user_daily_usage), never user_files
+class AnalyticsService(SupabaseService):
+    sortable_columns = {
+        'storage_used_bytes', 'file_count', 'last_upload_date', 'active_upload_days',
+        'files_added_30d', 'bytes_added_30d', 'user_created_at'
+    }
+    
+    async def list_user_analytics(self, limit: int = 50, offset: int = 0, tier: Optional[str] = None,
+                                  sort: str = 'storage_used_bytes', descending: bool = True) -> Dict:
+        """Page through the materialized per-user analytics"""
+        if sort not in self.sortable_columns:
+            raise HTTPException(status_code=400, detail=f"Cannot sort by {sort}")
+        try:
+            query = self.supabase.table('user_analytics_mv').select('*', count='exact')
+            if tier:
+                query = query.eq('subscription_tier', tier)
+            result = query.order(sort, desc=descending).range(offset, offset + limit - 1).execute()
+            rows = result.data or []
+            return {
+                "users": rows,
+                "total": result.count if result.count is not None else len(rows),
+                "refreshed_at": rows[0].get('refreshed_at') if rows else None
+            }
+        except Exception as e:
+            logging.error(f"Error fetching user analytics: {e}")
+            raise upstream_error(e, "Could not fetch analytics")
+    
+    async def get_daily_usage(self, user_id: str, days: int = 30) -> List[Dict]:
+        """Daily rollup rows for one user, oldest first"""
+        try:
+            since = (datetime.utcnow() - timedelta(days=days)).date().isoformat()
+            result = self.supabase.table('user_daily_usage').select('*').eq('user_id', user_id).gte('usage_date', since).order('usage_date').execute()
+            return result.data or []
+        except Exception as e:
+            logging.error(f"Error fetching daily usage: {e}")
+            raise upstream_error(e, "Could not fetch daily usage")
+    
+    async def refresh(self) -> None:
+        """Refresh the materialized view without blocking readers"""
+        try:
+            self.supabase.rpc('refresh_user_analytics').execute()
+        except Exception as e:
+            logging.error(f"Error refreshing analytics: {e}")
+            raise upstream_error(e, "Could not refresh analytics")
+
+# Share Service for public share links
+class ShareService(SupabaseService):
+    columns = 'id,file_id,share_token,expires_at,permission_type,is_public,created_at,accessed_count,last_accessed'
+    # Download links handed out for a share; short so revoking takes effect soon
+    download_url_ttl = 300
+    
+    def __init__(self, supabase_client: Optional["Client"] = None, lifecycle: Optional[StorageLifecycle] = None):
+        super().__init__(supabase_client)
+        self.lifecycle = lifecycle or StorageLifecycle(StorageTiers.from_env())
+    
+    async def create_share(self, file_id: str, user_id: str, expires_in_hours: Optional[int] = None) -> Dict:
+        """Create a public read-only link to one of the user's files"""
+        try:
+            owned = self.supabase.table('user_files').select('id').eq('id', file_id).eq('user_id', user_id).execute()
+            if not owned.data:
+                raise HTTPException(status_code=404, detail="File not found")
+            
+            share = {
+                'id': str(uuid.uuid4()),
+                'file_id': file_id,
+                'owner_id': user_id,
+                'share_token': new_share_token(),
+                'expires_at': (datetime.utcnow() + timedelta(hours=expires_in_hours)).isoformat() + 'Z' if expires_in_hours else None,
+                'permission_type': 'read',
+                'is_public': True,
+            }
+            result = self.supabase.table('file_shares').insert(share).execute()
+            return result.data[0] if result.data else share
+        except HTTPException:
+            raise
+        except Exception as e:
+            logging.error(f"Share creation error: {e}")
+            raise upstream_error(e, "Could not create share link")
+    
+    async def list_shares(self, file_id: str, user_id: str) -> List[Dict]:
+        try:
+            result = self.supabase.table('file_shares').select(self.columns) \
+                .eq('file_id', file_id).eq('owner_id', user_id).order('created_at', desc=True).execute()
+            return result.data or []
+        except Exception as e:
+            logging.error(f"Error fetching shares: {e}")
+            raise upstream_error(e, "Could not fetch share links")
+    
+    async def revoke_share(self, share_id: str, user_id: str) -> Optional[str]:
+        """Delete a share; returns its token, or None if the user has no such share"""
+        try:
+            result = self.supabase.table('file_shares').delete().eq('id', share_id).eq('owner_id', user_id).execute()
+        except Exception as e:
+            logging.error(f"Share revoke error: {e}")
+            raise upstream_error(e, "Could not revoke share link")
+        return result.data[0]['share_token'] if result.data else None
+    
+    async def load_by_token(self, token: str) -> Optional[Dict]:
+        """Share and file details for a token, with a signed download URL; None if unknown"""
+        return await asyncio.to_thread(self._load_by_token, token)
+    
+    def _load_by_token(self, token: str) -> Optional[Dict]:
+        shares = self.supabase.table('file_shares').select('id,file_id,expires_at,permission_type') \
+            .eq('share_token', token).eq('is_public', True).limit(1).execute().data
+        if not shares:
+            return None
+        share = shares[0]
+        files = self.supabase.table('user_files').select('id,name,mime_type,size,storage_path,storage_tier') \
+            .eq('id', share['file_id']).limit(1).execute().data
+        if not files:
+            return None
+        file_info = files[0]
+        signed = self.supabase.storage.from_(self.lifecycle.readable_bucket(file_info)).create_signed_url(
+            file_info['storage_path'], self.download_url_ttl, {'download': file_info['name']}
+        )
+        return {
+            'id': share['id'],
+            'file_id': share['file_id'],
+            'expires_at': share.get('expires_at'),
+            'permission': share.get('permission_type') or 'read',
+            'file': {k: file_info[k] for k in ('name', 'mime_type', 'size')},
+            'download_url': signed.get('signedURL') or signed.get('signedUrl'),
+            # Cached entries must never hand out a link close to expiring
+            'download_url_expires': time.time() + self.download_url_ttl,
+        }
+
+def publish_extracted(user_id: str, file_id: str, fields: Dict):
+    change_hub.publish(user_id, "file.updated", {
+        "file_id": file_id,
+        "metadata": {k: v for k, v in fields.items() if k != "phash"}
+    })
 
 # Initialize services
-user_service = UserService(supabase)
-file_service = FileService(supabase)
+metadata_extractor = MetadataExtractor.from_env(on_extracted=publish_extracted)
+# Idle files move to colder buckets; reads are recorded behind the request
+storage_lifecycle = StorageLifecycle.from_env()
+file_access = AccessCounter(rpc="record_file_access", flush_interval=float(os.getenv("FILE_ACCESS_FLUSH_INTERVAL", 30.0)))
+user_service = UserService()
+file_service = FileService(extractor=metadata_extractor, lifecycle=storage_lifecycle)
+share_service = ShareService(lifecycle=storage_lifecycle)
+# Cached well inside the signed URL lifetime
+share_resolver = ShareResolver.from_env(share_service.load_by_token)
+share_access = AccessCounter.from_env()
+analytics_service = AnalyticsService()
+activity_logger = ActivityLogger.from_env()
+change_hub = ChangeHub.from_env()
+# Last file listings served per user, answered while Supabase is failing
+stale_cache = StaleCache.from_env()
+# On-demand CPU and memory profiling for admins
+profiler = SamplingProfiler.from_env()
+allocation_tracker = AllocationTracker.from_env()
+
+def publish_imported(user_id: str, rows: List[Dict]):
+    for row in rows:
+        change_hub.publish(user_id, "file.created", {
+            "file_id": row["id"], "name": row["name"], "mime_type": row["mime_type"],
+            "size": row["size"], "status": row["status"]
+        })
+
+importer = ArchiveImporter(file_service, extractor=metadata_extractor, bucket=storage_lifecycle.tiers.hot.bucket,
+                           on_imported=publish_imported)
+
+# Admission control for uploads and usage scans; tiers come from cached profiles
+admission = AdmissionController.from_env(tier_resolver=user_service.cached_tier)
+ADMISSION_ROUTES = {
+    ("POST", "/api/files/upload"): "upload",
+    ("GET", "/api/analytics/usage"): "stats",
+    ("GET", "/api/files/duplicates"): "stats",
+    ("POST", "/api/imports"): "import",
+    ("GET", "/api/shares/{token}"): "share",
+}
+
+# Uploads a client may retry with an Idempotency-Key header without storing or counting them twice
+idempotency_store = IdempotencyStore.from_env()
+IDEMPOTENT_ROUTES = [
+    ("POST", "/api/files/upload"),
+]
 
 # API Routes
 @api_router.get("/")
@@ -231,7 +588,7 @@ async def get_profile(current_user: Dict = Depends(get_current_user)):
         }
     except Exception as e:
         logging.error(f"Profile fetch error: {e}")
-        raise HTTPException(status_code=500, detail="Could not fetch profile")
+        raise upstream_error(e, "Could not fetch profile")
 
 @api_router.put("/auth/profile")
 async def update_profile(
@@ -244,46 +601,18 @@ async def update_profile(
     if not updated_profile:
         raise HTTPException(status_code=404, detail="Profile not found")
     
+    activity_logger.log(current_user['sub'], "profile.update", "profile", current_user['sub'],
+                        profile_data.dict(exclude_unset=True))
     return {"message": "Profile updated successfully", "profile": updated_profile}
 
 @api_router.get("/plans")
 async def get_plans():
     """Get available subscription plans"""
-    plans = {
-        "free": {
-            "name": "Free",
-            "price": 0,
-            "features": ["5 files", "Basic support", "1GB storage", "Basic AI organization"],
-            "max_files": 5,
-            "storage_gb": 1,
-            "ai_features": ["basic_tagging"]
-        },
-        "pro": {
-            "name": "Pro", 
-            "price": 9.99,
-            "features": ["100 files", "Priority support", "10GB storage", "Advanced AI", "File sharing"],
-            "max_files": 100,
-            "storage_gb": 10,
-            "ai_features": ["advanced_tagging", "smart_search", "auto_categorization"]
-        },
-        "team": {
-            "name": "Team",
-            "price": 19.99,
-            "features": ["500 files", "Team collaboration", "50GB storage", "API access", "Admin dashboard"],
-            "max_files": 500,
-            "storage_gb": 50,
-            "ai_features": ["advanced_tagging", "smart_search", "auto_categorization", "team_insights"]
-        },
-        "enterprise": {
-            "name": "Enterprise",
-            "price": 49.99,
-            "features": ["Unlimited files", "Custom integrations", "Unlimited storage", "24/7 support", "Advanced security"],
-            "max_files": -1,
-            "storage_gb": -1,
-            "ai_features": ["all_features", "custom_models", "priority_processing"]
-        }
-    }
-    return plans
+    return PLANS
+
+async def plan_max_files(profile: Dict) -> int:
+    """File limit of the profile's plan; -1 means unlimited"""
+    return PLANS[plan_key(profile.get('tier'))]['max_files']
 
 # File Management Endpoints
 @api_router.post("/files/upload")
@@ -296,33 +625,158 @@ async def upload_file(
     profile = await user_service.get_or_create_profile(current_user)
     
     # Check file count limits based on subscription
-    user_files = await file_service.get_user_files(current_user['sub'])
+    max_files = await plan_max_files(profile)
     
-    plans_response = await get_plans()
-    # Map standard tier to free for plan lookup
-    tier = profile.get('tier', 'standard')
-    if tier == 'standard':
-        tier = 'free'
-    user_plan = plans_response.get(tier, plans_response['free'])
-    max_files = user_plan['max_files']
-    
-    if max_files != -1 and len(user_files) >= max_files:
+    if max_files != -1 and await file_service.count_user_files(current_user['sub']) >= max_files:
         raise HTTPException(
             status_code=429, 
             detail=f"File limit exceeded. Your {profile['subscription_tier']} plan allows {max_files} files."
         )
     
     result = await file_service.upload_file(file_data, current_user['sub'])
+    activity_logger.log(current_user['sub'], "file.upload", "file", result["file_id"],
+                        {"mime_type": file_data.mime_type, "size": result["metadata"].get("size")})
+    change_hub.publish(current_user['sub'], "file.created", {
+        "file_id": result["file_id"], "name": file_data.name, "mime_type": file_data.mime_type,
+        "size": result["metadata"].get("size"), "status": "uploaded"
+    })
     return result
 
+# Bulk import from a ZIP or tar archive
+@api_router.post("/imports", status_code=202)
+async def import_archive(
+    archive: UploadFile = File(...),
+    current_user: Dict = Depends(get_current_user)
+):
+    """Start importing every supported file in an archive; poll /imports/{job_id} for progress"""
+    filename = archive.filename or "archive"
+    if not filename.lower().endswith(ARCHIVE_SUFFIXES):
+        raise HTTPException(status_code=400, detail=f"Unsupported archive type; use one of {', '.join(ARCHIVE_SUFFIXES)}")
+    
+    profile = await user_service.get_or_create_profile(current_user)
+    max_files = await plan_max_files(profile)
+    remaining = None
+    if max_files != -1:
+        remaining = max_files - await file_service.count_user_files(current_user['sub'])
+        if remaining <= 0:
+            raise HTTPException(status_code=429, detail=f"File limit exceeded. Your plan allows {max_files} files.")
+    
+    # Admission control rejects oversized requests before their body is read; this covers it being off
+    max_bytes = admission.policies["import"].max_bytes
+    if max_bytes is not None and archive.size is not None and archive.size > max_bytes:
+        raise HTTPException(status_code=413, detail=f"Archive exceeds the limit of {max_bytes} bytes")
+    
+    # The upload is discarded with the request, so hand the job its own copy
+    def save_copy() -> str:
+        with tempfile.NamedTemporaryFile(prefix="import-", suffix=os.path.basename(filename)[-16:], delete=False) as copy:
+            archive.file.seek(0)
+            copied = 0
+            while chunk := archive.file.read(1024 * 1024):
+                copied += len(chunk)
+                if max_bytes is not None and copied > max_bytes:
+                    copy.close()
+                    os.unlink(copy.name)
+                    raise HTTPException(status_code=413, detail=f"Archive exceeds the limit of {max_bytes} bytes")
+                copy.write(chunk)
+            return copy.name
+    archive_path = await asyncio.to_thread(save_copy)
+    
+    job = await asyncio.to_thread(importer.submit, ImportJob(current_user['sub'], filename), archive_path, remaining)
+    activity_logger.log(current_user['sub'], "files.import", "import_job", job.id, {"archive": filename})
+    return job.to_dict()
+
+@api_router.get("/imports/{job_id}")
+async def get_import_job(job_id: str, current_user: Dict = Depends(get_current_user)):
+    """Progress of an archive import"""
+    try:
+        job = await asyncio.to_thread(importer.get_job, job_id, current_user['sub'])
+    except Exception as e:
+        logging.error(f"Error fetching import job: {e}")
+        raise upstream_error(e, "Could not fetch import job")
+    if job is None:
+        raise HTTPException(status_code=404, detail="Import job not found")
+    return job
+
 @api_router.get("/files")
 async def get_files(
     limit: int = 50,
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return, e.g. id,name,size,thumbnail_url"),
     current_user: Dict = Depends(get_current_user)
 ):
     """Get user's files"""
-    files = await file_service.get_user_files(current_user['sub'], limit)
-    return {"files": files, "count": len(files)}
+    selected = parse_fields(fields, FileService.list_columns)
+    files, age = await stale_cache.aload(
+        ("files", current_user['sub'], limit, fields and ",".join(selected)),
+        lambda: file_service.get_user_files(current_user['sub'], limit, select_list(selected, FileService.list_columns)),
+    )
+    response = json_response({"files": files, "count": len(files)})
+    if age is not None:
+        mark_stale(response, age)
+    return response
+
+# Timeline and places views, answered from indexed metadata keys
+@api_router.get("/files/timeline")
+async def get_timeline(
+    start: Optional[str] = Query(None, description="ISO date or datetime, inclusive"),
+    end: Optional[str] = Query(None, description="ISO date or datetime, exclusive"),
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=500),
+    current_user: Dict = Depends(get_current_user)
+):
+    """Files with a capture time, newest first"""
+    try:
+        for value in (start, end):
+            if value:
+                datetime.fromisoformat(value)
+        if cursor:
+            captured_at, _, last_id = cursor.partition('|')
+            datetime.fromisoformat(captured_at)
+            uuid.UUID(last_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date or cursor")
+    return json_response(await file_service.get_timeline(current_user['sub'], start, end, cursor, limit))
+
+@api_router.get("/files/places")
+async def get_places(
+    south: float = Query(..., ge=-90, le=90),
+    north: float = Query(..., ge=-90, le=90),
+    west: float = Query(..., ge=-180, le=180),
+    east: float = Query(..., ge=-180, le=180),
+    limit: int = Query(500, ge=1, le=2000),
+    current_user: Dict = Depends(get_current_user)
+):
+    """Geotagged files inside a bounding box"""
+    if south > north:
+        raise HTTPException(status_code=400, detail="south must not exceed north")
+    files = await file_service.get_places(current_user['sub'], south, north, west, east, limit)
+    return json_response({"files": files, "count": len(files)})
+
+@api_router.get("/files/duplicates")
+async def get_duplicate_images(
+    max_distance: int = Query(6, ge=0, le=MAX_DISTANCE),
+    limit: int = Query(100, ge=1, le=1000),
+    current_user: Dict = Depends(get_current_user)
+):
+    """Clusters of near-identical images with a suggested keeper for each"""
+    files = await file_service.get_image_fingerprints(current_user['sub'])
+    try:
+        clusters = await asyncio.to_thread(find_duplicate_clusters, files, max_distance)
+    except OptionalDependencyError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    
+    return {
+        "clusters": clusters[:limit],
+        "cluster_count": len(clusters),
+        "reclaimable_bytes": sum(c["reclaimable_bytes"] for c in clusters),
+        "images_scanned": len(files)
+    }
+
+@api_router.get("/files/{file_id}/download")
+async def download_file(file_id: str, current_user: Dict = Depends(get_current_user)):
+    """Short-lived download URL for a file"""
+    download = await file_service.get_download(file_id, current_user['sub'])
+    file_access.hit(file_id)
+    return download
 
 @api_router.delete("/files/{file_id}")
 async def delete_file(
@@ -331,8 +785,79 @@ async def delete_file(
 ):
     """Delete a file"""
     success = await file_service.delete_file(file_id, current_user['sub'])
+    if success:
+        activity_logger.log(current_user['sub'], "file.delete", "file", file_id)
+        change_hub.publish(current_user['sub'], "file.deleted", {"file_id": file_id})
     return {"message": "File deleted successfully" if success else "File deletion failed"}
 
+# Share links
+@api_router.post("/files/{file_id}/shares", status_code=201)
+async def create_share(
+    file_id: str,
+    share_data: ShareCreate,
+    current_user: Dict = Depends(get_current_user)
+):
+    """Create a public link to a file"""
+    share = await share_service.create_share(file_id, current_user['sub'], share_data.expires_in_hours)
+    # A token that was guessed before it existed may be negatively cached
+    share_resolver.invalidate(share['share_token'])
+    activity_logger.log(current_user['sub'], "share.create", "file_share", share['id'], {"file_id": file_id})
+    return {**share, "url": f"/api/shares/{share['share_token']}"}
+
+@api_router.get("/files/{file_id}/shares")
+async def list_shares(file_id: str, current_user: Dict = Depends(get_current_user)):
+    """Share links for a file, with access counts"""
+    shares = await share_service.list_shares(file_id, current_user['sub'])
+    return {"shares": shares, "count": len(shares)}
+
+@api_router.delete("/shares/{share_id}")
+async def revoke_share(share_id: str, current_user: Dict = Depends(get_current_user)):
+    """Revoke a share link; other workers stop serving it within the cache TTL"""
+    token = await share_service.revoke_share(share_id, current_user['sub'])
+    if token is None:
+        raise HTTPException(status_code=404, detail="Share not found")
+    share_resolver.invalidate(token)
+    activity_logger.log(current_user['sub'], "share.revoke", "file_share", share_id)
+    return {"message": "Share link revoked"}
+
+@api_router.get("/shares/{token}")
+async def resolve_share(token: str):
+    """Public: file details and a short-lived download URL for a share link"""
+    if not is_share_token(token):
+        raise HTTPException(status_code=404, detail="Share link not found")
+    try:
+        share = await share_resolver.resolve(token)
+        if share and share['download_url_expires'] - time.time() < share_service.download_url_ttl / 2:
+            # Cached longer than expected (e.g. a large SHARE_CACHE_TTL); sign afresh
+            share_resolver.invalidate(token)
+            share = await share_resolver.resolve(token)
+    except Exception as e:
+        logging.error(f"Share resolution error: {e}")
+        raise upstream_error(e, "Could not open share link")
+    if share is None:
+        raise HTTPException(status_code=404, detail="Share link not found")
+    if share['expires_at'] and datetime.fromisoformat(share['expires_at'].replace('Z', '+00:00')) <= datetime.now(timezone.utc):
+        raise HTTPException(status_code=410, detail="Share link has expired")
+    
+    share_access.hit(share['id'])
+    file_access.hit(share['file_id'])
+    return {k: v for k, v in share.items() if k not in ('download_url_expires', 'file_id')}
+
+# Realtime change feed; clients resume with Last-Event-ID or ?cursor=
+@api_router.get("/events")
+async def stream_events(
+    request: Request,
+    cursor: Optional[str] = Query(None),
+    current_user: Dict = Depends(get_stream_user)
+):
+    """Server-Sent Events stream of the user's file changes"""
+    start = parse_cursor(request.headers.get("last-event-id"), cursor)
+    return StreamingResponse(
+        change_hub.stream(current_user['sub'], start),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 # Analytics endpoint (Pro+ only)
 @api_router.get("/analytics/usage")
 async def get_usage_analytics(
@@ -366,36 +891,141 @@ async def get_usage_analytics(
         "generated_at": datetime.utcnow().isoformat()
     }
 
-# Include router in main app
-app.include_router(api_router)
+# Admin analytics endpoints (precomputed rollups only)
+@api_router.get("/admin/analytics/users")
+async def admin_user_analytics(
+    limit: int = Query(50, ge=1, le=500),
+    offset: int = Query(0, ge=0),
+    tier: Optional[str] = None,
+    sort: str = 'storage_used_bytes',
+    descending: bool = True,
+    current_user: Dict = Depends(require_user_role("admin"))
+):
+    """Per-user analytics for the admin dashboard"""
+    return await analytics_service.list_user_analytics(limit, offset, tier, sort, descending)
 
-# CORS Configuration
-app.add_middleware(
-    CORSMiddleware,
-    allow_credentials=True,
-    allow_origins=["*"],
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+@api_router.get("/admin/analytics/users/{user_id}/daily")
+async def admin_user_daily_usage(
+    user_id: str,
+    days: int = Query(30, ge=1, le=366),
+    current_user: Dict = Depends(require_user_role("admin"))
+):
+    """Daily upload/delete rollups for a single user"""
+    usage = await analytics_service.get_daily_usage(user_id, days)
+    return {"user_id": user_id, "days": days, "usage": usage}
+
+@api_router.post("/admin/analytics/refresh")
+async def admin_refresh_analytics(current_user: Dict = Depends(require_user_role("admin"))):
+    """Refresh user_analytics_mv on demand (also runs on a pg_cron schedule)"""
+    await analytics_service.refresh()
+    return {"message": "Analytics refreshed", "refreshed_at": datetime.utcnow().isoformat()}
+
+# Profiling (admins only)
+@api_router.get("/admin/profile/cpu", response_class=PlainTextResponse)
+async def profile_cpu(
+    seconds: float = Query(10, gt=0),
+    interval_ms: float = Query(10, ge=1, le=1000),
+    include_idle: bool = False,
+    current_user: Dict = Depends(require_user_role("admin"))
+):
+    """Sample every thread's stack for `seconds`; returns collapsed stacks for flamegraph.pl or speedscope"""
+    try:
+        stacks = await asyncio.to_thread(profiler.profile, seconds, interval_ms / 1000, include_idle)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return PlainTextResponse(stacks)
+
+@api_router.post("/admin/profile/memory")
+async def start_memory_profile(
+    frames: Optional[int] = Query(None, ge=1, le=128),
+    current_user: Dict = Depends(require_user_role("admin"))
+):
+    """Start tracemalloc (or take a new baseline if it is running)"""
+    return allocation_tracker.start(frames)
+
+@api_router.get("/admin/profile/memory")
+async def memory_profile(
+    request: Request,
+    top: int = Query(25, ge=1, le=500),
+    route: Optional[str] = Query(None, description='Limit top_lines to one route, e.g. "POST /api/files/upload"'),
+    current_user: Dict = Depends(require_user_role("admin"))
+):
+    """Memory allocated since the baseline and still held, by route and source line, plus per-route peaks"""
+    try:
+        return await asyncio.to_thread(allocation_tracker.report, request.app.routes, top, route)
+    except NotTracking as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@api_router.delete("/admin/profile/memory")
+async def stop_memory_profile(current_user: Dict = Depends(require_user_role("admin"))):
+    """Stop tracemalloc"""
+    return allocation_tracker.stop()
 
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    format=LOG_FORMAT
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("startup")
-async def startup_event():
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create shared clients and background workers once per process, not at import"""
     logger.info("FileInASnap API starting up with Supabase integration")
+    started = time.perf_counter()
+    get_supabase()
+    get_supabase_anon()
+    activity_logger.start()
+    change_hub.start()
+    share_access.start()
+    file_access.start()
+    storage_lifecycle.start()
+    tracer.start()
+    logger.info(f"FileInASnap API ready in {(time.perf_counter() - started) * 1000:.1f}ms")
+    yield
+    logger.info("FileInASnap API shutting down")
+    tracer.stop()
+    change_hub.stop()
+    importer.shutdown()
+    metadata_extractor.stop()
+    share_access.stop()
+    storage_lifecycle.stop()
+    file_access.stop()
+    activity_logger.stop()
+
+def create_app() -> FastAPI:
+    """Build the FastAPI application"""
+    app = FastAPI(title="FileInASnap API", version="1.0.0", lifespan=lifespan, default_response_class=FastJSONResponse)
     
-    # Create necessary database tables if they don't exist
-    try:
-        # This is a placeholder - in production you'd run proper migrations
-        logger.info("Database tables ready")
-    except Exception as e:
-        logger.error(f"Database setup error: {e}")
+    # Include router in main app
+    app.include_router(api_router)
+    
+    # Innermost, so stored and replayed responses are the uncompressed bodies the routes produced
+    app.add_middleware(IdempotencyMiddleware, store=idempotency_store, routes=IDEMPOTENT_ROUTES)
+    
+    # Compresses route and replayed responses alike
+    app.add_middleware(CompressionMiddleware, **CompressionMiddleware.options_from_env())
+    
+    # Admission control sits inside CORS so 429s are readable by browsers
+    app.add_middleware(AdmissionMiddleware, controller=admission, routes=ADMISSION_ROUTES)
+    
+    # CORS Configuration
+    app.add_middleware(
+        CORSMiddleware,
+        allow_credentials=True,
+        allow_origins=["*"],
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    
+    # Per-route memory peaks while allocation tracking is on; a no-op otherwise
+    app.add_middleware(AllocationMiddleware, tracker=allocation_tracker)
+    
+    # Counts Supabase calls per request into Server-Timing and flags requests over CALL_BUDGET
+    app.add_middleware(CallBudgetMiddleware, budget=CallBudget.from_env())
+    
+    # Outermost, so each request's root span covers all of the above
+    app.add_middleware(TracingMiddleware)
+    return app
 
-@app.on_event("shutdown") 
-async def shutdown_event():
-    logger.info("FileInASnap API shutting down")
+app = create_app()
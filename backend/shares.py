@@ -0,0 +1,241 @@
+"""
+Public share links for FileInASnap
+Share tokens are resolved through an in-process cache, with separate
+short-lived negative entries so guessed or revoked tokens cannot reach the
+database on every request. Access counts are aggregated in memory and
+written in one batched statement per flush (see
+supabase/migrations/*_share_access_counters.sql), so a popular link costs
+one row update per worker per interval rather than one per hit.
+"""
+
+import asyncio
+import logging
+import os
+import re
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from clients import get_supabase
+
+logger = logging.getLogger(__name__)
+
+TOKEN_BYTES = 24
+TOKEN_PATTERN = re.compile(r"^[A-Za-z0-9_-]{32}$")
+
+
+def new_share_token() -> str:
+    """Unguessable URL-safe token (192 bits)"""
+    return secrets.token_urlsafe(TOKEN_BYTES)
+
+
+def is_share_token(token: str) -> bool:
+    """Cheap shape check, so malformed tokens are rejected before any lookup"""
+    return bool(TOKEN_PATTERN.match(token or ""))
+
+
+class ShareResolver:
+    """
+    Caches token -> share lookups
+
+    Found shares are kept for `ttl` seconds in an LRU of `max_entries`;
+    unknown tokens are remembered for `negative_ttl` seconds in a separate
+    LRU of `max_negative`, so a flood of random tokens can only evict other
+    misses, never live links. Concurrent misses for one token share a single
+    load. A revoke in another worker is seen here once the entry expires.
+    """
+
+    def __init__(
+        self,
+        load: Callable[[str], Awaitable[Optional[Dict[str, Any]]]],
+        ttl: float = 30.0,
+        negative_ttl: float = 60.0,
+        max_entries: int = 10000,
+        max_negative: int = 50000,
+    ):
+        self.load = load
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.max_negative = max_negative
+        self._found: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._missing: "OrderedDict[str, float]" = OrderedDict()
+        self._inflight: Dict[str, "asyncio.Future"] = {}
+        self.stats = {"hits": 0, "negative_hits": 0, "loads": 0}
+
+    @classmethod
+    def from_env(cls, load) -> "ShareResolver":
+        """Build a resolver configured from SHARE_CACHE_* environment variables"""
+        return cls(
+            load,
+            ttl=float(os.getenv("SHARE_CACHE_TTL", 30.0)),
+            negative_ttl=float(os.getenv("SHARE_CACHE_NEGATIVE_TTL", 60.0)),
+            max_entries=int(os.getenv("SHARE_CACHE_MAX_ENTRIES", 10000)),
+        )
+
+    async def resolve(self, token: str) -> Optional[Dict[str, Any]]:
+        """The share for `token`, or None if there is none"""
+        now = time.monotonic()
+        entry = self._found.get(token)
+        if entry is not None:
+            if entry[0] > now:
+                self._found.move_to_end(token)
+                self.stats["hits"] += 1
+                return entry[1]
+            del self._found[token]
+        expires = self._missing.get(token)
+        if expires is not None:
+            if expires > now:
+                self.stats["negative_hits"] += 1
+                return None
+            del self._missing[token]
+
+        pending = self._inflight.get(token)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        pending = self._inflight[token] = asyncio.get_running_loop().create_future()
+        try:
+            self.stats["loads"] += 1
+            share = await self.load(token)
+            self._store(token, share)
+            pending.set_result(share)
+            return share
+        except Exception as e:
+            pending.set_exception(e)
+            # Waiters see the error; nobody may be awaiting, so mark it retrieved
+            pending.exception()
+            raise
+        finally:
+            del self._inflight[token]
+
+    def _store(self, token: str, share: Optional[Dict[str, Any]]):
+        now = time.monotonic()
+        if share is None:
+            self._missing[token] = now + self.negative_ttl
+            while len(self._missing) > self.max_negative:
+                self._missing.popitem(last=False)
+        else:
+            self._found[token] = (now + self.ttl, share)
+            while len(self._found) > self.max_entries:
+                self._found.popitem(last=False)
+
+    def invalidate(self, token: str, share: Optional[Dict[str, Any]] = None):
+        """Forget a token after it changes; pass `share` to replace it instead (e.g. on create)"""
+        self._found.pop(token, None)
+        self._missing.pop(token, None)
+        if share is not None:
+            self._store(token, share)
+
+
+class AccessCounter:
+    """
+    Write-behind access counts and times
+
+    Hits only touch an in-memory dict; a background thread writes the
+    accumulated totals every `flush_interval` seconds through one call to
+    `rpc`, which takes a JSONB array of {id, count, last_accessed}. The
+    default updates file_shares; record_file_access updates user_files.
+    Totals from a failed flush are merged back and retried with the next
+    one. At most `max_pending` ids are tracked; further hits to new ids
+    are dropped (and counted) until the next flush.
+    """
+
+    def __init__(
+        self,
+        supabase_client=None,
+        rpc: str = "record_share_access",
+        flush_interval: float = 10.0,
+        batch_size: int = 1000,
+        max_pending: int = 100000,
+    ):
+        self._supabase = supabase_client
+        self.rpc = rpc
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self._pending: Dict[str, List] = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {"hits": 0, "written": 0, "dropped": 0, "failed_flushes": 0}
+
+    @classmethod
+    def from_env(cls, supabase_client=None) -> "AccessCounter":
+        """Build a counter configured from SHARE_ACCESS_* environment variables"""
+        return cls(
+            supabase_client,
+            flush_interval=float(os.getenv("SHARE_ACCESS_FLUSH_INTERVAL", 10.0)),
+            max_pending=int(os.getenv("SHARE_ACCESS_MAX_PENDING", 100000)),
+        )
+
+    @property
+    def supabase(self):
+        return self._supabase or get_supabase()
+
+    def hit(self, item_id: str):
+        """Count one access; never blocks on the database"""
+        now = datetime.now(timezone.utc).isoformat()
+        with self._lock:
+            self.stats["hits"] += 1
+            entry = self._pending.get(item_id)
+            if entry is not None:
+                entry[0] += 1
+                entry[1] = now
+            elif len(self._pending) < self.max_pending:
+                self._pending[item_id] = [1, now]
+            else:
+                self.stats["dropped"] += 1
+
+    def start(self):
+        """Start the background flush thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name=f"{self.rpc}-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """Stop the flush thread, writing whatever is still buffered"""
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stopping.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """Write all accumulated counts"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        items = list(pending.items())
+        for start in range(0, len(items), self.batch_size):
+            batch = items[start:start + self.batch_size]
+            hits = [{"id": item_id, "count": count, "last_accessed": last} for item_id, (count, last) in batch]
+            try:
+                self.supabase.rpc(self.rpc, {"hits": hits}).execute()
+                self.stats["written"] += sum(count for _, (count, _) in batch)
+            except Exception as e:
+                self.stats["failed_flushes"] += 1
+                logger.warning(f"Access flush via {self.rpc} failed, retrying next interval: {e}")
+                self._merge_back(items[start:])
+                return
+
+    def _merge_back(self, items: List[Tuple[str, List]]):
+        with self._lock:
+            for item_id, (count, last) in items:
+                entry = self._pending.get(item_id)
+                if entry is not None:
+                    entry[0] += count
+                elif len(self._pending) < self.max_pending:
+                    self._pending[item_id] = [count, last]
+                else:
+                    self.stats["dropped"] += count
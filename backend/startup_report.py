@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Startup-time report for FileInASnap
+Breaks cold-start cost into module imports (from `python -X importtime`),
+app construction and Supabase client creation, each measured in a fresh
+interpreter so nothing is already cached.
+
+Usage:
+    python startup_report.py
+    python startup_report.py --app server --top 25
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+BACKEND_DIR = Path(__file__).parent
+
+# Runs in the child interpreter; prints phase timings as JSON
+PHASES_SCRIPT = """
+import json, time
+t0 = time.perf_counter()
+import {module}
+t1 = time.perf_counter()
+{module}.create_app()
+t2 = time.perf_counter()
+clients = None
+try:
+    from clients import get_supabase
+    get_supabase()
+    clients = (time.perf_counter() - t2) * 1000
+except Exception as e:
+    clients = repr(e)
+print(json.dumps({{"import_ms": (t1 - t0) * 1000, "create_app_ms": (t2 - t1) * 1000, "clients_ms": clients}}))
+"""
+
+
+def parse_importtime(stderr: str) -> List[Tuple[str, int, int, int]]:
+    """Return (module, self_us, cumulative_us, depth) rows from -X importtime output"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3:
+            continue
+        raw_name = parts[2].rstrip()
+        # One separator space, then two spaces per nesting level
+        depth = (len(raw_name) - len(raw_name.lstrip()) - 1) // 2
+        rows.append((raw_name.strip(), int(parts[0]), int(parts[1]), depth))
+    return rows
+
+
+def measure_imports(module: str) -> List[Tuple[str, int, int, int]]:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BACKEND_DIR, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+    return parse_importtime(result.stderr)
+
+
+def measure_phases(module: str) -> Dict:
+    result = subprocess.run(
+        [sys.executable, "-c", PHASES_SCRIPT.format(module=module)],
+        cwd=BACKEND_DIR, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Measuring {module} failed:\n{result.stderr[-2000:]}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def report(module: str, top: int) -> Dict:
+    rows = measure_imports(module)
+    by_package: Dict[str, int] = defaultdict(int)
+    for name, self_us, _, _ in rows:
+        by_package[name.split(".")[0]] += self_us
+    total_us = sum(self_us for _, self_us, _, _ in rows)
+    phases = measure_phases(module)
+
+    print(f"\n📦 {module}.py cold start")
+    print("-" * 60)
+    print(f"   imports (in-process)   {phases['import_ms']:>9.1f} ms")
+    print(f"   create_app()           {phases['create_app_ms']:>9.1f} ms")
+    clients = phases["clients_ms"]
+    if isinstance(clients, (int, float)):
+        print(f"   Supabase clients       {clients:>9.1f} ms  (paid in lifespan, not at import)")
+    else:
+        print(f"   Supabase clients       skipped: {clients}")
+
+    print(f"\n   Import cost by top-level package ({total_us / 1000:.1f} ms total self time)")
+    for package, us in sorted(by_package.items(), key=lambda item: -item[1])[:top]:
+        print(f"   {package:<32}{us / 1000:>9.1f} ms  {us / total_us:>6.1%}")
+
+    print(f"\n   Slowest direct imports of {module} (cumulative)")
+    direct = [r for r in rows if r[3] == 1]
+    for name, _, cumulative_us, _ in sorted(direct, key=lambda r: -r[2])[:top]:
+        print(f"   {name:<32}{cumulative_us / 1000:>9.1f} ms")
+
+    return {
+        "module": module,
+        "phases": phases,
+        "import_self_ms_by_package": {k: round(v / 1000, 2) for k, v in by_package.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Break down FileInASnap cold-start cost")
+    parser.add_argument("--app", choices=["main", "server"], action="append", help="app module(s) to measure")
+    parser.add_argument("--top", type=int, default=15, help="rows to show per section")
+    parser.add_argument("--json", type=Path, help="also write the report as JSON")
+    args = parser.parse_args()
+
+    results = [report(module, args.top) for module in (args.app or ["main", "server"])]
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
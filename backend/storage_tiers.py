@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+Tiered storage lifecycle for FileInASnap
+Files are uploaded to the hot tier's bucket. A lifecycle pass moves files
+that nobody has read for a tier's `after_days` into that tier's bucket, and
+reading a file from a colder tier moves it back. user_files.storage_tier
+records which bucket holds the object; storage_path is the same key in
+every bucket, so nothing else needs rewriting. Reads are recorded behind
+the request by an AccessCounter calling record_file_access() (see
+supabase/migrations/*_storage_tiers.sql).
+
+STORAGE_TIERS lists the tiers from hottest to coldest as
+name:bucket:after_days[:restore], for example
+
+    hot:user-files:0,cold:user-files-cold:30,archive:user-files-archive:180:restore
+
+A tier marked `restore` cannot be read in place (e.g. a bucket backed by an
+archival storage class). Reads of those files wait while they are copied
+back to the hot tier. Files in other tiers are served from where they are
+and promoted in the background.
+
+Usage:
+    python storage_tiers.py run [--limit N] [--dry-run]
+"""
+
+import argparse
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, NamedTuple, Optional
+
+from clients import get_supabase
+
+logger = logging.getLogger(__name__)
+
+# user_files.storage_tier defaults to this name
+HOT = "hot"
+DEFAULT_TIERS = f"{HOT}:user-files:0"
+
+
+class TierPolicy(NamedTuple):
+    name: str
+    bucket: str
+    # Days without a read before a file moves into this tier
+    after_days: int
+    # Objects here must be copied back to the hot tier before they can be read
+    restore: bool = False
+
+
+class StorageTiers:
+    """The configured tiers, hottest first"""
+
+    def __init__(self, tiers: List[TierPolicy]):
+        if not tiers or tiers[0].name != HOT or tiers[0].after_days != 0:
+            raise ValueError(f"The first storage tier must be {HOT!r}, with after_days 0")
+        for colder, hotter in zip(tiers[1:], tiers):
+            if colder.after_days <= hotter.after_days:
+                raise ValueError(f"Tier {colder.name} must have a larger after_days than {hotter.name}")
+        if tiers[0].restore:
+            raise ValueError("The hot tier must be readable in place")
+        self.tiers = tiers
+        self._by_name = {tier.name: tier for tier in tiers}
+
+    @classmethod
+    def parse(cls, spec: str) -> "StorageTiers":
+        tiers = []
+        for item in filter(None, (part.strip() for part in spec.split(","))):
+            fields = item.split(":")
+            if len(fields) not in (3, 4) or (len(fields) == 4 and fields[3] != "restore"):
+                raise ValueError(f"Invalid storage tier {item!r}; expected name:bucket:after_days[:restore]")
+            tiers.append(TierPolicy(fields[0], fields[1], int(fields[2]), len(fields) == 4))
+        return cls(tiers)
+
+    @classmethod
+    def from_env(cls) -> "StorageTiers":
+        """Tiers configured from STORAGE_TIERS"""
+        return cls.parse(os.getenv("STORAGE_TIERS", DEFAULT_TIERS))
+
+    @property
+    def hot(self) -> TierPolicy:
+        return self.tiers[0]
+
+    def get(self, name: Optional[str]) -> TierPolicy:
+        """Policy for a stored tier name; rows written before tiering are hot"""
+        return self._by_name.get(name or self.hot.name) or self.hot
+
+    def bucket_for(self, row: Dict) -> str:
+        """Bucket holding a user_files row's object"""
+        return self.get(row.get("storage_tier")).bucket
+
+
+class StorageLifecycle:
+    """
+    Moves objects between tiers
+
+    A move copies the object into the target bucket, switches the row with
+    an update guarded on its current tier, and only then removes the
+    source, so a row never points at a missing object. When the guard fails
+    (the file was deleted or moved by someone else meanwhile), the copy is
+    removed again unless the row now points at it.
+    """
+
+    def __init__(
+        self,
+        tiers: StorageTiers,
+        supabase_client=None,
+        batch_size: int = 100,
+        workers: int = 4,
+        interval: float = 0.0,
+        promote_workers: int = 2,
+    ):
+        self.tiers = tiers
+        self._supabase = supabase_client
+        self.batch_size = batch_size
+        self.workers = workers
+        self.interval = interval
+        self._promoter = ThreadPoolExecutor(max_workers=promote_workers, thread_name_prefix="storage-promote")
+        self._promoting: set = set()
+        self._promoting_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {"demoted": 0, "promoted": 0, "bytes_moved": 0, "failed": 0}
+
+    @classmethod
+    def from_env(cls, tiers: Optional[StorageTiers] = None, supabase_client=None) -> "StorageLifecycle":
+        """Build a lifecycle configured from STORAGE_LIFECYCLE_* environment variables"""
+        return cls(
+            tiers or StorageTiers.from_env(),
+            supabase_client,
+            batch_size=int(os.getenv("STORAGE_LIFECYCLE_BATCH", 100)),
+            workers=int(os.getenv("STORAGE_LIFECYCLE_WORKERS", 4)),
+            # 0 leaves demotion to `python storage_tiers.py run` on a schedule
+            interval=float(os.getenv("STORAGE_LIFECYCLE_INTERVAL", 0)),
+        )
+
+    @property
+    def supabase(self):
+        return self._supabase or get_supabase()
+
+    def move(self, row: Dict, target: TierPolicy) -> bool:
+        """Move one file's object into `target`; False if it was not moved"""
+        source = self.tiers.get(row.get("storage_tier"))
+        if source.name == target.name:
+            return False
+        path = row["storage_path"]
+        content = self.supabase.storage.from_(source.bucket).download(path)
+        self.supabase.storage.from_(target.bucket).upload(
+            path, content, file_options={"content-type": row.get("mime_type") or "application/octet-stream", "upsert": "true"}
+        )
+        values = {"storage_tier": target.name}
+        if target.name == self.tiers.hot.name:
+            # A promotion is a read; don't let the next pass demote it straight away
+            values["last_accessed"] = datetime.now(timezone.utc).isoformat()
+        result = self.supabase.table("user_files").update(values, returning="representation") \
+            .eq("id", row["id"]).eq("storage_tier", source.name).execute()
+        if not result.data:
+            current = self.supabase.table("user_files").select("storage_tier").eq("id", row["id"]).execute().data
+            if not current or current[0]["storage_tier"] != target.name:
+                self.supabase.storage.from_(target.bucket).remove([path])
+            return False
+        self.supabase.storage.from_(source.bucket).remove([path])
+        self.stats["bytes_moved"] += len(content)
+        return True
+
+    def run_once(self, limit: Optional[int] = None, dry_run: bool = False) -> Dict[str, int]:
+        """One lifecycle pass: demote every file idle past its next tier's threshold"""
+        counts = {"candidates": 0, "moved": 0, "skipped": 0, "failed": 0}
+        now = datetime.now(timezone.utc)
+        tiers = self.tiers.tiers
+        # Coldest tier first, so a file idle long enough for it skips the tiers in between
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="storage-lifecycle") as pool:
+            for target in tiers[:0:-1]:
+                cutoff = (now - timedelta(days=target.after_days)).isoformat()
+                for source in tiers[:tiers.index(target)]:
+                    self._demote_tier(pool, source, target, cutoff, counts, limit, dry_run)
+        logger.info(f"Storage lifecycle pass: {counts}")
+        return counts
+
+    def _demote_tier(self, pool, source: TierPolicy, target: TierPolicy, cutoff: str,
+                     counts: Dict[str, int], limit: Optional[int], dry_run: bool):
+        def demote(row: Dict) -> str:
+            try:
+                return "moved" if self.move(row, target) else "skipped"
+            except Exception as e:
+                logger.warning(f"Moving {row['id']} to {target.name} failed: {e}")
+                self.stats["failed"] += 1
+                return "failed"
+
+        while limit is None or counts["candidates"] < limit:
+            size = self.batch_size if limit is None else min(self.batch_size, limit - counts["candidates"])
+            if dry_run:
+                # Nothing moves, so paging would return the same rows again; count in one call
+                size = 10000 if limit is None else limit - counts["candidates"]
+            page = self.supabase.rpc("storage_lifecycle_candidates", {
+                "p_tier": source.name, "p_cutoff": cutoff, "p_limit": size,
+            }).execute().data or []
+            if not page:
+                return
+            counts["candidates"] += len(page)
+            if dry_run:
+                return
+            outcomes = list(pool.map(demote, page))
+            for outcome in outcomes:
+                counts[outcome] += 1
+            self.stats["demoted"] += outcomes.count("moved")
+            # Failed rows would come back first on the next page; leave them for the next pass
+            if "moved" not in outcomes:
+                return
+
+    def readable_bucket(self, row: Dict) -> str:
+        """
+        Bucket to serve a file from, restoring it first if its tier can't be read in place
+        Files in other cold tiers are served where they are and promoted in the background.
+        """
+        tier = self.tiers.get(row.get("storage_tier"))
+        if tier.name == self.tiers.hot.name:
+            return tier.bucket
+        if tier.restore:
+            if self.move(row, self.tiers.hot):
+                self.stats["promoted"] += 1
+            return self.tiers.hot.bucket
+        self.promote_later(row)
+        return tier.bucket
+
+    def promote_later(self, row: Dict):
+        """Queue a move back to the hot tier; repeated reads of one file queue it once"""
+        with self._promoting_lock:
+            if row["id"] in self._promoting:
+                return
+            self._promoting.add(row["id"])
+        self._promoter.submit(self._promote, dict(row))
+
+    def _promote(self, row: Dict):
+        try:
+            if self.move(row, self.tiers.hot):
+                self.stats["promoted"] += 1
+        except Exception as e:
+            self.stats["failed"] += 1
+            logger.warning(f"Promoting {row['id']} to {self.tiers.hot.name} failed: {e}")
+        finally:
+            with self._promoting_lock:
+                self._promoting.discard(row["id"])
+
+    def start(self):
+        """Run lifecycle passes every `interval` seconds in the background, if configured"""
+        if self.interval <= 0 or len(self.tiers.tiers) < 2 or (self._thread and self._thread.is_alive()):
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="storage-lifecycle", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Storage lifecycle pass failed: {e}")
+
+    def stop(self, timeout: float = 5.0):
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+        self._promoter.shutdown(wait=False, cancel_futures=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move idle FileInASnap files to colder storage tiers")
+    parser.add_argument("command", choices=("run",))
+    parser.add_argument("--limit", type=int, default=None, help="Stop after this many candidate files")
+    parser.add_argument("--dry-run", action="store_true", help="Count candidates without moving them")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    lifecycle = StorageLifecycle.from_env()
+    try:
+        print(lifecycle.run_once(limit=args.limit, dry_run=args.dry_run))
+    finally:
+        lifecycle.stop()
+
+
+if __name__ == "__main__":
+    main()
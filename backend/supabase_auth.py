@@ -3,22 +3,25 @@ Supabase Authentication Module for FileInASnap
 Handles JWT validation and user authentication using Supabase Auth
 """
 
-from fastapi import Depends, HTTPException, status
-from fastapi.security import HTTPBearer
+from fastapi import Depends, HTTPException, Query, status
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from functools import lru_cache
 from typing import Dict, Optional
 import jwt
 import os
 from dotenv import load_dotenv
 import logging
-from supabase import Client, create_client
+from clients import get_supabase, get_supabase_anon, has_service_key
+from tracing import LOG_FORMAT, current_span, traced
 
 load_dotenv()
 
 # Configure logging
-logging.basicConfig(level=logging.INFO)
+logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
 logger = logging.getLogger(__name__)
 
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
 
 class SupabaseAuthConfig:
     def __init__(self):
@@ -29,21 +32,37 @@ class SupabaseAuthConfig:
         
         if not all([self.supabase_url, self.supabase_anon_key]):
             raise ValueError("Missing required Supabase configuration")
-        
-        # Create Supabase clients
-        self.supabase_client = create_client(self.supabase_url, self.supabase_anon_key)
-        if self.supabase_service_key:
-            self.supabase_admin = create_client(self.supabase_url, self.supabase_service_key)
-        else:
-            self.supabase_admin = None
+    
+    # Clients are shared with the rest of the process instead of created per module
+    @property
+    def supabase_client(self):
+        return get_supabase_anon()
+    
+    @property
+    def supabase_admin(self):
+        return get_supabase() if has_service_key() else None
 
-supabase_auth_config = SupabaseAuthConfig()
+@lru_cache(maxsize=1)
+def get_auth_config() -> SupabaseAuthConfig:
+    """Validate auth configuration on first use rather than at import"""
+    return SupabaseAuthConfig()
+
+def __getattr__(name: str):
+    # Keep `from supabase_auth import supabase_auth_config` working without import-time side effects
+    if name == "supabase_auth_config":
+        return get_auth_config()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 class SupabaseTokenValidator:
-    def __init__(self):
-        self.supabase = supabase_auth_config.supabase_client
-        self.admin_client = supabase_auth_config.supabase_admin
+    @property
+    def supabase(self):
+        return get_auth_config().supabase_client
+    
+    @property
+    def admin_client(self):
+        return get_auth_config().supabase_admin
 
+    @traced()
     async def validate_token(self, token: str) -> Dict:
         """Validate JWT token from Supabase Auth"""
         try:
@@ -60,6 +79,7 @@ class SupabaseTokenValidator:
             
             # Return standardized user info
             return {
+                "sub": user.id,
                 "user_id": user.id,
                 "email": user.email,
                 "email_verified": user.email_confirmed_at is not None,
@@ -79,6 +99,7 @@ class SupabaseTokenValidator:
                 detail="Could not validate token"
             )
 
+    @traced()
     async def get_user_by_id(self, user_id: str) -> Optional[Dict]:
         """Get user details by ID using admin client"""
         try:
@@ -91,6 +112,7 @@ class SupabaseTokenValidator:
             if user_response.user:
                 user = user_response.user
                 return {
+                    "sub": user.id,
                     "user_id": user.id,
                     "email": user.email,
                     "email_verified": user.email_confirmed_at is not None,
@@ -124,6 +146,11 @@ async def get_current_user(credentials: HTTPBearer = Depends(security)) -> Dict:
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid user ID in token"
             )
+        
+        # Tag the request's span so its trace can be found by user
+        span = current_span()
+        if span:
+            span.set_attribute("enduser.id", user_info["user_id"])
             
         return user_info
         
@@ -146,6 +173,22 @@ async def get_optional_user(credentials: HTTPBearer = Depends(security)) -> Opti
     except HTTPException:
         return None
 
+async def get_stream_user(
+    access_token: Optional[str] = Query(None),
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)
+) -> Dict:
+    """
+    Current user for streaming endpoints
+    Browsers' EventSource cannot set headers, so the token may also be passed as ?access_token=
+    """
+    token = credentials.credentials if credentials else access_token
+    if not token:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authenticated"
+        )
+    return await get_current_user(HTTPAuthorizationCredentials(scheme="Bearer", credentials=token))
+
 def require_user_role(required_role: str):
     """
     Decorator factory for requiring specific user roles
@@ -164,6 +207,26 @@ def require_user_role(required_role: str):
     
     return role_checker
 
+def require_permission(required_permission: str):
+    """
+    Decorator factory for requiring specific permissions
+    Permissions are read from the user's app_metadata; admins pass every check
+    Usage: @require_permission("read:analytics")
+    """
+    async def permission_checker(current_user: Dict = Depends(get_current_user)):
+        app_metadata = current_user.get("app_metadata") or {}
+        permissions = app_metadata.get("permissions", [])
+
+        if required_permission not in permissions and app_metadata.get("role") != "admin":
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail=f"Insufficient permissions. Required: {required_permission}"
+            )
+
+        return current_user
+
+    return permission_checker
+
 def require_subscription_tier(required_tier: str):
     """
     Decorator factory for requiring specific subscription tiers
@@ -180,7 +243,9 @@ def require_subscription_tier(required_tier: str):
 __all__ = [
     "get_current_user",
     "get_optional_user", 
+    "get_stream_user",
     "require_user_role",
+    "require_permission",
     "require_subscription_tier",
     "token_validator",
     "supabase_auth_config"
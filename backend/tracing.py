@@ -0,0 +1,455 @@
+"""
+Request tracing for FileInASnap
+Each API request gets a root span, and every Supabase call made while
+serving it (PostgREST, Storage and Auth) gets a child span from the
+instrumented httpx clients, so the time an upload spends on its profile
+lookup, count, storage write and metadata insert is visible per request.
+Trace context follows the W3C traceparent format: incoming traceparent
+headers are continued, outgoing Supabase requests carry one, and every
+log line written while serving a request includes its trace and span ids.
+
+Sampling is decided once per trace: a sampled caller (traceparent flag 01)
+is always followed, other traces are kept with probability
+TRACE_SAMPLE_RATIO. Sampled spans are exported in batches from a
+background thread as OTLP/JSON, either appended to a local file (one
+ExportTraceServiceRequest per line, readable offline and by the
+OpenTelemetry collector's otlpjsonfile receiver) or posted to an OTLP/HTTP
+endpoint such as a local collector or Jaeger.
+"""
+
+import functools
+import inspect
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional
+
+import httpx
+
+import call_budget
+
+logger = logging.getLogger(__name__)
+
+# Includes the current request's trace and span ids (see _record_factory)
+LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - [trace=%(trace_id)s span=%(span_id)s] - %(message)s"
+
+# OTLP span kinds
+INTERNAL, SERVER, CLIENT = 1, 2, 3
+
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+_INVALID_TRACE_ID = "0" * 32
+
+_current: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+# PostgREST verbs by HTTP method, for span names like "select profiles"
+_REST_OPERATIONS = {"GET": "select", "HEAD": "count", "POST": "insert", "PATCH": "update", "PUT": "upsert",
+                    "DELETE": "delete"}
+
+
+def _attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        typed = {"boolValue": value}
+    elif isinstance(value, int):
+        typed = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    else:
+        typed = {"stringValue": str(value)}
+    return {"key": key, "value": typed}
+
+
+class Span:
+    """One timed operation within a trace"""
+
+    __slots__ = ("tracer", "name", "kind", "trace_id", "span_id", "parent_id", "sampled", "attributes",
+                 "start_ns", "end_ns", "error")
+
+    def __init__(self, tracer: "Tracer", name: str, kind: int, trace_id: str, parent_id: Optional[str],
+                 sampled: bool, attributes: Optional[Dict[str, Any]] = None):
+        self.tracer = tracer
+        self.name = name
+        self.kind = kind
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64) or 1:016x}"
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.attributes = dict(attributes or {})
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.error: Optional[str] = None
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def set_attribute(self, key: str, value: Any):
+        if value is not None:
+            self.attributes[key] = value
+
+    def set_error(self, message: str):
+        self.error = message
+
+    def end(self):
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+            if self.sampled:
+                self.tracer.record(self)
+
+    def to_otlp(self) -> Dict[str, Any]:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [_attribute(key, value) for key, value in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def parse_traceparent(header: Optional[str]):
+    """(trace_id, parent span id, sampled) from a W3C traceparent header, or None if absent or invalid"""
+    match = _TRACEPARENT.match((header or "").strip().lower())
+    if not match or match.group(1) == _INVALID_TRACE_ID or match.group(2) == "0" * 16:
+        return None
+    return match.group(1), match.group(2), bool(int(match.group(3), 16) & 1)
+
+
+class FileExporter:
+    """Appends OTLP/JSON export requests to a local file, one per line"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def export(self, payload: Dict[str, Any]):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(payload, separators=(",", ":")) + "\n")
+
+    def close(self):
+        pass
+
+
+class OTLPExporter:
+    """Posts OTLP/JSON export requests to an OTLP/HTTP traces endpoint"""
+
+    def __init__(self, endpoint: str, headers: Optional[Dict[str, str]] = None, timeout: float = 5.0):
+        self.url = endpoint.rstrip("/") + "/v1/traces"
+        self._client = httpx.Client(timeout=timeout, headers=headers)
+
+    def export(self, payload: Dict[str, Any]):
+        self._client.post(self.url, json=payload).raise_for_status()
+
+    def close(self):
+        self._client.close()
+
+
+class Tracer:
+    """
+    Creates spans and exports the sampled ones in the background
+
+    Finished spans are queued and written every `flush_interval` seconds
+    or when `batch_size` are waiting. At most `max_queue` spans are held;
+    beyond that new spans are dropped, so an unreachable exporter never
+    grows memory or slows requests.
+    """
+
+    def __init__(
+        self,
+        service_name: str = "fileinasnap",
+        exporter=None,
+        sample_ratio: float = 0.1,
+        enabled: bool = True,
+        batch_size: int = 512,
+        flush_interval: float = 5.0,
+        max_queue: int = 10000,
+    ):
+        self.service_name = service_name
+        self.exporter = exporter
+        self.sample_ratio = sample_ratio
+        self.enabled = enabled
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+
+        self._queue: Deque[Span] = deque()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self.stats = {"exported": 0, "dropped": 0, "failed_batches": 0}
+
+    @classmethod
+    def from_env(cls) -> "Tracer":
+        """Build a tracer configured from TRACE_* and standard OTEL_* environment variables"""
+        kind = os.getenv("TRACE_EXPORTER", "none").lower()
+        if kind == "file":
+            exporter = FileExporter(os.getenv("TRACE_FILE", "traces.jsonl"))
+        elif kind == "otlp":
+            headers = dict(
+                pair.split("=", 1) for pair in os.getenv("OTEL_EXPORTER_OTLP_HEADERS", "").split(",") if "=" in pair
+            )
+            exporter = OTLPExporter(os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT", "http://localhost:4318"), headers)
+        else:
+            exporter = None
+        return cls(
+            service_name=os.getenv("OTEL_SERVICE_NAME", "fileinasnap"),
+            exporter=exporter,
+            sample_ratio=float(os.getenv("TRACE_SAMPLE_RATIO", 0.1)),
+            enabled=os.getenv("TRACING", "on").lower() != "off",
+            batch_size=int(os.getenv("TRACE_BATCH_SIZE", 512)),
+            flush_interval=float(os.getenv("TRACE_FLUSH_INTERVAL", 5.0)),
+            max_queue=int(os.getenv("TRACE_MAX_QUEUE", 10000)),
+        )
+
+    def _sample(self, trace_id: str) -> bool:
+        # Decided from the trace id like OpenTelemetry's TraceIdRatioBased sampler, so every
+        # process seeing the trace agrees
+        return self.exporter is not None and int(trace_id[16:], 16) < self.sample_ratio * 2 ** 64
+
+    def start_span(self, name: str, kind: int = INTERNAL, attributes: Optional[Dict[str, Any]] = None,
+                   traceparent: Optional[str] = None) -> Span:
+        """A child of the current span, of the caller in `traceparent`, or a new trace's root"""
+        parent = _current.get()
+        if parent is not None:
+            return Span(self, name, kind, parent.trace_id, parent.span_id, parent.sampled, attributes)
+        remote = parse_traceparent(traceparent)
+        if remote is not None:
+            trace_id, parent_id, sampled = remote
+            return Span(self, name, kind, trace_id, parent_id, sampled and self.exporter is not None, attributes)
+        trace_id = f"{random.getrandbits(128) or 1:032x}"
+        return Span(self, name, kind, trace_id, None, self._sample(trace_id), attributes)
+
+    @contextmanager
+    def span(self, name: str, kind: int = INTERNAL, attributes: Optional[Dict[str, Any]] = None,
+             traceparent: Optional[str] = None) -> Iterator[Optional[Span]]:
+        """Run a block as the current span; yields None when tracing is disabled"""
+        if not self.enabled:
+            yield None
+            return
+        span = self.start_span(name, kind, attributes, traceparent)
+        token = _current.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.set_error(f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            _current.reset(token)
+            span.end()
+
+    def record(self, span: Span):
+        with self._cond:
+            if len(self._queue) >= self.max_queue:
+                self.stats["dropped"] += 1
+                return
+            self._queue.append(span)
+            if len(self._queue) >= self.batch_size:
+                self._cond.notify_all()
+
+    def start(self):
+        """Start the background export thread"""
+        if self.exporter is None or (self._thread and self._thread.is_alive()):
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """Stop the export thread, exporting whatever is still queued"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush()
+
+    def flush(self):
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                return
+            self._export(batch)
+
+    def _take_batch(self) -> List[Span]:
+        with self._cond:
+            count = min(self.batch_size, len(self._queue))
+            return [self._queue.popleft() for _ in range(count)]
+
+    def _run(self):
+        while True:
+            with self._cond:
+                deadline = time.monotonic() + self.flush_interval
+                while not self._stopping and len(self._queue) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if self._stopping:
+                    return
+            batch = self._take_batch()
+            if batch:
+                self._export(batch)
+
+    def _export(self, batch: List[Span]):
+        if self.exporter is None:
+            return
+        payload = {"resourceSpans": [{
+            "resource": {"attributes": [_attribute("service.name", self.service_name)]},
+            "scopeSpans": [{"scope": {"name": "fileinasnap.tracing"}, "spans": [span.to_otlp() for span in batch]}],
+        }]}
+        try:
+            self.exporter.export(payload)
+            self.stats["exported"] += len(batch)
+        except Exception as e:
+            self.stats["failed_batches"] += 1
+            self.stats["dropped"] += len(batch)
+            logger.warning(f"Dropping {len(batch)} spans: {e}")
+
+
+tracer = Tracer.from_env()
+
+
+def traced(name: Optional[str] = None):
+    """Decorator running a function or coroutine function in its own span"""
+    def decorate(func: Callable) -> Callable:
+        span_name = name or func.__qualname__
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def run_async(*args, **kwargs):
+                with tracer.span(span_name):
+                    return await func(*args, **kwargs)
+            return run_async
+
+        @functools.wraps(func)
+        def run(*args, **kwargs):
+            with tracer.span(span_name):
+                return func(*args, **kwargs)
+        return run
+    return decorate
+
+
+_base_record_factory = logging.getLogRecordFactory()
+
+
+def _record_factory(*args, **kwargs) -> logging.LogRecord:
+    record = _base_record_factory(*args, **kwargs)
+    span = _current.get()
+    record.trace_id = span.trace_id if span else "-"
+    record.span_id = span.span_id if span else "-"
+    return record
+
+
+logging.setLogRecordFactory(_record_factory)
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware giving each HTTP request a root server span
+
+    Continues the caller's traceparent if it sent one and returns the trace
+    id in X-Trace-Id so a slow or failed response can be looked up.
+    """
+
+    def __init__(self, app, tracer: Tracer = tracer):
+        self.app = app
+        self.tracer = tracer
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.tracer.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in scope.get("headers", [])}
+        attributes = {"http.request.method": scope["method"], "url.path": scope["path"]}
+        with self.tracer.span(scope["method"], SERVER, attributes, headers.get("traceparent")) as span:
+            async def send_traced(message):
+                if message["type"] == "http.response.start":
+                    span.set_attribute("http.response.status_code", message["status"])
+                    if message["status"] >= 500:
+                        span.set_error(f"HTTP {message['status']}")
+                    message.setdefault("headers", [])
+                    message["headers"] = list(message["headers"]) + [(b"x-trace-id", span.trace_id.encode())]
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_traced)
+            finally:
+                # The router records the matched route in the scope; name the span after its template
+                route = getattr(scope.get("route"), "path", None)
+                if route:
+                    span.name = f"{scope['method']} {route}"
+                    span.set_attribute("http.route", route)
+
+
+class TracingTransport(httpx.BaseTransport):
+    """Wraps an httpx transport so each Supabase request is a client span carrying traceparent, and is counted"""
+
+    def __init__(self, transport: httpx.BaseTransport, service: str, tracer: Tracer = tracer):
+        self.transport = transport
+        self.service = service
+        self.tracer = tracer
+
+    def _describe(self, request: httpx.Request):
+        """Span name and attributes; names omit ids and keys so they group well"""
+        segments = [segment for segment in request.url.path.split("/") if segment][2:]
+        attributes = {
+            "http.request.method": request.method,
+            "url.path": request.url.path,
+            "server.address": request.url.host,
+            "peer.service": f"supabase-{self.service}",
+        }
+        if self.service == "rest" and segments:
+            if segments[0] == "rpc" and len(segments) > 1:
+                attributes["db.operation"] = f"rpc {segments[1]}"
+            else:
+                attributes["db.operation"] = _REST_OPERATIONS.get(request.method, request.method.lower())
+                attributes["db.sql.table"] = segments[0]
+            return f"{attributes['db.operation']} {attributes.get('db.sql.table', '')}".strip(), attributes
+        return f"{self.service} {request.method} {segments[0] if segments else ''}".strip(), attributes
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        name, attributes = self._describe(request)
+        started = time.perf_counter()
+        try:
+            if not self.tracer.enabled:
+                return self.transport.handle_request(request)
+            with self.tracer.span(name, CLIENT, attributes) as span:
+                request.headers["traceparent"] = span.traceparent
+                response = self.transport.handle_request(request)
+                span.set_attribute("http.response.status_code", response.status_code)
+                if response.status_code >= 500:
+                    span.set_error(f"HTTP {response.status_code}")
+                return response
+        finally:
+            # Counted whether or not tracing is on (see call_budget.py)
+            call_budget.record(self.service, name, time.perf_counter() - started)
+
+    def close(self):
+        self.transport.close()
+
+
+def instrument(session: httpx.Client, service: str):
+    """Trace an httpx client's requests, including any proxy mounts, as `service` calls"""
+    if not isinstance(session._transport, TracingTransport):
+        session._transport = TracingTransport(session._transport, service)
+    session._mounts = {
+        pattern: transport if transport is None or isinstance(transport, TracingTransport)
+        else TracingTransport(transport, service)
+        for pattern, transport in session._mounts.items()
+    }
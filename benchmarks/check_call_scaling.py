@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Upstream call scaling check for FileInASnap
+Seeds a small and a large library against the in-process Supabase
+stand-in, requests every read endpoint of backend/main.py and
+backend/server.py as both owners and compares the upstream calls each
+response reports in its Server-Timing header (see backend/call_budget.py).
+A call count that grows with the library is an N+1 pattern.
+tests/test_call_scaling.py asserts the counts are equal; this script
+prints the same comparison and exits non-zero on growth.
+
+Usage:
+    python benchmarks/check_call_scaling.py
+    python benchmarks/check_call_scaling.py --small 2 --large 50
+"""
+
+import argparse
+import os
+import random
+import re
+import sys
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, NamedTuple, Tuple
+
+import httpx
+
+from fake_supabase import FakeSupabase
+from run_benchmarks import AppServer, boot_backends
+
+# Read endpoints per app; {folder} is the owner's top-level folder
+MAIN_ENDPOINTS = [
+    "/folders",
+    "/folders?parent_id=root",
+    "/folders?parent_id={folder}",
+    "/folders/{folder}/tree",
+    "/files",
+    "/files?folder_id={folder}",
+    "/stats",
+    "/bootstrap",
+]
+SERVER_ENDPOINTS = [
+    "/api/auth/profile",
+    "/api/files",
+    "/api/files/timeline",
+    "/api/files/places?south=-90&north=90&west=-180&east=180",
+    "/api/files/duplicates",
+    "/api/analytics/usage",
+]
+
+ENDPOINTS = [("main", endpoint) for endpoint in MAIN_ENDPOINTS] + \
+            [("server", endpoint) for endpoint in SERVER_ENDPOINTS]
+
+_CALLS = re.compile(r'desc="(\d+) calls?"')
+
+
+def upstream_calls(response: httpx.Response) -> int:
+    """Total upstream calls reported in a response's Server-Timing header"""
+    return sum(int(count) for count in _CALLS.findall(response.headers.get("server-timing", "")))
+
+
+def seed_library(fake: FakeSupabase, name: str, size: int) -> Dict[str, str]:
+    """An owner with one top-level folder holding `size` subfolders of files, and `size` * 3 API files"""
+    db, auth = fake.db, fake.auth
+    user = auth.ensure_user(f"scaling-{name}@example.com")
+    owner = user["id"]
+    db.insert("profiles", [{"id": owner, "email": user["email"], "full_name": name, "tier": "enterprise"}])
+
+    library = db.insert("folders", [{"name": "Library", "owner_id": owner}])[0]
+    folders = db.insert("folders", [
+        {"name": f"Folder {i:04d}", "owner_id": owner, "parent_id": library["id"]} for i in range(size)
+    ])
+    db.insert("files", [
+        {
+            "folder_id": folder["id"],
+            "owner_id": owner,
+            "object_key": f"{owner}/{uuid.uuid4()}.jpg",
+            "filename": f"photo-{j}.jpg",
+            "original_filename": f"photo-{j}.jpg",
+            "bytes": 1024,
+            "mime": "image/jpeg",
+        }
+        for folder in [library] + folders for j in range(3)
+    ])
+
+    taken = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    db.insert("user_files", [
+        {
+            "id": str(uuid.uuid4()), "user_id": owner, "name": f"{i}.jpg", "original_name": f"{i}.jpg",
+            "mime_type": "image/jpeg", "size": 1024, "storage_path": f"{owner}/{i}.jpg",
+            "metadata": {
+                "captured_at": (taken + timedelta(hours=i)).isoformat(),
+                "gps_lat": random.uniform(-60, 60), "gps_lon": random.uniform(-170, 170),
+                "phash": f"{random.getrandbits(64):016x}",
+            },
+        }
+        for i in range(size * 3)
+    ])
+    return {"folder": library["id"], "token": auth.mint_token(user, ttl_seconds=3600)}
+
+
+def measure(base_url: str, endpoints: List[str], owner: Dict[str, str]) -> Dict[str, httpx.Response]:
+    headers = {"Authorization": f"Bearer {owner['token']}"}
+    with httpx.Client(base_url=base_url, headers=headers, timeout=60.0) as client:
+        return {endpoint: client.get(endpoint.format(folder=owner["folder"])) for endpoint in endpoints}
+
+
+class Scaling(NamedTuple):
+    """Status codes and upstream calls of one endpoint for the small and large library"""
+    status_small: int
+    status_large: int
+    calls_small: int
+    calls_large: int
+
+
+def measure_scaling(small_size: int, large_size: int) -> Dict[Tuple[str, str], Scaling]:
+    """Boot both apps against a fresh stand-in and measure every endpoint in ENDPOINTS"""
+    # Counts come from Server-Timing, which enforce mode would replace with 500s
+    os.environ["CALL_BUDGET_MODE"] = "log"
+    os.environ.setdefault("METADATA_EXTRACTION", "off")
+
+    results = {}
+    with FakeSupabase() as fake:
+        main_app, server_app = boot_backends(fake)
+        small = seed_library(fake, "small", small_size)
+        large = seed_library(fake, "large", large_size)
+        main_server = AppServer(main_app, "main").start()
+        api_server = AppServer(server_app, "server").start()
+        try:
+            for label, url, endpoints in (("main", main_server.url, MAIN_ENDPOINTS),
+                                          ("server", api_server.url, SERVER_ENDPOINTS)):
+                small_responses = measure(url, endpoints, small)
+                large_responses = measure(url, endpoints, large)
+                for endpoint in endpoints:
+                    before, after = small_responses[endpoint], large_responses[endpoint]
+                    results[(label, endpoint)] = Scaling(before.status_code, after.status_code,
+                                                         upstream_calls(before), upstream_calls(after))
+        finally:
+            main_server.stop()
+            api_server.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fail if any endpoint's upstream calls grow with the data")
+    parser.add_argument("--small", type=int, default=2, help="folders (and files x3) in the small library")
+    parser.add_argument("--large", type=int, default=40, help="folders (and files x3) in the large library")
+    args = parser.parse_args()
+
+    failures = []
+    for (label, endpoint), result in measure_scaling(args.small, args.large).items():
+        if result.status_small != 200 or result.status_large != 200:
+            verdict = f"❌ HTTP {result.status_small}/{result.status_large}"
+            failures.append(f"{label} {endpoint}: HTTP {result.status_small}/{result.status_large}")
+        elif result.calls_large > result.calls_small:
+            verdict = "❌ grows with data"
+            failures.append(f"{label} {endpoint}: {result.calls_small} -> {result.calls_large} upstream calls")
+        else:
+            verdict = "✅"
+        print(f"{label:<7} {endpoint:<60} {result.calls_small:>4} {result.calls_large:>4}  {verdict}")
+
+    if failures:
+        print(f"\n❌ Upstream calls grow from {args.small} to {args.large} folders:")
+        for message in failures:
+            print(f"   {message}")
+        sys.exit(1)
+    print("\n✅ Upstream calls are independent of library size")
+
+
+if __name__ == "__main__":
+    main()
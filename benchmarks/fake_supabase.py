@@ -0,0 +1,865 @@
+"""
+In-process Supabase stand-in for FileInASnap benchmarks
+Serves the subset of PostgREST, Storage and Auth used by the backend over
+real HTTP on localhost, with configurable injected latency per service.
+"""
+
+import email.parser
+import email.policy
+import itertools
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+import jwt
+
+DEFAULT_JWT_SECRET = "fake-supabase-jwt-secret-with-at-least-32-characters"
+
+# Columns filled in on insert when the caller leaves them out
+TABLE_DEFAULTS: Dict[str, Dict[str, Callable[[], Any]]] = {
+    "folders": {"created_at": lambda: _now(), "parent_id": lambda: None, "file_count": lambda: 0,
+                "total_bytes": lambda: 0, "subtree_file_count": lambda: 0, "subtree_bytes": lambda: 0},
+    "files": {"created_at": lambda: _now(), "status": lambda: "uploaded"},
+    "profiles": {"created_at": lambda: _now(), "tier": lambda: "standard"},
+    "user_files": {"upload_date": lambda: _now(), "status": lambda: "uploaded", "metadata": lambda: {},
+                   "storage_tier": lambda: "hot"},
+    "activity_logs": {"created_at": lambda: _now(), "details": lambda: {}},
+}
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class FakeDatabaseError(Exception):
+    """Raised by fake rpcs and triggers; answered like a PostgREST error with a SQLSTATE"""
+
+    def __init__(self, code: str, message: str):
+        super().__init__(message)
+        self.code = code
+
+
+class LatencyProfile:
+    """Injected latency (milliseconds) per upstream service"""
+
+    def __init__(self, rest_ms: float = 0.0, storage_ms: float = 0.0, auth_ms: float = 0.0, jitter_ms: float = 0.0):
+        self.rest_ms = rest_ms
+        self.storage_ms = storage_ms
+        self.auth_ms = auth_ms
+        self.jitter_ms = jitter_ms
+
+    def delay(self, service: str) -> None:
+        base = getattr(self, f"{service}_ms", 0.0)
+        if self.jitter_ms:
+            base += random.uniform(0, self.jitter_ms)
+        if base > 0:
+            time.sleep(base / 1000.0)
+
+    def to_dict(self) -> Dict[str, float]:
+        return {
+            "rest_ms": self.rest_ms,
+            "storage_ms": self.storage_ms,
+            "auth_ms": self.auth_ms,
+            "jitter_ms": self.jitter_ms,
+        }
+
+
+class FakeDatabase:
+    """Thread-safe in-memory tables with just enough PostgREST semantics"""
+
+    def __init__(self):
+        self.tables: Dict[str, List[Dict]] = {}
+        self.rpcs: Dict[str, Callable[[Dict], Any]] = {
+            "health_check": lambda params: True,
+            "record_share_access": self._record_share_access,
+            "record_file_access": self._record_file_access,
+            "storage_lifecycle_candidates": self._storage_lifecycle_candidates,
+            "move_folder": self._move_folder,
+            "delete_folder_tree": self._delete_folder_tree,
+            "move_files": self._move_files,
+            "rename_files": self._rename_files,
+            "claim_idempotency_key": self._claim_idempotency_key,
+            "user_file_stats": self._user_file_stats,
+        }
+        self.lock = threading.RLock()
+        # Stand-ins for AFTER statement triggers in supabase/migrations, called with (operation, rows)
+        self.triggers: Dict[str, List[Callable[[str, List[Dict]], None]]] = {
+            "folders": [self._bump_change_versions],
+            "files": [self._bump_change_versions, self._folder_stats],
+        }
+        # Stand-ins for BEFORE row triggers, called with each new row
+        self.before_insert: Dict[str, List[Callable[[Dict], None]]] = {
+            "folders": [self._set_folder_path],
+        }
+        self._change_version = itertools.count(1)
+
+    def table(self, name: str) -> List[Dict]:
+        return self.tables.setdefault(name, [])
+
+    def insert(self, name: str, rows: List[Dict], upsert_on: Optional[List[str]] = None) -> List[Dict]:
+        inserted = []
+        with self.lock:
+            table = self.table(name)
+            for row in rows:
+                row = dict(row)
+                row.setdefault("id", str(uuid.uuid4()))
+                for column, default in TABLE_DEFAULTS.get(name, {}).items():
+                    row.setdefault(column, default())
+                for trigger in self.before_insert.get(name, []):
+                    trigger(row)
+                if upsert_on:
+                    existing = next(
+                        (r for r in table if all(str(r.get(c)) == str(row.get(c)) for c in upsert_on)),
+                        None,
+                    )
+                    if existing is not None:
+                        existing.update(row)
+                        inserted.append(dict(existing))
+                        continue
+                table.append(row)
+                inserted.append(dict(row))
+            self._fire(name, "INSERT", inserted)
+        return inserted
+
+    def select(self, name: str, filters: List[Tuple[str, str, str]]) -> List[Dict]:
+        with self.lock:
+            return [dict(r) for r in self.table(name) if _matches(r, filters)]
+
+    def update(self, name: str, filters: List[Tuple[str, str, str]], values: Dict) -> List[Dict]:
+        updated = []
+        with self.lock:
+            for row in self.table(name):
+                if _matches(row, filters):
+                    row.update(values)
+                    updated.append(dict(row))
+            self._fire(name, "UPDATE", updated)
+        return updated
+
+    def delete(self, name: str, filters: List[Tuple[str, str, str]]) -> List[Dict]:
+        with self.lock:
+            table = self.table(name)
+            removed = [r for r in table if _matches(r, filters)]
+            self.tables[name] = [r for r in table if not _matches(r, filters)]
+            self._fire(name, "DELETE", removed)
+        return removed
+
+    def _fire(self, name: str, operation: str, rows: List[Dict]) -> None:
+        if rows:
+            for trigger in self.triggers.get(name, []):
+                trigger(operation, rows)
+
+    def _record_share_access(self, params: Dict) -> None:
+        with self.lock:
+            shares = {s["id"]: s for s in self.table("file_shares")}
+            for hit in params.get("hits", []):
+                share = shares.get(hit["id"])
+                if share is not None:
+                    share["accessed_count"] = (share.get("accessed_count") or 0) + hit["count"]
+                    share["last_accessed"] = max(share.get("last_accessed") or "", hit["last_accessed"])
+
+    def _record_file_access(self, params: Dict) -> None:
+        with self.lock:
+            files = {f["id"]: f for f in self.table("user_files")}
+            for hit in params.get("hits", []):
+                row = files.get(hit["id"])
+                if row is not None:
+                    row["last_accessed"] = max(row.get("last_accessed") or "", hit["last_accessed"])
+
+    def _storage_lifecycle_candidates(self, params: Dict) -> List[Dict]:
+        def stamp(value: str) -> datetime:
+            parsed = datetime.fromisoformat(value)
+            return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+        cutoff = stamp(params["p_cutoff"])
+        with self.lock:
+            rows = [
+                (stamp(r.get("last_accessed") or r["upload_date"]), r) for r in self.table("user_files")
+                if r.get("storage_tier", "hot") == params["p_tier"]
+            ]
+        rows = sorted((item for item in rows if item[0] < cutoff), key=lambda item: (item[0], item[1]["id"]))
+        columns = ("id", "user_id", "storage_path", "mime_type", "size", "storage_tier")
+        return [{c: r.get(c) for c in columns} for _, r in rows[:params["p_limit"]]]
+
+    def _set_folder_path(self, row: Dict) -> None:
+        """Mirror of set_folder_path()"""
+        if not row.get("parent_id"):
+            row.update(path=f"/{row['id']}/", depth=0)
+            return
+        parent = next((f for f in self.table("folders") if f["id"] == row["parent_id"]), None)
+        if parent is None or parent.get("owner_id") != row.get("owner_id"):
+            raise FakeDatabaseError("23503", f"parent folder {row['parent_id']} not found")
+        row.update(path=f"{parent['path']}{row['id']}/", depth=parent["depth"] + 1)
+
+    def _apply_folder_stat_changes(self, changes: List[Tuple[str, int, int]]) -> None:
+        """Mirror of apply_folder_stat_changes(): (folder_id, files, bytes) deltas"""
+        folders = {f["id"]: f for f in self.table("folders")}
+        for folder_id, count, size in changes:
+            folder = folders.get(folder_id)
+            if folder is None:
+                continue
+            folder["file_count"] += count
+            folder["total_bytes"] += size
+            for ancestor_id in folder["path"].strip("/").split("/"):
+                ancestor = folders.get(ancestor_id)
+                if ancestor is not None:
+                    ancestor["subtree_file_count"] += count
+                    ancestor["subtree_bytes"] += size
+
+    def _folder_stats(self, operation: str, rows: List[Dict]) -> None:
+        """Mirror of the files_folder_stats_* triggers for inserts and deletes"""
+        if operation in ("INSERT", "DELETE"):
+            sign = 1 if operation == "INSERT" else -1
+            self._apply_folder_stat_changes([
+                (r["folder_id"], sign, sign * (r.get("bytes") or 0)) for r in rows if r.get("folder_id")
+            ])
+
+    def _move_folder(self, params: Dict) -> List[Dict]:
+        with self.lock:
+            folders = [f for f in self.table("folders") if f.get("owner_id") == params["p_owner_id"]]
+            moved = next((f for f in folders if f["id"] == params["p_folder_id"]), None)
+            if moved is None:
+                return []
+            new_path, new_depth = f"/{moved['id']}/", 0
+            if params.get("p_parent_id"):
+                parent = next((f for f in folders if f["id"] == params["p_parent_id"]), None)
+                if parent is None:
+                    raise FakeDatabaseError("23503", f"parent folder {params['p_parent_id']} not found")
+                if parent["path"].startswith(moved["path"]):
+                    raise FakeDatabaseError("23514", "cannot move a folder into itself or its descendants")
+                new_path, new_depth = f"{parent['path']}{moved['id']}/", parent["depth"] + 1
+            if new_path != moved["path"]:
+                old_ids = set(moved["path"].strip("/").split("/")[:-1])
+                new_ids = set(new_path.strip("/").split("/")[:-1])
+                for folder in folders:
+                    sign = (folder["id"] in new_ids) - (folder["id"] in old_ids)
+                    folder["subtree_file_count"] += sign * moved["subtree_file_count"]
+                    folder["subtree_bytes"] += sign * moved["subtree_bytes"]
+                old_path, old_depth = moved["path"], moved["depth"]
+                for folder in folders:
+                    if folder["path"].startswith(old_path):
+                        folder["path"] = new_path + folder["path"][len(old_path):]
+                        folder["depth"] += new_depth - old_depth
+                        folder["updated_at"] = _now()
+                moved["parent_id"] = params.get("p_parent_id")
+            return [dict(moved)]
+
+    def _delete_folder_tree(self, params: Dict) -> List[Dict]:
+        with self.lock:
+            root = next((f for f in self.table("folders")
+                         if f["id"] == params["p_folder_id"] and f.get("owner_id") == params["p_owner_id"]), None)
+            if root is None:
+                return []
+            subtree = {f["id"] for f in self.table("folders")
+                       if f.get("owner_id") == params["p_owner_id"] and f["path"].startswith(root["path"])}
+            files = self.delete("files", [("folder_id", "in", f"({','.join(subtree)})")])
+            self.delete("folders", [("id", "in", f"({','.join(subtree)})")])
+            return [{"object_key": f.get("object_key")} for f in files]
+
+    def _user_file_stats(self, params: Dict) -> List[Dict]:
+        with self.lock:
+            owner_id = params["p_owner_id"]
+            folders = [f for f in self.table("folders") if f.get("owner_id") == owner_id]
+            top_level = [f for f in folders if not f.get("parent_id")]
+            types: Dict[str, int] = {}
+            for row in self.table("files"):
+                if row.get("owner_id") == owner_id and row.get("mime"):
+                    file_type = row["mime"].split("/")[0]
+                    types[file_type] = types.get(file_type, 0) + 1
+            return [{
+                "folders": len(folders),
+                "files": sum(f["subtree_file_count"] for f in top_level),
+                "total_bytes": sum(f["subtree_bytes"] for f in top_level),
+                "type_breakdown": types,
+            }]
+
+    def _claim_idempotency_key(self, params: Dict) -> List[Dict]:
+        with self.lock:
+            now = datetime.now(timezone.utc)
+            fresh = {
+                "subject": params["p_subject"], "key": params["p_key"], "fingerprint": params["p_fingerprint"],
+                "status_code": None, "response": None, "created_at": now.isoformat(),
+                "locked_until": (now + timedelta(seconds=params["p_lock_seconds"])).isoformat(),
+                "expires_at": (now + timedelta(seconds=params["p_ttl_seconds"])).isoformat(),
+            }
+            table = self.table("idempotency_keys")
+            row = next((r for r in table if r["subject"] == fresh["subject"] and r["key"] == fresh["key"]), None)
+            if row is None:
+                table.append(fresh)
+                row, claimed = fresh, True
+            elif datetime.fromisoformat(row["expires_at"]) < now or (
+                    row["status_code"] is None and datetime.fromisoformat(row["locked_until"]) < now):
+                row.update(fresh)
+                claimed = True
+            else:
+                claimed = False
+            return [{"claimed": claimed, "stored_fingerprint": row["fingerprint"],
+                     "stored_status": row["status_code"], "stored_response": row["response"]}]
+
+    def _move_files(self, params: Dict) -> List[Dict]:
+        with self.lock:
+            owner_id, folder_id = params["p_owner_id"], params["p_folder_id"]
+            if not any(f["id"] == folder_id and f.get("owner_id") == owner_id for f in self.table("folders")):
+                raise FakeDatabaseError("23503", f"folder {folder_id} not found")
+            ids = set(params["p_file_ids"])
+            moved = [f for f in self.table("files")
+                     if f["id"] in ids and f.get("owner_id") == owner_id and f.get("folder_id") != folder_id]
+            changes = []
+            for row in moved:
+                if row.get("folder_id"):
+                    changes.append((row["folder_id"], -1, -(row.get("bytes") or 0)))
+                changes.append((folder_id, 1, row.get("bytes") or 0))
+                row.update(folder_id=folder_id, updated_at=_now())
+            self._apply_folder_stat_changes(changes)
+            self._fire("files", "UPDATE", [dict(r) for r in moved])
+            return [{"id": r["id"]} for r in moved]
+
+    def _rename_files(self, params: Dict) -> List[Dict]:
+        with self.lock:
+            names = {r["id"]: r["filename"] for r in params["p_renames"]}
+            renamed = [f for f in self.table("files") if f["id"] in names and f.get("owner_id") == params["p_owner_id"]]
+            for row in renamed:
+                row.update(filename=names[row["id"]], updated_at=_now())
+            self._fire("files", "UPDATE", [dict(r) for r in renamed])
+            return [{"id": r["id"], "filename": r["filename"]} for r in renamed]
+
+    def _bump_change_versions(self, operation: str, rows: List[Dict]) -> None:
+        """Mirror of bump_user_change_versions(): one new version per affected owner"""
+        table = self.table("user_change_versions")
+        for owner_id in {r.get("owner_id") for r in rows if r.get("owner_id")}:
+            version = next(self._change_version)
+            existing = next((r for r in table if r["owner_id"] == owner_id), None)
+            if existing is not None:
+                existing.update(version=version, updated_at=_now())
+            else:
+                table.append({"owner_id": owner_id, "version": version, "updated_at": _now()})
+
+
+def _column(row: Dict, path: str) -> Any:
+    """Resolve a column or a JSON path such as metadata->>phash"""
+    if "->" not in path:
+        return row.get(path)
+    parts = re.split(r"->>?", path)
+    value = row.get(parts[0])
+    for key in parts[1:]:
+        value = value.get(key) if isinstance(value, dict) else None
+    return value
+
+
+def _split_logic(expression: str) -> List[str]:
+    """Top-level comma-separated terms of an or=(...) / and(...) expression"""
+    terms, depth, quoted, current = [], 0, False, ""
+    for char in expression:
+        if char == '"':
+            quoted = not quoted
+        elif not quoted and char == "(":
+            depth += 1
+        elif not quoted and char == ")":
+            depth -= 1
+        if char == "," and depth == 0 and not quoted:
+            terms.append(current)
+            current = ""
+        else:
+            current += char
+    return terms + [current] if current else terms
+
+
+def _term_matches(row: Dict, term: str) -> bool:
+    if term.startswith(("and(", "or(")):
+        kind, _, inner = term.partition("(")
+        results = [_term_matches(row, t) for t in _split_logic(inner[:-1])]
+        return all(results) if kind == "and" else any(results)
+    column, op, value = re.match(r"^(.+?)\.(eq|neq|gt|gte|lt|lte|like|ilike|is|in)\.(.*)$", term).groups()
+    return _matches(row, [(column, op, value.strip('"'))])
+
+
+def _matches(row: Dict, filters: List[Tuple[str, str, str]]) -> bool:
+    for column, op, value in filters:
+        if column in ("or", "and"):
+            if not _term_matches(row, f"{column}{value}"):
+                return False
+            continue
+        if op == "not":
+            inner_op, _, inner_value = value.partition(".")
+            if _matches(row, [(column, inner_op, inner_value)]):
+                return False
+            continue
+        current = _column(row, column)
+        text = None if current is None else str(current).lower() if isinstance(current, bool) else str(current)
+        if isinstance(current, bool):
+            # Postgres reads booleans case-insensitively; postgrest-py sends True/False
+            value = value.lower()
+        if op == "eq" and text != value:
+            return False
+        if op == "neq" and text == value:
+            return False
+        if op == "in" and text not in [v.strip('"') for v in value.strip("()").split(",")]:
+            return False
+        if op == "is" and value == "null" and current is not None:
+            return False
+        if op in ("like", "ilike"):
+            pattern = "^" + re.escape(value).replace(r"\*", ".*").replace("%", ".*") + "$"
+            if text is None or not re.match(pattern, text, re.IGNORECASE if op == "ilike" else 0):
+                return False
+        if op in ("gt", "gte", "lt", "lte"):
+            if current is None:
+                return False
+            left, right = (current, float(value)) if isinstance(current, (int, float)) else (text, value)
+            if op == "gt" and not left > right:
+                return False
+            if op == "gte" and not left >= right:
+                return False
+            if op == "lt" and not left < right:
+                return False
+            if op == "lte" and not left <= right:
+                return False
+    return True
+
+
+def _sort_key(value: Any) -> Tuple[int, Any]:
+    if value is None:
+        return (1, "")
+    if isinstance(value, (int, float)):
+        return (0, value)
+    return (0, str(value))
+
+
+class FakeStorage:
+    """
+    In-memory buckets keyed by object path
+    With retain_content=False only object sizes are kept, so large upload
+    benchmarks do not inflate the measured process RSS
+    """
+
+    def __init__(self, retain_content: bool = True):
+        self.buckets: Dict[str, Dict[str, bytes]] = {}
+        self.retain_content = retain_content
+        self.lock = threading.RLock()
+
+    def store(self, bucket: str, key: str, content: bytes) -> None:
+        with self.lock:
+            self.bucket(bucket)[key] = content if self.retain_content else b""
+
+    def bucket(self, name: str) -> Dict[str, bytes]:
+        with self.lock:
+            return self.buckets.setdefault(name, {})
+
+
+class FakeAuth:
+    """Issues and validates HS256 access tokens for fake users"""
+
+    def __init__(self, jwt_secret: str):
+        self.jwt_secret = jwt_secret
+        self.users: Dict[str, Dict] = {}
+        self.lock = threading.RLock()
+
+    def ensure_user(self, email: str, user_id: Optional[str] = None, role: str = "user") -> Dict:
+        with self.lock:
+            for user in self.users.values():
+                if user["email"] == email:
+                    return user
+            user_id = user_id or str(uuid.uuid4())
+            now = _now()
+            user = {
+                "id": user_id,
+                "aud": "authenticated",
+                "role": "authenticated",
+                "email": email,
+                "email_confirmed_at": now,
+                "created_at": now,
+                "last_sign_in_at": now,
+                "app_metadata": {"provider": "email", "role": role, "permissions": ["read:analytics"]},
+                "user_metadata": {"full_name": email.split("@")[0]},
+            }
+            self.users[user_id] = user
+            return user
+
+    def mint_token(self, user: Dict, ttl_seconds: int = 3600) -> str:
+        now = datetime.now(timezone.utc)
+        payload = {
+            "sub": user["id"],
+            "email": user["email"],
+            "aud": "authenticated",
+            "role": "authenticated",
+            "app_metadata": user["app_metadata"],
+            "user_metadata": user["user_metadata"],
+            "iat": int(now.timestamp()),
+            "exp": int((now + timedelta(seconds=ttl_seconds)).timestamp()),
+        }
+        return jwt.encode(payload, self.jwt_secret, algorithm="HS256")
+
+    def user_for_token(self, token: str) -> Optional[Dict]:
+        try:
+            payload = jwt.decode(token, self.jwt_secret, algorithms=["HS256"], options={"verify_aud": False})
+        except jwt.InvalidTokenError:
+            return None
+        return self.users.get(payload.get("sub"))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; without TCP_NODELAY every
+    # response would stall on Nagle + delayed ACK and swamp injected latency
+    disable_nagle_algorithm = True
+    server: "_FakeHTTPServer"
+
+    def log_message(self, format, *args):  # noqa: A002 - silence per-request logging
+        pass
+
+    # Response helpers
+    def _send(self, status: int, body: Any = None, headers: Optional[Dict[str, str]] = None, raw: bool = False):
+        payload = body if raw else json.dumps(body, default=str).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/octet-stream" if raw else "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _body(self) -> bytes:
+        # Always drained by _dispatch so keep-alive connections stay in sync
+        if self._raw_body is None:
+            length = int(self.headers.get("Content-Length") or 0)
+            self._raw_body = self.rfile.read(length) if length else b""
+        return self._raw_body
+
+    def _json_body(self) -> Any:
+        raw = self._body()
+        return json.loads(raw) if raw else None
+
+    # Dispatch
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_HEAD(self):
+        self._dispatch("HEAD")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_PATCH(self):
+        self._dispatch("PATCH")
+
+    def do_PUT(self):
+        self._dispatch("PUT")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+    def _dispatch(self, method: str):
+        fake = self.server.fake
+        parts = urlsplit(self.path)
+        path = unquote(parts.path)
+        query = parse_qsl(parts.query, keep_blank_values=True)
+        self._raw_body = None
+        self._body()
+        try:
+            if path.startswith("/rest/v1/"):
+                fake.latency.delay("rest")
+                fake.count_request("rest")
+                self._rest(method, path[len("/rest/v1/"):], query)
+            elif path.startswith("/storage/v1/"):
+                fake.latency.delay("storage")
+                fake.count_request("storage")
+                self._storage(method, path[len("/storage/v1/"):], query)
+            elif path.startswith("/auth/v1/"):
+                fake.latency.delay("auth")
+                fake.count_request("auth")
+                self._auth(method, path[len("/auth/v1/"):], query)
+            else:
+                self._send(404, {"message": "not found"})
+        except FakeDatabaseError as e:
+            self._send(400, {"code": e.code, "message": str(e), "details": None, "hint": None})
+        except Exception as e:  # surface fake bugs as upstream 500s
+            self._send(500, {"message": str(e)})
+
+    # PostgREST
+    def _rest(self, method: str, resource: str, query: List[Tuple[str, str]]):
+        db = self.server.fake.db
+        if resource.startswith("rpc/"):
+            name = resource[len("rpc/"):]
+            handler = db.rpcs.get(name)
+            if handler is None:
+                self._send(404, {"code": "PGRST202", "message": f"Could not find the function {name}"})
+                return
+            params = self._json_body() or dict(query)
+            self._send(200, handler(params))
+            return
+
+        table = resource.strip("/")
+        filters, select, order, limit, offset, on_conflict = [], "*", None, None, 0, None
+        for key, value in query:
+            if key == "select":
+                select = value
+            elif key == "order":
+                order = value
+            elif key == "limit":
+                limit = int(value)
+            elif key == "offset":
+                offset = int(value)
+            elif key == "on_conflict":
+                on_conflict = value.split(",")
+            elif key in ("or", "and"):
+                filters.append((key, key, value))
+            elif "." in value:
+                op, _, operand = value.partition(".")
+                filters.append((key, op, operand))
+        prefer = self.headers.get("Prefer", "")
+        single = "vnd.pgrst.object" in (self.headers.get("Accept") or "")
+
+        if method in ("GET", "HEAD"):
+            rows = db.select(table, filters)
+            if order:
+                for clause in reversed(order.split(",")):
+                    column, _, direction = clause.partition(".")
+                    rows.sort(key=lambda r: _sort_key(_column(r, column)), reverse=direction.startswith("desc"))
+            total = len(rows)
+            rows = rows[offset:offset + limit if limit is not None else None]
+        elif method == "POST":
+            payload = self._json_body()
+            rows = payload if isinstance(payload, list) else [payload]
+            upsert_on = (on_conflict or ["id"]) if "merge-duplicates" in prefer else None
+            rows = db.insert(table, rows, upsert_on=upsert_on)
+            total = len(rows)
+        elif method == "PATCH":
+            rows = db.update(table, filters, self._json_body() or {})
+            total = len(rows)
+        elif method == "DELETE":
+            rows = db.delete(table, filters)
+            total = len(rows)
+        else:
+            self._send(405, {"message": "method not allowed"})
+            return
+
+        rows = [_project(r, select) for r in rows]
+        headers = {}
+        if "count=" in prefer:
+            headers["Content-Range"] = f"{offset}-{offset + len(rows) - 1}/{total}" if rows else f"*/{total}"
+        status = 201 if method == "POST" else 200
+        if "return=minimal" in prefer:
+            self._send(status, [], headers)
+        elif single:
+            if len(rows) != 1:
+                self._send(406, {"code": "PGRST116", "message": "JSON object requested, multiple (or no) rows returned"})
+            else:
+                self._send(status, rows[0], headers)
+        else:
+            self._send(status, rows, headers)
+
+    # Storage
+    def _storage(self, method: str, resource: str, query: List[Tuple[str, str]]):
+        storage = self.server.fake.storage
+        params = dict(query)
+        if resource.startswith("bucket") and method == "GET":
+            now = _now()
+            buckets = [
+                {"id": name, "name": name, "owner": "", "public": False, "created_at": now,
+                 "updated_at": now, "file_size_limit": None, "allowed_mime_types": None}
+                for name in list(storage.buckets)
+            ]
+            if resource == "bucket":
+                self._send(200, buckets)
+                return
+            found = [b for b in buckets if b["id"] == resource[len("bucket/"):]]
+            self._send(200 if found else 404, found[0] if found else {"statusCode": "404", "error": "Bucket not found"})
+        elif resource == "bucket" and method == "POST":
+            body = self._json_body() or {}
+            storage.bucket(body.get("id") or body.get("name"))
+            self._send(200, {"name": body.get("name")})
+        elif resource.startswith("object/upload/sign/"):
+            bucket, _, key = resource[len("object/upload/sign/"):].partition("/")
+            if method == "POST":
+                self._send(200, {"url": f"/object/upload/sign/{bucket}/{key}?token={uuid.uuid4().hex}"})
+            else:
+                storage.store(bucket, key, _multipart_file(self.headers, self._body()))
+                self._send(200, {"Key": f"{bucket}/{key}"})
+        elif resource.startswith("object/sign/"):
+            bucket, _, key = resource[len("object/sign/"):].partition("/")
+            if method == "POST" and not key:
+                paths = (self._json_body() or {}).get("paths", [])
+                objects = storage.bucket(bucket)
+                self._send(200, [
+                    {"path": path, "error": None if path in objects else "Either the object does not exist or you do not have access to it",
+                     "signedURL": f"/object/sign/{bucket}/{path}?token={uuid.uuid4().hex}"}
+                    for path in paths
+                ])
+            elif method == "POST":
+                self._body()
+                self._send(200, {"signedURL": f"/object/sign/{bucket}/{key}?token={uuid.uuid4().hex}"})
+            else:
+                self._object_content(bucket, key)
+        elif resource in ("object/move", "object/copy"):
+            body = self._json_body() or {}
+            objects = storage.bucket(body["bucketId"])
+            with storage.lock:
+                content = objects.get(body["sourceKey"])
+                if content is None:
+                    self._send(404, {"statusCode": "404", "error": "not_found", "message": "Object not found"})
+                    return
+                objects[body["destinationKey"]] = content
+                if resource == "object/move":
+                    del objects[body["sourceKey"]]
+            self._send(200, {"message": "Successfully moved" if resource == "object/move" else "Successfully copied"})
+        elif resource.startswith("object/list/"):
+            bucket = resource[len("object/list/"):]
+            prefix = (self._json_body() or {}).get("prefix", "")
+            self._send(200, [
+                {"name": key[len(prefix):].lstrip("/"), "metadata": {"size": len(value)}}
+                for key, value in storage.bucket(bucket).items() if key.startswith(prefix)
+            ])
+        elif resource.startswith("object/"):
+            bucket, _, key = resource[len("object/"):].partition("/")
+            objects = storage.bucket(bucket)
+            if method == "DELETE" and not key:
+                prefixes = (self._json_body() or {}).get("prefixes", [])
+                with storage.lock:
+                    removed = [{"name": p} for p in prefixes if objects.pop(p, None) is not None]
+                self._send(200, removed)
+            elif method in ("POST", "PUT"):
+                content = _multipart_file(self.headers, self._body())
+                with storage.lock:
+                    if method == "POST" and key in objects and self.headers.get("x-upsert") != "true":
+                        self._send(400, {"statusCode": "409", "error": "Duplicate", "message": "The resource already exists"})
+                        return
+                    storage.store(bucket, key, content)
+                self._send(200, {"Key": f"{bucket}/{key}"})
+            elif method == "GET":
+                self._object_content(bucket, key)
+            else:
+                self._send(405, {"message": "method not allowed"})
+        else:
+            self._send(404, {"message": f"unknown storage route {resource}", "params": params})
+
+    def _object_content(self, bucket: str, key: str):
+        content = self.server.fake.storage.bucket(bucket).get(key)
+        if content is None:
+            self._send(400, {"statusCode": "404", "error": "not_found", "message": "Object not found"})
+        else:
+            self._send(200, content, raw=True)
+
+    # Auth
+    def _auth(self, method: str, resource: str, query: List[Tuple[str, str]]):
+        auth = self.server.fake.auth
+        if resource == "token" and method == "POST":
+            body = self._json_body() or {}
+            user = auth.ensure_user(body.get("email", "anonymous@example.com"))
+            self._send(200, {
+                "access_token": auth.mint_token(user),
+                "refresh_token": uuid.uuid4().hex,
+                "expires_in": 3600,
+                "token_type": "bearer",
+                "user": user,
+            })
+        elif resource == "user" and method == "GET":
+            token = (self.headers.get("Authorization") or "").replace("Bearer ", "")
+            user = auth.user_for_token(token)
+            if user is None:
+                self._send(401, {"code": 401, "msg": "invalid JWT"})
+            else:
+                self._send(200, user)
+        elif resource.startswith("admin/users/") and method == "GET":
+            user = auth.users.get(resource[len("admin/users/"):])
+            self._send(200 if user else 404, user or {"msg": "User not found"})
+        else:
+            self._send(404, {"msg": f"unknown auth route {resource}"})
+
+
+def _project(row: Dict, select: str) -> Dict:
+    if select in ("*", ""):
+        return row
+    columns = [c.strip() for c in select.split(",") if c.strip() and "(" not in c]
+    if "*" in columns:
+        return row
+    projected = {}
+    for column in columns:
+        alias, _, path = column.rpartition(":")
+        value = _column(row, path)
+        # ->> yields text, like PostgREST
+        projected[alias or path.split("->")[-1].lstrip(">")] = str(value) if "->>" in path and value is not None else value
+    return projected
+
+
+def _multipart_file(headers, body: bytes) -> bytes:
+    content_type = headers.get("Content-Type", "")
+    if not content_type.startswith("multipart/"):
+        return body
+    message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode() + body
+    )
+    for part in message.iter_parts():
+        if part.get_param("name", header="content-disposition") == "file":
+            return part.get_payload(decode=True) or b""
+    return b""
+
+
+class _FakeHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+    fake: "FakeSupabase"
+
+
+class FakeSupabase:
+    """
+    Local PostgREST/Storage/Auth stand-in
+
+    Usage:
+        with FakeSupabase(latency=LatencyProfile(rest_ms=5)) as fake:
+            os.environ["SUPABASE_URL"] = fake.url
+    """
+
+    def __init__(self, latency: Optional[LatencyProfile] = None, jwt_secret: str = DEFAULT_JWT_SECRET,
+                 host: str = "127.0.0.1", port: int = 0, retain_content: bool = True):
+        self.latency = latency or LatencyProfile()
+        self.jwt_secret = jwt_secret
+        self.db = FakeDatabase()
+        self.storage = FakeStorage(retain_content=retain_content)
+        self.auth = FakeAuth(jwt_secret)
+        self.storage.bucket("user-files")
+        self.request_counts: Dict[str, int] = {"rest": 0, "storage": 0, "auth": 0}
+        self._count_lock = threading.Lock()
+        self._httpd = _FakeHTTPServer((host, port), _Handler)
+        self._httpd.fake = self
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def service_key(self) -> str:
+        """API key shaped like a Supabase service-role JWT"""
+        return jwt.encode({"role": "service_role", "iss": "supabase"}, self.jwt_secret, algorithm="HS256")
+
+    def anon_key(self) -> str:
+        return jwt.encode({"role": "anon", "iss": "supabase"}, self.jwt_secret, algorithm="HS256")
+
+    def count_request(self, service: str) -> None:
+        with self._count_lock:
+            self.request_counts[service] = self.request_counts.get(service, 0) + 1
+
+    def reset_counts(self) -> None:
+        with self._count_lock:
+            for key in self.request_counts:
+                self.request_counts[key] = 0
+
+    def start(self) -> "FakeSupabase":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="fake-supabase", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> "FakeSupabase":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
@@ -0,0 +1,469 @@
+#!/usr/bin/env python3
+"""
+FileInASnap Backend Benchmark Suite
+Boots backend/server.py and backend/main.py against an in-process Supabase
+stand-in, drives concurrent scenarios and reports throughput, p50/p95/p99
+latency and peak RSS. Results can be saved as JSON baselines and compared
+between versions.
+
+Usage:
+    python benchmarks/run_benchmarks.py --save v2.0.0
+    python benchmarks/run_benchmarks.py --compare benchmarks/baselines/v2.0.0.json
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import logging
+import os
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+BENCH_DIR = Path(__file__).parent
+REPO_ROOT = BENCH_DIR.parent
+BACKEND_DIR = REPO_ROOT / "backend"
+BASELINE_DIR = BENCH_DIR / "baselines"
+
+sys.path.insert(0, str(BENCH_DIR))
+from fake_supabase import FakeSupabase, LatencyProfile  # noqa: E402
+
+# Mixed payload sizes for the upload scenario (bytes)
+UPLOAD_SIZES = [4 * 1024, 64 * 1024, 512 * 1024, 2 * 1024 * 1024]
+
+
+class RSSSampler:
+    """Samples resident set size in a background thread to capture per-scenario peaks"""
+
+    def __init__(self, interval: float = 0.02):
+        self.interval = interval
+        self.peak_kb = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def current_kb() -> int:
+        try:
+            with open("/proc/self/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1])
+        except OSError:
+            pass
+        # ru_maxrss is kilobytes on Linux and bytes on macOS
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss // 1024 if sys.platform == "darwin" else maxrss
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak_kb = max(self.peak_kb, self.current_kb())
+            self._stop.wait(self.interval)
+
+    def __enter__(self) -> "RSSSampler":
+        self.peak_kb = self.current_kb()
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak_kb = max(self.peak_kb, self.current_kb())
+
+
+class AppServer:
+    """Runs an ASGI app under uvicorn in a background thread"""
+
+    def __init__(self, app, name: str):
+        import uvicorn
+
+        self.name = name
+        self.port = _free_port()
+        config = uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning", lifespan="on")
+        self.server = uvicorn.Server(config)
+        # Signal handlers can only be installed from the main thread
+        self.server.install_signal_handlers = lambda: None
+        self.thread = threading.Thread(target=self.server.run, name=f"uvicorn-{name}", daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self) -> "AppServer":
+        self.thread.start()
+        deadline = time.time() + 30
+        while not self.server.started:
+            if time.time() > deadline or not self.thread.is_alive():
+                raise RuntimeError(f"{self.name} failed to start")
+            time.sleep(0.05)
+        return self
+
+    def stop(self):
+        self.server.should_exit = True
+        self.thread.join(timeout=10)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100.0 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def boot_backends(fake: FakeSupabase):
+    """Point the backend at the stand-in and import both apps fresh"""
+    os.environ["SUPABASE_URL"] = fake.url
+    os.environ["SUPABASE_SERVICE_KEY"] = fake.service_key()
+    os.environ["SUPABASE_ANON_KEY"] = fake.anon_key()
+    os.environ["SUPABASE_JWT_SECRET"] = fake.jwt_secret
+    # Measure handler cost, not the per-user rate limits
+    os.environ.setdefault("ADMISSION_CONTROL", "off")
+    sys.path.insert(0, str(BACKEND_DIR))
+    import main
+    import server
+    from clients import reset_clients
+
+    # Per-request client logging would dominate the measurements
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    reset_clients()
+    return main.create_app(), server.create_app()
+
+
+class BenchmarkContext:
+    """Seeded users, tokens and fixtures shared by the scenarios"""
+
+    def __init__(self, fake: FakeSupabase, folders: int, files_per_folder: int, requests: int):
+        self.fake = fake
+        self.folders = folders
+        self.files_per_folder = files_per_folder
+        self.requests = requests
+        self.tokens: Dict[str, str] = {}
+        self.user_ids: Dict[str, str] = {}
+        self.upload_folder_id = ""
+        self.delete_file_ids: List[str] = []
+        self.api_delete_file_ids: List[str] = []
+        self.upload_payloads = [
+            {
+                "name": f"bench-{size}.jpg",
+                "content": base64.b64encode(os.urandom(size)).decode(),
+                "mime_type": "image/jpeg",
+                "size": size,
+            }
+            for size in UPLOAD_SIZES
+        ]
+
+    def seed(self):
+        db, auth = self.fake.db, self.fake.auth
+        for role in ("reader", "writer", "deleter"):
+            user = auth.ensure_user(f"bench-{role}@example.com")
+            self.user_ids[role] = user["id"]
+            self.tokens[role] = auth.mint_token(user, ttl_seconds=24 * 3600)
+            db.insert("profiles", [{"id": user["id"], "email": user["email"], "full_name": role, "tier": "enterprise"}])
+
+        reader = self.user_ids["reader"]
+        folders = db.insert("folders", [{"name": f"Folder {i:04d}", "owner_id": reader} for i in range(self.folders)])
+        db.insert("files", [
+            {
+                "folder_id": folder["id"],
+                "owner_id": reader,
+                "object_key": f"{reader}/{folder['id']}/photo-{j}.jpg",
+                "filename": f"photo-{j}.jpg",
+                "original_filename": f"photo-{j}.jpg",
+                "bytes": UPLOAD_SIZES[j % len(UPLOAD_SIZES)],
+                "mime": "image/jpeg" if j % 3 else "application/pdf",
+            }
+            for folder in folders for j in range(self.files_per_folder)
+        ])
+
+        writer = self.user_ids["writer"]
+        self.upload_folder_id = db.insert("folders", [{"name": "Uploads", "owner_id": writer}])[0]["id"]
+
+        deleter = self.user_ids["deleter"]
+        delete_folder = db.insert("folders", [{"name": "Trash", "owner_id": deleter}])[0]
+        rows = db.insert("files", [
+            {
+                "folder_id": delete_folder["id"],
+                "owner_id": deleter,
+                "object_key": f"{deleter}/{delete_folder['id']}/{i}.bin",
+                "filename": f"{i}.bin",
+                "original_filename": f"{i}.bin",
+                "bytes": 1024,
+                "mime": "application/octet-stream",
+            }
+            for i in range(self.requests)
+        ])
+        self.delete_file_ids = [r["id"] for r in rows]
+        for row in rows:
+            self.fake.storage.store("user-files", row["object_key"], b"x" * 1024)
+
+        user_files = []
+        for i in range(self.requests):
+            file_id = str(uuid.uuid4())
+            path = f"{deleter}/{file_id}.txt"
+            self.fake.storage.store("user-files", path, b"x" * 1024)
+            user_files.append({
+                "id": file_id, "user_id": deleter, "name": f"{i}.txt", "original_name": f"{i}.txt",
+                "mime_type": "text/plain", "size": 1024, "storage_path": path,
+            })
+        self.api_delete_file_ids = [r["id"] for r in db.insert("user_files", user_files)]
+
+    def auth(self, role: str) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {self.tokens[role]}"}
+
+
+Scenario = Callable[[httpx.AsyncClient, int], Awaitable[List[httpx.Response]]]
+
+
+def build_scenarios(ctx: BenchmarkContext, main_url: str, server_url: str, fake_url: str) -> Dict[str, Scenario]:
+    async def login(client: httpx.AsyncClient, i: int):
+        token_response = await client.post(
+            f"{fake_url}/auth/v1/token?grant_type=password",
+            json={"email": f"bench-login-{i % 50}@example.com", "password": "bench"},
+        )
+        token = token_response.json()["access_token"]
+        profile_response = await client.get(
+            f"{server_url}/api/auth/profile", headers={"Authorization": f"Bearer {token}"}
+        )
+        return [token_response, profile_response]
+
+    async def list_folders(client: httpx.AsyncClient, i: int):
+        return [await client.get(f"{main_url}/folders", headers=ctx.auth("reader"))]
+
+    async def upload_batch(client: httpx.AsyncClient, i: int):
+        payload = ctx.upload_payloads[i % len(ctx.upload_payloads)]
+        return [await client.post(f"{server_url}/api/files/upload", json=payload, headers=ctx.auth("writer"))]
+
+    async def presign_complete(client: httpx.AsyncClient, i: int):
+        headers = ctx.auth("writer")
+        presign = await client.get(
+            f"{main_url}/uploads/presign",
+            params={"folder_id": ctx.upload_folder_id, "filename": f"bench-{i}.jpg"},
+            headers=headers,
+        )
+        if presign.status_code != 200:
+            return [presign]
+        complete = await client.post(
+            f"{main_url}/uploads/complete",
+            json={
+                "folder_id": ctx.upload_folder_id,
+                "object_key": presign.json()["object_key"],
+                "filename": f"bench-{i}.jpg",
+                "bytes": UPLOAD_SIZES[i % len(UPLOAD_SIZES)],
+                "mime": "image/jpeg",
+            },
+            headers=headers,
+        )
+        return [presign, complete]
+
+    async def stats(client: httpx.AsyncClient, i: int):
+        return [await client.get(f"{main_url}/stats", headers=ctx.auth("reader"))]
+
+    async def delete(client: httpx.AsyncClient, i: int):
+        file_id = ctx.delete_file_ids[i]
+        return [await client.delete(f"{main_url}/files/{file_id}", headers=ctx.auth("deleter"))]
+
+    async def api_delete(client: httpx.AsyncClient, i: int):
+        file_id = ctx.api_delete_file_ids[i]
+        return [await client.delete(f"{server_url}/api/files/{file_id}", headers=ctx.auth("deleter"))]
+
+    return {
+        "login": login,
+        "list_folders": list_folders,
+        "upload_batch": upload_batch,
+        "presign_complete": presign_complete,
+        "stats": stats,
+        "delete": delete,
+        "api_delete": api_delete,
+    }
+
+
+async def run_scenario(name: str, scenario: Scenario, total: int, concurrency: int, fake: FakeSupabase) -> Dict:
+    """Run `total` iterations of a scenario with `concurrency` in-flight workers"""
+    latencies: List[float] = []
+    status_counts: Dict[str, int] = {}
+    errors = 0
+    next_index = iter(range(total))
+    limits = httpx.Limits(max_connections=concurrency * 2, max_keepalive_connections=concurrency * 2)
+
+    async with httpx.AsyncClient(timeout=120.0, limits=limits) as client:
+        async def worker():
+            nonlocal errors
+            for i in next_index:
+                start = time.perf_counter()
+                try:
+                    responses = await scenario(client, i)
+                except httpx.HTTPError as e:
+                    errors += 1
+                    status_counts[type(e).__name__] = status_counts.get(type(e).__name__, 0) + 1
+                    continue
+                latencies.append((time.perf_counter() - start) * 1000.0)
+                for response in responses:
+                    key = str(response.status_code)
+                    status_counts[key] = status_counts.get(key, 0) + 1
+                    if response.status_code >= 400:
+                        errors += 1
+
+        fake.reset_counts()
+        with RSSSampler() as rss:
+            started = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+            duration = time.perf_counter() - started
+
+    latencies.sort()
+    upstream = dict(fake.request_counts)
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "errors": errors,
+        "status_counts": status_counts,
+        "duration_s": round(duration, 3),
+        "throughput_rps": round(total / duration, 2) if duration else 0.0,
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "max_ms": round(latencies[-1], 2) if latencies else 0.0,
+        "peak_rss_mb": round(rss.peak_kb / 1024, 1),
+        "upstream_calls": upstream,
+        "upstream_calls_per_iteration": round(sum(upstream.values()) / total, 2) if total else 0.0,
+    }
+
+
+def compare(results: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """Return regression messages for scenarios slower than the baseline by more than threshold"""
+    regressions = []
+    print(f"\n{'scenario':<18}{'p95 base':>10}{'p95 now':>10}{'Δ p95':>9}{'rps base':>10}{'rps now':>10}{'Δ rps':>9}")
+    for name, current in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if not previous:
+            continue
+        p95_delta = (current["p95_ms"] - previous["p95_ms"]) / previous["p95_ms"] if previous["p95_ms"] else 0.0
+        rps_delta = (
+            (current["throughput_rps"] - previous["throughput_rps"]) / previous["throughput_rps"]
+            if previous["throughput_rps"] else 0.0
+        )
+        print(
+            f"{name:<18}{previous['p95_ms']:>10.1f}{current['p95_ms']:>10.1f}{p95_delta:>+9.1%}"
+            f"{previous['throughput_rps']:>10.1f}{current['throughput_rps']:>10.1f}{rps_delta:>+9.1%}"
+        )
+        if p95_delta > threshold:
+            regressions.append(f"{name}: p95 {previous['p95_ms']}ms -> {current['p95_ms']}ms")
+        if rps_delta < -threshold:
+            regressions.append(f"{name}: throughput {previous['throughput_rps']} -> {current['throughput_rps']} rps")
+    return regressions
+
+
+def print_report(results: Dict):
+    print(f"\n{'scenario':<18}{'reqs':>6}{'err':>5}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'rss MB':>9}{'calls/it':>10}")
+    for name, r in results["scenarios"].items():
+        print(
+            f"{name:<18}{r['requests']:>6}{r['errors']:>5}{r['throughput_rps']:>9.1f}{r['p50_ms']:>9.1f}"
+            f"{r['p95_ms']:>9.1f}{r['p99_ms']:>9.1f}{r['peak_rss_mb']:>9.1f}{r['upstream_calls_per_iteration']:>10.1f}"
+        )
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args) -> Dict:
+    latency = LatencyProfile(args.rest_ms, args.storage_ms, args.auth_ms, args.jitter_ms)
+    with FakeSupabase(latency=latency, retain_content=False) as fake:
+        main_app, server_app = boot_backends(fake)
+        ctx = BenchmarkContext(fake, args.folders, args.files_per_folder, args.requests)
+        ctx.seed()
+
+        main_server = AppServer(main_app, "main").start()
+        api_server = AppServer(server_app, "server").start()
+        try:
+            scenarios = build_scenarios(ctx, main_server.url, api_server.url, fake.url)
+            selected = args.scenarios or list(scenarios)
+            results = {}
+            for name in selected:
+                print(f"▶ {name} ({args.requests} iterations, concurrency {args.concurrency})")
+                results[name] = await run_scenario(name, scenarios[name], args.requests, args.concurrency, fake)
+        finally:
+            main_server.stop()
+            api_server.stop()
+
+    return {
+        "meta": {
+            "label": args.save,
+            "git_revision": git_revision(),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "latency": latency.to_dict(),
+            "folders": args.folders,
+            "files_per_folder": args.files_per_folder,
+            "process_peak_rss_mb": round(
+                resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1
+            ),
+        },
+        "scenarios": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FileInASnap backend benchmarks")
+    parser.add_argument("--requests", type=int, default=200, help="iterations per scenario")
+    parser.add_argument("--concurrency", type=int, default=16, help="in-flight iterations per scenario")
+    parser.add_argument("--folders", type=int, default=50, help="folders seeded for list_folders/stats")
+    parser.add_argument("--files-per-folder", type=int, default=10)
+    parser.add_argument("--rest-ms", type=float, default=2.0, help="injected PostgREST latency")
+    parser.add_argument("--storage-ms", type=float, default=5.0, help="injected Storage latency")
+    parser.add_argument("--auth-ms", type=float, default=3.0, help="injected Auth latency")
+    parser.add_argument("--jitter-ms", type=float, default=1.0, help="uniform extra latency per upstream call")
+    parser.add_argument("--scenario", dest="scenarios", action="append", help="run only this scenario (repeatable)")
+    parser.add_argument("--save", metavar="LABEL", help="save results to benchmarks/baselines/LABEL.json")
+    parser.add_argument("--output", type=Path, help="write results JSON to this path")
+    parser.add_argument("--compare", type=Path, metavar="BASELINE", help="compare against a saved baseline")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed regression before failing (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    print_report(results)
+
+    outputs = [args.output] if args.output else []
+    if args.save:
+        BASELINE_DIR.mkdir(parents=True, exist_ok=True)
+        outputs.append(BASELINE_DIR / f"{args.save}.json")
+    for path in outputs:
+        path.write_text(json.dumps(results, indent=2) + "\n")
+        print(f"💾 Results saved to {path}")
+
+    if args.compare:
+        regressions = compare(results, json.loads(args.compare.read_text()), args.threshold)
+        if regressions:
+            print("\n❌ Regressions detected:")
+            for message in regressions:
+                print(f"   {message}")
+            sys.exit(1)
+        print("\n✅ No regressions beyond threshold")
+
+
+if __name__ == "__main__":
+    main()
@@ -19,6 +19,31 @@ const createId = () => {
   return Date.now().toString(36) + Math.random().toString(36).substr(2);
 };
 
+// Completing an upload is safe to repeat under the same Idempotency-Key, so a lost
+// response, a 5xx, or a "still in progress" 409 is retried instead of failing the upload
+const COMPLETE_ATTEMPTS = 4;
+const COMPLETE_RETRY_DELAY = 1000;
+
+const isRetryable = (error) =>
+  error.status === undefined || error.status >= 500 || (error.status === 409 && error.retryAfter != null);
+
+const completeUpload = async (url, idempotencyKey, body) => {
+  for (let attempt = 1; ; attempt++) {
+    try {
+      return await authedFetch(url, {
+        method: "POST",
+        headers: { "Idempotency-Key": idempotencyKey },
+        body: JSON.stringify(body),
+      });
+    } catch (error) {
+      if (attempt === COMPLETE_ATTEMPTS || !isRetryable(error)) throw error;
+      console.warn(`Completing upload failed (attempt ${attempt}), retrying:`, error);
+      const retryAfter = Number(error.retryAfter) * 1000;
+      await new Promise((resolve) => setTimeout(resolve, retryAfter || COMPLETE_RETRY_DELAY * attempt));
+    }
+  }
+};
+
 const UploadModal = ({ isOpen, onClose, selectedFolder: initialFolder, onUploadComplete }) => {
   const [files, setFiles] = useState([]);
   const [folders, setFolders] = useState([]);
@@ -95,6 +120,8 @@ const UploadModal = ({ isOpen, onClose, selectedFolder: initialFolder, onUploadC
       const folderId = await ensureFolder();
       for (const file of files) {
         const key = `${createId()}-${file.name}`;
+        // One per file and reused by every retry, so the completion is recorded once
+        const idempotencyKey = createId();
         const presign = await authedFetch(
           `${api}/uploads/presign?folder_id=${folderId}&filename=${encodeURIComponent(key)}`
         ).then((r) => r.json());
@@ -108,24 +135,21 @@ const UploadModal = ({ isOpen, onClose, selectedFolder: initialFolder, onUploadC
               setProgress((p) => ({ ...p, [key]: Math.round((e.loaded / e.total) * 100) }));
             }
           };
-          xhr.onload = async () => {
-            if (xhr.status >= 200 && xhr.status < 300) {
-              await authedFetch(`${api}/uploads/complete`, {
-                method: "POST",
-                body: JSON.stringify({
-                  folder_id: folderId,
-                  filename: file.name,
-                  object_key: presign.object_key,
-                  bytes: file.size,
-                  mime: file.type,
-                }),
-              });
-              resolve();
-            } else reject(new Error(`Upload failed (${xhr.status})`));
+          xhr.onload = () => {
+            if (xhr.status >= 200 && xhr.status < 300) resolve();
+            else reject(new Error(`Upload failed (${xhr.status})`));
           };
           xhr.onerror = () => reject(new Error("Network error"));
           xhr.send(file);
         });
+
+        await completeUpload(`${api}/uploads/complete`, idempotencyKey, {
+          folder_id: folderId,
+          filename: file.name,
+          object_key: presign.object_key,
+          bytes: file.size,
+          mime: file.type,
+        });
       }
       setFiles([]);
       setProgress({});
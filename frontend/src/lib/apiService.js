@@ -477,6 +477,37 @@ class ApiService {
     }
   }
 
+  // ========================================
+  // DASHBOARD BOOTSTRAP
+  // ========================================
+
+  // Profile, plans, folders, recent files and stats in one request. Sections
+  // are kept with their ETags; unchanged ones come back without data (or the
+  // whole response is a 304) and are served from what we already have.
+  async getBootstrap() {
+    const cached = this.bootstrapSections || {};
+    const etags = Object.values(cached).map(section => section.etag).filter(Boolean);
+    const response = await fetch(`${this.baseURL}/bootstrap`, {
+      headers: {
+        ...this.getAuthHeaders(),
+        ...(etags.length ? { 'If-None-Match': etags.join(', ') } : {})
+      }
+    });
+
+    let sections = cached;
+    if (response.status !== 304) {
+      if (!response.ok) {
+        throw new Error(`HTTP ${response.status}: ${response.statusText}`);
+      }
+      const fresh = await response.json();
+      sections = Object.fromEntries(
+        Object.entries(fresh).map(([name, section]) => [name, section.not_modified ? cached[name] : section])
+      );
+    }
+    this.bootstrapSections = sections;
+    return Object.fromEntries(Object.entries(sections).map(([name, section]) => [name, section?.data]));
+  }
+
   async getRecentActivity(limit = 10) {
     try {
       const { data: user } = await supabase.auth.getUser();
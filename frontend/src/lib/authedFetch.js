@@ -35,6 +35,7 @@ export async function authedFetch(input, init = {}) {
     
     const error = new Error(detail || `HTTP ${res.status}`);
     error.status = res.status;
+    error.retryAfter = res.headers.get("Retry-After");
     throw error;
   }
   
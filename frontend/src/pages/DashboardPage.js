@@ -78,10 +78,17 @@ const Dashboard = () => {
       setLoading(true);
       const { apiService } = await import('../lib/apiService');
       
-      const [foldersData, statsData] = await Promise.all([
-        apiService.getFolders(),
-        apiService.getStats()
-      ]);
+      let foldersData, statsData;
+      try {
+        // One round trip for everything the dashboard shows on load
+        ({ folders: foldersData, stats: statsData } = await apiService.getBootstrap());
+      } catch (bootstrapError) {
+        console.warn('Bootstrap failed, loading sections separately:', bootstrapError);
+        [foldersData, statsData] = await Promise.all([
+          apiService.getFolders(),
+          apiService.getStats()
+        ]);
+      }
 
       setFolders(foldersData);
       setStats({
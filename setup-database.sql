@@ -29,10 +29,13 @@ CREATE TABLE IF NOT EXISTS files (
 );
 
 -- Create indexes for better performance
-CREATE INDEX IF NOT EXISTS folders_owner_id_idx ON folders(owner_id);
-CREATE INDEX IF NOT EXISTS files_owner_id_idx ON files(owner_id);
-CREATE INDEX IF NOT EXISTS files_folder_id_idx ON files(folder_id);
-CREATE INDEX IF NOT EXISTS files_created_at_idx ON files(created_at DESC);
+-- Composite indexes matching main.py's listings; see
+-- supabase/migrations/20261019000900_folders_files_indexes.sql
+CREATE INDEX IF NOT EXISTS idx_folders_owner_created ON folders(owner_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_files_owner_created ON files(owner_id, created_at DESC) INCLUDE (bytes);
+CREATE INDEX IF NOT EXISTS idx_files_folder_created ON files(folder_id, created_at DESC);
+-- Nesting (parent_id, path) and rolled-up folder stats come from
+-- supabase/migrations/20261019001100_folder_hierarchy.sql
 
 -- Row Level Security (RLS) 
 ALTER TABLE folders ENABLE ROW LEVEL SECURITY;
@@ -0,0 +1,113 @@
+-- Range-partition activity_logs by month
+-- Retention drops whole partitions instead of running DELETEs over a large heap.
+-- The buffered writer in backend/activity_log.py inserts batches into the parent table.
+
+-- Keep the existing rows around while the partitioned table is built
+ALTER TABLE IF EXISTS activity_logs RENAME TO activity_logs_legacy;
+
+CREATE TABLE IF NOT EXISTS activity_logs (
+    id UUID NOT NULL DEFAULT uuid_generate_v4(),
+    user_id UUID REFERENCES auth.users(id) ON DELETE SET NULL,
+    action TEXT NOT NULL,
+    resource_type TEXT,
+    resource_id UUID,
+    details JSONB DEFAULT '{}',
+    ip_address INET,
+    user_agent TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT timezone('utc'::text, now()) NOT NULL,
+    -- The partition key must be part of every unique constraint
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+-- Catches rows outside the pre-created months so inserts never fail
+CREATE TABLE IF NOT EXISTS activity_logs_default PARTITION OF activity_logs DEFAULT;
+
+-- Indexes declared on the parent are created on every partition.
+-- Per-user history reads are (user_id, created_at DESC); time-range scans use a tiny BRIN.
+CREATE INDEX IF NOT EXISTS idx_activity_logs_user_created ON activity_logs(user_id, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_activity_logs_created_brin ON activity_logs USING brin(created_at);
+
+-- Create monthly partitions from `from_month` through `months_ahead` months past now
+CREATE OR REPLACE FUNCTION ensure_activity_log_partitions(
+    months_ahead INTEGER DEFAULT 3,
+    from_month DATE DEFAULT date_trunc('month', now())::date
+)
+RETURNS INTEGER AS $$
+DECLARE
+    month_start DATE := date_trunc('month', from_month)::date;
+    last_month DATE := (date_trunc('month', now()) + make_interval(months => months_ahead))::date;
+    partition_name TEXT;
+    created INTEGER := 0;
+BEGIN
+    WHILE month_start <= last_month LOOP
+        partition_name := format('activity_logs_y%sm%s', to_char(month_start, 'YYYY'), to_char(month_start, 'MM'));
+        IF to_regclass(partition_name) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF activity_logs FOR VALUES FROM (%L) TO (%L)',
+                partition_name, month_start, (month_start + INTERVAL '1 month')::date
+            );
+            created := created + 1;
+        END IF;
+        month_start := (month_start + INTERVAL '1 month')::date;
+    END LOOP;
+    RETURN created;
+END;
+$$ language plpgsql security definer;
+
+-- Detach and drop monthly partitions that ended more than `retain_months` ago
+CREATE OR REPLACE FUNCTION drop_activity_log_partitions(retain_months INTEGER DEFAULT 12)
+RETURNS INTEGER AS $$
+DECLARE
+    cutoff DATE := (date_trunc('month', now()) - make_interval(months => retain_months))::date;
+    part RECORD;
+    dropped INTEGER := 0;
+BEGIN
+    FOR part IN
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = 'activity_logs'
+          AND c.relname ~ '^activity_logs_y[0-9]{4}m[0-9]{2}$'
+          AND to_date(substring(c.relname FROM 'y([0-9]{4})m') || substring(c.relname FROM 'm([0-9]{2})$'), 'YYYYMM') < cutoff
+    LOOP
+        EXECUTE format('ALTER TABLE activity_logs DETACH PARTITION %I', part.relname);
+        EXECUTE format('DROP TABLE %I', part.relname);
+        dropped := dropped + 1;
+    END LOOP;
+    RETURN dropped;
+END;
+$$ language plpgsql security definer;
+
+-- Partitions covering the legacy rows, plus the upcoming months
+SELECT ensure_activity_log_partitions(
+    3,
+    COALESCE((SELECT min(created_at)::date FROM activity_logs_legacy), now()::date)
+);
+
+INSERT INTO activity_logs (id, user_id, action, resource_type, resource_id, details, ip_address, user_agent, created_at)
+SELECT id, user_id, action, resource_type, resource_id, details, ip_address, user_agent, created_at
+FROM activity_logs_legacy;
+
+DROP TABLE activity_logs_legacy;
+
+ALTER TABLE activity_logs ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Users can view own activity logs"
+    ON activity_logs FOR SELECT
+    USING (auth.uid() = user_id);
+
+GRANT SELECT ON activity_logs TO authenticated;
+
+-- Daily partition maintenance when pg_cron is available
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_cron') THEN
+        PERFORM cron.schedule(
+            'activity-log-partitions',
+            '15 0 * * *',
+            'SELECT ensure_activity_log_partitions(); SELECT drop_activity_log_partitions();'
+        );
+    END IF;
+END;
+$$;
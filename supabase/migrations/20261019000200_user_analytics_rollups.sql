@@ -0,0 +1,225 @@
+-- Precomputed user analytics
+-- Replaces the user_analytics view, which joined every profile with all of its files on each
+-- query, with a per-user daily rollup maintained incrementally from user_files writes and a
+-- materialized view over the rollups that is refreshed CONCURRENTLY on a schedule.
+
+-- Per-user, per-day upload/delete totals
+CREATE TABLE IF NOT EXISTS user_daily_usage (
+    user_id UUID NOT NULL REFERENCES auth.users(id) ON DELETE CASCADE,
+    usage_date DATE NOT NULL,
+    files_added INTEGER NOT NULL DEFAULT 0,
+    files_removed INTEGER NOT NULL DEFAULT 0,
+    bytes_added BIGINT NOT NULL DEFAULT 0,
+    bytes_removed BIGINT NOT NULL DEFAULT 0,
+    last_upload_at TIMESTAMP WITH TIME ZONE,
+    PRIMARY KEY (user_id, usage_date)
+);
+
+CREATE INDEX IF NOT EXISTS idx_user_daily_usage_date ON user_daily_usage(usage_date);
+
+-- Live file count per user and MIME type, so distinct-type counts need no file scan
+CREATE TABLE IF NOT EXISTS user_mime_type_counts (
+    user_id UUID NOT NULL REFERENCES auth.users(id) ON DELETE CASCADE,
+    mime_type TEXT NOT NULL,
+    file_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, mime_type)
+);
+
+ALTER TABLE user_daily_usage ENABLE ROW LEVEL SECURITY;
+ALTER TABLE user_mime_type_counts ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Users can view own daily usage"
+    ON user_daily_usage FOR SELECT
+    USING (auth.uid() = user_id);
+
+-- Apply one statement's worth of file changes to the rollups.
+-- `changes` holds one row per file with sign +1 (became active) or -1 (stopped being active).
+CREATE OR REPLACE FUNCTION apply_user_file_rollup_changes(changes JSONB)
+RETURNS void AS $$
+BEGIN
+    INSERT INTO user_daily_usage AS d (user_id, usage_date, files_added, files_removed, bytes_added, bytes_removed, last_upload_at)
+    SELECT
+        (c->>'user_id')::uuid,
+        (c->>'event_at')::timestamptz::date,
+        count(*) FILTER (WHERE (c->>'sign')::int > 0),
+        count(*) FILTER (WHERE (c->>'sign')::int < 0),
+        COALESCE(sum((c->>'size')::bigint) FILTER (WHERE (c->>'sign')::int > 0), 0),
+        COALESCE(sum((c->>'size')::bigint) FILTER (WHERE (c->>'sign')::int < 0), 0),
+        max((c->>'event_at')::timestamptz) FILTER (WHERE (c->>'sign')::int > 0)
+    FROM jsonb_array_elements(changes) c
+    WHERE c->>'user_id' IS NOT NULL
+    GROUP BY 1, 2
+    ON CONFLICT (user_id, usage_date) DO UPDATE SET
+        files_added = d.files_added + EXCLUDED.files_added,
+        files_removed = d.files_removed + EXCLUDED.files_removed,
+        bytes_added = d.bytes_added + EXCLUDED.bytes_added,
+        bytes_removed = d.bytes_removed + EXCLUDED.bytes_removed,
+        last_upload_at = GREATEST(d.last_upload_at, EXCLUDED.last_upload_at);
+
+    INSERT INTO user_mime_type_counts AS m (user_id, mime_type, file_count)
+    SELECT (c->>'user_id')::uuid, c->>'mime_type', sum((c->>'sign')::int)
+    FROM jsonb_array_elements(changes) c
+    WHERE c->>'user_id' IS NOT NULL
+    GROUP BY 1, 2
+    ON CONFLICT (user_id, mime_type) DO UPDATE SET
+        file_count = GREATEST(m.file_count + EXCLUDED.file_count, 0);
+END;
+$$ language plpgsql security definer;
+
+-- Statement-level triggers see all affected rows at once through transition tables,
+-- so bulk inserts and deletes cost one rollup upsert per statement instead of per row.
+CREATE OR REPLACE FUNCTION user_files_rollup_on_insert()
+RETURNS trigger AS $$
+BEGIN
+    PERFORM apply_user_file_rollup_changes(COALESCE((
+        SELECT jsonb_agg(jsonb_build_object(
+            'user_id', n.user_id, 'mime_type', n.mime_type, 'size', n.size,
+            'event_at', n.upload_date, 'sign', 1))
+        FROM new_rows n
+        WHERE n.status NOT IN ('deleted', 'error')
+    ), '[]'::jsonb));
+    RETURN NULL;
+END;
+$$ language plpgsql security definer;
+
+CREATE OR REPLACE FUNCTION user_files_rollup_on_delete()
+RETURNS trigger AS $$
+BEGIN
+    PERFORM apply_user_file_rollup_changes(COALESCE((
+        SELECT jsonb_agg(jsonb_build_object(
+            'user_id', o.user_id, 'mime_type', o.mime_type, 'size', o.size,
+            'event_at', now(), 'sign', -1))
+        FROM old_rows o
+        WHERE o.status NOT IN ('deleted', 'error')
+    ), '[]'::jsonb));
+    RETURN NULL;
+END;
+$$ language plpgsql security definer;
+
+-- Status transitions in and out of deleted/error count as removals and re-additions
+CREATE OR REPLACE FUNCTION user_files_rollup_on_update()
+RETURNS trigger AS $$
+BEGIN
+    PERFORM apply_user_file_rollup_changes(COALESCE((
+        SELECT jsonb_agg(change)
+        FROM (
+            SELECT jsonb_build_object(
+                'user_id', o.user_id, 'mime_type', o.mime_type, 'size', o.size,
+                'event_at', now(), 'sign', -1) AS change
+            FROM old_rows o JOIN new_rows n ON n.id = o.id
+            WHERE o.status NOT IN ('deleted', 'error')
+              AND (n.status IN ('deleted', 'error') OR n.size <> o.size OR n.mime_type <> o.mime_type OR n.user_id IS DISTINCT FROM o.user_id)
+            UNION ALL
+            SELECT jsonb_build_object(
+                'user_id', n.user_id, 'mime_type', n.mime_type, 'size', n.size,
+                'event_at', now(), 'sign', 1)
+            FROM old_rows o JOIN new_rows n ON n.id = o.id
+            WHERE n.status NOT IN ('deleted', 'error')
+              AND (o.status IN ('deleted', 'error') OR n.size <> o.size OR n.mime_type <> o.mime_type OR n.user_id IS DISTINCT FROM o.user_id)
+        ) changes
+    ), '[]'::jsonb));
+    RETURN NULL;
+END;
+$$ language plpgsql security definer;
+
+DROP TRIGGER IF EXISTS user_files_rollup_insert ON user_files;
+CREATE TRIGGER user_files_rollup_insert
+    AFTER INSERT ON user_files
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION user_files_rollup_on_insert();
+
+DROP TRIGGER IF EXISTS user_files_rollup_delete ON user_files;
+CREATE TRIGGER user_files_rollup_delete
+    AFTER DELETE ON user_files
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION user_files_rollup_on_delete();
+
+DROP TRIGGER IF EXISTS user_files_rollup_update ON user_files;
+CREATE TRIGGER user_files_rollup_update
+    AFTER UPDATE ON user_files
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION user_files_rollup_on_update();
+
+-- One-time backfill from existing files; everything after this is incremental
+INSERT INTO user_daily_usage (user_id, usage_date, files_added, bytes_added, last_upload_at)
+SELECT user_id, upload_date::date, count(*), sum(size), max(upload_date)
+FROM user_files
+WHERE status NOT IN ('deleted', 'error') AND user_id IS NOT NULL
+GROUP BY user_id, upload_date::date
+ON CONFLICT (user_id, usage_date) DO NOTHING;
+
+INSERT INTO user_mime_type_counts (user_id, mime_type, file_count)
+SELECT user_id, mime_type, count(*)
+FROM user_files
+WHERE status NOT IN ('deleted', 'error') AND user_id IS NOT NULL
+GROUP BY user_id, mime_type
+ON CONFLICT (user_id, mime_type) DO NOTHING;
+
+-- Dashboard rows built only from the rollups
+CREATE MATERIALIZED VIEW IF NOT EXISTS user_analytics_mv AS
+SELECT
+    up.user_id,
+    up.email,
+    up.full_name,
+    up.subscription_tier,
+    up.storage_used_bytes,
+    up.file_count,
+    up.created_at AS user_created_at,
+    COALESCE(mt.unique_file_types, 0) AS unique_file_types,
+    COALESCE(du.active_upload_days, 0) AS active_upload_days,
+    CASE WHEN du.net_files > 0 THEN du.net_bytes::numeric / du.net_files END AS avg_file_size,
+    du.last_upload_date,
+    COALESCE(du.files_added_30d, 0) AS files_added_30d,
+    COALESCE(du.bytes_added_30d, 0) AS bytes_added_30d,
+    now() AS refreshed_at
+FROM user_profiles up
+LEFT JOIN (
+    SELECT
+        user_id,
+        count(*) FILTER (WHERE files_added > 0) AS active_upload_days,
+        sum(files_added - files_removed) AS net_files,
+        sum(bytes_added - bytes_removed) AS net_bytes,
+        max(last_upload_at) AS last_upload_date,
+        sum(files_added) FILTER (WHERE usage_date > current_date - 30) AS files_added_30d,
+        sum(bytes_added) FILTER (WHERE usage_date > current_date - 30) AS bytes_added_30d
+    FROM user_daily_usage
+    GROUP BY user_id
+) du ON du.user_id = up.user_id
+LEFT JOIN (
+    SELECT user_id, count(*) AS unique_file_types
+    FROM user_mime_type_counts
+    WHERE file_count > 0
+    GROUP BY user_id
+) mt ON mt.user_id = up.user_id
+WHERE up.user_id IS NOT NULL;
+
+-- REFRESH ... CONCURRENTLY requires a unique index on the materialized view
+CREATE UNIQUE INDEX IF NOT EXISTS idx_user_analytics_mv_user_id ON user_analytics_mv(user_id);
+CREATE INDEX IF NOT EXISTS idx_user_analytics_mv_storage ON user_analytics_mv(storage_used_bytes DESC);
+CREATE INDEX IF NOT EXISTS idx_user_analytics_mv_last_upload ON user_analytics_mv(last_upload_date DESC NULLS LAST);
+CREATE INDEX IF NOT EXISTS idx_user_analytics_mv_tier ON user_analytics_mv(subscription_tier);
+
+CREATE OR REPLACE FUNCTION refresh_user_analytics()
+RETURNS void AS $$
+BEGIN
+    REFRESH MATERIALIZED VIEW CONCURRENTLY user_analytics_mv;
+END;
+$$ language plpgsql security definer;
+
+-- The old view exposed every user's row to every authenticated user; keep the name for
+-- existing callers but serve only the caller's own precomputed row
+DROP VIEW IF EXISTS user_analytics;
+CREATE VIEW user_analytics AS
+SELECT * FROM user_analytics_mv WHERE user_id = auth.uid();
+
+REVOKE ALL ON user_analytics_mv FROM anon, authenticated;
+GRANT SELECT ON user_analytics TO authenticated;
+GRANT SELECT ON user_analytics_mv TO service_role;
+
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_cron') THEN
+        PERFORM cron.schedule('refresh-user-analytics', '*/15 * * * *', 'SELECT refresh_user_analytics();');
+    END IF;
+END;
+$$;
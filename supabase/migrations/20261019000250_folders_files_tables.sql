@@ -0,0 +1,31 @@
+-- Managed schema for main.py's folders/files tables
+-- These were only ever created by hand from backend/init_schema.sql, yet the change-version
+-- and change-feed triggers (000300, 000400) and the later index and hierarchy migrations all
+-- depend on them, so `migrate.py up` on a fresh database needs them first. On databases set up
+-- from init_schema.sql this is a no-op. Policies stay in init_schema.sql; the API uses the
+-- service role.
+
+CREATE TABLE IF NOT EXISTS folders (
+  id uuid PRIMARY KEY DEFAULT gen_random_uuid(),
+  name text NOT NULL,
+  owner_id uuid NOT NULL REFERENCES auth.users(id) ON DELETE CASCADE,
+  created_at timestamptz DEFAULT now(),
+  updated_at timestamptz DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS files (
+  id uuid PRIMARY KEY DEFAULT gen_random_uuid(),
+  folder_id uuid NOT NULL REFERENCES folders(id) ON DELETE CASCADE,
+  owner_id uuid NOT NULL REFERENCES auth.users(id) ON DELETE CASCADE,
+  object_key text NOT NULL,
+  filename text NOT NULL,
+  original_filename text NOT NULL,
+  bytes bigint NOT NULL DEFAULT 0,
+  mime text,
+  status text DEFAULT 'uploaded',
+  created_at timestamptz DEFAULT now(),
+  updated_at timestamptz DEFAULT now()
+);
+
+ALTER TABLE folders ENABLE ROW LEVEL SECURITY;
+ALTER TABLE files ENABLE ROW LEVEL SECURITY;
@@ -0,0 +1,93 @@
+-- Per-user change versions for conditional GETs
+-- Every statement that writes folders or files bumps the owner's version, so list and stats
+-- endpoints can answer If-None-Match with a single primary-key lookup instead of re-running
+-- their queries. Versions come from one sequence: they only ever increase, even if a user's
+-- row is deleted and recreated, so an old ETag can never match again.
+
+CREATE SEQUENCE IF NOT EXISTS user_change_version_seq;
+
+CREATE TABLE IF NOT EXISTS user_change_versions (
+    owner_id UUID PRIMARY KEY REFERENCES auth.users(id) ON DELETE CASCADE,
+    version BIGINT NOT NULL,
+    updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
+);
+
+ALTER TABLE user_change_versions ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Users can view own change version"
+    ON user_change_versions FOR SELECT
+    USING (auth.uid() = owner_id);
+
+-- Statement-level: a bulk write bumps each affected owner once, not once per row.
+-- Owners are visited in a fixed order so concurrent bulk writes lock rows consistently.
+CREATE OR REPLACE FUNCTION bump_user_change_versions()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO user_change_versions (owner_id, version)
+        SELECT owner_id, nextval('user_change_version_seq')
+        FROM (SELECT DISTINCT owner_id FROM new_rows ORDER BY owner_id) owners
+        ON CONFLICT (owner_id) DO UPDATE
+            SET version = EXCLUDED.version, updated_at = NOW();
+    ELSIF TG_OP = 'UPDATE' THEN
+        INSERT INTO user_change_versions (owner_id, version)
+        SELECT owner_id, nextval('user_change_version_seq')
+        FROM (
+            SELECT owner_id FROM new_rows
+            UNION
+            SELECT owner_id FROM old_rows
+            ORDER BY owner_id
+        ) owners
+        ON CONFLICT (owner_id) DO UPDATE
+            SET version = EXCLUDED.version, updated_at = NOW();
+    ELSE
+        INSERT INTO user_change_versions (owner_id, version)
+        SELECT owner_id, nextval('user_change_version_seq')
+        FROM (SELECT DISTINCT owner_id FROM old_rows ORDER BY owner_id) owners
+        -- Skip owners whose auth.users row is being deleted in the same cascade
+        WHERE EXISTS (SELECT 1 FROM auth.users u WHERE u.id = owners.owner_id)
+        ON CONFLICT (owner_id) DO UPDATE
+            SET version = EXCLUDED.version, updated_at = NOW();
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+-- Transition tables allow only one event per trigger, hence three per table
+DROP TRIGGER IF EXISTS folders_change_version_insert ON folders;
+DROP TRIGGER IF EXISTS folders_change_version_update ON folders;
+DROP TRIGGER IF EXISTS folders_change_version_delete ON folders;
+DROP TRIGGER IF EXISTS files_change_version_insert ON files;
+DROP TRIGGER IF EXISTS files_change_version_update ON files;
+DROP TRIGGER IF EXISTS files_change_version_delete ON files;
+
+CREATE TRIGGER folders_change_version_insert
+    AFTER INSERT ON folders REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_user_change_versions();
+CREATE TRIGGER folders_change_version_update
+    AFTER UPDATE ON folders REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_user_change_versions();
+CREATE TRIGGER folders_change_version_delete
+    AFTER DELETE ON folders REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_user_change_versions();
+
+CREATE TRIGGER files_change_version_insert
+    AFTER INSERT ON files REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_user_change_versions();
+CREATE TRIGGER files_change_version_update
+    AFTER UPDATE ON files REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_user_change_versions();
+CREATE TRIGGER files_change_version_delete
+    AFTER DELETE ON files REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_user_change_versions();
+
+-- Seed a version for every existing owner so first polls after deploy get ETags
+INSERT INTO user_change_versions (owner_id, version)
+SELECT owner_id, nextval('user_change_version_seq')
+FROM (
+    SELECT owner_id FROM folders
+    UNION
+    SELECT owner_id FROM files
+    ORDER BY owner_id
+) owners
+ON CONFLICT (owner_id) DO NOTHING;
@@ -0,0 +1,97 @@
+-- Change feed notifications
+-- Row triggers on folders, files and user_files publish compact events on the user_changes
+-- channel. The API's change feed LISTENs when CHANGE_FEED_SOURCE=postgres, so clients also
+-- hear about writes made outside the API, such as AI processing results.
+-- Event ids come from a sequence so every worker hands out the same resume cursors.
+
+CREATE SEQUENCE IF NOT EXISTS change_event_seq;
+
+CREATE OR REPLACE FUNCTION notify_user_change()
+RETURNS TRIGGER AS $$
+DECLARE
+    owner UUID;
+    event_type TEXT;
+    data JSONB;
+BEGIN
+    IF TG_TABLE_NAME = 'folders' THEN
+        owner := COALESCE(NEW.owner_id, OLD.owner_id);
+        event_type := CASE TG_OP
+            WHEN 'INSERT' THEN 'folder.created'
+            WHEN 'DELETE' THEN 'folder.deleted'
+            ELSE 'folder.updated' END;
+        data := jsonb_build_object('folder_id', COALESCE(NEW.id, OLD.id), 'name', COALESCE(NEW.name, OLD.name));
+
+    ELSIF TG_TABLE_NAME = 'files' THEN
+        owner := COALESCE(NEW.owner_id, OLD.owner_id);
+        IF TG_OP = 'UPDATE' AND NEW.status IS NOT DISTINCT FROM OLD.status THEN
+            RETURN NULL;
+        END IF;
+        event_type := CASE TG_OP
+            WHEN 'INSERT' THEN 'file.created'
+            WHEN 'DELETE' THEN 'file.deleted'
+            ELSE 'file.status_changed' END;
+        data := jsonb_build_object(
+            'file_id', COALESCE(NEW.id, OLD.id),
+            'folder_id', COALESCE(NEW.folder_id, OLD.folder_id),
+            'filename', COALESCE(NEW.filename, OLD.filename),
+            'bytes', COALESCE(NEW.bytes, OLD.bytes),
+            'mime', COALESCE(NEW.mime, OLD.mime),
+            'status', COALESCE(NEW.status, OLD.status)
+        );
+
+    ELSE -- user_files
+        owner := COALESCE(NEW.user_id, OLD.user_id);
+        IF TG_OP = 'INSERT' THEN
+            event_type := 'file.created';
+        ELSIF TG_OP = 'DELETE' THEN
+            event_type := 'file.deleted';
+        ELSIF NEW.ai_processed AND NOT COALESCE(OLD.ai_processed, FALSE) THEN
+            event_type := 'file.ai_processed';
+        ELSIF NEW.status IS DISTINCT FROM OLD.status THEN
+            event_type := 'file.status_changed';
+        ELSE
+            -- Touches such as last_accessed are not worth a push
+            RETURN NULL;
+        END IF;
+        data := jsonb_build_object(
+            'file_id', COALESCE(NEW.id, OLD.id),
+            'name', COALESCE(NEW.name, OLD.name),
+            'mime_type', COALESCE(NEW.mime_type, OLD.mime_type),
+            'size', COALESCE(NEW.size, OLD.size),
+            'status', COALESCE(NEW.status, OLD.status)
+        );
+        IF event_type = 'file.ai_processed' THEN
+            -- Keep payloads well under NOTIFY's 8000-byte limit; clients fetch descriptions on demand
+            data := data || jsonb_build_object('ai_tags', to_jsonb(NEW.ai_tags[1:20]));
+        END IF;
+    END IF;
+
+    IF owner IS NULL THEN
+        RETURN NULL;
+    END IF;
+
+    PERFORM pg_notify('user_changes', jsonb_build_object(
+        'id', nextval('change_event_seq'),
+        'user_id', owner,
+        'type', event_type,
+        'data', data,
+        'at', NOW()
+    )::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS folders_notify_change ON folders;
+CREATE TRIGGER folders_notify_change
+    AFTER INSERT OR UPDATE OF name OR DELETE ON folders
+    FOR EACH ROW EXECUTE FUNCTION notify_user_change();
+
+DROP TRIGGER IF EXISTS files_notify_change ON files;
+CREATE TRIGGER files_notify_change
+    AFTER INSERT OR UPDATE OF status OR DELETE ON files
+    FOR EACH ROW EXECUTE FUNCTION notify_user_change();
+
+DROP TRIGGER IF EXISTS user_files_notify_change ON user_files;
+CREATE TRIGGER user_files_notify_change
+    AFTER INSERT OR UPDATE OF status, ai_processed OR DELETE ON user_files
+    FOR EACH ROW EXECUTE FUNCTION notify_user_change();
@@ -0,0 +1,8 @@
+-- Index for near-duplicate detection
+-- GET /api/files/duplicates pages through a user's hashed images by id; the partial index
+-- covers only rows with a perceptual hash, so it stays small and unaffected by other files.
+-- Built CONCURRENTLY so user_files stays writable; backend/migrate.py runs it outside a transaction.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_user_files_phash
+    ON user_files (user_id, id)
+    WHERE (metadata->>'phash') IS NOT NULL;
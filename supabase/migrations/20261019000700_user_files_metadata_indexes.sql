@@ -0,0 +1,16 @@
+-- Expression indexes on extracted media metadata
+-- The timeline (GET /api/files/timeline) orders and ranges on metadata->>'captured_at', an ISO
+-- 8601 string that sorts chronologically as text. The places view (GET /api/files/places)
+-- filters a bounding box on metadata->'gps_lat' / 'gps_lon'; PostgREST compares those as jsonb,
+-- which orders numbers numerically. The expressions match what PostgREST generates, and the
+-- partial predicates keep files without the key out of the indexes. Built CONCURRENTLY so
+-- user_files stays writable; backend/migrate.py runs this file outside a transaction.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_user_files_captured_at
+    ON user_files (user_id, (metadata->>'captured_at') DESC, id DESC)
+    WHERE (metadata->>'captured_at') IS NOT NULL;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_user_files_gps
+    ON user_files (user_id, (metadata->'gps_lat'), (metadata->'gps_lon'))
+    WHERE (metadata->'gps_lat') IS NOT NULL;
+
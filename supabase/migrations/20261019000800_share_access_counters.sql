@@ -0,0 +1,25 @@
+-- Batched share link access counters
+-- API workers count share link hits in memory and periodically call record_share_access()
+-- with the totals, so a popular link costs one row update per worker per flush instead of
+-- one UPDATE per hit contending on the same row.
+
+CREATE OR REPLACE FUNCTION record_share_access(hits JSONB)
+RETURNS void AS $$
+    UPDATE file_shares s SET
+        accessed_count = COALESCE(s.accessed_count, 0) + h.count,
+        last_accessed = GREATEST(s.last_accessed, h.last_accessed)
+    FROM (
+        SELECT id, sum(count)::integer AS count, max(last_accessed) AS last_accessed
+        FROM jsonb_to_recordset(hits) AS x(id uuid, count integer, last_accessed timestamptz)
+        GROUP BY id
+    ) h
+    WHERE s.id = h.id;
+$$ language sql security definer;
+
+-- Only the API (service role) reports hits
+REVOKE EXECUTE ON FUNCTION record_share_access(JSONB) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION record_share_access(JSONB) TO service_role;
+
+-- Public links are looked up by token; the UNIQUE constraint already indexes share_token, and
+-- owners list links per file
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_file_shares_file_owner ON file_shares(file_id, owner_id);
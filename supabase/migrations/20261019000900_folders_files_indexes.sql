@@ -0,0 +1,36 @@
+-- Indexes for main.py's folders/files queries
+-- The tables (see 20261019000250_folders_files_tables.sql) came with one single-column index
+-- per column. Each listing in main.py filters on one column and orders on
+-- created_at, so those indexes either found the rows and then sorted all of them, or walked
+-- created_at across every user. The composite indexes below match each query:
+--
+--   GET /folders          folders WHERE owner_id = ? ORDER BY created_at      -> idx_folders_owner_created
+--     per-folder counts   files   WHERE folder_id = ? (count)                 -> idx_files_folder_created
+--   GET /files            files   WHERE owner_id = ? ORDER BY created_at DESC -> idx_files_owner_created
+--   GET /files?folder_id  files   WHERE owner_id = ? AND folder_id = ? ORDER BY created_at DESC
+--                                                                             -> idx_files_folder_created
+--   folder export         files   WHERE folder_id = ? AND owner_id = ? ORDER BY created_at
+--                                                                             -> idx_files_folder_created
+--   GET /stats            folders WHERE owner_id = ? (count)                  -> idx_folders_owner_created
+--                         files   bytes WHERE owner_id = ?                    -> idx_files_owner_created (covers bytes)
+--   delete / selection    files   WHERE id = ? AND owner_id = ?               -> primary key
+--
+-- The old single-column indexes are prefixes of the new ones, or are unused, so they are
+-- dropped afterwards. The folder_id FK cascade still has an index that starts with folder_id.
+-- Everything is built CONCURRENTLY, so backend/migrate.py runs this file outside a transaction.
+-- `python backend/query_plans.py` checks that none of these queries falls back to a
+-- sequential scan or an explicit sort.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_folders_owner_created
+    ON folders (owner_id, created_at);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_files_owner_created
+    ON files (owner_id, created_at DESC) INCLUDE (bytes);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_files_folder_created
+    ON files (folder_id, created_at DESC);
+
+DROP INDEX CONCURRENTLY IF EXISTS folders_owner_id_idx;
+DROP INDEX CONCURRENTLY IF EXISTS files_owner_id_idx;
+DROP INDEX CONCURRENTLY IF EXISTS files_folder_id_idx;
+DROP INDEX CONCURRENTLY IF EXISTS files_created_at_idx;
@@ -0,0 +1,44 @@
+-- Tiered storage for user_files
+-- storage_tier names the bucket that currently holds a file's object (see STORAGE_TIERS in
+-- backend/storage_tiers.py); storage_path is the same key in every tier's bucket. Adding a
+-- column with a constant default does not rewrite the table.
+-- Built CONCURRENTLY, so backend/migrate.py runs this file outside a transaction.
+
+ALTER TABLE user_files ADD COLUMN IF NOT EXISTS storage_tier TEXT NOT NULL DEFAULT 'hot';
+
+-- API workers record file reads in memory and periodically call record_file_access() with the
+-- latest time per file, so reads never wait on a row update
+CREATE OR REPLACE FUNCTION record_file_access(hits JSONB)
+RETURNS void AS $$
+    UPDATE user_files f SET
+        last_accessed = GREATEST(f.last_accessed, h.last_accessed)
+    FROM (
+        SELECT id, max(last_accessed) AS last_accessed
+        FROM jsonb_to_recordset(hits) AS x(id uuid, last_accessed timestamptz)
+        GROUP BY id
+    ) h
+    WHERE f.id = h.id
+      AND f.last_accessed IS DISTINCT FROM GREATEST(f.last_accessed, h.last_accessed);
+$$ language sql security definer;
+
+-- Files in a tier that nobody has read since the cutoff, least recently used first. Files
+-- never read count from their upload.
+CREATE OR REPLACE FUNCTION storage_lifecycle_candidates(p_tier TEXT, p_cutoff TIMESTAMPTZ, p_limit INTEGER)
+RETURNS TABLE (id UUID, user_id UUID, storage_path TEXT, mime_type TEXT, size BIGINT, storage_tier TEXT) AS $$
+    SELECT f.id, f.user_id, f.storage_path, f.mime_type, f.size, f.storage_tier
+    FROM user_files f
+    WHERE f.storage_tier = p_tier
+      AND COALESCE(f.last_accessed, f.upload_date) < p_cutoff
+    ORDER BY COALESCE(f.last_accessed, f.upload_date), f.id
+    LIMIT p_limit;
+$$ language sql stable security definer;
+
+-- Only the API (service role) reports reads and runs the lifecycle
+REVOKE EXECUTE ON FUNCTION record_file_access(JSONB) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION record_file_access(JSONB) TO service_role;
+REVOKE EXECUTE ON FUNCTION storage_lifecycle_candidates(TEXT, TIMESTAMPTZ, INTEGER) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION storage_lifecycle_candidates(TEXT, TIMESTAMPTZ, INTEGER) TO service_role;
+
+-- Matches the candidates query, so each lifecycle pass reads only the rows it moves
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_user_files_tier_last_access
+    ON user_files (storage_tier, (COALESCE(last_accessed, upload_date)), id);
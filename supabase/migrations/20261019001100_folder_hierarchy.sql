@@ -0,0 +1,222 @@
+-- Nested folders with materialized paths and rolled-up stats
+-- Each folder stores its ancestry as path = '/<root id>/.../<own id>/', so a whole subtree is
+-- one range scan on `path LIKE '<prefix>%'` (text_pattern_ops index in the next migration)
+-- and ancestors are simply the ids in the path. Every folder also keeps the number and size
+-- of the files directly in it (file_count, total_bytes) and in its whole subtree
+-- (subtree_file_count, subtree_bytes). Statement-level triggers on files maintain these
+-- incrementally, so listing a tree with totals never walks it level by level.
+
+ALTER TABLE folders
+    ADD COLUMN IF NOT EXISTS parent_id UUID REFERENCES folders(id) ON DELETE CASCADE,
+    ADD COLUMN IF NOT EXISTS path TEXT,
+    ADD COLUMN IF NOT EXISTS depth INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS file_count BIGINT NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS total_bytes BIGINT NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS subtree_file_count BIGINT NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS subtree_bytes BIGINT NOT NULL DEFAULT 0;
+
+-- Existing folders were all top level
+UPDATE folders SET path = '/' || id || '/' WHERE path IS NULL;
+UPDATE folders f SET
+    file_count = s.n, total_bytes = s.b, subtree_file_count = s.n, subtree_bytes = s.b
+FROM (SELECT folder_id, count(*) AS n, COALESCE(sum(bytes), 0) AS b FROM files GROUP BY folder_id) s
+WHERE f.id = s.folder_id;
+ALTER TABLE folders ALTER COLUMN path SET NOT NULL;
+
+-- Path and depth come from the parent, which must belong to the same owner
+CREATE OR REPLACE FUNCTION set_folder_path()
+RETURNS trigger AS $$
+DECLARE
+    parent folders%ROWTYPE;
+BEGIN
+    IF NEW.parent_id IS NULL THEN
+        NEW.path := '/' || NEW.id || '/';
+        NEW.depth := 0;
+        RETURN NEW;
+    END IF;
+    SELECT * INTO parent FROM folders WHERE id = NEW.parent_id;
+    IF NOT FOUND OR parent.owner_id <> NEW.owner_id THEN
+        RAISE EXCEPTION 'parent folder % not found', NEW.parent_id USING ERRCODE = 'foreign_key_violation';
+    END IF;
+    NEW.path := parent.path || NEW.id || '/';
+    NEW.depth := parent.depth + 1;
+    RETURN NEW;
+END;
+$$ language plpgsql;
+
+DROP TRIGGER IF EXISTS folders_set_path ON folders;
+CREATE TRIGGER folders_set_path
+    BEFORE INSERT ON folders
+    FOR EACH ROW EXECUTE FUNCTION set_folder_path();
+
+-- Applies per-folder deltas: `direct` to the folder itself, subtree totals to it and every
+-- ancestor. Changes for folders that no longer exist (cascaded deletes) are ignored.
+CREATE OR REPLACE FUNCTION apply_folder_stat_changes(changes JSONB)
+RETURNS void AS $$
+    WITH c AS (
+        SELECT folder_id, sum(n)::bigint AS n, sum(b)::bigint AS b
+        FROM jsonb_to_recordset(changes) AS x(folder_id uuid, n bigint, b bigint)
+        GROUP BY folder_id
+    ), targets AS (
+        SELECT ancestor::uuid AS id, c.n, c.b, ancestor::uuid = c.folder_id AS direct
+        FROM c
+        JOIN folders fo ON fo.id = c.folder_id
+        CROSS JOIN LATERAL unnest(string_to_array(trim(both '/' from fo.path), '/')) AS ancestor
+    )
+    UPDATE folders f SET
+        file_count = f.file_count + t.direct_n,
+        total_bytes = f.total_bytes + t.direct_b,
+        subtree_file_count = f.subtree_file_count + t.n,
+        subtree_bytes = f.subtree_bytes + t.b
+    FROM (
+        SELECT id, sum(n) AS n, sum(b) AS b,
+               COALESCE(sum(n) FILTER (WHERE direct), 0) AS direct_n,
+               COALESCE(sum(b) FILTER (WHERE direct), 0) AS direct_b
+        FROM targets GROUP BY id
+    ) t
+    WHERE f.id = t.id;
+$$ language sql security definer;
+
+CREATE OR REPLACE FUNCTION folder_stats_on_insert()
+RETURNS trigger AS $$
+BEGIN
+    PERFORM apply_folder_stat_changes(COALESCE((
+        SELECT jsonb_agg(jsonb_build_object('folder_id', folder_id, 'n', 1, 'b', COALESCE(bytes, 0)))
+        FROM new_rows WHERE folder_id IS NOT NULL
+    ), '[]'::jsonb));
+    RETURN NULL;
+END;
+$$ language plpgsql security definer;
+
+CREATE OR REPLACE FUNCTION folder_stats_on_delete()
+RETURNS trigger AS $$
+BEGIN
+    PERFORM apply_folder_stat_changes(COALESCE((
+        SELECT jsonb_agg(jsonb_build_object('folder_id', folder_id, 'n', -1, 'b', -COALESCE(bytes, 0)))
+        FROM old_rows WHERE folder_id IS NOT NULL
+    ), '[]'::jsonb));
+    RETURN NULL;
+END;
+$$ language plpgsql security definer;
+
+-- A file moved between folders or resized is a removal plus an addition
+CREATE OR REPLACE FUNCTION folder_stats_on_update()
+RETURNS trigger AS $$
+BEGIN
+    PERFORM apply_folder_stat_changes(COALESCE((
+        SELECT jsonb_agg(change)
+        FROM (
+            SELECT jsonb_build_object('folder_id', o.folder_id, 'n', -1, 'b', -COALESCE(o.bytes, 0)) AS change
+            FROM old_rows o JOIN new_rows n ON n.id = o.id
+            WHERE o.folder_id IS NOT NULL
+              AND (n.folder_id IS DISTINCT FROM o.folder_id OR n.bytes IS DISTINCT FROM o.bytes)
+            UNION ALL
+            SELECT jsonb_build_object('folder_id', n.folder_id, 'n', 1, 'b', COALESCE(n.bytes, 0))
+            FROM old_rows o JOIN new_rows n ON n.id = o.id
+            WHERE n.folder_id IS NOT NULL
+              AND (n.folder_id IS DISTINCT FROM o.folder_id OR n.bytes IS DISTINCT FROM o.bytes)
+        ) changes
+    ), '[]'::jsonb));
+    RETURN NULL;
+END;
+$$ language plpgsql security definer;
+
+DROP TRIGGER IF EXISTS files_folder_stats_insert ON files;
+CREATE TRIGGER files_folder_stats_insert
+    AFTER INSERT ON files REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION folder_stats_on_insert();
+
+DROP TRIGGER IF EXISTS files_folder_stats_delete ON files;
+CREATE TRIGGER files_folder_stats_delete
+    AFTER DELETE ON files REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION folder_stats_on_delete();
+
+DROP TRIGGER IF EXISTS files_folder_stats_update ON files;
+CREATE TRIGGER files_folder_stats_update
+    AFTER UPDATE ON files REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION folder_stats_on_update();
+
+-- Moves a folder and its whole subtree under a new parent (NULL for top level) in one
+-- statement per table: paths and depths are rewritten by prefix, and the subtree totals move
+-- from the old ancestors to the new ones. Returns the moved folder, or nothing if the owner
+-- has no such folder.
+CREATE OR REPLACE FUNCTION move_folder(p_folder_id UUID, p_owner_id UUID, p_parent_id UUID)
+RETURNS SETOF folders AS $$
+DECLARE
+    moved folders%ROWTYPE;
+    parent folders%ROWTYPE;
+    new_path TEXT;
+    new_depth INTEGER := 0;
+BEGIN
+    SELECT * INTO moved FROM folders WHERE id = p_folder_id AND owner_id = p_owner_id FOR UPDATE;
+    IF NOT FOUND THEN
+        RETURN;
+    END IF;
+    IF p_parent_id IS NOT NULL THEN
+        SELECT * INTO parent FROM folders WHERE id = p_parent_id AND owner_id = p_owner_id;
+        IF NOT FOUND THEN
+            RAISE EXCEPTION 'parent folder % not found', p_parent_id USING ERRCODE = 'foreign_key_violation';
+        END IF;
+        IF left(parent.path, length(moved.path)) = moved.path THEN
+            RAISE EXCEPTION 'cannot move a folder into itself or its descendants' USING ERRCODE = 'check_violation';
+        END IF;
+        new_path := parent.path || moved.id || '/';
+        new_depth := parent.depth + 1;
+    ELSE
+        new_path := '/' || moved.id || '/';
+    END IF;
+    IF new_path = moved.path THEN
+        RETURN QUERY SELECT * FROM folders WHERE id = moved.id;
+        RETURN;
+    END IF;
+
+    -- Take the subtree's totals off its old ancestors and add them to the new ones
+    UPDATE folders f SET
+        subtree_file_count = f.subtree_file_count + CASE WHEN f.id::text = ANY(new_ids) THEN moved.subtree_file_count ELSE -moved.subtree_file_count END,
+        subtree_bytes = f.subtree_bytes + CASE WHEN f.id::text = ANY(new_ids) THEN moved.subtree_bytes ELSE -moved.subtree_bytes END
+    FROM (
+        SELECT string_to_array(trim(both '/' from left(moved.path, length(moved.path) - length(moved.id::text) - 1)), '/') AS old_ids,
+               string_to_array(trim(both '/' from left(new_path, length(new_path) - length(moved.id::text) - 1)), '/') AS new_ids
+    ) a
+    WHERE f.owner_id = p_owner_id
+      AND (f.id::text = ANY(a.old_ids) OR f.id::text = ANY(a.new_ids))
+      AND NOT (f.id::text = ANY(a.old_ids) AND f.id::text = ANY(a.new_ids));
+
+    UPDATE folders SET
+        path = new_path || substr(path, length(moved.path) + 1),
+        depth = depth + (new_depth - moved.depth),
+        parent_id = CASE WHEN id = moved.id THEN p_parent_id ELSE parent_id END,
+        updated_at = now()
+    WHERE owner_id = p_owner_id AND path LIKE moved.path || '%';
+
+    RETURN QUERY SELECT * FROM folders WHERE id = moved.id;
+END;
+$$ language plpgsql security definer;
+
+-- Deletes a folder, its subtree and all their files; the file triggers take the removed
+-- totals off the remaining ancestors. Returns the storage keys of the deleted files so the
+-- caller can remove the objects.
+CREATE OR REPLACE FUNCTION delete_folder_tree(p_folder_id UUID, p_owner_id UUID)
+RETURNS TABLE (object_key TEXT) AS $$
+DECLARE
+    prefix TEXT;
+BEGIN
+    SELECT path INTO prefix FROM folders WHERE id = p_folder_id AND owner_id = p_owner_id FOR UPDATE;
+    IF NOT FOUND THEN
+        RETURN;
+    END IF;
+    RETURN QUERY
+        DELETE FROM files fi
+        USING folders fo
+        WHERE fo.owner_id = p_owner_id AND fo.path LIKE prefix || '%' AND fi.folder_id = fo.id
+        RETURNING fi.object_key;
+    DELETE FROM folders WHERE owner_id = p_owner_id AND path LIKE prefix || '%';
+END;
+$$ language plpgsql security definer;
+
+-- Only the API (service role) restructures folders
+REVOKE EXECUTE ON FUNCTION move_folder(UUID, UUID, UUID) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION move_folder(UUID, UUID, UUID) TO service_role;
+REVOKE EXECUTE ON FUNCTION delete_folder_tree(UUID, UUID) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION delete_folder_tree(UUID, UUID) TO service_role;
+REVOKE EXECUTE ON FUNCTION apply_folder_stat_changes(JSONB) FROM PUBLIC, anon, authenticated;
@@ -0,0 +1,12 @@
+-- Indexes for nested folders
+-- Subtrees are read, moved and deleted with `owner_id = ? AND path LIKE '<prefix>%'`;
+-- text_pattern_ops lets a B-tree answer the prefix match as a range scan whatever the
+-- collation. Children of one folder are listed by parent_id, which also serves the
+-- parent_id foreign key's cascade. Built CONCURRENTLY, so backend/migrate.py runs this file
+-- outside a transaction.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_folders_owner_path
+    ON folders (owner_id, path text_pattern_ops);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_folders_parent_created
+    ON folders (parent_id, created_at);
@@ -0,0 +1,34 @@
+-- Bulk file moves and renames
+-- Object keys no longer contain the folder or filename (see presign_upload in backend/main.py),
+-- so reorganizing files only touches rows. Each function updates any number of files in one
+-- statement; the files_folder_stats_update trigger moves their counts between folders.
+
+-- Moves the owner's files into a folder. Returns the ids that changed folder.
+CREATE OR REPLACE FUNCTION move_files(p_owner_id UUID, p_file_ids UUID[], p_folder_id UUID)
+RETURNS TABLE (id UUID) AS $$
+BEGIN
+    PERFORM 1 FROM folders WHERE folders.id = p_folder_id AND owner_id = p_owner_id;
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'folder % not found', p_folder_id USING ERRCODE = 'foreign_key_violation';
+    END IF;
+    RETURN QUERY
+        UPDATE files f SET folder_id = p_folder_id, updated_at = now()
+        WHERE f.id = ANY(p_file_ids) AND f.owner_id = p_owner_id AND f.folder_id IS DISTINCT FROM p_folder_id
+        RETURNING f.id;
+END;
+$$ language plpgsql security definer;
+
+-- Renames the owner's files from [{"id": ..., "filename": ...}, ...]. Returns the renamed rows.
+CREATE OR REPLACE FUNCTION rename_files(p_owner_id UUID, p_renames JSONB)
+RETURNS TABLE (id UUID, filename TEXT) AS $$
+    UPDATE files f SET filename = r.filename, updated_at = now()
+    FROM jsonb_to_recordset(p_renames) AS r(id uuid, filename text)
+    WHERE f.id = r.id AND f.owner_id = p_owner_id
+    RETURNING f.id, f.filename;
+$$ language sql security definer;
+
+-- Only the API (service role) reorganizes files
+REVOKE EXECUTE ON FUNCTION move_files(UUID, UUID[], UUID) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION move_files(UUID, UUID[], UUID) TO service_role;
+REVOKE EXECUTE ON FUNCTION rename_files(UUID, JSONB) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION rename_files(UUID, JSONB) TO service_role;
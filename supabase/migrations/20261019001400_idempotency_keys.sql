@@ -0,0 +1,73 @@
+-- Idempotency keys
+-- Requests to upload and create endpoints that carry an Idempotency-Key header are recorded
+-- here by backend/idempotency.py. A retry with the same key gets the stored response instead of
+-- creating a duplicate row or object. Rows are small (a fingerprint and the JSON response) and
+-- expire after a TTL.
+
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    -- "user:<id>" for verified tokens, as used by admission control
+    subject TEXT NOT NULL,
+    key TEXT NOT NULL,
+    -- sha256 of method, path and body; a key reused for a different request is rejected
+    fingerprint TEXT NOT NULL,
+    -- NULL while the first request is still running
+    status_code SMALLINT,
+    response JSONB,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+    -- A running request that has not finished by then is presumed dead and may be retried
+    locked_until TIMESTAMP WITH TIME ZONE,
+    expires_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    PRIMARY KEY (subject, key)
+);
+
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires ON idempotency_keys(expires_at);
+
+-- Only the API (service role) reads or writes keys
+ALTER TABLE idempotency_keys ENABLE ROW LEVEL SECURITY;
+
+-- Claims a key for a request in one round trip. New keys, expired ones and keys whose first
+-- request outlived its lock are (re)claimed and returned with claimed = true. Otherwise the
+-- stored row is returned: finished (stored_status set) or still running (stored_status NULL).
+CREATE OR REPLACE FUNCTION claim_idempotency_key(
+    p_subject TEXT, p_key TEXT, p_fingerprint TEXT, p_ttl_seconds INTEGER, p_lock_seconds INTEGER
+)
+RETURNS TABLE (claimed BOOLEAN, stored_fingerprint TEXT, stored_status SMALLINT, stored_response JSONB) AS $$
+BEGIN
+    RETURN QUERY
+        INSERT INTO idempotency_keys AS k (subject, key, fingerprint, locked_until, expires_at)
+        VALUES (p_subject, p_key, p_fingerprint,
+                now() + make_interval(secs => p_lock_seconds), now() + make_interval(secs => p_ttl_seconds))
+        ON CONFLICT (subject, key) DO UPDATE SET
+            fingerprint = EXCLUDED.fingerprint, status_code = NULL, response = NULL, created_at = now(),
+            locked_until = EXCLUDED.locked_until, expires_at = EXCLUDED.expires_at
+        WHERE k.expires_at < now() OR (k.status_code IS NULL AND k.locked_until < now())
+        RETURNING true, k.fingerprint, k.status_code, k.response;
+    IF NOT FOUND THEN
+        -- The conflicting insert waited for any concurrent claim to commit, so this sees it
+        RETURN QUERY
+            SELECT false, k.fingerprint, k.status_code, k.response
+            FROM idempotency_keys k WHERE k.subject = p_subject AND k.key = p_key;
+    END IF;
+END;
+$$ language plpgsql security definer;
+
+CREATE OR REPLACE FUNCTION purge_idempotency_keys()
+RETURNS INTEGER AS $$
+    WITH purged AS (
+        DELETE FROM idempotency_keys WHERE expires_at < now() RETURNING 1
+    )
+    SELECT count(*)::integer FROM purged;
+$$ language sql security definer;
+
+REVOKE EXECUTE ON FUNCTION claim_idempotency_key(TEXT, TEXT, TEXT, INTEGER, INTEGER) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION claim_idempotency_key(TEXT, TEXT, TEXT, INTEGER, INTEGER) TO service_role;
+REVOKE EXECUTE ON FUNCTION purge_idempotency_keys() FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION purge_idempotency_keys() TO service_role;
+
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_cron') THEN
+        PERFORM cron.schedule('purge-idempotency-keys', '17 * * * *', 'SELECT purge_idempotency_keys();');
+    END IF;
+END;
+$$;
@@ -0,0 +1,24 @@
+-- Dashboard stats in one round trip
+-- GET /stats and /bootstrap used to download the size of every file a user owns. File and byte
+-- totals now come from the top-level folders' rolled-up subtree_file_count / subtree_bytes
+-- (see 20261019001100_folder_hierarchy.sql; every file lives in some folder), and the type
+-- breakdown is grouped in the database, so only a handful of values cross the wire.
+
+CREATE OR REPLACE FUNCTION user_file_stats(p_owner_id UUID)
+RETURNS TABLE (folders BIGINT, files BIGINT, total_bytes BIGINT, type_breakdown JSONB) AS $$
+    SELECT
+        (SELECT count(*) FROM folders WHERE owner_id = p_owner_id),
+        (SELECT COALESCE(sum(subtree_file_count), 0)::bigint FROM folders
+         WHERE owner_id = p_owner_id AND parent_id IS NULL),
+        (SELECT COALESCE(sum(subtree_bytes), 0)::bigint FROM folders
+         WHERE owner_id = p_owner_id AND parent_id IS NULL),
+        (SELECT COALESCE(jsonb_object_agg(file_type, n), '{}'::jsonb) FROM (
+            -- "image/jpeg" -> "image"; files without a MIME type are not counted
+            SELECT split_part(mime, '/', 1) AS file_type, count(*) AS n
+            FROM files WHERE owner_id = p_owner_id AND COALESCE(mime, '') <> ''
+            GROUP BY 1
+        ) types);
+$$ language sql stable security definer;
+
+REVOKE EXECUTE ON FUNCTION user_file_stats(UUID) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION user_file_stats(UUID) TO service_role;
@@ -0,0 +1,116 @@
+-- Change feed events for reorganized files and folders, and extracted media metadata
+-- move_files and rename_files (20261019001300_file_bulk_updates.sql) update folder_id and
+-- filename, and move_folder (20261019001100_folder_hierarchy.sql) updates parent_id, none of
+-- which the triggers from 20261019000400_change_feed_notify.sql watched, so with
+-- CHANGE_FEED_SOURCE=postgres clients never heard about moves or renames. Each moved or
+-- renamed file now notifies file.moved / file.renamed, the same per-file events the API
+-- publishes itself in local mode, and a moved folder notifies folder.updated with its
+-- parent_id. Descendants whose path changes with it do not notify. Metadata extraction
+-- (backend/media_metadata.py) updates user_files.metadata, which now notifies file.updated.
+
+CREATE OR REPLACE FUNCTION notify_user_change()
+RETURNS TRIGGER AS $$
+DECLARE
+    owner UUID;
+    event_type TEXT;
+    data JSONB;
+BEGIN
+    IF TG_TABLE_NAME = 'folders' THEN
+        owner := COALESCE(NEW.owner_id, OLD.owner_id);
+        event_type := CASE TG_OP
+            WHEN 'INSERT' THEN 'folder.created'
+            WHEN 'DELETE' THEN 'folder.deleted'
+            ELSE 'folder.updated' END;
+        data := jsonb_build_object(
+            'folder_id', COALESCE(NEW.id, OLD.id),
+            'name', COALESCE(NEW.name, OLD.name),
+            'parent_id', CASE TG_OP WHEN 'DELETE' THEN OLD.parent_id ELSE NEW.parent_id END
+        );
+
+    ELSIF TG_TABLE_NAME = 'files' THEN
+        owner := COALESCE(NEW.owner_id, OLD.owner_id);
+        IF TG_OP = 'INSERT' THEN
+            event_type := 'file.created';
+        ELSIF TG_OP = 'DELETE' THEN
+            event_type := 'file.deleted';
+        ELSIF NEW.folder_id IS DISTINCT FROM OLD.folder_id THEN
+            event_type := 'file.moved';
+        ELSIF NEW.filename IS DISTINCT FROM OLD.filename THEN
+            event_type := 'file.renamed';
+        ELSIF NEW.status IS DISTINCT FROM OLD.status THEN
+            event_type := 'file.status_changed';
+        ELSE
+            RETURN NULL;
+        END IF;
+        data := jsonb_build_object(
+            'file_id', COALESCE(NEW.id, OLD.id),
+            'folder_id', COALESCE(NEW.folder_id, OLD.folder_id),
+            'filename', COALESCE(NEW.filename, OLD.filename),
+            'bytes', COALESCE(NEW.bytes, OLD.bytes),
+            'mime', COALESCE(NEW.mime, OLD.mime),
+            'status', COALESCE(NEW.status, OLD.status)
+        );
+
+    ELSE -- user_files
+        owner := COALESCE(NEW.user_id, OLD.user_id);
+        IF TG_OP = 'INSERT' THEN
+            event_type := 'file.created';
+        ELSIF TG_OP = 'DELETE' THEN
+            event_type := 'file.deleted';
+        ELSIF NEW.ai_processed AND NOT COALESCE(OLD.ai_processed, FALSE) THEN
+            event_type := 'file.ai_processed';
+        ELSIF NEW.status IS DISTINCT FROM OLD.status THEN
+            event_type := 'file.status_changed';
+        ELSIF NEW.metadata IS DISTINCT FROM OLD.metadata THEN
+            event_type := 'file.updated';
+        ELSE
+            -- Touches such as last_accessed are not worth a push
+            RETURN NULL;
+        END IF;
+        data := jsonb_build_object(
+            'file_id', COALESCE(NEW.id, OLD.id),
+            'name', COALESCE(NEW.name, OLD.name),
+            'mime_type', COALESCE(NEW.mime_type, OLD.mime_type),
+            'size', COALESCE(NEW.size, OLD.size),
+            'status', COALESCE(NEW.status, OLD.status)
+        );
+        IF event_type = 'file.ai_processed' THEN
+            -- Keep payloads well under NOTIFY's 8000-byte limit; clients fetch descriptions on demand
+            data := data || jsonb_build_object('ai_tags', to_jsonb(NEW.ai_tags[1:20]));
+        ELSIF event_type = 'file.updated' THEN
+            -- Extracted capture time, GPS and dimensions; the hash is internal. Oversized
+            -- metadata is left out for the same reason as above.
+            data := data || jsonb_build_object('metadata', CASE
+                WHEN octet_length((NEW.metadata - 'phash')::text) <= 4000 THEN NEW.metadata - 'phash' END);
+        END IF;
+    END IF;
+
+    IF owner IS NULL THEN
+        RETURN NULL;
+    END IF;
+
+    PERFORM pg_notify('user_changes', jsonb_build_object(
+        'id', nextval('change_event_seq'),
+        'user_id', owner,
+        'type', event_type,
+        'data', data,
+        'at', NOW()
+    )::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS folders_notify_change ON folders;
+CREATE TRIGGER folders_notify_change
+    AFTER INSERT OR UPDATE OF name, parent_id OR DELETE ON folders
+    FOR EACH ROW EXECUTE FUNCTION notify_user_change();
+
+DROP TRIGGER IF EXISTS files_notify_change ON files;
+CREATE TRIGGER files_notify_change
+    AFTER INSERT OR UPDATE OF status, folder_id, filename OR DELETE ON files
+    FOR EACH ROW EXECUTE FUNCTION notify_user_change();
+
+DROP TRIGGER IF EXISTS user_files_notify_change ON user_files;
+CREATE TRIGGER user_files_notify_change
+    AFTER INSERT OR UPDATE OF status, ai_processed, metadata OR DELETE ON user_files
+    FOR EACH ROW EXECUTE FUNCTION notify_user_change();
@@ -0,0 +1,152 @@
+-- Serialize folder tree changes per owner
+-- move_folder locked only the moved folder and read the new parent's path unlocked, so two
+-- concurrent cross-moves (A into B, B into A) could both pass the descendant check and create a
+-- cycle. Likewise a folder created, or a file counted, while its ancestors were being moved read
+-- the pre-move path: the folder then fell out of every `path LIKE prefix%` query and the file's
+-- totals went to the old ancestors.
+--
+-- Moves and tree deletes now take an exclusive per-owner advisory lock for the rest of their
+-- transaction; the path trigger and the folder stats rollup take it shared, so they run
+-- concurrently with each other but wait for (and are waited on by) restructuring. Every
+-- statement after the lock reads committed paths.
+
+CREATE OR REPLACE FUNCTION lock_folder_tree(p_owner_id UUID, p_exclusive BOOLEAN)
+RETURNS void AS $$
+BEGIN
+    -- Two-key form, so it cannot collide with migrate.py's single-key lock
+    IF p_exclusive THEN
+        PERFORM pg_advisory_xact_lock(1179601988, hashtext(p_owner_id::text));  -- 'FOLD'
+    ELSE
+        PERFORM pg_advisory_xact_lock_shared(1179601988, hashtext(p_owner_id::text));
+    END IF;
+END;
+$$ language plpgsql;
+
+CREATE OR REPLACE FUNCTION set_folder_path()
+RETURNS trigger AS $$
+DECLARE
+    parent folders%ROWTYPE;
+BEGIN
+    IF NEW.parent_id IS NULL THEN
+        NEW.path := '/' || NEW.id || '/';
+        NEW.depth := 0;
+        RETURN NEW;
+    END IF;
+    -- Waits for a move or delete in progress, so the parent's path read below is current
+    PERFORM lock_folder_tree(NEW.owner_id, false);
+    SELECT * INTO parent FROM folders WHERE id = NEW.parent_id;
+    IF NOT FOUND OR parent.owner_id <> NEW.owner_id THEN
+        RAISE EXCEPTION 'parent folder % not found', NEW.parent_id USING ERRCODE = 'foreign_key_violation';
+    END IF;
+    NEW.path := parent.path || NEW.id || '/';
+    NEW.depth := parent.depth + 1;
+    RETURN NEW;
+END;
+$$ language plpgsql;
+
+CREATE OR REPLACE FUNCTION apply_folder_stat_changes(changes JSONB)
+RETURNS void AS $$
+    -- Ancestors come from paths, which must not be rewritten by a move meanwhile
+    SELECT lock_folder_tree(owner_id, false)
+    FROM (
+        SELECT DISTINCT fo.owner_id FROM folders fo
+        WHERE fo.id IN (SELECT (x->>'folder_id')::uuid FROM jsonb_array_elements(changes) x)
+        ORDER BY fo.owner_id
+    ) owners;
+
+    WITH c AS (
+        SELECT folder_id, sum(n)::bigint AS n, sum(b)::bigint AS b
+        FROM jsonb_to_recordset(changes) AS x(folder_id uuid, n bigint, b bigint)
+        GROUP BY folder_id
+    ), targets AS (
+        SELECT ancestor::uuid AS id, c.n, c.b, ancestor::uuid = c.folder_id AS direct
+        FROM c
+        JOIN folders fo ON fo.id = c.folder_id
+        CROSS JOIN LATERAL unnest(string_to_array(trim(both '/' from fo.path), '/')) AS ancestor
+    )
+    UPDATE folders f SET
+        file_count = f.file_count + t.direct_n,
+        total_bytes = f.total_bytes + t.direct_b,
+        subtree_file_count = f.subtree_file_count + t.n,
+        subtree_bytes = f.subtree_bytes + t.b
+    FROM (
+        SELECT id, sum(n) AS n, sum(b) AS b,
+               COALESCE(sum(n) FILTER (WHERE direct), 0) AS direct_n,
+               COALESCE(sum(b) FILTER (WHERE direct), 0) AS direct_b
+        FROM targets GROUP BY id
+    ) t
+    WHERE f.id = t.id;
+$$ language sql security definer;
+
+CREATE OR REPLACE FUNCTION move_folder(p_folder_id UUID, p_owner_id UUID, p_parent_id UUID)
+RETURNS SETOF folders AS $$
+DECLARE
+    moved folders%ROWTYPE;
+    parent folders%ROWTYPE;
+    new_path TEXT;
+    new_depth INTEGER := 0;
+BEGIN
+    PERFORM lock_folder_tree(p_owner_id, true);
+    SELECT * INTO moved FROM folders WHERE id = p_folder_id AND owner_id = p_owner_id FOR UPDATE;
+    IF NOT FOUND THEN
+        RETURN;
+    END IF;
+    IF p_parent_id IS NOT NULL THEN
+        SELECT * INTO parent FROM folders WHERE id = p_parent_id AND owner_id = p_owner_id;
+        IF NOT FOUND THEN
+            RAISE EXCEPTION 'parent folder % not found', p_parent_id USING ERRCODE = 'foreign_key_violation';
+        END IF;
+        IF left(parent.path, length(moved.path)) = moved.path THEN
+            RAISE EXCEPTION 'cannot move a folder into itself or its descendants' USING ERRCODE = 'check_violation';
+        END IF;
+        new_path := parent.path || moved.id || '/';
+        new_depth := parent.depth + 1;
+    ELSE
+        new_path := '/' || moved.id || '/';
+    END IF;
+    IF new_path = moved.path THEN
+        RETURN QUERY SELECT * FROM folders WHERE id = moved.id;
+        RETURN;
+    END IF;
+
+    -- Take the subtree's totals off its old ancestors and add them to the new ones
+    UPDATE folders f SET
+        subtree_file_count = f.subtree_file_count + CASE WHEN f.id::text = ANY(new_ids) THEN moved.subtree_file_count ELSE -moved.subtree_file_count END,
+        subtree_bytes = f.subtree_bytes + CASE WHEN f.id::text = ANY(new_ids) THEN moved.subtree_bytes ELSE -moved.subtree_bytes END
+    FROM (
+        SELECT string_to_array(trim(both '/' from left(moved.path, length(moved.path) - length(moved.id::text) - 1)), '/') AS old_ids,
+               string_to_array(trim(both '/' from left(new_path, length(new_path) - length(moved.id::text) - 1)), '/') AS new_ids
+    ) a
+    WHERE f.owner_id = p_owner_id
+      AND (f.id::text = ANY(a.old_ids) OR f.id::text = ANY(a.new_ids))
+      AND NOT (f.id::text = ANY(a.old_ids) AND f.id::text = ANY(a.new_ids));
+
+    UPDATE folders SET
+        path = new_path || substr(path, length(moved.path) + 1),
+        depth = depth + (new_depth - moved.depth),
+        parent_id = CASE WHEN id = moved.id THEN p_parent_id ELSE parent_id END,
+        updated_at = now()
+    WHERE owner_id = p_owner_id AND path LIKE moved.path || '%';
+
+    RETURN QUERY SELECT * FROM folders WHERE id = moved.id;
+END;
+$$ language plpgsql security definer;
+
+CREATE OR REPLACE FUNCTION delete_folder_tree(p_folder_id UUID, p_owner_id UUID)
+RETURNS TABLE (object_key TEXT) AS $$
+DECLARE
+    prefix TEXT;
+BEGIN
+    PERFORM lock_folder_tree(p_owner_id, true);
+    SELECT path INTO prefix FROM folders WHERE id = p_folder_id AND owner_id = p_owner_id FOR UPDATE;
+    IF NOT FOUND THEN
+        RETURN;
+    END IF;
+    RETURN QUERY
+        DELETE FROM files fi
+        USING folders fo
+        WHERE fo.owner_id = p_owner_id AND fo.path LIKE prefix || '%' AND fi.folder_id = fo.id
+        RETURNING fi.object_key;
+    DELETE FROM folders WHERE owner_id = p_owner_id AND path LIKE prefix || '%';
+END;
+$$ language plpgsql security definer;
@@ -0,0 +1,15 @@
+"""
+Shared test setup
+The backend and the benchmark helpers import their siblings by module
+name, the way they are run (cd backend; python main.py), so both
+directories go on sys.path.
+"""
+
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).parent.parent
+for directory in ("backend", "benchmarks"):
+    path = str(REPO_ROOT / directory)
+    if path not in sys.path:
+        sys.path.insert(0, path)
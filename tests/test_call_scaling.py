@@ -0,0 +1,27 @@
+"""
+Upstream call counts must not grow with the size of a library
+Every read endpoint of main.py and server.py is requested for a small and
+a large library seeded in the Supabase stand-in; an endpoint making more
+PostgREST/Storage/Auth calls for the large one has an N+1 loop.
+"""
+
+import pytest
+
+from check_call_scaling import ENDPOINTS, measure_scaling
+
+SMALL = 2
+LARGE = 25
+
+
+@pytest.fixture(scope="module")
+def scaling():
+    return measure_scaling(SMALL, LARGE)
+
+
+@pytest.mark.parametrize("app,endpoint", ENDPOINTS, ids=[f"{app} {endpoint}" for app, endpoint in ENDPOINTS])
+def test_upstream_calls_do_not_grow_with_library(scaling, app, endpoint):
+    result = scaling[(app, endpoint)]
+    assert (result.status_small, result.status_large) == (200, 200)
+    assert result.calls_small > 0, "no upstream calls reported in Server-Timing"
+    assert result.calls_large == result.calls_small, \
+        f"{result.calls_small} upstream calls for {SMALL} folders but {result.calls_large} for {LARGE}"
@@ -0,0 +1,21 @@
+"""
+Hot folders/files queries must be served by indexes
+Runs backend/query_plans.py's EXPLAIN check against DATABASE_URL, which
+must have the migrations applied (python backend/migrate.py up). Skipped
+when no database is configured.
+"""
+
+import os
+
+import pytest
+
+from query_plans import check
+
+
+@pytest.mark.skipif(not os.getenv("DATABASE_URL"), reason="DATABASE_URL is not set")
+def test_hot_queries_use_indexes(caplog):
+    pytest.importorskip("psycopg2")
+    caplog.set_level("INFO", logger="query_plans")
+    assert check(os.environ["DATABASE_URL"]), "\n".join(
+        record.getMessage() for record in caplog.records if record.levelname == "ERROR"
+    )
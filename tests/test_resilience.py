@@ -0,0 +1,261 @@
+"""
+Circuit breaker, hedging and stale serving in backend/resilience.py
+Upstreams are httpx.MockTransport handlers wrapped in a ResilientTransport.
+"""
+
+import asyncio
+import threading
+import time
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+from resilience import CircuitBreaker, ResilientTransport, StaleCache, Upstream, UpstreamUnavailable, upstream_error
+
+
+def client(handler, **settings) -> httpx.Client:
+    upstream = Upstream("test", **settings)
+    return httpx.Client(transport=ResilientTransport(httpx.MockTransport(handler), upstream),
+                        base_url="http://upstream")
+
+
+def upstream_of(session: httpx.Client) -> Upstream:
+    return session._transport.upstream
+
+
+# Circuit breaker
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=60)
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    assert 0 < breaker.retry_after() <= 60
+
+
+def test_breaker_success_resets_failure_count():
+    breaker = CircuitBreaker("test", failure_threshold=2)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_breaker_lets_one_probe_through_after_reset_timeout():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0.01)
+    breaker.record_failure()
+    time.sleep(0.02)
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_failed_probe_reopens_breaker():
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=0.01)
+    for _ in range(3):
+        breaker.record_failure()
+    time.sleep(0.02)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_failure_statuses_open_the_circuit_and_refuse_requests():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(503)
+
+    with client(handler, failure_threshold=2, reset_timeout=60) as session:
+        assert session.get("/a").status_code == 503
+        assert session.get("/a").status_code == 503
+        with pytest.raises(UpstreamUnavailable) as refused:
+            session.get("/a")
+    assert len(calls) == 2
+    assert refused.value.retry_after > 0
+    assert upstream_of(session).stats["rejected"] == 1
+
+
+def test_client_errors_do_not_count_as_failures():
+    with client(lambda request: httpx.Response(404), failure_threshold=1) as session:
+        for _ in range(3):
+            assert session.get("/missing").status_code == 404
+        assert upstream_of(session).breaker.state == CircuitBreaker.CLOSED
+
+
+def test_probe_raising_unexpected_error_reopens_breaker():
+    fail = True
+
+    def handler(request):
+        if fail:
+            raise ValueError("malformed upstream answer")
+        return httpx.Response(200)
+
+    with client(handler, failure_threshold=1, reset_timeout=0.01) as session:
+        with pytest.raises(ValueError):
+            session.get("/a")
+        assert upstream_of(session).breaker.state == CircuitBreaker.OPEN
+        time.sleep(0.02)
+        with pytest.raises(ValueError):
+            session.get("/a")
+        # The failed probe reopened the circuit rather than leaving it half open for good
+        assert upstream_of(session).breaker.state == CircuitBreaker.OPEN
+        fail = False
+        time.sleep(0.02)
+        assert session.get("/a").status_code == 200
+        assert upstream_of(session).breaker.state == CircuitBreaker.CLOSED
+
+
+def test_transport_errors_are_failures():
+    def handler(request):
+        raise httpx.ConnectError("refused", request=request)
+
+    with client(handler, failure_threshold=1, reset_timeout=60) as session:
+        with pytest.raises(httpx.ConnectError):
+            session.get("/a")
+        with pytest.raises(UpstreamUnavailable):
+            session.get("/a")
+
+
+def test_disabled_upstream_is_passed_through():
+    with client(lambda request: httpx.Response(503), failure_threshold=1, enabled=False) as session:
+        for _ in range(3):
+            assert session.get("/a").status_code == 503
+
+
+# Hedging
+
+def slow_first_handler(delay: float):
+    """The first request is slow, later ones answer at once"""
+    lock = threading.Lock()
+    calls = []
+
+    def handler(request):
+        with lock:
+            calls.append(request.method)
+            attempt = len(calls)
+        if attempt == 1:
+            time.sleep(delay)
+        return httpx.Response(200, json={"attempt": attempt})
+
+    return handler, calls
+
+
+def test_slow_get_is_hedged_and_second_answer_wins():
+    handler, calls = slow_first_handler(0.5)
+    with client(handler, hedge_after=0.02) as session:
+        response = session.get("/a")
+    assert response.json() == {"attempt": 2}
+    assert len(calls) == 2
+    stats = upstream_of(session).stats
+    assert (stats["hedged"], stats["hedge_wins"]) == (1, 1)
+
+
+def test_fast_get_is_not_hedged():
+    handler, calls = slow_first_handler(0.0)
+    with client(handler, hedge_after=0.2) as session:
+        assert session.get("/a").json() == {"attempt": 1}
+    assert len(calls) == 1
+    assert upstream_of(session).stats["hedged"] == 0
+
+
+def test_writes_are_never_hedged():
+    handler, calls = slow_first_handler(0.1)
+    with client(handler, hedge_after=0.01) as session:
+        assert session.post("/a", json={}).json() == {"attempt": 1}
+    assert calls == ["POST"]
+
+
+def test_hedge_survives_one_failed_attempt():
+    lock = threading.Lock()
+    calls = []
+
+    def handler(request):
+        with lock:
+            calls.append(request)
+            attempt = len(calls)
+        if attempt == 1:
+            time.sleep(0.1)
+            raise httpx.ReadTimeout("slow", request=request)
+        return httpx.Response(200, json={"attempt": attempt})
+
+    with client(handler, hedge_after=0.02) as session:
+        assert session.get("/a").json() == {"attempt": 2}
+
+
+# Stale cache
+
+def failing():
+    raise httpx.ConnectError("down")
+
+
+def test_stale_cache_returns_fresh_values_and_falls_back_when_loading_fails():
+    cache = StaleCache()
+    assert cache.load("k", lambda: 1) == (1, None)
+    value, age = cache.load("k", failing)
+    assert value == 1 and age is not None and age >= 0
+    assert cache.stats["stale_hits"] == 1
+
+
+def test_stale_cache_raises_without_a_usable_entry():
+    cache = StaleCache(max_age=0.01)
+    with pytest.raises(httpx.ConnectError):
+        cache.load("k", failing)
+    cache.load("k", lambda: 1)
+    time.sleep(0.02)
+    with pytest.raises(httpx.ConnectError):
+        cache.load("k", failing)
+    assert cache.stats["misses"] == 2
+
+
+def test_stale_cache_does_not_hide_client_errors():
+    cache = StaleCache()
+    cache.load("k", lambda: 1)
+
+    def not_found():
+        raise HTTPException(status_code=404, detail="Not found")
+
+    with pytest.raises(HTTPException):
+        cache.load("k", not_found)
+
+
+def test_stale_cache_evicts_least_recently_stored():
+    cache = StaleCache(max_entries=2)
+    for key in ("a", "b", "c"):
+        cache.load(key, lambda: key)
+    with pytest.raises(httpx.ConnectError):
+        cache.load("a", failing)
+    assert cache.load("c", failing)[0] == "c"
+
+
+def test_stale_cache_aload():
+    cache = StaleCache()
+
+    async def load(value):
+        return value
+
+    async def down():
+        failing()
+
+    async def scenario():
+        assert await cache.aload("k", lambda: load(5)) == (5, None)
+        return await cache.aload("k", down)
+
+    value, age = asyncio.run(scenario())
+    assert value == 5 and age is not None
+
+
+# Error mapping
+
+def test_upstream_error_maps_refusals_to_503_with_retry_after():
+    error = upstream_error(UpstreamUnavailable("rest", "circuit open", 7.4), "Could not fetch files")
+    assert error.status_code == 503
+    assert error.headers == {"Retry-After": "7"}
+    assert upstream_error(ValueError("bug"), "Could not fetch files").status_code == 500